@@ -27,7 +27,7 @@ word_counts_to_vocab.py --num-words=$num_words --weights=data/weights data/word_
 
 prepare_int_data.py data/text $datasub/words.txt $datasub/int
 
-get_counts.py $datasub/int $ngram_order $datasub/counts
+get_counts.py --compress-counts=true $datasub/int $ngram_order $datasub/counts
 
 validate_count_dir.py $datasub/counts
 
@@ -76,13 +76,21 @@ mkdir -p $datasub/arpa
 format_arpa_lm.py $datasub/lm | gzip -c > $datasub/arpa/${ngram_order}.arpa.gz
 
 
-# make LM dir with splits, and keeping them.
-make_lm_dir.py --num-splits=2 --keep-splits=true $datasub/counts \
+# make LM dir with splits, and keeping them, in the compact format.
+make_lm_dir.py --num-splits=2 --keep-splits=true --compact-float-counts=true \
+    $datasub/counts \
     $datasub/optimize/final.metaparams $datasub/lm2
 
 mkdir -p $datasub/arpa2
-format_arpa_lm.py $datasub/lm2 | gzip -c > $datasub/arpa2/${ngram_order}.arpa.gz
+format_arpa_lm.py --output=$datasub/arpa2/${ngram_order}.arpa.gz $datasub/lm2
 
 split_lm_dir.py $datasub/lm 3 $datasub/lm3
 mkdir -p $datasub/arpa3
-format_arpa_lm.py $datasub/lm3 | gzip -c > $datasub/arpa3/${ngram_order}.arpa.gz
+format_arpa_lm.py --direct-sections=false $datasub/lm3 | gzip -c > $datasub/arpa3/${ngram_order}.arpa.gz
+
+# write the LM in binary form, and check that it converts back to the same
+# ARPA LM (the quantization is lossless for an LM this small).
+mkdir -p $datasub/binary
+format_binary_lm.py $datasub/lm3 $datasub/binary/${ngram_order}.bin
+cmp <($POCOLM_ROOT/src/binary-lm-to-arpa $datasub/binary/${ngram_order}.bin | LC_ALL=C sort) \
+    <(gunzip -c $datasub/arpa3/${ngram_order}.arpa.gz | LC_ALL=C sort)
@@ -3,6 +3,7 @@
 # we're using python 3.x style print but want it to work in python 2.x,
 from __future__ import print_function
 import os
+import glob
 import argparse
 import sys
 
@@ -37,6 +38,13 @@ def CleanupDir(count_dir, ngram_order, num_train_sets):
     filename = os.path.join(count_dir, "int.dev")
     if os.path.isfile(filename):
         os.remove(filename)
+    # the per-source counts that get_counts.py --incremental=true keeps when
+    # applying min-counts, and the fingerprints that describe them.
+    for filename in glob.glob(os.path.join(count_dir, "int.*.split*")):
+        os.remove(filename)
+    filename = os.path.join(count_dir, "source_fingerprints")
+    if os.path.isfile(filename):
+        os.remove(filename)
 
 
 if os.system("validate_count_dir.py " + args.count_dir) != 0:
@@ -40,6 +40,7 @@ for n in range(1, num_train_sets + 1):
     names.append(str(n))
 
 for name in names:
-    filename = os.path.join(args.int_dir, name + '.txt.gz')
-    if os.path.isfile(filename):
-        os.remove(filename)
+    for suffix in ['.txt.gz', '.int', '.int.index']:
+        filename = os.path.join(args.int_dir, name + suffix)
+        if os.path.isfile(filename):
+            os.remove(filename)
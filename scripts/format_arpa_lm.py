@@ -7,6 +7,9 @@ import argparse
 import sys
 import subprocess
 import glob
+import shutil
+import tempfile
+import threading
 
 # If the encoding of the default sys.stdout is not utf-8,
 # force it to be utf-8. See PR #95.
@@ -20,8 +23,9 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
 sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
             ] + sys.path
 
-# for ExitProgram
-from pocolm_common import ExitProgram
+from pocolm_common import (ExitProgram, GetFloatCountsFiles,
+                           EnsureFloatCountsIndex)
+from parallel_gzip import ParallelGzipWriter
 
 parser = argparse.ArgumentParser(
     description="This script turns a pocolm language model "
@@ -33,12 +37,39 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     "--temp-dir",
     type=str,
-    help="Temporary directory for use by 'sort'; if not provided, "
+    help="Temporary directory for use by 'sort' (or for the sections of "
+    "the ARPA file, with --direct-sections=true); if not provided, "
     "we use the destination directory lm_dir")
+parser.add_argument(
+    "--direct-sections",
+    type=str,
+    default="true",
+    choices=["true", "false"],
+    help="If true, write the section of the ARPA file for each n-gram order "
+    "directly from the float-counts (all orders in parallel), and concatenate "
+    "them; this avoids sorting all the n-grams, and only needs space in "
+    "--temp-dir for the sections.  If false, use float-counts-to-pre-arpa, "
+    "sort and pre-arpa-to-arpa, which puts the n-grams of each order in "
+    "sorted order.")
 parser.add_argument("--max-memory",
                     type=str,
                     default='',
-                    help="Memory limitation for sort.")
+                    help="Memory limitation for sort (if "
+                    "--direct-sections=false) and for compressing the output "
+                    "(if --output ends in '.gz'); these share the memory.")
+parser.add_argument(
+    "--output",
+    type=str,
+    help="If provided, the ARPA LM is written to this file instead of to the "
+    "standard output.  If it ends in '.gz', it is gzip-compressed using "
+    "--num-jobs threads; the memory used for this counts towards "
+    "--max-memory.")
+parser.add_argument(
+    "--num-jobs",
+    type=int,
+    default=4,
+    help="Number of threads used to compress the output, if --output ends "
+    "in '.gz'.")
 parser.add_argument("lm_dir",
                     help="Directory of the source language model, as created "
                     "by make_lm_dir.py")
@@ -135,6 +166,41 @@ def DivideMemory(total, n):
     return str(int(sub_memory)) + unit
 
 
+# Converts a memory size in the format of --max-memory (the same as for the
+# --buffer-size option of sort) into a number of bytes.
+def MemoryStringToBytes(s):
+    (value, unit) = ParseMemoryString(s)
+    if unit == '%':
+        return (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') *
+                value // 100)
+    # like sort, we interpret a number without a unit as kilobytes.
+    multipliers = {'b': 1, 'k': 1024, '': 1024, 'm': 1024**2, 'g': 1024**3}
+    return value * multipliers[unit.lower()]
+
+
+if args.num_jobs < 1:
+    sys.exit("format_arpa_lm.py: --num-jobs must be >= 1")
+
+# num_compressors is the number of processes, besides the sorts, that share
+# --max-memory: this is 1 if we compress the output, else 0.  In that case,
+# compressor_memory is the memory it may use in bytes (or None for no limit).
+if args.output is not None and args.output.endswith(".gz"):
+    num_compressors = 1
+    if args.max_memory == '':
+        compressor_memory = None
+    elif args.direct_sections == "true":
+        # without sort, the compressor has all the memory.
+        compressor_memory = MemoryStringToBytes(args.max_memory)
+    else:
+        num_sorts = (1 if not os.path.exists(args.lm_dir + "/num_splits")
+                     else int(open(args.lm_dir + "/num_splits",
+                                   encoding="utf-8").readline()) + 1)
+        compressor_memory = MemoryStringToBytes(
+            DivideMemory(args.max_memory, num_sorts + 1))
+else:
+    num_compressors = 0
+    compressor_memory = None
+
 # read ngram order.
 f = open(args.lm_dir + "/ngram_order", encoding="utf-8")
 ngram_order = int(f.readline())
@@ -152,63 +218,196 @@ except:
         "format_arpa_lm.py: error getting num-words from {0}/words.txt".format(
             args.lm_dir))
 
-if not os.path.exists(args.lm_dir + "/num_splits"):
-    if args.max_memory == '':
-        mem_opt = ''
+# Returns a list containing the number of n-grams of each order, as written
+# to num_ngrams by make_lm_dir.py (or the pruning scripts).
+def ReadNumNgrams():
+    num_ngrams = []
+    with open(args.lm_dir + "/num_ngrams", encoding="utf-8") as f:
+        for line in f:
+            [order, count] = line.split()
+            assert int(order) == len(num_ngrams) + 1
+            num_ngrams.append(int(count))
+    if len(num_ngrams) != ngram_order:
+        ExitProgram("expected {0}/num_ngrams to have {1} lines".format(
+            args.lm_dir, ngram_order))
+    return num_ngrams
+
+
+# This function writes the section of the ARPA file for the n-grams of order
+# 'order' to the file <section_dir>/<order>.arpa, and checks that the number of
+# n-grams it wrote is 'expected_num_ngrams'.  It runs in a thread, so instead
+# of exiting on error it appends the error message, which includes the log
+# (the caller removes <section_dir>), to 'errors'.
+def WriteSection(section_dir, order, float_counts_files, expected_num_ngrams,
+                 errors):
+    log_file = "{0}/{1}.log".format(section_dir, order)
+    command = ("float-counts-to-arpa-section {0} {1}/words.txt {2} "
+               ">{3}/{0}.arpa".format(order, args.lm_dir,
+                                      " ".join(float_counts_files),
+                                      section_dir))
+    with open(log_file, "w", encoding="utf-8") as f:
+        print("# " + command, file=f)
+        f.flush()
+        ret = subprocess.call(command,
+                              shell=True,
+                              stderr=f,
+                              executable='/bin/bash')
+    with open(log_file, encoding="utf-8") as f:
+        log = f.read()
+    if ret != 0:
+        errors.append("command {0} exited with status {1}, output was:\n"
+                      "{2}".format(command, ret, log))
+        return
+    num_ngrams = None
+    for line in log.splitlines():
+        if line.startswith("float-counts-to-arpa-section: wrote "):
+            num_ngrams = int(line.split()[2])
+    if num_ngrams != expected_num_ngrams:
+        errors.append("wrote {0} {1}-grams but expected {2} from "
+                      "{3}/num_ngrams; output was:\n{4}".format(
+                          num_ngrams, order, expected_num_ngrams,
+                          args.lm_dir, log))
+
+
+# This function writes the ARPA file by writing the section for each n-gram
+# order directly from the float-counts files, all at once in separate
+# threads, and then concatenating the header and the sections.  Nothing is
+# sorted: the n-grams are written in the order of the float-counts.  The
+# sections are written to a temporary directory in --temp-dir (by default, the
+# LM-dir), which is removed whether or not we succeed.
+def WriteArpaDirectly():
+    float_counts_files = GetFloatCountsFiles(args.lm_dir)
+    for float_counts in float_counts_files:
+        EnsureFloatCountsIndex(float_counts)
+    # the ARPA file counts <s> as a unigram, although it has no probability.
+    num_ngrams = ReadNumNgrams()
+    num_ngrams[0] += 1
+    section_dir = tempfile.mkdtemp(dir=args.temp_dir)
+    errors = []
+    threads = []
+    for order in range(1, ngram_order + 1):
+        threads.append(
+            threading.Thread(target=WriteSection,
+                             args=[
+                                 section_dir, order, float_counts_files,
+                                 num_ngrams[order - 1], errors
+                             ]))
+        threads[-1].start()
+    for t in threads:
+        t.join()
+    if len(errors) > 0:
+        shutil.rmtree(section_dir)
+        ExitProgram(errors[0])
+
+    with open(section_dir + "/header", "w", encoding="utf-8") as f:
+        print("\\data\\", file=f)
+        for order in range(1, ngram_order + 1):
+            print("ngram {0}={1}".format(order, num_ngrams[order - 1]), file=f)
+    with open(section_dir + "/end", "w", encoding="utf-8") as f:
+        print("\n\\end\\", file=f)
+    WriteOutput("cat {0}/header ".format(section_dir) + " ".join([
+        "{0}/{1}.arpa".format(section_dir, order)
+        for order in range(1, ngram_order + 1)
+    ]) + " {0}/end".format(section_dir),
+                cleanup_dir=section_dir)
+    shutil.rmtree(section_dir)
+
+
+# This function runs 'command', which writes the ARPA file to its standard
+# output, and writes its output to the standard output or, with --output, to
+# that file (compressing it, if the name ends in .gz).  If 'cleanup_dir' is
+# set, that directory is removed before exiting if the command fails.
+def WriteOutput(command, cleanup_dir=None):
+    print("format_arpa_lm.py: running " + command, file=sys.stderr)
+    if args.output is None:
+        ret = os.system(command)
     else:
-        mem_opt = "--buffer-size={0}".format(args.max_memory)
-    # LM counts are in one file.
-    command = (
-        "float-counts-to-pre-arpa {ngram_order} {num_words} {lm_dir}/float.all | sort {mem_opt} |"
-        " pre-arpa-to-arpa {lm_dir}/words.txt".format(ngram_order=ngram_order,
-                                                      num_words=num_words,
-                                                      lm_dir=args.lm_dir,
-                                                      mem_opt=mem_opt))
-else:
-    # reading num_splits shouldn't fail, we validated the directory.
-    num_splits = int(
-        open(args.lm_dir + "/num_splits", encoding="utf-8").readline())
-    if args.max_memory == '':
-        mem_opt = ''
+        if args.output.endswith(".gz"):
+            output = ParallelGzipWriter(args.output,
+                                        num_threads=args.num_jobs,
+                                        max_memory=compressor_memory)
+        else:
+            output = open(args.output, "wb")
+        p = subprocess.Popen(command,
+                             shell=True,
+                             stdout=subprocess.PIPE,
+                             executable='/bin/bash')
+        while True:
+            data = p.stdout.read(1048576)
+            if len(data) == 0:
+                break
+            output.write(data)
+        ret = p.wait()
+        output.close()
+    if ret != 0:
+        if cleanup_dir is not None:
+            shutil.rmtree(cleanup_dir)
+        ExitProgram("command {0} exited with status {1}".format(command, ret))
+
+
+# This function writes the ARPA file using float-counts-to-pre-arpa, which
+# writes the n-grams in a form where sorting them (as text) puts them in the
+# right order, then sort and then pre-arpa-to-arpa.
+def WriteArpaWithSort():
+    if not os.path.exists(args.lm_dir + "/num_splits"):
+        if args.max_memory == '':
+            mem_opt = ''
+        else:
+            mem_opt = "--buffer-size={0}".format(
+                DivideMemory(args.max_memory, 1 + num_compressors))
+        # LM counts are in one file.
+        command = (
+            "float-counts-to-pre-arpa {ngram_order} {num_words} {lm_dir}/float.all | sort {mem_opt} |"
+            " pre-arpa-to-arpa {lm_dir}/words.txt".format(ngram_order=ngram_order,
+                                                          num_words=num_words,
+                                                          lm_dir=args.lm_dir,
+                                                          mem_opt=mem_opt))
     else:
-        mem_opt = "--buffer-size={0}".format(
-            DivideMemory(args.max_memory, num_splits + 1))
-
-    [
-        os.remove(x)
-        for x in glob.glob("{lm_dir}/.*.error".format(lm_dir=args.lm_dir))
-    ]
-    # create command line of the form:
-    # sort -m <(command1) <(command2) ... <(commandN) | pre-arpa-to-arpa ...
-    # we put it all inside bash -c, because the process substitution <(command)
-    # won't always work in /bin/sh.
-    command = (
-        "bash -c 'sort -m {mem_opt} ".format(mem_opt=mem_opt)
-        +  # sort -m merges already-sorted files.
-        " ".join([
-            "<(float-counts-to-pre-arpa {opt} {ngram_order} {num_words} "
-            "{lm_dir}/float.all.{n} | sort {mem_opt} || touch {lm_dir}/.{n}.error)"
-            .format(opt=('--no-unigram' if n > 1 else ''),
-                    ngram_order=ngram_order,
-                    num_words=num_words,
-                    lm_dir=args.lm_dir,
-                    n=n,
-                    mem_opt=mem_opt) for n in range(1, num_splits + 1)
-        ]) +
-        " | pre-arpa-to-arpa {lm_dir}/words.txt'".format(lm_dir=args.lm_dir))
-
-print("format_arpa_lm.py: running " + command, file=sys.stderr)
-
-ret = os.system(command)
-
-if ret != 0:
-    sys.exit("format_arpa_lm.py: command {0} exited with status {1}".format(
-        command, ret))
-
-if len(glob.glob("{lm_dir}/.*.error".format(lm_dir=args.lm_dir))) > 0:
-    ExitProgram(
-        "Something went wrong for the float-counts-to-pre-arpa or sort command."
-    )
+        # reading num_splits shouldn't fail, we validated the directory.
+        num_splits = int(
+            open(args.lm_dir + "/num_splits", encoding="utf-8").readline())
+        if args.max_memory == '':
+            mem_opt = ''
+        else:
+            mem_opt = "--buffer-size={0}".format(
+                DivideMemory(args.max_memory,
+                             num_splits + 1 + num_compressors))
+
+        [
+            os.remove(x)
+            for x in glob.glob("{lm_dir}/.*.error".format(lm_dir=args.lm_dir))
+        ]
+        # create command line of the form:
+        # sort -m <(command1) <(command2) ... <(commandN) | pre-arpa-to-arpa ...
+        # we put it all inside bash -c, because the process substitution <(command)
+        # won't always work in /bin/sh.
+        command = (
+            "bash -c 'sort -m {mem_opt} ".format(mem_opt=mem_opt)
+            +  # sort -m merges already-sorted files.
+            " ".join([
+                "<(float-counts-to-pre-arpa {opt} {ngram_order} {num_words} "
+                "{lm_dir}/float.all.{n} | sort {mem_opt} || touch {lm_dir}/.{n}.error)"
+                .format(opt=('--no-unigram' if n > 1 else ''),
+                        ngram_order=ngram_order,
+                        num_words=num_words,
+                        lm_dir=args.lm_dir,
+                        n=n,
+                        mem_opt=mem_opt) for n in range(1, num_splits + 1)
+            ]) +
+            " | pre-arpa-to-arpa {lm_dir}/words.txt'".format(lm_dir=args.lm_dir))
+
+    WriteOutput(command)
+
+    if len(glob.glob("{lm_dir}/.*.error".format(lm_dir=args.lm_dir))) > 0:
+        ExitProgram(
+            "Something went wrong for the float-counts-to-pre-arpa or sort command."
+        )
+
+
+if args.direct_sections == "true":
+    WriteArpaDirectly()
+else:
+    WriteArpaWithSort()
 
 print("format_arpa_lm.py: succeeded formatting ARPA lm from {0}".format(
     args.lm_dir),
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# we're using python 3.x style print but want it to work in python 2.x,
+from __future__ import print_function
+import os
+import argparse
+import sys
+
+# If the encoding of the default sys.stdout is not utf-8,
+# force it to be utf-8. See PR #95.
+if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
+    import codecs
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
+    sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
+    sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
+
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+from pocolm_common import (ExitProgram, GetFloatCountsFiles,
+                           EnsureFloatCountsIndex)
+
+parser = argparse.ArgumentParser(
+    description="This script turns a pocolm language model directory as "
+    "created by make_lm_dir.py into a binary LM, in the format described in "
+    "src/binary-lm.h.  The binary LM contains the same probabilities and "
+    "backoff weights as the ARPA LM written by format_arpa_lm.py (but "
+    "quantized), and the vocabulary; it is designed to be memory-mapped by "
+    "decoders (see class BinaryLm in src/binary-lm.h), so it loads "
+    "instantly.  It can be converted to ARPA format with binary-lm-to-arpa.",
+    epilog="e.g. format_binary_lm.py data/lm data/lm.bin",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+parser.add_argument(
+    "--quantization-bits",
+    type=int,
+    default=16,
+    help="Number of bits (1 to 16) of the quantized log-probs and backoff "
+    "weights.  The quantization is lossless for an n-gram order with no more "
+    "than 2^bits distinct log-probs.")
+parser.add_argument("lm_dir",
+                    help="Directory of the source language model, as created "
+                    "by make_lm_dir.py")
+parser.add_argument("binary_lm_out", help="Filename of the binary LM to write")
+
+args = parser.parse_args()
+
+# Add the script dir and the src dir to the path.
+os.environ['PATH'] = (os.environ['PATH'] + os.pathsep +
+                      os.path.abspath(os.path.dirname(sys.argv[0])) +
+                      os.pathsep +
+                      os.path.abspath(os.path.dirname(sys.argv[0])) +
+                      "/../src")
+
+if os.system("validate_lm_dir.py " + args.lm_dir) != 0:
+    sys.exit("format_binary_lm.py: failed to validate input LM directory")
+
+if args.quantization_bits < 1 or args.quantization_bits > 16:
+    sys.exit("format_binary_lm.py: invalid --quantization-bits={0}".format(
+        args.quantization_bits))
+
+float_counts_files = GetFloatCountsFiles(args.lm_dir)
+for float_counts in float_counts_files:
+    EnsureFloatCountsIndex(float_counts)
+
+command = ("float-counts-to-binary-lm --quantization-bits={0} {1}/words.txt "
+           "{2} {3}".format(args.quantization_bits, args.lm_dir,
+                            args.binary_lm_out, " ".join(float_counts_files)))
+print("format_binary_lm.py: running " + command, file=sys.stderr)
+ret = os.system(command)
+if ret != 0:
+    ExitProgram("command {0} exited with status {1}".format(command, ret))
+
+print("format_binary_lm.py: succeeded writing binary LM {0} from {1}".format(
+    args.binary_lm_out, args.lm_dir),
+      file=sys.stderr)
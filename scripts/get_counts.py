@@ -8,6 +8,7 @@ import sys
 import threading
 import shutil
 import glob
+import hashlib
 import tempfile
 import platform
 
@@ -92,12 +93,55 @@ parser.add_argument(
 parser.add_argument("--max-memory",
                     type=str,
                     default='',
-                    help="Memory limitation for sort.")
+                    help="Memory limitation for sort (or for "
+                    "get-int-counts-direct, if --use-direct-counts=true).")
+parser.add_argument(
+    "--use-direct-counts",
+    type=str,
+    default='false',
+    choices=['true', 'false'],
+    help="If true, count the n-grams with the program get-int-counts-direct, "
+    "which aggregates them in memory (spilling sorted runs to disk when "
+    "--max-memory is exceeded), instead of with the pipeline "
+    "'get-text-counts | sort | uniq -c | get-int-counts'.  The output is the "
+    "same; this is faster and uses less temporary disk space.")
 parser.add_argument("--limit-unk-history",
                     type=str,
                     default='false',
                     choices=['true', 'false'],
                     help="Truncate the left n-gram of an <unk> in history.")
+parser.add_argument(
+    "--incremental",
+    type=str,
+    default='false',
+    choices=['true', 'false'],
+    help="If true, reuse the counts already in <dest-count-dir> for "
+    "data-sources whose integerized data has not changed since they were "
+    "counted (as recorded in <dest-count-dir>/source_fingerprints), even if "
+    "the data-source's number has changed, e.g. because another data-source "
+    "was added.  With --min-counts, the per-source counts int.N.splitJ that "
+    "are the input to int-counts-enforce-min-counts are kept (regardless of "
+    "--cleanup), so that when a data-source changes, only that data-source is "
+    "recounted and the min-counts are re-applied.")
+parser.add_argument(
+    "--num-splits",
+    type=int,
+    default=1,
+    help="If >1, also write the counts split up by the most recent history "
+    "word into <dest-count-dir>/split<num-splits>/{1,2,...}, in the same "
+    "layout as split_count_dir.sh, while the counts are being written.  This "
+    "saves a pass over the counts when you run optimize_metaparameters.py "
+    "with the same --num-splits.")
+parser.add_argument(
+    "--compress-counts",
+    type=str,
+    default='false',
+    choices=['true', 'false'],
+    help="If true, at the end, convert the count files (including those in "
+    "the split directories, if --num-splits > 1) to the block-compressed "
+    "format written by int-counts-compress (see src/lm-state.h), which is "
+    "typically about a third of the size.  It is read transparently by all "
+    "programs that read counts.")
 parser.add_argument("source_int_dir",
                     help="Specify <source_int_dir> the data-source")
 parser.add_argument("ngram_order", type=int, help="Specify the order of ngram")
@@ -156,6 +200,20 @@ def CopyMetaInfo(source_int_dir, dest_count_dir):
             ExitProgram('error copying {0} to {1}'.format(src, dest))
 
 
+# returns true if data-source n (e.g. '1' or 'dev') in source_int_dir is in
+# the packed int-text format (see prepare_int_data.py --int-format=packed),
+# rather than gzipped text.
+def IsPackedIntData(source_int_dir, n):
+    return os.path.exists('{0}/{1}.int'.format(source_int_dir, n))
+
+
+# returns the file containing the integerized data for data-source n.
+def GetIntDataFile(source_int_dir, n):
+    return '{0}/{1}.{2}'.format(
+        source_int_dir, n,
+        'int' if IsPackedIntData(source_int_dir, n) else 'txt.gz')
+
+
 def IsCygwin():
     return platform.system()[0:3].lower() == 'win' or platform.system(
     )[0:3].lower() == 'cyg'
@@ -321,6 +379,105 @@ def SaveNgramOrder(dest_count_dir, ngram_order):
     f.close()
 
 
+# returns the directory {dest_count_dir}/split{num_splits}/{s}.
+def GetSplitDir(dest_count_dir, s):
+    return '{0}/split{1}/{2}'.format(dest_count_dir, args.num_splits, s)
+
+
+# This function, called if --num-splits > 1, creates the split directories
+# {dest_count_dir}/split{num_splits}/{1,2,...} and their meta-info, as
+# split_count_dir.sh would.
+def CreateSplitDirs(dest_count_dir):
+    for s in range(1, args.num_splits + 1):
+        split_dir = GetSplitDir(dest_count_dir, s)
+        if not os.path.isdir(split_dir):
+            os.makedirs(split_dir)
+        for f in ['num_train_sets', 'num_words', 'ngram_order', 'names']:
+            shutil.copy(dest_count_dir + '/' + f, split_dir + '/' + f)
+        # words.txt could be a fairly large file, so soft-link it.
+        if os.path.lexists(split_dir + '/words.txt'):
+            os.remove(split_dir + '/words.txt')
+        os.symlink('../../words.txt', split_dir + '/words.txt')
+        with open(split_dir + '/split_modulus', 'w', encoding="utf-8") as f:
+            print(args.num_splits, file=f)
+
+
+# the set of count files (e.g. 'int.1.3') that have been written to the split
+# directories, by commands set up by GetSplitOutputs().
+files_written_to_splits = set()
+
+
+# This function is used to write count files to the split directories
+# (if --num-splits > 1) at the same time as writing them to dest_count_dir.
+# 'filenames' is a list of count files that a command writes (it may include
+# /dev/null).  It returns a tuple (setup_command, outputs, finish_command):
+# 'outputs' is the list of filenames that the command should write to instead
+# (fifos in 'tempdir'); 'setup_command' is a bash command that creates the
+# fifos and starts background processes that copy each fifo to the count file
+# and split it into the split directories; and 'finish_command' should follow
+# the command, to wait for those processes.  If anything fails, the file
+# 'error_file' is created.
+def GetSplitOutputs(dest_count_dir, filenames, tempdir, error_file):
+    if args.num_splits <= 1:
+        return ('', filenames, '')
+    setup_command = ''
+    finish_command = ''
+    outputs = []
+    for i in range(len(filenames)):
+        filename = filenames[i]
+        if filename == '/dev/null':
+            outputs.append(filename)
+            continue
+        name = os.path.basename(filename)
+        fifo = '{0}/split_output.{1}'.format(tempdir, i)
+        split_files = ' '.join([
+            GetSplitDir(dest_count_dir, s) + '/' + name
+            for s in range(1, args.num_splits + 1)
+        ])
+        # we open each fifo for writing in the shell itself (after the reader
+        # has started), so that the readers get end-of-file and exit even if
+        # the command fails before opening its outputs.
+        setup_command += ('mkfifo {0}; (tee {1} <{0} | split-int-counts '
+                          '{2} || touch {3}) & exec {{fd{4}}}>{0}; '.format(
+                              fifo, filename, split_files, error_file, i))
+        finish_command += 'exec {{fd{0}}}>&-; '.format(i)
+        outputs.append(fifo)
+        files_written_to_splits.add(name)
+    finish_command += 'wait; '
+    return (setup_command, outputs, finish_command)
+
+
+# This function, called if --num-splits > 1 at the end, splits the count files
+# that were not already written to the split directories (e.g. because they
+# were reused in incremental mode).
+def SplitRemainingCounts(dest_count_dir, ngram_order, num_train_sets):
+    threads = []
+    for n in ['dev'] + list(range(1, num_train_sets + 1)):
+        for name in ['int.{0}.{1}'.format(n, o)
+                     for o in range(2, ngram_order + 1)] + (
+                         ['int.dev'] if n == 'dev' else []):
+            if name in files_written_to_splits:
+                continue
+            command = 'split-int-counts {0} <{1}/{2}'.format(
+                ' '.join([
+                    GetSplitDir(dest_count_dir, s) + '/' + name
+                    for s in range(1, args.num_splits + 1)
+                ]), dest_count_dir, name)
+            log_file = '{0}/log/split_counts.{1}.log'.format(
+                dest_count_dir, name)
+            threads.append(
+                threading.Thread(target=RunCommand,
+                                 args=[command, log_file,
+                                       args.verbose == 'true']))
+            threads[-1].start()
+    for t in threads:
+        t.join()
+    # split_count_dir.sh won't redo the splitting if the split int.dev files
+    # are newer than int.dev.
+    for s in range(1, args.num_splits + 1):
+        os.utime(GetSplitDir(dest_count_dir, s) + '/int.dev')
+
+
 # this function dumps the counts to disk.
 
 #  if num_splits == 0 [relevant when we're not using min-counts], then it dumps
@@ -337,27 +494,61 @@ def GetCountsSingleProcess(source_int_dir,
                            n,
                            max_mem,
                            num_splits=0):
+    tempdir = None
+    split_setup = ''
+    split_finish = ''
     if num_splits == 0:
-        int_counts_output = "/dev/null " + " ".join([
-            "{0}/int.{1}.{2}".format(dest_count_dir, n, o)
-            for o in range(2, ngram_order + 1)
-        ])
+        outputs = ['/dev/null'] + GetCountsOutputs(dest_count_dir,
+                                                   ngram_order, n, 0)
+        if args.num_splits > 1:
+            tempdir = tempfile.mkdtemp()
+            error_file = tempdir + '/error'
+            (split_setup, outputs,
+             split_finish) = GetSplitOutputs(dest_count_dir, outputs, tempdir,
+                                             error_file)
+        int_counts_output = ' '.join(outputs)
     else:
         assert num_splits >= 1
         int_counts_output = '/dev/stdout | split-int-counts ' + \
             ' '.join(["{0}/int.{1}.split{2}".format(dest_count_dir, n, j)
                      for j in range(1, num_splits + 1)])
 
-    command = "bash -c 'set -o pipefail; export LC_ALL=C; gunzip -c {source_int_dir}/{n}.txt.gz | "\
-              "get-text-counts {limit_unk_history} {ngram_order} | sort {mem_opt}| uniq -c | "\
-              "get-int-counts {int_counts_output}'".format(source_int_dir=source_int_dir,
-                                                           n=n, ngram_order=ngram_order,
-                                                           limit_unk_history="--limit-unk-history" if args.limit_unk_history == 'true' else "",
-                                                           mem_opt="--buffer-size={0}".format(max_mem) if max_mem != '' else '',
-                                                           int_counts_output=int_counts_output)
+    if IsPackedIntData(source_int_dir, n):
+        input_command = ''
+        input_opt = '--packed-input={0}/{1}.int'.format(source_int_dir, n)
+    else:
+        input_command = 'gunzip -c {0}/{1}.txt.gz | '.format(source_int_dir, n)
+        input_opt = ''
+
+    if args.use_direct_counts == 'true':
+        command = "bash -c 'set -o pipefail; {split_setup}{input_command}"\
+                  "get-int-counts-direct {input_opt} {limit_unk_history} {mem_opt} {ngram_order} "\
+                  "{int_counts_output} || exit 1; {split_finish}'".format(
+                                                split_setup=split_setup, split_finish=split_finish,
+                                                input_command=input_command, input_opt=input_opt,
+                                                ngram_order=ngram_order,
+                                                limit_unk_history="--limit-unk-history" if args.limit_unk_history == 'true' else "",
+                                                mem_opt="--max-memory={0}".format(max_mem) if max_mem != '' else '',
+                                                int_counts_output=int_counts_output)
+    else:
+        command = "bash -c 'set -o pipefail; export LC_ALL=C; {split_setup}{input_command}"\
+                  "get-text-counts {input_opt} {limit_unk_history} {ngram_order} | sort {mem_opt}| uniq -c | "\
+                  "get-int-counts {int_counts_output} || exit 1; {split_finish}'".format(
+                                                               split_setup=split_setup, split_finish=split_finish,
+                                                               input_command=input_command, input_opt=input_opt,
+                                                               ngram_order=ngram_order,
+                                                               limit_unk_history="--limit-unk-history" if args.limit_unk_history == 'true' else "",
+                                                               mem_opt="--buffer-size={0}".format(max_mem) if max_mem != '' else '',
+                                                               int_counts_output=int_counts_output)
     log_file = "{dest_count_dir}/log/get_counts.{n}.log".format(
         dest_count_dir=dest_count_dir, n=n)
     RunCommand(command, log_file, args.verbose == 'true')
+    if tempdir is not None:
+        failed = os.path.exists(error_file)
+        shutil.rmtree(tempdir)
+        if failed:
+            ExitProgram("Something went wrong writing the split counts for "
+                        "data-source {0}.".format(n))
 
 
 # This function uses multiple parallel processes to dumps the counts to files.
@@ -373,6 +564,9 @@ def GetCountsSingleProcess(source_int_dir,
 # 'get-text-counts' (this tends to be the bottleneck).
 # It will use just one process if the amount of data is quite small or if
 # the platform is Cygwin (where named pipes don't work)
+# For packed int-data, each process reads its own part of the data directly;
+# otherwise the lines are distributed to the processes by
+# distribute-input-lines.
 def GetCountsMultiProcess(source_int_dir,
                           dest_count_dir,
                           ngram_order,
@@ -380,11 +574,13 @@ def GetCountsMultiProcess(source_int_dir,
                           num_proc,
                           max_mem,
                           num_splits=0):
+    packed = IsPackedIntData(source_int_dir, n)
+    input_file = GetIntDataFile(source_int_dir, n)
     try:
-        file_size = os.path.getsize('{0}/{1}.txt.gz'.format(source_int_dir, n))
+        file_size = os.path.getsize(input_file)
     except:
         ExitProgram('get_counts.py: error getting file size of '
-                    '{0}/{1}.txt.gz'.format(source_int_dir, n))
+                    '{0}'.format(input_file))
 
     if IsCygwin() or num_proc <= 1 or file_size < 1000000:
         if num_proc > 1 and file_size >= 1000000:
@@ -396,17 +592,6 @@ def GetCountsMultiProcess(source_int_dir,
         return GetCountsSingleProcess(source_int_dir, dest_count_dir,
                                       ngram_order, n, max_mem, num_splits)
 
-    if num_splits == 0:
-        int_counts_output = "/dev/null " + " ".join([
-            "{0}/int.{1}.{2}".format(dest_count_dir, n, o)
-            for o in range(2, ngram_order + 1)
-        ])
-    else:
-        assert num_splits >= 1
-        int_counts_output = '/dev/stdout | split-int-counts ' + \
-            ' '.join(["{0}/int.{1}.split{2}".format(dest_count_dir, n, j)
-                     for j in range(1, num_splits + 1)])
-
     try:
         # we want a temporary directory on a local file system
         # for
@@ -425,13 +610,79 @@ def GetCountsMultiProcess(source_int_dir,
                                                            n=n))
     ]
 
+    split_setup = ''
+    split_finish = ''
+    if num_splits == 0:
+        (split_setup, outputs, split_finish) = GetSplitOutputs(
+            dest_count_dir,
+            ['/dev/null'] + GetCountsOutputs(dest_count_dir, ngram_order, n, 0),
+            tempdir, '{0}/.{1}.split.error'.format(log_dir, n))
+        int_counts_output = ' '.join(outputs)
+    else:
+        assert num_splits >= 1
+        int_counts_output = '/dev/stdout | split-int-counts ' + \
+            ' '.join(["{0}/int.{1}.split{2}".format(dest_count_dir, n, j)
+                     for j in range(1, num_splits + 1)])
+
     log_file = "{log_dir}/get_counts.{n}.log".format(log_dir=log_dir, n=n)
 
-    test_command = "bash -c 'set -o pipefail; (echo a; echo b) | "\
-        "distribute-input-lines /dev/null /dev/null'"
-    # We run the following command just to make sure distribute-input-lines is
-    # on the path and compiled, since we get hard-to-debug errors if it fails.
-    RunCommand(test_command, log_file)
+    if packed:
+        distribute_command = ''
+        worker_inputs = [
+            '--packed-input={0} --part={1}/{2}'.format(input_file, p + 1,
+                                                       num_proc)
+            for p in range(num_proc)
+        ]
+    else:
+        test_command = "bash -c 'set -o pipefail; (echo a; echo b) | "\
+            "distribute-input-lines /dev/null /dev/null'"
+        # We run the following command just to make sure distribute-input-lines is
+        # on the path and compiled, since we get hard-to-debug errors if it fails.
+        RunCommand(test_command, log_file)
+        distribute_command = (
+            ''.join(['mkfifo {0}/{1}; '.format(tempdir, p)
+                     for p in range(num_proc)]) +
+            'gunzip -c {0} | distribute-input-lines '.format(input_file) +
+            ' '.join(['{0}/{1}'.format(tempdir, p)
+                      for p in range(num_proc)]) + '& ')
+        worker_inputs = [
+            '<{0}/{1}'.format(tempdir, p) for p in range(num_proc)
+        ]
+
+    if args.use_direct_counts == 'true':
+        # Each get-int-counts-direct process writes the counts of all orders
+        # for its share of the lines; merge-int-counts adds them up, and we
+        # then divide them up by order (or by most-recent history word).
+        if num_splits == 0:
+            split_command = 'split-int-counts-by-order ' + int_counts_output
+        else:
+            split_command = 'split-int-counts ' + ' '.join([
+                "{0}/int.{1}.split{2}".format(dest_count_dir, n, j)
+                for j in range(1, num_splits + 1)
+            ])
+        if max_mem == '':
+            mem_opt = ''
+        else:
+            mem_opt = "--max-memory={0}".format(DivideMemory(
+                max_mem, num_proc))
+        command = (
+            "bash -c 'set -o pipefail; set -e; mkdir -p {0}; ".format(tempdir)
+            + 'trap "rm -r {0}" SIGINT SIGKILL SIGTERM EXIT; '.format(tempdir)
+            + split_setup + distribute_command + 'merge-int-counts ' +
+            ' '.join([
+                '<(get-int-counts-direct {3} {0} {1} {2} /dev/stdout || '
+                'touch {4}/.{5}.{6}.error)'.format(
+                    "--limit-unk-history" if args.limit_unk_history == 'true'
+                    else "", mem_opt, ngram_order, worker_inputs[p], log_dir,
+                    n, p) for p in range(num_proc)
+            ]) + ' | {0}; '.format(split_command) + split_finish + "'")
+        RunCommand(command, log_file, args.verbose == 'true')
+        if len(glob.glob("{log_dir}/.{n}.*.error".format(log_dir=log_dir,
+                                                         n=n))) > 0:
+            ExitProgram(
+                "Something went wrong for the get-int-counts-direct command "
+                "for training set {n}.".format(n=n))
+        return
 
     if max_mem == '':
         mem_opt = ''
@@ -442,20 +693,17 @@ def GetCountsMultiProcess(source_int_dir,
     # for example 'set -o pipefail' would only work in bash.
     command = (
         "bash -c 'set -o pipefail; set -e; export LC_ALL=C; mkdir -p {0}; ".
-        format(tempdir) + ''.join(
-            ['mkfifo {0}/{1}; '.format(tempdir, p) for p in range(num_proc)]) +
+        format(tempdir) +
         'trap "rm -r {0}" SIGINT SIGKILL SIGTERM EXIT; '.format(tempdir) +
-        'gunzip -c {0}/{1}.txt.gz | distribute-input-lines '.format(
-            source_int_dir, n) +
-        ' '.join(['{0}/{1}'.format(tempdir, p) for p in range(num_proc)]) +
-        '& ' + 'sort -m {0} '.format(mem_opt) + ' '.join([
-            '<(get-text-counts {4} {0} <{1}/{2} | sort {3} || touch {5}/.{6}.{2}.error)'
+        split_setup + distribute_command + 'sort -m {0} '.format(mem_opt) +
+        ' '.join([
+            '<(get-text-counts {1} {4} {0} | sort {3} || touch {5}/.{6}.{2}.error)'
             .format(
-                ngram_order, tempdir, p, mem_opt, "--limit-unk-history"
+                ngram_order, worker_inputs[p], p, mem_opt, "--limit-unk-history"
                 if args.limit_unk_history == 'true' else "", log_dir, n)
             for p in range(num_proc)
-        ]) + '| uniq -c | get-int-counts {0}'.format(int_counts_output) + "'"
-    )  # end the quote from the 'bash -c'.
+        ]) + '| uniq -c | get-int-counts {0}; '.format(int_counts_output) +
+        split_finish + "'")  # end the quote from the 'bash -c'.
 
     RunCommand(command, log_file, args.verbose == 'true')
 
@@ -466,6 +714,160 @@ def GetCountsMultiProcess(source_int_dir,
             .format(n=n))
 
 
+# This returns the list of files that GetCountsMultiProcess writes for
+# data-source n, for the given num_splits (see above).
+def GetCountsOutputs(dest_count_dir, ngram_order, n, num_splits):
+    if num_splits == 0:
+        return [
+            '{0}/int.{1}.{2}'.format(dest_count_dir, n, o)
+            for o in range(2, ngram_order + 1)
+        ]
+    else:
+        return [
+            '{0}/int.{1}.split{2}'.format(dest_count_dir, n, j)
+            for j in range(1, num_splits + 1)
+        ]
+
+
+# This returns a string describing the options that the counts of a
+# data-source depend on, apart from the data itself.
+def GetCountsOptionsKey(ngram_order, num_splits):
+    return 'order={0},limit-unk-history={1},splits={2}'.format(
+        ngram_order, args.limit_unk_history, num_splits)
+
+
+def FileHash(filename):
+    h = hashlib.sha1()
+    try:
+        with open(filename, 'rb') as f:
+            while True:
+                block = f.read(1 << 20)
+                if len(block) == 0:
+                    break
+                h.update(block)
+    except Exception as e:
+        ExitProgram('error reading {0}: {1}'.format(filename, str(e)))
+    return h.hexdigest()
+
+
+# This reads {dest_count_dir}/source_fingerprints, as written by
+# WriteSourceFingerprints.  It returns a pair (fingerprints, min_counts) where
+# 'fingerprints' is a dict from data-source (e.g. '1' or 'dev') to a tuple
+# (options-key, size, mtime, sha1) describing the integerized data that its
+# counts were computed from, and 'min_counts' is the formatted min-counts
+# string (see FormatMinCounts()) that was applied to the counts, or None.
+def ReadSourceFingerprints(dest_count_dir):
+    fingerprints = {}
+    min_counts = None
+    filename = '{0}/source_fingerprints'.format(dest_count_dir)
+    if not os.path.exists(filename):
+        return (fingerprints, min_counts)
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            a = line.split()
+            try:
+                if a[0] == 'min-counts':
+                    min_counts = ' '.join(a[1:])
+                else:
+                    [n, key, size, mtime, sha1] = a
+                    fingerprints[n] = (key, int(size), int(mtime), sha1)
+            except:
+                ExitProgram('bad line {0} in {1}'.format(line[:-1], filename))
+    return (fingerprints, min_counts)
+
+
+def WriteSourceFingerprints(dest_count_dir, fingerprints, min_counts):
+    filename = '{0}/source_fingerprints'.format(dest_count_dir)
+    with open(filename, 'w', encoding="utf-8") as f:
+        for (n, (key, size, mtime, sha1)) in fingerprints.items():
+            print(n, key, size, mtime, sha1, file=f)
+        if min_counts is not None:
+            print('min-counts', min_counts, file=f)
+
+
+# This function, called if --incremental=true, works out which data-sources
+# need to be counted.  'sources' is a list of pairs (n, num_splits), e.g.
+# [('dev', 0), ('1', 0), ('2', 0)].  The counts of a data-source whose
+# integerized data (and counting options) is the same as for some data-source
+# in the previous run are reused, renaming the count files if the data-source's
+# number has changed.  It returns a tuple (sources_to_count, fingerprints,
+# old_min_counts, changed), where 'sources_to_count' is the set of
+# data-sources whose counts must be computed, 'fingerprints' is to be written
+# with WriteSourceFingerprints() once they are computed, old_min_counts is
+# the min-counts string of the previous run (or None), and 'changed' is true
+# if any count file was renamed.
+def ReuseCounts(source_int_dir, dest_count_dir, ngram_order, sources):
+    (old_fingerprints, old_min_counts) = ReadSourceFingerprints(dest_count_dir)
+    # remove the fingerprints file now, in case we fail before the counts are
+    # consistent with it again.
+    if os.path.exists('{0}/source_fingerprints'.format(dest_count_dir)):
+        os.remove('{0}/source_fingerprints'.format(dest_count_dir))
+
+    fingerprints = {}
+    for (n, num_splits) in sources:
+        key = GetCountsOptionsKey(ngram_order, num_splits)
+        filename = GetIntDataFile(source_int_dir, n)
+        stat = os.stat(filename)
+        old = old_fingerprints.get(n)
+        if (old is not None and old[0:3] == (key, stat.st_size,
+                                             stat.st_mtime_ns)):
+            sha1 = old[3]
+        else:
+            sha1 = FileHash(filename)
+        fingerprints[n] = (key, stat.st_size, stat.st_mtime_ns, sha1)
+
+    # a map from (options-key, sha1) to the old data-source with those counts,
+    # if its count files still exist.
+    old_counts = {}
+    for (m, (key, size, mtime, sha1)) in old_fingerprints.items():
+        num_splits = int(key.split('splits=')[1])
+        if all([
+                os.path.exists(f) for f in GetCountsOutputs(
+                    dest_count_dir, ngram_order, m, num_splits)
+        ]):
+            old_counts[(key, sha1)] = m
+
+    # first find the data-sources whose counts are unchanged and in place,
+    # then those whose counts can be moved from another data-source.  Each old
+    # data-source's counts can only be used once (this matters if two
+    # data-sources have the same data).
+    unchanged = set()
+    for (n, num_splits) in sources:
+        (key, size, mtime, sha1) = fingerprints[n]
+        if old_counts.get((key, sha1)) == n:
+            unchanged.add(n)
+            del old_counts[(key, sha1)]
+    sources_to_count = set()
+    renames = []  # list of (old data-source, new data-source, num_splits)
+    for (n, num_splits) in sources:
+        if n in unchanged:
+            continue
+        (key, size, mtime, sha1) = fingerprints[n]
+        m = old_counts.pop((key, sha1), None)
+        if m is None:
+            sources_to_count.add(n)
+        else:
+            renames.append((m, n, num_splits))
+
+    # the renames may form cycles, so we first move the files out of the way.
+    for (m, n, num_splits) in renames:
+        for f in GetCountsOutputs(dest_count_dir, ngram_order, m, num_splits):
+            os.rename(f, f + '.tmp')
+    for (m, n, num_splits) in renames:
+        for (f, g) in zip(
+                GetCountsOutputs(dest_count_dir, ngram_order, m, num_splits),
+                GetCountsOutputs(dest_count_dir, ngram_order, n,
+                                 num_splits)):
+            os.rename(f + '.tmp', g)
+
+    reused = [n for (n, num_splits) in sources if n not in sources_to_count]
+    if len(reused) > 0:
+        print("get_counts.py: reusing the counts of data-source(s) {0}".format(
+            ' '.join(reused)),
+              file=sys.stderr)
+    return (sources_to_count, fingerprints, old_min_counts, len(renames) > 0)
+
+
 # This function applies the min-counts (it is only called if you supplied the
 # --min-counts option to this script).  It reads in the data dumped by
 # GetCounts.  It dumps the files into {dest_count_dir}/int.{n}.split{j}.{o}
@@ -503,14 +905,14 @@ def EnforceMinCounts(dest_count_dir, formatted_min_counts, ngram_order,
 # option to this script).  It reads in the data dumped by EnforceMinCounts.
 # it merges the files into {dest_count_dir}/int.{n}.{o}.
 def MergeCounts(dest_count_dir, num_jobs, n, o):
-    if num_jobs > 1:
-        command = ('merge-int-counts ' + ' '.join([
-            '{0}/int.{1}.split{2}.{3}'.format(dest_count_dir, n, j, o)
-            for j in range(1, num_jobs + 1)
-        ]) + '>{0}/int.{1}.{2}'.format(dest_count_dir, n, o))
+    if num_jobs > 1 or args.num_splits > 1:
         log_file = '{0}/log/merge_counts.{1}.{2}.log'.format(
             dest_count_dir, n, o)
-        RunCommand(command, log_file, args.verbose == 'true')
+        RunCommandWithSplitOutput(
+            'merge-int-counts ' + ' '.join([
+                '{0}/int.{1}.split{2}.{3}'.format(dest_count_dir, n, j, o)
+                for j in range(1, num_jobs + 1)
+            ]), '{0}/int.{1}.{2}'.format(dest_count_dir, n, o), log_file)
     else:
         assert num_jobs == 1
         # we can just move the file if num-jobs == 1.
@@ -529,9 +931,63 @@ def MergeDevData(dest_count_dir, ngram_order):
     command = ("merge-int-counts " + ' '.join([
         dest_count_dir + "/int.dev." + str(n)
         for n in range(2, ngram_order + 1)
-    ]) + ">{0}/int.dev".format(dest_count_dir))
+    ]))
     log_file = dest_count_dir + '/log/merge_dev_counts.log'
-    RunCommand(command, log_file, args.verbose == 'true')
+    RunCommandWithSplitOutput(command, dest_count_dir + '/int.dev', log_file)
+
+
+# This function runs 'command', which writes counts to its standard output,
+# writing them to 'output'; if --num-splits > 1, the counts are also written to
+# the split directories (see GetSplitOutputs()).
+def RunCommandWithSplitOutput(command, output, log_file):
+    if args.num_splits <= 1:
+        RunCommand(command + ' >' + output, log_file, args.verbose == 'true')
+        return
+    tempdir = tempfile.mkdtemp()
+    error_file = tempdir + '/error'
+    (split_setup, outputs,
+     split_finish) = GetSplitOutputs(os.path.dirname(output), [output],
+                                     tempdir, error_file)
+    RunCommand(
+        "bash -c 'set -o pipefail; {0}{1} >{2} || exit 1; {3}'".format(
+            split_setup, command, outputs[0], split_finish), log_file,
+        args.verbose == 'true')
+    failed = os.path.exists(error_file)
+    shutil.rmtree(tempdir)
+    if failed:
+        ExitProgram("Something went wrong writing the split counts for "
+                    "{0}".format(output))
+
+
+# This function, called if --compress-counts=true at the end, converts the
+# count files to the block-compressed format.  We do one directory at a time
+# (in parallel over its count files), so the number of processes doesn't grow
+# with --num-splits; and we do the split directories last, so that
+# split_count_dir.sh still sees their int.dev as newer than the one in
+# dest_count_dir.
+def CompressCounts(dest_count_dir, ngram_order, num_train_sets):
+    names = ['int.dev'] + [
+        'int.{0}.{1}'.format(n, o)
+        for n in ['dev'] + list(range(1, num_train_sets + 1))
+        for o in range(2, ngram_order + 1)
+    ]
+    splits = list(range(1, args.num_splits + 1)) if args.num_splits > 1 else []
+    dirs = [(dest_count_dir, '')] + [(GetSplitDir(dest_count_dir, s),
+                                      'split{0}.'.format(s)) for s in splits]
+    for (count_dir, log_prefix) in dirs:
+        threads = []
+        for name in names:
+            command = ('int-counts-compress {0}/{1} {0}/{1}.tmp && '
+                       'mv {0}/{1}.tmp {0}/{1}'.format(count_dir, name))
+            log_file = '{0}/log/compress_counts.{1}{2}.log'.format(
+                dest_count_dir, log_prefix, name)
+            threads.append(
+                threading.Thread(target=RunCommand,
+                                 args=[command, log_file,
+                                       args.verbose == 'true']))
+            threads[-1].start()
+        for t in threads:
+            t.join()
 
 
 # this function returns the value and unit of the max_memory
@@ -601,6 +1057,31 @@ CopyMetaInfo(args.source_int_dir, args.dest_count_dir)
 
 SaveNgramOrder(args.dest_count_dir, args.ngram_order)
 
+if args.num_splits < 1:
+    ExitProgram("bad option --num-splits={0}".format(args.num_splits))
+if args.num_splits > 1:
+    CreateSplitDirs(args.dest_count_dir)
+
+if args.min_counts == '':
+    num_mc_jobs = 0
+else:
+    num_mc_jobs = args.num_min_count_jobs
+    if num_mc_jobs < 1:
+        ExitProgram("bad option --num-min-count-jobs={0}".format(num_mc_jobs))
+
+# 'sources' is a list of pairs (data-source, num-splits); the dev data is never
+# split since the min-counts aren't relevant to it.
+sources = [('dev', 0)] + [(str(n), num_mc_jobs)
+                          for n in range(1, num_train_sets + 1)]
+if args.incremental == 'true':
+    (sources_to_count, fingerprints, old_min_counts,
+     renamed_counts) = ReuseCounts(args.source_int_dir, args.dest_count_dir,
+                                   args.ngram_order, sources)
+else:
+    sources_to_count = set([n for (n, num_splits) in sources])
+    if os.path.exists(args.dest_count_dir + '/source_fingerprints'):
+        os.remove(args.dest_count_dir + '/source_fingerprints')
+
 if args.min_counts == '':
     # no min-counts specified: use normal pipeline.
     print("get_counts.py: dumping counts", file=sys.stderr)
@@ -613,6 +1094,8 @@ if args.min_counts == '':
     else:
         max_mem = ''
     for n in ["dev"] + list(range(1, num_train_sets + 1)):
+        if str(n) not in sources_to_count:
+            continue
         threads.append(
             threading.Thread(target=GetCountsMultiProcess,
                              args=[
@@ -628,25 +1111,24 @@ if args.min_counts == '':
         for t in threads:
             t.join()
 
-    MergeDevData(args.dest_count_dir, args.ngram_order)
+    if 'dev' in sources_to_count or not os.path.exists(args.dest_count_dir +
+                                                       '/int.dev'):
+        MergeDevData(args.dest_count_dir, args.ngram_order)
+    formatted_min_counts = None
     print("get_counts.py: done", file=sys.stderr)
 
 else:
     # First process the dev data, the min-counts aren't relevant here.
-    GetCountsSingleProcess(args.source_int_dir, args.dest_count_dir,
-                           args.ngram_order, 'dev', args.max_memory)
-    MergeDevData(args.dest_count_dir, args.ngram_order)
+    if 'dev' in sources_to_count:
+        GetCountsSingleProcess(args.source_int_dir, args.dest_count_dir,
+                               args.ngram_order, 'dev', args.max_memory)
+    if 'dev' in sources_to_count or not os.path.exists(args.dest_count_dir +
+                                                       '/int.dev'):
+        MergeDevData(args.dest_count_dir, args.ngram_order)
 
-    num_mc_jobs = args.num_min_count_jobs
-    if num_mc_jobs < 1:
-        ExitProgram("bad option --num-min-count-jobs={0}".format(num_mc_jobs))
     formatted_min_counts = FormatMinCounts(args.source_int_dir, num_train_sets,
                                            args.ngram_order, args.min_counts)
 
-    if not num_mc_jobs >= 1:
-        sys.exit(
-            "get_counts.py: invalid option --num-jobs={0}".format(num_mc_jobs))
-
     # First, dump the counts split up by most-recent-history instead of ngram-order.
     print("get_counts.py: dumping counts", file=sys.stderr)
     if args.max_memory != '':
@@ -658,6 +1140,8 @@ else:
         max_mem = ''
     threads = []
     for n in range(1, num_train_sets + 1):
+        if str(n) not in sources_to_count:
+            continue
         threads.append(
             threading.Thread(target=GetCountsMultiProcess,
                              args=[
@@ -673,50 +1157,82 @@ else:
         for t in threads:
             t.join()
 
-    # Next, apply the min-counts.
-    print("get_counts.py: applying min-counts", file=sys.stderr)
-    threads = []
-    for j in range(1, num_mc_jobs + 1):
-        threads.append(
-            threading.Thread(target=EnforceMinCounts,
-                             args=[
-                                 args.dest_count_dir, formatted_min_counts,
-                                 args.ngram_order, num_train_sets, j
-                             ]))
-        threads[-1].start()
-
-    for t in threads:
-        t.join()
-
-    if args.cleanup == 'true':
-        for n in range(1, num_train_sets + 1):
-            for j in range(1, num_mc_jobs + 1):
-                os.remove("{0}/int.{1}.split{2}".format(
-                    args.dest_count_dir, n, j))
-
-    print("get_counts.py: merging counts", file=sys.stderr)
-    threads = []
-    for n in range(1, num_train_sets + 1):
-        for o in range(2, args.ngram_order + 1):
+    # In incremental mode, we can skip applying the min-counts if none of the
+    # training data's counts changed and the min-counts are the same.
+    if (args.incremental == 'true'
+            and sources_to_count.issubset(set(['dev'])) and not renamed_counts
+            and old_min_counts == formatted_min_counts and all([
+                os.path.exists(f) for n in range(1, num_train_sets + 1)
+                for f in GetCountsOutputs(args.dest_count_dir,
+                                          args.ngram_order, n, 0)
+            ])):
+        print("get_counts.py: training data unchanged, not re-applying "
+              "min-counts.",
+              file=sys.stderr)
+    else:
+        # Next, apply the min-counts.
+        print("get_counts.py: applying min-counts", file=sys.stderr)
+        threads = []
+        for j in range(1, num_mc_jobs + 1):
             threads.append(
-                threading.Thread(target=MergeCounts,
-                                 args=[args.dest_count_dir, num_mc_jobs, n,
-                                       o]))
+                threading.Thread(target=EnforceMinCounts,
+                                 args=[
+                                     args.dest_count_dir, formatted_min_counts,
+                                     args.ngram_order, num_train_sets, j
+                                 ]))
             threads[-1].start()
-    for t in threads:
-        t.join()
 
-    if args.cleanup == 'true':
+        for t in threads:
+            t.join()
+
+        # in incremental mode we keep the per-source counts int.{n}.split{j}
+        # so that they can be reused.
+        if args.cleanup == 'true' and args.incremental == 'false':
+            for n in range(1, num_train_sets + 1):
+                for j in range(1, num_mc_jobs + 1):
+                    os.remove("{0}/int.{1}.split{2}".format(
+                        args.dest_count_dir, n, j))
+
+        print("get_counts.py: merging counts", file=sys.stderr)
+        threads = []
         for n in range(1, num_train_sets + 1):
-            for j in range(1, args.num_min_count_jobs + 1):
-                for o in range(2, args.ngram_order + 1):
-                    try:
-                        os.remove("{0}/int.{1}.split{2}.{3}".format(
-                            args.dest_count_dir, n, j, o))
-                    except:
-                        pass
+            for o in range(2, args.ngram_order + 1):
+                threads.append(
+                    threading.Thread(target=MergeCounts,
+                                     args=[args.dest_count_dir, num_mc_jobs, n,
+                                           o]))
+                threads[-1].start()
+        for t in threads:
+            t.join()
+
+        if args.cleanup == 'true':
+            for n in range(1, num_train_sets + 1):
+                for j in range(1, args.num_min_count_jobs + 1):
+                    for o in range(2, args.ngram_order + 1):
+                        try:
+                            os.remove("{0}/int.{1}.split{2}.{3}".format(
+                                args.dest_count_dir, n, j, o))
+                        except:
+                            pass
     print("get_counts.py: finished.", file=sys.stderr)
 
+if args.num_splits > 1:
+    SplitRemainingCounts(args.dest_count_dir, args.ngram_order,
+                         num_train_sets)
+
+if args.compress_counts == 'true':
+    print("get_counts.py: compressing counts", file=sys.stderr)
+    CompressCounts(args.dest_count_dir, args.ngram_order, num_train_sets)
+
+if args.incremental == 'true':
+    WriteSourceFingerprints(args.dest_count_dir, fingerprints,
+                            formatted_min_counts)
+
 if os.system("validate_count_dir.py " + args.dest_count_dir) != 0:
     ExitProgram("command validate_count_dir.py {0} failed".format(
         args.dest_count_dir))
+
+if args.num_splits > 1 and os.system("validate_count_dir.py " + GetSplitDir(
+        args.dest_count_dir, 1)) != 0:
+    ExitProgram("command validate_count_dir.py {0} failed".format(
+        GetSplitDir(args.dest_count_dir, 1)))
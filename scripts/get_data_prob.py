@@ -19,6 +19,12 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
     sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
 
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+from pocolm_common import GetFloatCountsFiles, EnsureFloatCountsIndex
+
 parser = argparse.ArgumentParser(
     description="This script evaluates the probability of some "
     "data (in text or gzipped-text format), given a language model "
@@ -26,15 +32,33 @@ parser = argparse.ArgumentParser(
     "The perplexity is printed to the standard output.",
     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
+parser.add_argument(
+    "--direct-scoring",
+    type=str,
+    default="true",
+    choices=["true", "false"],
+    help="If true, compute the probabilities with score-sentences, which "
+    "looks up the n-grams of each sentence directly in the (memory-mapped) "
+    "model, scoring all the parts of a split LM-dir in one process.  If "
+    "false, count the n-grams with 'get-text-counts | sort | uniq -c | "
+    "get-int-counts' in a temporary directory and run compute-probs on the "
+    "counts.  The results are the same up to roundoff; the direct method "
+    "avoids the sorting, temporary files and most of the processes.  Note: "
+    "the direct method writes float.all.index (see float-counts-index) to the "
+    "LM-dir if it does not exist.")
 parser.add_argument("--max-memory",
                     type=str,
                     default='',
-                    help="Memory limitation for sort.")
+                    help="Memory limitation for sort (only relevant with "
+                    "--direct-scoring=false).")
 parser.add_argument(
     "text_in",
     type=str,
     help="Filename of input data (one sentence per line, no BOS or "
-    "EOS symbols; text or gzipped text")
+    "EOS symbols; text or gzipped text).  If it ends in '.int', it is "
+    "interpreted as integerized data in the packed format written by "
+    "'prepare_int_data.py --int-format=packed' (e.g. data/int/dev.int), "
+    "which must have been created with the same words.txt as the LM.")
 parser.add_argument("lm_dir_in",
                     help="Source directory, for the input language model.")
 
@@ -107,34 +131,36 @@ def RunCommand(command):
         sys.exit("get_data_prob.py: error running command: " + command)
 
 
-work_dir = tempfile.mkdtemp(dir=args.lm_dir_in)
-
-# this temporary directory will be used by "sort".
-os.environ['TMPDIR'] = work_dir
-
-ngram_order = GetNgramOrder(args.lm_dir_in)
-
-# set the memory restriction for "sort"
-sort_mem_opt = ''
-if args.max_memory != '':
-    sort_mem_opt = ("--buffer-size={0} ".format(args.max_memory))
-
-# create
-if args.text_in[-3:] == '.gz':
-    command = "gunzip -c {0} | text_to_int.py {1}/words.txt ".format(
-        args.text_in, args.lm_dir_in)
-else:
-    command = "text_to_int.py {0}/words.txt <{1}".format(
-        args.lm_dir_in, args.text_in)
-command += "| get-text-counts {0} | sort {1} | uniq -c | get-int-counts ".format(
-    ngram_order, sort_mem_opt)
-if num_splits is None:
-    command += "{0}/int.dev".format(work_dir)
-else:
-    command += "/dev/stdout | split-int-counts " + ' '.join(
-        [work_dir + "/int.dev." + str(n) for n in range(1, num_splits + 1)])
+# This function computes the probabilities with score-sentences, without
+# counting the n-grams of the data first.  It returns a pair
+# (total-num-words, total-log-prob).
+def ComputeProbsDirectly():
+    float_counts_files = GetFloatCountsFiles(args.lm_dir_in)
+    for float_counts in float_counts_files:
+        EnsureFloatCountsIndex(float_counts)
+    score_command = "score-sentences --total-only {0}".format(
+        " ".join(float_counts_files))
+    if args.text_in[-4:] == '.int':
+        # packed integerized data is read directly by score-sentences.
+        command = "score-sentences --total-only --packed-input={0} {1}".format(
+            args.text_in, " ".join(float_counts_files))
+    elif args.text_in[-3:] == '.gz':
+        command = "set -o pipefail; gunzip -c {0} | text_to_int.py {1}/words.txt | {2}".format(
+            args.text_in, args.lm_dir_in, score_command)
+    else:
+        command = "set -o pipefail; text_to_int.py {0}/words.txt <{1} | {2}".format(
+            args.lm_dir_in, args.text_in, score_command)
+    print(command, file=sys.stderr)
+    try:
+        output = subprocess.check_output(command,
+                                         shell=True,
+                                         universal_newlines=True,
+                                         executable='/bin/bash')
+        [num_words, tot_objf] = output.split()
+    except:
+        sys.exit("get_data_prob.py: error running command: " + command)
+    return (float(num_words), float(tot_objf))
 
-RunCommand(command)
 
 tot_num_words = 0.0
 tot_logprob = 0.0
@@ -160,16 +186,65 @@ def ComputeProbs(split_index):
     tot_logprob += float(tot_objf)
 
 
-if num_splits is None:
-    ComputeProbs(None)
+# This function computes the probabilities by counting the n-grams of the data
+# (which requires sorting them) in a temporary directory, and running
+# compute-probs on the counts.  It returns a pair (total-num-words,
+# total-log-prob).
+def ComputeProbsWithSort():
+    global work_dir
+    work_dir = tempfile.mkdtemp(dir=args.lm_dir_in)
+
+    # this temporary directory will be used by "sort".
+    os.environ['TMPDIR'] = work_dir
+
+    ngram_order = GetNgramOrder(args.lm_dir_in)
+
+    # set the memory restriction for "sort"
+    sort_mem_opt = ''
+    if args.max_memory != '':
+        sort_mem_opt = ("--buffer-size={0} ".format(args.max_memory))
+
+    # create
+    if args.text_in[-4:] == '.int':
+        # packed integerized data is read directly by get-text-counts.
+        command = "get-text-counts --packed-input={0} {1} ".format(
+            args.text_in, ngram_order)
+    else:
+        if args.text_in[-3:] == '.gz':
+            command = "gunzip -c {0} | text_to_int.py {1}/words.txt ".format(
+                args.text_in, args.lm_dir_in)
+        else:
+            command = "text_to_int.py {0}/words.txt <{1}".format(
+                args.lm_dir_in, args.text_in)
+        command += "| get-text-counts {0} ".format(ngram_order)
+    command += "| sort {0} | uniq -c | get-int-counts ".format(sort_mem_opt)
+    if num_splits is None:
+        command += "{0}/int.dev".format(work_dir)
+    else:
+        command += "/dev/stdout | split-int-counts " + ' '.join(
+            [work_dir + "/int.dev." + str(n) for n in range(1, num_splits + 1)])
+
+    RunCommand(command)
+
+    if num_splits is None:
+        ComputeProbs(None)
+    else:
+        threads = []
+        for split_index in range(1, num_splits + 1):
+            threads.append(
+                threading.Thread(target=ComputeProbs, args=[split_index]))
+            threads[-1].start()
+        for t in threads:
+            t.join()
+
+    shutil.rmtree(work_dir)
+    return (tot_num_words, tot_logprob)
+
+
+if args.direct_scoring == "true":
+    (tot_num_words, tot_logprob) = ComputeProbsDirectly()
 else:
-    threads = []
-    for split_index in range(1, num_splits + 1):
-        threads.append(
-            threading.Thread(target=ComputeProbs, args=[split_index]))
-        threads[-1].start()
-    for t in threads:
-        t.join()
+    (tot_num_words, tot_logprob) = ComputeProbsWithSort()
 
 logprob = tot_logprob / tot_num_words
 perplexity = math.exp(-logprob)
@@ -180,5 +255,3 @@ print("get_data_prob.py: log-prob of {0} given model {1} was "
       file=sys.stderr)
 
 print(logprob, file=sys.stdout)
-
-shutil.rmtree(work_dir)
@@ -53,6 +53,17 @@ parser.add_argument("--cleanup",
                     choices=["true", "false"],
                     help="If true, remove intermediate files in work_dir "
                     "that won't be used in future")
+parser.add_argument(
+    "--in-memory",
+    type=str,
+    default="true",
+    choices=["true", "false"],
+    help="If true, do all the merging, discounting and backprop in a single "
+    "compute-objf-and-derivs process that keeps the intermediate counts in "
+    "memory, instead of running a separate program for each step and writing "
+    "the intermediate files (float.*, discount.* and their "
+    "derivatives) to work_dir.  This needs enough memory to hold all the "
+    "counts in count_dir.")
 parser.add_argument("--verbose",
                     type=str,
                     default='false',
@@ -150,18 +161,27 @@ def Cleanup():
     RemoveFiles(args.work_dir, filenames)
 
 
-# This function does the count merging for the specified
-# n-gram order, writing to $work_dir/merged.$order
+# This function does the count merging and discounting for the specified
+# n-gram order, writing to $work_dir/float.$order and $work_dir/discount.$(order-1),
+# using merge-discount-counts, which does the same as merge-counts followed by
+# discount-counts without writing the merged counts.
 # For the highest order we merge count_dir/int.*.order,
 # each with its appropriate scaling factor; for orders
 # strictly between the highest order and 1 we merge those
 # but also the discount counts from work_dir/discount.order;
 # for order 1, no merging is done (-> this function shouldn't be
 # called).
-def MergeCounts(order):
-    # merge counts of the specified order > 1.
+def MergeDiscountCounts(order):
+    # merge and discount counts of the specified order > 1.
     assert order > 1
-    command = "merge-counts"
+    command = "merge-discount-counts {d1} {d2} {d3} {d4} {work}/float.{order} {work}/discount.{orderm1}".format(
+        d1=d1[order],
+        d2=d2[order],
+        d3=d3[order],
+        d4=d4[order],
+        work=args.work_dir,
+        order=order,
+        orderm1=order - 1)
     for n in range(1, num_train_sets + 1):
         command += " {counts}/int.{train_set}.{order},{scale}".format(
             counts=args.count_dir,
@@ -180,20 +200,27 @@ def MergeCounts(order):
     if order < ngram_order:
         command += " {work}/discount.{order}".format(work=args.work_dir,
                                                      order=order)
-    # the output gets redirected to the output file.
-    command += " >{work}/merged.{order}".format(work=args.work_dir,
-                                                order=order)
-    log_file = "{0}/log/merge_counts.{1}.log".format(args.work_dir, order)
+    log_file = "{0}/log/merge_discount_counts.{1}.log".format(
+        args.work_dir, order)
     RunCommand(command, log_file, args.verbose == 'true')
 
 
-def MergeCountsBackward(order):
+def MergeDiscountCountsBackward(order):
     global scale_derivs
-    # merge counts of the specified order > 1; the backprop phase.
+    # merge and discount counts of the specified order > 1; the backprop
+    # phase.  merge-discount-counts-backward recomputes the merged counts
+    # from the sources.
     assert order > 1
-    command = "merge-counts-backward {work}/merged.{order} {work}/merged_derivs.{order} ".format(
-        work=args.work_dir, order=order)
-
+    command = (
+        "merge-discount-counts-backward {d1} {d2} {d3} {d4} {work}/float.{order} "
+        "{work}/float_derivs.{order} {work}/discount.{orderm1} "
+        "{work}/discount_derivs.{orderm1}".format(d1=d1[order],
+                                                  d2=d2[order],
+                                                  d3=d3[order],
+                                                  d4=d4[order],
+                                                  work=args.work_dir,
+                                                  order=order,
+                                                  orderm1=order - 1))
     for n in range(1, num_train_sets + 1):
         command += " {counts}/int.{train_set}.{order} {scale}".format(
             counts=args.count_dir,
@@ -206,67 +233,26 @@ def MergeCountsBackward(order):
     if order < ngram_order:
         command += " {work}/discount.{order} {work}/discount_derivs.{order}".format(
             work=args.work_dir, order=order)
-    log_file = "{0}/log/merge_counts_backward.{1}.log".format(
+    log_file = "{0}/log/merge_discount_counts_backward.{1}.log".format(
         args.work_dir, order)
     output = GetCommandStdout(command, log_file, args.verbose == 'true')
     try:
-        this_scale_derivs = [
-            float(n) / num_dev_set_words for n in output.split()
-        ]
-        assert len(scale_derivs) == num_train_sets
+        # the output is the derivatives w.r.t. D1, D2, D3 and D4, followed by
+        # those w.r.t. the scaling factors.
+        derivs = [float(n) / num_dev_set_words for n in output.split()]
+        assert len(derivs) == 4 + num_train_sets
+        [d1_deriv[order], d2_deriv[order], d3_deriv[order],
+         d4_deriv[order]] = derivs[0:4]
         # the scaling factors are applied for each order > 1, and the
         # derivatives will be a sum over the derivatives for each of these
         # orders.
         for n in range(num_train_sets):
-            scale_derivs[n] += this_scale_derivs[n]
+            scale_derivs[n] += derivs[4 + n]
     except:
         sys.exit("get_objf_and_derivs.py: unexpected output from command:" +
                  output)
 
 
-def DiscountCounts(order):
-    # discount counts of the specified order > 1.
-    assert order > 1
-    command = "discount-counts {d1} {d2} {d3} {d4} {work}/merged.{order} {work}/float.{order} {work}/discount.{orderm1} ".format(
-        d1=d1[order],
-        d2=d2[order],
-        d3=d3[order],
-        d4=d4[order],
-        work=args.work_dir,
-        order=order,
-        orderm1=order - 1)
-    log_file = "{0}/log/discount_counts.{1}.log".format(args.work_dir, order)
-    RunCommand(command, log_file, args.verbose == 'true')
-
-
-def DiscountCountsBackward(order):
-    # discount counts of the specified order > 1; backprop version.
-    assert order > 1
-    command = (
-        "discount-counts-backward {d1} {d2} {d3} {d4} {work}/merged.{order} {work}/float.{order} "
-        "{work}/float_derivs.{order} {work}/discount.{orderm1} {work}/discount_derivs.{orderm1} "
-        "{work}/merged_derivs.{order}".format(d1=d1[order],
-                                              d2=d2[order],
-                                              d3=d3[order],
-                                              d4=d4[order],
-                                              work=args.work_dir,
-                                              order=order,
-                                              orderm1=order - 1))
-    log_file = "{0}/log/discount_counts_backward.{1}.log".format(
-        args.work_dir, order)
-    output = GetCommandStdout(command, log_file, args.verbose == 'true')
-    try:
-        [deriv1, deriv2, deriv3, deriv4] = output.split()
-    except:
-        sys.exit(
-            "get_objf_and_derivs.py: could not parse output of command: " +
-            output)
-    d1_deriv[order] = float(deriv1) / num_dev_set_words
-    d2_deriv[order] = float(deriv2) / num_dev_set_words
-    d3_deriv[order] = float(deriv3) / num_dev_set_words
-    d4_deriv[order] = float(deriv4) / num_dev_set_words
-
-
 def DiscountCountsOrder1():
     command = "discount-counts-1gram {num_words} <{work}/discount.1 >{work}/float.1".format(
         num_words=num_words, work=args.work_dir)
@@ -348,10 +334,13 @@ def ComputeObjfAndFinalDerivs(need_derivs):
         sys.exit(
             "get_objf_and_derivs.py: error interpreting the output of compute-probs: "
             "output was: " + output)
+    WriteObjf()
+
+
+def WriteObjf():
     print("get_objf_and_derivs.py: objf is {0} over {1} "
           "words".format(objf, num_dev_set_words),
           file=sys.stderr)
-    # Write the objective function.
     try:
         f = open(args.objf_out, "w", encoding="utf-8")
         print(str(objf), file=f)
@@ -362,6 +351,49 @@ def ComputeObjfAndFinalDerivs(need_derivs):
             args.objf_out)
 
 
+# This function does the work of this script in a single process, by running
+# compute-objf-and-derivs, which keeps the intermediate counts in memory; it
+# writes float.all (if it will be kept) and num_ngrams to the work dir and sets
+# the same variables as the corresponding functions do in the on-disk version.
+def ComputeInMemory(need_derivs):
+    global num_dev_set_words, objf, scale_derivs
+    if args.need_model == 'true' or args.cleanup == 'false':
+        float_counts_out = "{0}/float.all".format(args.work_dir)
+    else:
+        # we still need the output of writing them, for num_ngrams.
+        float_counts_out = "/dev/null"
+    metaparameters = [train_set_scale[n] for n in range(1, num_train_sets + 1)]
+    for o in range(2, ngram_order + 1):
+        metaparameters += [d1[o], d2[o], d3[o], d4[o]]
+    command = "echo {request} {metaparameters} | compute-objf-and-derivs ".format(
+        request=("objf-and-derivs" if need_derivs else "objf"),
+        metaparameters=" ".join([str(x) for x in metaparameters]))
+    if args.fold_dev_into_int is not None:
+        command += "--fold-dev-into={0} ".format(args.fold_dev_into_int)
+    command += "--float-counts-out={0} {1}".format(float_counts_out,
+                                                   args.count_dir)
+    log_file = "{0}/log/compute_objf_and_derivs.log".format(args.work_dir)
+    output = GetCommandStdout(command, log_file, args.verbose == 'true')
+    ParseNumNgrams(args.work_dir, log_file)
+    try:
+        fields = output.split()
+        num_dev_set_words = int(fields[0])
+        objf = float(fields[1]) / num_dev_set_words
+        derivs = [float(x) / num_dev_set_words for x in fields[2:]]
+        assert len(derivs) == (len(metaparameters) if need_derivs else 0)
+    except:
+        sys.exit(
+            "get_objf_and_derivs.py: error interpreting the output of "
+            "compute-objf-and-derivs: output was: " + output)
+    WriteObjf()
+    if need_derivs:
+        scale_derivs = derivs[0:num_train_sets]
+        for o in range(2, ngram_order + 1):
+            i = num_train_sets + 4 * (o - 2)
+            [d1_deriv[o], d2_deriv[o], d3_deriv[o],
+             d4_deriv[o]] = derivs[i:i + 4]
+
+
 def WriteDerivs():
     try:
         f = open(args.derivs_out, "w", encoding="utf-8")
@@ -385,10 +417,22 @@ if not os.path.isdir(args.work_dir + "/log"):
     except:
         ExitProgram("error creating directory {0}/log".format(args.work_dir))
 
+if args.in_memory == 'true':
+    d1_deriv = {}
+    d2_deriv = {}
+    d3_deriv = {}
+    d4_deriv = {}
+    ComputeInMemory(args.derivs_out is not None)
+    if args.derivs_out is not None:
+        WriteDerivs()
+    if args.cleanup == 'true':
+        # removes any intermediate files left by a previous on-disk run.
+        Cleanup()
+    sys.exit(0)
+
 # for n-gram orders down to 2, do the merging and discounting.
 for o in range(ngram_order, 1, -1):
-    MergeCounts(o)
-    DiscountCounts(o)
+    MergeDiscountCounts(o)
 
 DiscountCountsOrder1()
 MergeAllOrders()
@@ -419,8 +463,7 @@ d4_deriv = {}
 DiscountCountsOrder1Backward()
 
 for o in range(2, ngram_order + 1):
-    DiscountCountsBackward(o)
-    MergeCountsBackward(o)
+    MergeDiscountCountsBackward(o)
 
 WriteDerivs()
 if args.cleanup == 'true':
@@ -6,7 +6,6 @@ import re
 import os
 import argparse
 import sys
-import threading
 
 # If the encoding of the default sys.stdout is not utf-8,
 # force it to be utf-8. See PR #95.
@@ -24,6 +23,10 @@ sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
 from pocolm_common import ExitProgram
 from pocolm_common import RunCommand
 from pocolm_common import GetCommandStdout
+# for the scheduling of the commands
+from task_graph import TaskGraph
+from task_graph import ParseMemorySize
+from task_graph import GetTotalFileSize
 
 parser = argparse.ArgumentParser(
     description="This does the same as get_objf_and_derivs.py "
@@ -44,6 +47,25 @@ parser.add_argument(
     help="Number of splits in count directory.  You must previously have "
     "split the counts directory with this number of splits.  This option is "
     "required (if you're not using splitting, then use get_objf_and_deriv.py)")
+parser.add_argument(
+    "--num-jobs",
+    type=int,
+    default=0,
+    help="Maximum number of commands to run at once.  Each split has a chain "
+    "of commands to run for each order, and commands from different splits "
+    "(and commands that don't depend on each other, such as the final merging "
+    "of the model and the backward pass) run in parallel as soon as their "
+    "inputs are ready.  0 means no limit, which runs up to one command per "
+    "split at once.")
+parser.add_argument(
+    "--max-memory",
+    type=str,
+    default='',
+    help="If set, e.g. to '10G', don't start a command if that would make the "
+    "estimated total memory used by the commands running at once exceed this "
+    "(a command that needs more than this on its own is run by itself).  "
+    "Only the commands that load their input into memory (compute-probs) "
+    "count towards the total.")
 parser.add_argument("--verbose",
                     type=str,
                     default='false',
@@ -93,6 +115,9 @@ args = parser.parse_args()
 if args.num_splits is None or not args.num_splits > 1:
     sys.exit(
         "get_objf_and_derivs_split.py: --num-splits must be supplied and >1.")
+if args.num_jobs < 0:
+    sys.exit("get_objf_and_derivs_split.py: invalid option --num-jobs={0}".
+             format(args.num_jobs))
 
 # Add the script dir and the src dir to the path.
 os.environ['PATH'] = (os.environ['PATH'] + os.pathsep +
@@ -207,18 +232,29 @@ def Cleanup():
             CleanupSplitDir(split_dir)
 
 
-# This function does the count merging for the specified
-# n-gram order, writing to $work_dir/merged.$order
+# This function does the count merging and discounting for the specified
+# n-gram order, writing to $split_work_dir/$split_index/float.$order and
+# $split_work_dir/$split_index/discount.$(order-1), using merge-discount-counts,
+# which does the same as merge-counts followed by discount-counts without
+# writing the merged counts.
 # For the highest order we merge count_dir/int.*.order,
 # each with its appropriate scalign factor; for orders
 # strictly between the highest order and 1 we merge those
 # but also the discount counts from work_dir/discount.order;
 # for order 1, no merging is done (-> this function shouldn't be
 # called).
-def MergeCounts(split_index, order):
-    # merge counts of the specified order > 1.
+def MergeDiscountCounts(split_index, order):
+    # merge and discount counts of the specified order > 1.
     assert order > 1
-    command = "merge-counts"
+    this_split_work = "{0}/{1}".format(split_work_dir, split_index)
+    command = "merge-discount-counts {d1} {d2} {d3} {d4} {sdir}/float.{order} {sdir}/discount.{orderm1}".format(
+        d1=d1[order],
+        d2=d2[order],
+        d3=d3[order],
+        d4=d4[order],
+        sdir=this_split_work,
+        order=order,
+        orderm1=order - 1)
     for n in range(1, num_train_sets + 1):
         command += " {split_counts}/{split_index}/int.{train_set}.{order},{scale}".format(
             split_counts=split_count_dir,
@@ -236,26 +272,29 @@ def MergeCounts(split_index, order):
     # discount counts from the one-higher order.  there is no scale here, so
     # the program will expect general-counts, not int-counts.
     if order < ngram_order:
-        command += " {0}/{1}/discount.{2}".format(split_work_dir, split_index,
-                                                  order)
-
-    # the output gets redirected to the output file.
-    command += " >{0}/{1}/merged.{2}".format(split_work_dir, split_index,
-                                             order)
+        command += " {0}/discount.{1}".format(this_split_work, order)
 
-    log_file = "{0}/log/merge_counts.{1}.{2}.log".format(
+    log_file = "{0}/log/merge_discount_counts.{1}.{2}.log".format(
         args.work_dir, split_index, order)
     RunCommand(command, log_file, args.verbose == 'true')
 
 
-def MergeCountsBackward(split_index, order):
-    global scale_derivs
-    # merge counts of the specified order > 1; the backprop phase.
+def MergeDiscountCountsBackward(split_index, order):
+    # merge and discount counts of the specified order > 1; the backprop
+    # phase.  merge-discount-counts-backward recomputes the merged counts
+    # from the sources.
     assert order > 1
-
-    command = "merge-counts-backward {swork}/{s}/merged.{order} {swork}/{s}/merged_derivs.{order} ".format(
-        swork=split_work_dir, s=split_index, order=order)
-
+    this_split_work = "{0}/{1}".format(split_work_dir, split_index)
+    command = (
+        "merge-discount-counts-backward {d1} {d2} {d3} {d4} {sdir}/float.{order} "
+        "{sdir}/float_derivs.{order} {sdir}/discount.{orderm1} "
+        "{sdir}/discount_derivs.{orderm1}".format(d1=d1[order],
+                                                  d2=d2[order],
+                                                  d3=d3[order],
+                                                  d4=d4[order],
+                                                  sdir=this_split_work,
+                                                  order=order,
+                                                  orderm1=order - 1))
     for n in range(1, num_train_sets + 1):
         command += " {split_counts}/{s}/int.{train_set}.{order} {scale}".format(
             split_counts=split_count_dir,
@@ -267,72 +306,24 @@ def MergeCountsBackward(split_index, order):
     # discount counts from the one-higher order, and provide a filename
     # for it to output the derivatives w.r.t. that file.
     if order < ngram_order:
-        command += " {swork}/{s}/discount.{order} {swork}/{s}/discount_derivs.{order}".format(
-            swork=split_work_dir, s=split_index, order=order)
+        command += " {sdir}/discount.{order} {sdir}/discount_derivs.{order}".format(
+            sdir=this_split_work, order=order)
 
-    log_file = "{0}/log/merge_counts_backward.{1}.{2}.log".format(
+    log_file = "{0}/log/merge_discount_counts_backward.{1}.{2}.log".format(
         args.work_dir, split_index, order)
     output = GetCommandStdout(command, log_file, args.verbose == 'true')
     try:
-        this_scale_derivs = [
-            float(n) / num_dev_set_words_total for n in output.split()
-        ]
-        assert len(scale_derivs) == num_train_sets
-        # the scaling factors are applied for each order > 1, and the
-        # derivatives will be a sum over the derivatives for each of these
-        # orders (and also a sum over the different split-directories).
-        for n in range(num_train_sets):
-            scale_derivs[n] += this_scale_derivs[n]
+        # the output is the derivatives w.r.t. D1, D2, D3 and D4, followed by
+        # those w.r.t. the scaling factors.
+        derivs = [float(n) for n in output.split()]
+        assert len(derivs) == 4 + num_train_sets
     except:
         ExitProgram(
             "get_objf_and_derivs_split.py: unexpected output from command:" +
             output)
-
-
-def DiscountCounts(split_index, order):
-    # discount counts of the specified order > 1.
-    assert order > 1
-    this_split_work = "{0}/{1}".format(split_work_dir, split_index)
-    command = "discount-counts {d1} {d2} {d3} {d4} {sdir}/merged.{order} {sdir}/float.{order} {sdir}/discount.{orderm1} ".format(
-        d1=d1[order],
-        d2=d2[order],
-        d3=d3[order],
-        d4=d4[order],
-        sdir=this_split_work,
-        order=order,
-        orderm1=order - 1)
-    log_file = "{0}/log/discount_counts.{1}.{2}.log".format(
-        args.work_dir, split_index, order)
-    RunCommand(command, log_file, args.verbose == 'true')
-
-
-def DiscountCountsBackward(split_index, order):
-    # discount counts of the specified order > 1; backprop version.
-    assert order > 1
-    this_split_work = "{0}/{1}".format(split_work_dir, split_index)
-    command = (
-        "discount-counts-backward {d1} {d2} {d3} {d4} {sdir}/merged.{order} {sdir}/float.{order} "
-        "{sdir}/float_derivs.{order} {sdir}/discount.{orderm1} {sdir}/discount_derivs.{orderm1} "
-        "{sdir}/merged_derivs.{order}".format(d1=d1[order],
-                                              d2=d2[order],
-                                              d3=d3[order],
-                                              d4=d4[order],
-                                              sdir=this_split_work,
-                                              order=order,
-                                              orderm1=order - 1))
-    log_file = "{0}/log/discount_counts_backward.{1}.{2}.log".format(
-        args.work_dir, split_index, order)
-    output = GetCommandStdout(command, log_file, args.verbose == 'true')
-    try:
-        [deriv1, deriv2, deriv3, deriv4] = output.split()
-    except:
-        ExitProgram(
-            "get_objf_and_derivs_split.py: could not parse output of command: "
-            + output)
-    d1_deriv[order] += float(deriv1) / num_dev_set_words_total
-    d2_deriv[order] += float(deriv2) / num_dev_set_words_total
-    d3_deriv[order] += float(deriv3) / num_dev_set_words_total
-    d4_deriv[order] += float(deriv4) / num_dev_set_words_total
+    # these are summed over orders and splits by SumDerivs().
+    discount_backward_output[(split_index, order)] = derivs[0:4]
+    merge_backward_output[(split_index, order)] = derivs[4:]
 
 
 def MergeCountsOrder1():
@@ -490,7 +481,6 @@ def MergeAllSplits():
 
 
 def ComputeObjfAndFinalDerivs(split_index, need_derivs):
-    global num_dev_set_words_total, loglike_total
     command = "compute-probs {swork}/{s}/float.all {scount}/{s}/int.dev ".format(
         swork=split_work_dir, s=split_index, scount=split_count_dir)
     if need_derivs:
@@ -506,14 +496,70 @@ def ComputeObjfAndFinalDerivs(split_index, need_derivs):
     output = GetCommandStdout(command, log_file, args.verbose == 'true')
     try:
         [num_dev_set_words, tot_objf] = output.split()
-        num_dev_set_words_total += int(num_dev_set_words)
-        loglike_total += float(tot_objf)
+        compute_probs_output[split_index] = (int(num_dev_set_words),
+                                             float(tot_objf))
     except:
         ExitProgram(
             "get_objf_and_derivs_split.py: error interpreting the output of compute-probs: "
             "output was: " + output)
 
 
+# The tasks store their outputs in the following dicts, and the totals are
+# computed once they have all finished, always in the same order (so that the
+# results don't depend on the order in which the tasks happen to finish).
+# compute_probs_output is indexed by split and contains pairs
+# (num-dev-set-words, total-log-prob).
+compute_probs_output = {}
+# merge_backward_output is indexed by pairs (split, order) and contains the
+# derivatives w.r.t. the scales of the training sets.
+merge_backward_output = {}
+# discount_backward_output is indexed by pairs (split, order) and contains the
+# derivatives w.r.t. D1, D2, D3 and D4.
+discount_backward_output = {}
+
+
+def SumObjectiveFunction():
+    global num_dev_set_words_total, loglike_total
+    num_dev_set_words_total = 0
+    loglike_total = 0.0
+    for split_index in range(1, args.num_splits + 1):
+        (num_dev_set_words, tot_objf) = compute_probs_output[split_index]
+        num_dev_set_words_total += num_dev_set_words
+        loglike_total += tot_objf
+
+
+def SumDerivs():
+    global scale_derivs, d1_deriv, d2_deriv, d3_deriv, d4_deriv
+    # scale_derivs will be an array of the derivatives of the objective
+    # function w.r.t. the scaling factors of the training sets.  the scaling
+    # factors are applied for each order > 1, and the derivatives will be a
+    # sum over the derivatives for each of these orders (and also a sum over
+    # the different split-directories).
+    scale_derivs = [0] * num_train_sets
+    # the following dicts will be indexed by the order.
+    d1_deriv = {}
+    d2_deriv = {}
+    d3_deriv = {}
+    d4_deriv = {}
+    for o in range(2, ngram_order + 1):
+        d1_deriv[o] = 0.0
+        d2_deriv[o] = 0.0
+        d3_deriv[o] = 0.0
+        d4_deriv[o] = 0.0
+    for split_index in range(1, args.num_splits + 1):
+        for o in range(2, ngram_order + 1):
+            [deriv1, deriv2, deriv3,
+             deriv4] = discount_backward_output[(split_index, o)]
+            d1_deriv[o] += deriv1 / num_dev_set_words_total
+            d2_deriv[o] += deriv2 / num_dev_set_words_total
+            d3_deriv[o] += deriv3 / num_dev_set_words_total
+            d4_deriv[o] += deriv4 / num_dev_set_words_total
+            this_scale_derivs = merge_backward_output[(split_index, o)]
+            for n in range(num_train_sets):
+                scale_derivs[n] += (this_scale_derivs[n] /
+                                    num_dev_set_words_total)
+
+
 def WriteObjectiveFunction():
     objf = loglike_total / num_dev_set_words_total
     print("get_objf_and_derivs_split.py: objf is {0} over {1} "
@@ -547,98 +593,109 @@ def WriteDerivs():
     f.close()
 
 
-def ForwardAllButFirstOrder(split_index):
-    # for n-gram orders down to 2, do the merging and discounting.
-    for o in range(ngram_order, 1, -1):
-        MergeCounts(split_index, o)
-        DiscountCounts(split_index, o)
-
-
-def BackwardAllButFirstOrder(split_index):
-    # for n-gram orders 2 and greater, do the backwards discounting and merging.
-    # this is the backward version of ForwardAllButFirstOrder().
-    for o in range(2, ngram_order + 1):
-        DiscountCountsBackward(split_index, o)
-        MergeCountsBackward(split_index, o)
-
-
-def MergeAndComputeObjfForSplit(split_index):
-    MergeAllOrders(split_index)
-    ComputeObjfAndFinalDerivs(split_index, args.derivs_out is not None)
-
-
-# do the 'forward' computation (merging and discounting) for all the orders from
-# the highest down to order 2.
-threads = []
-for split_index in range(1, args.num_splits + 1):
-    threads.append(
-        threading.Thread(target=ForwardAllButFirstOrder, args=[split_index]))
-    threads[-1].start()
-for t in threads:
-    t.join()
-
-MergeCountsOrder1()
-DiscountCountsOrder1()
-
-num_dev_set_words_total = 0
-loglike_total = 0.0
-
-threads = []
-for split_index in range(1, args.num_splits + 1):
-    threads.append(
-        threading.Thread(target=MergeAndComputeObjfForSplit,
-                         args=[split_index]))
-    threads[-1].start()
-for t in threads:
-    t.join()
-
-CombineNumNgrams()
+# This adds to 'graph' the tasks that do the forward computation, i.e. the
+# merging and discounting, and the computation of the objective function; and
+# if args.need_model == 'true', the merging of the model.  Returns the list of
+# names of the tasks that compute the objective function.
+def AddForwardTasks(graph):
+    # for n-gram orders down to 2, do the merging and discounting.  the
+    # orders of each split form a chain, but the splits are independent.
+    discount_tasks = []
+    for split_index in range(1, args.num_splits + 1):
+        dependencies = []
+        for o in range(ngram_order, 1, -1):
+            dependencies = [
+                graph.Add(
+                    "merge_discount_counts.{0}.{1}".format(split_index, o),
+                    MergeDiscountCounts, [split_index, o],
+                    dependencies=dependencies)
+            ]
+        discount_tasks += dependencies
+
+    graph.Add("merge_counts_order1",
+              MergeCountsOrder1,
+              dependencies=discount_tasks)
+    graph.Add("discount_counts_order1",
+              DiscountCountsOrder1,
+              dependencies=["merge_counts_order1"])
+
+    merge_all_orders_tasks = []
+    compute_probs_tasks = []
+    for split_index in range(1, args.num_splits + 1):
+        merge_all_orders_tasks.append(
+            graph.Add("merge_all_orders.{0}".format(split_index),
+                      MergeAllOrders, [split_index],
+                      dependencies=["discount_counts_order1"]))
+        # compute-probs reads float.all into memory.
+        float_all = "{0}/{1}/float.all".format(split_work_dir, split_index)
+        compute_probs_tasks.append(
+            graph.Add("compute_objf_and_final_derivs.{0}".format(split_index),
+                      ComputeObjfAndFinalDerivs,
+                      [split_index, args.derivs_out is not None],
+                      dependencies=[merge_all_orders_tasks[-1]],
+                      memory=lambda f=float_all: 2 * GetTotalFileSize([f])))
+    graph.Add("combine_num_ngrams",
+              CombineNumNgrams,
+              dependencies=merge_all_orders_tasks)
+    if args.need_model == "true":
+        # this can run at the same time as the backward computation.
+        graph.Add("merge_all_splits",
+                  MergeAllSplits,
+                  dependencies=merge_all_orders_tasks)
+    return compute_probs_tasks
+
+
+# This adds to 'graph' the tasks that do the backward computation; it should be
+# called after AddForwardTasks(), with the list of tasks that it returned.
+def AddBackwardTasks(graph, compute_probs_tasks):
+    # Note: there is no need for a call like MergeAllOrdersBackward(), because
+    # that merging was just aggregating different histories of distinct
+    # orders, and to avoid the need for a backprop version of this program,
+    # the program 'compute-probs' writes the derivatives for history-states of
+    # distinct orders, to distinct files.
+    graph.Add("sum_float_derivs_order1",
+              SumFloatDerivsOrder1,
+              dependencies=compute_probs_tasks)
+    graph.Add("discount_counts_order1_backward",
+              DiscountCountsOrder1Backward,
+              dependencies=["sum_float_derivs_order1"])
+    graph.Add("merge_counts_order1_backward",
+              MergeCountsOrder1Backward,
+              dependencies=["discount_counts_order1_backward"])
+
+    # do the 'backward' computation for orders 2 and greater; this is a chain
+    # for each split, the reverse of the one in AddForwardTasks().
+    for split_index in range(1, args.num_splits + 1):
+        dependencies = ["merge_counts_order1_backward"]
+        for o in range(2, ngram_order + 1):
+            dependencies = [
+                graph.Add(
+                    "merge_discount_counts_backward.{0}.{1}".format(
+                        split_index, o),
+                    MergeDiscountCountsBackward, [split_index, o],
+                    dependencies=dependencies)
+            ]
+
+
+# The forward and backward computations are done as a single graph of tasks,
+# so that e.g. the merging of the model can overlap with the backward
+# computation.  The backward computation needs num_dev_set_words_total, which
+# is only known when all of compute_probs_tasks have finished; the
+# normalization is done in SumDerivs(), after all the tasks have run.
+graph = TaskGraph(num_jobs=args.num_jobs,
+                  max_memory=ParseMemorySize(args.max_memory),
+                  verbose=args.verbose == 'true')
+compute_probs_tasks = AddForwardTasks(graph)
+if args.derivs_out is not None:
+    AddBackwardTasks(graph, compute_probs_tasks)
+graph.Run()
+
+SumObjectiveFunction()
 WriteObjectiveFunction()
 
-if args.need_model == "true":
-    MergeAllSplits()
-
-if args.derivs_out is None:
-    if args.cleanup == 'true':
-        Cleanup()
-    sys.exit(0)
-
-# scale_derivs will be an array of the derivatives of the objective function
-# w.r.t. the scaling factors of the training sets.
-scale_derivs = [0] * num_train_sets
-# the following dicts will be indexed by the order.
-d1_deriv = {}
-d2_deriv = {}
-d3_deriv = {}
-d4_deriv = {}
-for o in range(2, ngram_order + 1):
-    d1_deriv[o] = 0.0
-    d2_deriv[o] = 0.0
-    d3_deriv[o] = 0.0
-    d4_deriv[o] = 0.0
-
-# Now comes the backprop code.
-
-# Note: there is no need for a call like MergeAllOrdersBackward(), because that
-# merging was just aggregating different histories of distinct orders, and to
-# avoid the need for a backprop version of this program, the program
-# 'compute-probs' writes the derivatives for history-states of distinct orders,
-# to distinct files.
-
-SumFloatDerivsOrder1()
-DiscountCountsOrder1Backward()
-MergeCountsOrder1Backward()
-
-# do the 'backward' computation for orders 2 and greater,
-# in parallel.
-threads = []
-for split_index in range(1, args.num_splits + 1):
-    threads.append(
-        threading.Thread(target=BackwardAllButFirstOrder, args=[split_index]))
-    threads[-1].start()
-for t in threads:
-    t.join()
-
-WriteDerivs()
+if args.derivs_out is not None:
+    SumDerivs()
+    WriteDerivs()
+
 if args.cleanup == 'true':
     Cleanup()
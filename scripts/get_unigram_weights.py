@@ -16,6 +16,13 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
     sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
 
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+# for ReadWordCountsCache
+from word_counts_cache import ReadWordCountsCache
+
 parser = argparse.ArgumentParser(
     description="Given a directory containing word counts "
     "as created by get_counts.py, this program obtains "
@@ -53,16 +60,33 @@ def ReadCountsFile(counts_file):
     return word_to_count
 
 
+# if the binary cache written by get_word_counts.py is up to date, we read the
+# counts from it instead of from the .counts files.
+cache = ReadWordCountsCache(args.count_dir)
+
+
+# this returns a dictionary from word to count for data source 'name', read
+# from the cache.
+def GetCachedCounts(name):
+    (words, source_to_entries) = cache
+    (indexes, counts) = source_to_entries[name]
+    return dict(zip(map(words.__getitem__, indexes), counts))
+
+
 train_counts = {}
 
 num_files_in_dest = 0
 for f in os.listdir(args.count_dir):
     full_path = args.count_dir + os.sep + f
     if f.endswith(".counts"):
+        if cache is not None:
+            word_to_count = GetCachedCounts(f[0:-7])
+        else:
+            word_to_count = ReadCountsFile(full_path)
         if f == "dev.counts":
-            dev_counts = ReadCountsFile(full_path)
+            dev_counts = word_to_count
         else:
-            train_counts[f[0:-7]] = ReadCountsFile(full_path)
+            train_counts[f[0:-7]] = word_to_count
 
 train_keys = list(train_counts.keys())
 num_train_files = len(train_keys)
@@ -4,8 +4,11 @@
 from __future__ import print_function
 import os
 import argparse
+import hashlib
+import io
+import multiprocessing
 import sys
-from collections import defaultdict
+from collections import Counter
 try:  # since gzip will only be needed if there are gzipped files,
     import gzip  # accept failure to import it.
 except:
@@ -19,14 +22,46 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
     sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
 
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+# for ReadWordCountsCache and WriteWordCountsCache
+from word_counts_cache import ReadWordCountsCache
+from word_counts_cache import WriteWordCountsCache
+
 parser = argparse.ArgumentParser(
     description="Extracts word counts from a data directory "
     "and creates a count directory with similar structure. "
     "Input directory has *.txt, counts directory has *.counts. "
-    "Format of counts files is 'count word', e.g. '124 hello' ",
+    "Format of counts files is 'count word', e.g. '124 hello'.  The same "
+    "counts are also written in binary form to counts.bin in the counts "
+    "directory, which get_unigram_weights.py and word_counts_to_vocab.py "
+    "read if it is up to date.",
     epilog="See egs/swbd/run.sh for example.",
     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
+parser.add_argument(
+    "--num-jobs",
+    type=int,
+    default=1,
+    help="Number of processes to count the words with.  The files are "
+    "counted in parallel, and (non-gzipped) files larger than "
+    "--bytes-per-job are split into pieces that are counted in parallel.")
+parser.add_argument("--bytes-per-job",
+                    type=int,
+                    default=32 * 1024 * 1024,
+                    help="The size of the pieces into which large "
+                    "non-gzipped files are split when --num-jobs > 1.")
+parser.add_argument(
+    "--incremental",
+    type=str,
+    choices=["true", "false"],
+    default="true",
+    help="If true, only count the sources whose text files have changed "
+    "since the counts in <count-dir> were computed.  A file is considered "
+    "unchanged if its size and modification time are the same, or if its "
+    "size and SHA-1 hash are the same, as recorded in <count-dir>/fingerprints.")
 parser.add_argument("text_dir",
                     help="Directory in which to look for input text data\n")
 parser.add_argument("count_dir",
@@ -43,47 +78,251 @@ if os.system("validate_text_dir.py " + args.text_dir) != 0:
 if not os.path.exists(args.count_dir):
     os.mkdir(args.count_dir)
 
+# The worker processes are created with fork(), since this script does its
+# work at the top level; if fork is not available we just use one process.
+if (args.num_jobs > 1
+        and 'fork' not in multiprocessing.get_all_start_methods()):
+    print("get_word_counts.py: warning: fork() is not supported on this "
+          "platform, so ignoring --num-jobs={0}".format(args.num_jobs),
+          file=sys.stderr)
+    args.num_jobs = 1
 
-def ProcessFile(text_file, counts_file):
-    try:
-        if text_file.endswith(".gz"):
-            f = gzip.open(text_file, 'rt', encoding="utf-8")
-        else:
-            f = open(text_file, 'r', encoding="utf-8")
-    except Exception as e:
-        sys.exit("Failed to open {0} for reading: {1}".format(
-            text_file, str(e)))
-    word_to_count = defaultdict(int)
+
+# Returns a Counter from word to count for the lines of 'text_file' that
+# start in the byte range [begin, end), or for the whole file if end is None.
+# The Counter's order is the order in which the words were first seen.
+# Errors are raised as exceptions (rather than by exiting), since this may be
+# called in a worker process.
+def CountWords(text_file, begin=0, end=None):
+    word_to_count = Counter()
+    if text_file.endswith(".gz"):
+        f = gzip.open(text_file, 'rt', encoding="utf-8")
+    elif end is None:
+        f = open(text_file, 'r', encoding="utf-8")
+    else:
+        f = open(text_file, 'rb')
+    if end is not None:
+        if begin > 0:
+            # skip to the start of the first line that starts at or after
+            # 'begin'.
+            f.seek(begin - 1)
+            f.readline()
+        data = f.read(max(end - f.tell(), 0))
+        if len(data) > 0 and data[-1:] != b'\n':
+            # finish the line that contains byte end - 1.
+            data += f.readline()
+        f.close()
+        # newline=None splits lines the same way as reading in text mode.
+        f = io.StringIO(data.decode("utf-8"), newline=None)
     for line in f:
-        for word in line.split():
-            word_to_count[word] += 1
+        word_to_count.update(line.split())
     f.close()
+    return word_to_count
+
+
+def WriteCountsFile(word_to_count, counts_file):
     try:
         cf = open(counts_file, "w", encoding="utf-8")
     except:
-        sys.exit("Failed to open {0} for writing".format(text_file))
+        sys.exit("Failed to open {0} for writing".format(counts_file))
     for word, count in word_to_count.items():
         print("{0} {1}".format(count, word), file=cf)
     cf.close()
 
 
-num_files_processed = 0
+# Returns the SHA-1 of the contents of 'text_file', as a hex string.
+def FileHash(text_file):
+    h = hashlib.sha1()
+    with open(text_file, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if len(block) == 0:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def RunTask(task):
+    (func, func_args) = task
+    return func(*func_args)
+
+
+# Runs the list of tasks, each a pair (function, tuple of arguments), and
+# returns an iterator over their results in order.
+def RunTasks(tasks):
+    if pool is not None:
+        # imap() returns the results in order, which ensures that the merged
+        # counts are in order of first appearance, as they would be with a
+        # single job.
+        return pool.imap(RunTask, tasks)
+    else:
+        return (RunTask(task) for task in tasks)
+
+
+# Reads the fingerprints of the text files from which the .counts files in
+# count_dir were computed, as written by WriteFingerprints(); returns a dict
+# from text filename (e.g. 'switchboard.txt.gz') to a tuple (size, mtime,
+# hash).
+def ReadFingerprints():
+    fingerprints = {}
+    path = args.count_dir + os.sep + "fingerprints"
+    if not os.path.exists(path):
+        return fingerprints
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                [filename, size, mtime, file_hash] = line.rsplit(None, 3)
+                fingerprints[filename] = (int(size), int(mtime), file_hash)
+            except:
+                sys.exit("get_word_counts.py: bad line {0} in {1}".format(
+                    line[:-1], path))
+    return fingerprints
+
+
+def WriteFingerprints(fingerprints):
+    path = args.count_dir + os.sep + "fingerprints"
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for (filename, (size, mtime, file_hash)) in fingerprints.items():
+            print(filename, size, mtime, file_hash, file=f)
+    os.rename(path + ".tmp", path)
+
+
+# this reads the counts file and returns a dict from word to count, in the
+# order of the file.
+def ReadCountsFile(counts_file):
+    word_to_count = Counter()
+    with open(counts_file, encoding="utf-8") as f:
+        for line in f:
+            [count, word] = line.split()
+            word_to_count[word] += int(count)
+    return word_to_count
+
+
+# source_to_text_path is a list of pairs (source name, text path), in the order
+# of os.listdir().
+source_to_text_path = []
 
 for f in os.listdir(args.text_dir):
-    num_files_processed += 1
     text_path = args.text_dir + os.sep + f
     if os.path.isdir(text_path):
         continue
     if f.endswith(".txt"):
-        counts_path = args.count_dir + os.sep + f[:-4] + ".counts"
-        ProcessFile(text_path, counts_path)
+        source_to_text_path.append((f[:-4], text_path))
     elif f.endswith(".txt.gz"):
-        counts_path = args.count_dir + os.sep + f[:-7] + ".counts"
-        ProcessFile(text_path, counts_path)
+        source_to_text_path.append((f[:-7], text_path))
     elif f != "unigram_weights":
         sys.exit("get_word_counts.py: did not expect to find file {0}/{1} in "
                  "text directory".format(args.text_dir, f))
 
+if args.num_jobs > 1:
+    pool = multiprocessing.get_context('fork').Pool(args.num_jobs)
+else:
+    pool = None
+
+# Work out which sources we need to count.  A source is unchanged if its size
+# and modification time are the same as when it was last counted, or if its
+# size and contents hash are the same.
+old_fingerprints = ReadFingerprints() if args.incremental == "true" else {}
+fingerprints = {}
+sources_to_count = []
+sources_to_hash = []
+for (name, text_path) in source_to_text_path:
+    filename = os.path.basename(text_path)
+    stat = os.stat(text_path)
+    fingerprints[filename] = (stat.st_size, stat.st_mtime_ns, None)
+    old = old_fingerprints.get(filename)
+    if (old is None or old[0] != stat.st_size or
+            not os.path.exists(args.count_dir + os.sep + name + ".counts")):
+        sources_to_count.append((name, text_path))
+    elif old[1] == stat.st_mtime_ns:
+        fingerprints[filename] = old
+    else:
+        sources_to_hash.append((name, text_path))
+
+try:
+    hashes = RunTasks([(FileHash, (text_path, ))
+                       for (name, text_path) in sources_to_hash])
+    for ((name, text_path), file_hash) in zip(sources_to_hash, hashes):
+        filename = os.path.basename(text_path)
+        (size, mtime, _) = fingerprints[filename]
+        fingerprints[filename] = (size, mtime, file_hash)
+        if file_hash != old_fingerprints[filename][2]:
+            sources_to_count.append((name, text_path))
+except Exception as e:
+    sys.exit("get_word_counts.py: error reading files in {0}: {1}".format(
+        args.text_dir, str(e)))
+
+# Each task is a pair (function, arguments); the task for the hash of
+# source sources_to_count[i] is followed by the CountWords() tasks for that
+# source, in order.
+tasks = []
+for (name, text_path) in sources_to_count:
+    if fingerprints[os.path.basename(text_path)][2] is None:
+        tasks.append((FileHash, (text_path, )))
+    file_size = os.path.getsize(text_path)
+    if (args.num_jobs > 1 and not text_path.endswith(".gz")
+            and file_size > args.bytes_per_job):
+        for begin in range(0, file_size, args.bytes_per_job):
+            tasks.append((CountWords,
+                          (text_path, begin,
+                           min(begin + args.bytes_per_job, file_size))))
+    else:
+        tasks.append((CountWords, (text_path, )))
+
+new_source_to_counts = {}
+try:
+    results = RunTasks(tasks)
+    for ((func, func_args), result) in zip(tasks, results):
+        text_path = func_args[0]
+        filename = os.path.basename(text_path)
+        name = filename[:-4] if filename.endswith(".txt") else filename[:-7]
+        if func == FileHash:
+            (size, mtime, _) = fingerprints[filename]
+            fingerprints[filename] = (size, mtime, result)
+        elif name in new_source_to_counts:
+            new_source_to_counts[name].update(result)
+        else:
+            new_source_to_counts[name] = result
+except Exception as e:
+    sys.exit("get_word_counts.py: error counting words in {0}: {1}".format(
+        args.text_dir, str(e)))
+
+if pool is not None:
+    pool.close()
+    pool.join()
+
+# Get the counts of the unchanged sources, from the binary cache if it's up to
+# date or else from their .counts files.
+cache = None
+if len(new_source_to_counts) < len(source_to_text_path):
+    cache = ReadWordCountsCache(args.count_dir)
+source_to_counts = {}
+for (name, text_path) in source_to_text_path:
+    if name in new_source_to_counts:
+        source_to_counts[name] = new_source_to_counts[name]
+    elif cache is not None and name in cache[1]:
+        (words, source_to_entries) = cache
+        (indexes, counts) = source_to_entries[name]
+        source_to_counts[name] = dict(
+            zip(map(words.__getitem__, indexes), counts))
+    else:
+        source_to_counts[name] = ReadCountsFile(args.count_dir + os.sep +
+                                                name + ".counts")
+
+# Remove the .counts files of sources that we previously counted but which are
+# no longer in the text directory.
+for filename in old_fingerprints:
+    name = filename[:-4] if filename.endswith(".txt") else filename[:-7]
+    counts_path = args.count_dir + os.sep + name + ".counts"
+    if name not in source_to_counts and os.path.exists(counts_path):
+        os.remove(counts_path)
+
+for (name, word_to_count) in new_source_to_counts.items():
+    WriteCountsFile(word_to_count,
+                    args.count_dir + os.sep + name + ".counts")
+
+num_files_processed = len(source_to_counts)
+
 num_files_in_dest = 0
 for f in os.listdir(args.count_dir):
     if f.endswith(".counts"):
@@ -94,6 +333,14 @@ if num_files_in_dest > num_files_processed:
              args.count_dir + " contains some extra counts files. "
              "Please clean up.")
 
-print("Created {0} .counts files in {1}".format(num_files_processed,
-                                                args.count_dir),
+# We only rewrite the binary cache if something changed, so that its
+# modification time can be used to tell whether later stages need to be redone.
+if (len(new_source_to_counts) > 0 or cache is None or
+        len(cache[1]) != len(source_to_counts)):
+    WriteWordCountsCache(args.count_dir, source_to_counts)
+WriteFingerprints(fingerprints)
+
+print("Created {0} .counts files in {1} ({2} of them were unchanged)".format(
+    num_files_processed, args.count_dir,
+    num_files_processed - len(new_source_to_counts)),
       file=sys.stderr)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# we're using python 3.x style print but want it to work in python 2.x,
+from __future__ import print_function
+import struct
+import threading
+import time
+import zlib
+
+from pocolm_common import ExitProgram
+
+# This module provides class ParallelGzipWriter, which writes a gzip-compressed
+# file using several threads, in the same way as 'pigz': the data is split
+# into blocks which are compressed in parallel (zlib releases the GIL while it
+# compresses), each as a raw deflate stream that ends on a byte boundary and
+# uses the last 32K of the previous block as its dictionary.  The compressed
+# blocks are concatenated inside a single gzip header and trailer, so the
+# result is a standard gzip file that gunzip (or any zlib-based reader) can
+# read.  The number of blocks being compressed at any time is limited, so the
+# memory used is bounded.  It has the write() and close() methods of a file
+# opened for writing in binary mode, so it can be used in place of one.
+#
+# e.g.:
+#   writer = ParallelGzipWriter('lm.arpa.gz', num_threads=4)
+#   writer.write(some_bytes)
+#   writer.close()
+
+# the size of the deflate window, which is the size of the dictionary that
+# each block can use.
+_dict_size = 32768
+
+
+def _CompressBlock(block, dictionary, last, level, output):
+    if dictionary is None:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    else:
+        compressor = zlib.compressobj(level,
+                                      zlib.DEFLATED,
+                                      -15,
+                                      zdict=dictionary)
+    output.append(
+        compressor.compress(block) +
+        compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH))
+
+
+class ParallelGzipWriter(object):
+    # 'filename' is the file to write.  'num_threads' is the maximum number of
+    # blocks that are compressed at once.  'max_memory' is, if not None, a
+    # limit in bytes on the memory used for the blocks being compressed (their
+    # input plus their output); it may reduce the number of blocks compressed
+    # at once, down to one.
+    def __init__(self,
+                 filename,
+                 num_threads=4,
+                 max_memory=None,
+                 block_size=1048576,
+                 level=6):
+        self.block_size = block_size
+        self.level = level
+        # we assume that the compressed output of a block is no larger than
+        # its input, which is true of text.
+        self.max_blocks = num_threads
+        if max_memory is not None:
+            self.max_blocks = min(self.max_blocks,
+                                  max_memory // (2 * block_size))
+        self.max_blocks = max(self.max_blocks, 1)
+        self.file = open(filename, 'wb')
+        self.file.write(
+            struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, int(time.time()), 0,
+                        255))
+        # the input that has not yet been made into a block.
+        self.buffer = []
+        self.buffer_size = 0
+        # the last _dict_size bytes of the previous block, or None.
+        self.dictionary = None
+        # the blocks being compressed, in order: each a tuple (thread, output)
+        # where 'output' is a list to which the thread appends the compressed
+        # data.
+        self.pending = []
+        self.crc = 0
+        self.size = 0
+
+    # Writes the bytes 'data' to the file.
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.block_size:
+            data = b''.join(self.buffer)
+            num_blocks = len(data) // self.block_size
+            for b in range(num_blocks):
+                self._AddBlock(data[b * self.block_size:(b + 1) *
+                                    self.block_size],
+                               last=False)
+            remainder = data[num_blocks * self.block_size:]
+            self.buffer = [remainder]
+            self.buffer_size = len(remainder)
+
+    def _AddBlock(self, block, last):
+        if len(self.pending) == self.max_blocks:
+            self._WriteOldestBlock()
+        output = []
+        thread = threading.Thread(
+            target=_CompressBlock,
+            args=[block, self.dictionary, last, self.level, output])
+        thread.start()
+        self.pending.append((thread, output))
+        self.dictionary = block[-_dict_size:]
+
+    def _WriteOldestBlock(self):
+        (thread, output) = self.pending.pop(0)
+        thread.join()
+        if len(output) != 1:
+            ExitProgram("error compressing data for {0}".format(
+                self.file.name))
+        self.file.write(output[0])
+
+    # Compresses the remaining data, writes the gzip trailer and closes the
+    # file.
+    def close(self):
+        self._AddBlock(b''.join(self.buffer), last=True)
+        self.buffer = []
+        while len(self.pending) > 0:
+            self._WriteOldestBlock()
+        self.file.write(
+            struct.pack('<II', self.crc & 0xffffffff,
+                        self.size & 0xffffffff))
+        self.file.close()
@@ -106,3 +106,40 @@ def TouchFile(fname):
 
 def LogMessage(message):
     print(os.path.basename(sys.argv[0]) + ": " + message, file=sys.stderr)
+
+
+# Returns the list of float-counts files of the LM-dir 'lm_dir': float.all, or
+# float.all.1, float.all.2 ... if it is split.
+def GetFloatCountsFiles(lm_dir):
+    if os.path.exists(lm_dir + "/num_splits"):
+        with open(lm_dir + "/num_splits", encoding="utf-8") as f:
+            num_splits = int(f.readline())
+        return [
+            "{0}/float.all.{1}".format(lm_dir, n)
+            for n in range(1, num_splits + 1)
+        ]
+    return [lm_dir + "/float.all"]
+
+
+# Creates the index file <float_counts>.index that score-sentences and the
+# ARPA/binary-LM writers need for the float-counts file 'float_counts', unless
+# it already exists and is up to date.  make_lm_dir.py, split_lm_dir.py and
+# prune_lm_dir.py write the index along with the float-counts, so normally
+# this does nothing for LM-dirs they created.
+def EnsureFloatCountsIndex(float_counts):
+    index = float_counts + ".index"
+    if (os.path.exists(index)
+            and os.path.getmtime(index) >= os.path.getmtime(float_counts)):
+        return
+    # the programs are in ../../src relative to this module.
+    command = [
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                     os.pardir, 'src', 'float-counts-index'), float_counts
+    ]
+    try:
+        subprocess.check_output(command,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+    except CalledProcessError as e:
+        ExitProgram("command {0} failed: {1}".format(' '.join(command),
+                                                     e.output))
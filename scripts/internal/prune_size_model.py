@@ -20,6 +20,45 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
     sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
 
 
+class CostHistogram:
+    """The histogram of the costs of the n-grams in a prune step, as written by
+    float-counts-prune --cost-histogram-out, for a prune step whose input had
+    num_xgrams x-grams.  The cost of an n-gram is the threshold above which
+    the prune step would prune it, so the histogram tells us (approximately)
+    how many x-grams we would have got from the same input with any threshold.
+    'bins' is a list of tuples (cost_lower_bound, cost_upper_bound, count) in
+    increasing order of cost.
+    """
+    def __init__(self, num_xgrams, bins):
+        self.num_xgrams = num_xgrams
+        self.bins = bins
+
+    def NumXgrams(self, threshold):
+        """Returns the number of x-grams we'd get with this threshold; within
+        a bin, we assume the costs are uniformly distributed in log-space."""
+        num_pruned = 0.0
+        for (lower, upper, count) in self.bins:
+            if upper <= threshold:
+                num_pruned += count
+            else:
+                if lower < threshold:
+                    num_pruned += count * (math.log(threshold / lower) /
+                                           math.log(upper / lower))
+                break
+        return self.num_xgrams - num_pruned
+
+    def Threshold(self, num_xgrams):
+        """The inverse of NumXgrams(): returns the threshold that would give us
+        num_xgrams x-grams, or None if there is no such threshold."""
+        cur_num_xgrams = float(self.num_xgrams)
+        for (lower, upper, count) in self.bins:
+            if lower > 0.0 and cur_num_xgrams - count <= num_xgrams:
+                fraction = (cur_num_xgrams - num_xgrams) / count
+                return lower * (upper / lower)**fraction
+            cur_num_xgrams -= count
+        return None
+
+
 class PruneSizeModel:
     """Estimate the coeffients of a line using two most recent points
 
@@ -39,8 +78,10 @@ class PruneSizeModel:
 
         # history keeps the infos for successful iterations, i.e. the iterations did not overshoot.
         # It is a list of list as
-        #   [threshold, num_xgrams, modeled_num_xgrams, intermediate_target_num_xgrams, starting_iter]
-        # indexed by time step.
+        #   [threshold, num_xgrams, modeled_num_xgrams, intermediate_target_num_xgrams,
+        #    cost_histogram, starting_iter]
+        # indexed by time step, where cost_histogram is the CostHistogram of
+        # the iteration, or None if it was not supplied.
         self.history = []
 
         # this power relationship is a heuristic that says how the num-xgrams
@@ -61,10 +102,10 @@ class PruneSizeModel:
 
     def SetInitialThreshold(self, initial_threshold, initial_num_xgrams):
         self.initial_threshold = initial_threshold
-        self.history.append([0.0, initial_num_xgrams, 0, 0, 0])
+        self.history.append([0.0, initial_num_xgrams, 0, 0, None, 0])
         self.DebugLog("Iter {0}: threshold={1:.3f}, num_xgrams={2}".format(
             self.iter, 0.0, int(initial_num_xgrams)))
-        self.history.append([initial_threshold, 0, 0, 0, 0])
+        self.history.append([initial_threshold, 0, 0, 0, None, 0])
 
     def NumXgrams2NumNgrams(self, num_xgrams):
         return self.num_unigrams + num_xgrams
@@ -73,11 +114,13 @@ class PruneSizeModel:
         return self.NumXgrams2NumNgrams(tot_num_xgrams) >= self.target_lower_threshold \
                and self.NumXgrams2NumNgrams(tot_num_xgrams) <= self.target_upper_threshold
 
-    def GetNextAction(self, cur_num_xgrams):
+    def GetNextAction(self, cur_num_xgrams, cost_histogram=None):
         """
         This function takes in the num_xgrams after pruned by threshold returned
         from last call of this function. Then it will return a new threshold that
         should be used by next iteration of pruning.
+        If cost_histogram (a CostHistogram) is supplied for that pruning, it is
+        used to predict the num_xgrams for other thresholds.
 
         It returns a tuple as (action, args), where the action tells the caller,
         what action it should take next time, and the args is a list of arguments
@@ -89,7 +132,8 @@ class PruneSizeModel:
                        The args should be None.
             'overshoot': indicates we overshot with the initial threshold.
                         the caller should retry with a lower initial threshold.
-                        The args should be None.
+                        The args should be None.  (This only happens if no
+                        cost_histogram was supplied; otherwise we backtrack.)
             'backtrack': indicates we overshot and need to backtrack.
                         the caller should abondan some recent iterations and
                         prune from the other starting point.
@@ -103,6 +147,7 @@ class PruneSizeModel:
         prev_threshold = self.GetPrevThreshold()
         cur_threshold = self.GetCurThreshold()
         self.SetCurNumXgrams(cur_num_xgrams)
+        self.history[-1][4] = cost_histogram
         self.iter += 1
 
         self.DebugLog(
@@ -115,6 +160,24 @@ class PruneSizeModel:
         if self.MatchTargetNumNgrams(cur_num_xgrams):
             return ('success', None)
 
+        if (cost_histogram is not None and self.NumXgrams2NumNgrams(
+                cur_num_xgrams) < self.target_lower_threshold):
+            # The histogram tells us (quite accurately) the num-xgrams we
+            # would have got from this iteration's input with any other
+            # threshold.  If one gives us the target, prune the same input
+            # again with it.
+            next_threshold = cost_histogram.Threshold(self.target_num_xgrams)
+            if next_threshold is not None and next_threshold != cur_threshold:
+                backtrack_iter = self.history.pop()[-1]
+                self.DebugLog("Prune the input of iter {0} again, from iter "
+                              "{1}".format(self.iter, backtrack_iter))
+                self.history.append([
+                    next_threshold, 0,
+                    cost_histogram.NumXgrams(next_threshold),
+                    self.target_num_xgrams, None, backtrack_iter
+                ])
+                return ('backtrack', [next_threshold, backtrack_iter])
+
         backtrack_iter = -1
         if self.NumXgrams2NumNgrams(
                 cur_num_xgrams) < self.target_lower_threshold:  # we overshot
@@ -158,12 +221,19 @@ class PruneSizeModel:
             modeled_next_num_xgrams = self.GetCurModeledNumXgrams()
             cur_target_num_xgrams = self.GetCurTargetNumXgrams()
         else:
-            cur_target_num_xgrams = self.GetIntermediateTargetNumXgrams()
+            cur_target_num_xgrams = self.target_num_xgrams
             (next_threshold, modeled_next_num_xgrams
-             ) = self.GetNextThreshold(cur_target_num_xgrams)
+             ) = self.GetNextThresholdFromHistogram()
+            if next_threshold is None:
+                # we have no cost histogram, or the target is beyond it; fall
+                # back to approaching the target gradually.
+                cur_target_num_xgrams = self.GetIntermediateTargetNumXgrams()
+                (next_threshold, modeled_next_num_xgrams
+                 ) = self.GetNextThreshold(cur_target_num_xgrams)
 
         hist = [
-            next_threshold, 0, modeled_next_num_xgrams, cur_target_num_xgrams
+            next_threshold, 0, modeled_next_num_xgrams, cur_target_num_xgrams,
+            None
         ]
         if backtrack_iter > 0:
             self.history.append(hist + [backtrack_iter])
@@ -262,6 +332,35 @@ class PruneSizeModel:
                                   cur_threshold)**self.xgrams_change_power
         return predicted_num_xgrams_if_repeat * predicted_extra_factor
 
+    def GetNextThresholdFromHistogram(self):
+        """
+        This function is called when we are still above the target.  We
+        prune the current iteration's output next, which also prunes some of
+        the n-grams that were protected in the current iteration's cost
+        histogram; as in GetModeledNextNumXgrams(),
+        we assume that this gives us prev_change_factor times what the
+        histogram says.  This function inverts that to find the threshold
+        that we predict will get us to the target, and returns
+        (next_threshold, modeled_next_num_xgrams), or (None, None) if we have
+        no cost histogram or it doesn't go that far.
+        """
+        cost_histogram = self.GetCurCostHistogram()
+        if cost_histogram is None:
+            return (None, None)
+        prev_change_factor = (float(self.GetCurNumXgrams()) /
+                              self.GetPrevNumXgrams())**self.prev_change_power
+        next_threshold = cost_histogram.Threshold(self.target_num_xgrams /
+                                                  prev_change_factor)
+        if next_threshold is None:
+            return (None, None)
+        # we never decrease the threshold, and as in GetNextThreshold(), we
+        # don't increase it by more than max_threshold_change_factor.
+        cur_threshold = self.GetCurThreshold()
+        next_threshold = min(max(next_threshold, cur_threshold),
+                             self.max_threshold_change_factor * cur_threshold)
+        return (next_threshold,
+                prev_change_factor * cost_histogram.NumXgrams(next_threshold))
+
     def AdjustModelForOvershoot(self):
         self.xgrams_change_power *= 1.2
         self.prev_change_power *= 1.2
@@ -289,6 +388,9 @@ class PruneSizeModel:
     def GetCurTargetNumXgrams(self):
         return self.history[-1][3]
 
+    def GetCurCostHistogram(self):
+        return self.history[-1][4]
+
     def LogMessage(self, message):
         print("PruneSizeModel: " + message, file=sys.stderr)
 
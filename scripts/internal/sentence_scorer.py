@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# we're using python 3.x style print but want it to work in python 2.x,
+from __future__ import print_function
+import os
+import subprocess
+import sys
+import threading
+
+from pocolm_common import GetFloatCountsFiles, EnsureFloatCountsIndex
+
+# This module provides class SentenceScorer, which computes the log-probs of
+# sentences given a pocolm LM-dir, using the program score-sentences.  It keeps
+# score-sentences running, so after the LM is loaded (which is fast, since it
+# is memory-mapped) each batch of sentences only costs the lookups.  The
+# log-probs are the same as those that get_data_prob.py computes (which gives
+# their total over the data).
+#
+# e.g.:
+#   scorer = SentenceScorer('data/lm')
+#   for (num_words, log_prob, word_log_probs) in scorer.ScoreSentences(
+#           ['hello there', 'how are you']):
+#       print(log_prob / num_words)
+#   scorer.Close()
+
+# the programs are in ../../src relative to this module.
+_src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                        os.pardir, 'src')
+
+
+class SentenceScorer(object):
+    # 'lm_dir' is a pocolm LM-dir (split or not).  If 'per_word' is true,
+    # ScoreSentences() also returns the log-prob of each word.  Note: this
+    # writes the index files of the float-counts to the LM-dir if they don't
+    # exist.
+    def __init__(self, lm_dir, per_word=False):
+        self.per_word = per_word
+        # word_to_int maps each word to its integer form, as a string; like
+        # text_to_int.py, we map words numbered 0, 1 or 2 (normally <eps>, <s>
+        # and </s>) to 3 (normally <unk>), and OOVs are also mapped to 3.
+        self.word_to_int = {}
+        with open(lm_dir + "/words.txt", encoding="utf-8") as f:
+            for line in f:
+                [word, index] = line.split()
+                self.word_to_int[word] = index if int(index) > 2 else '3'
+        float_counts_files = GetFloatCountsFiles(lm_dir)
+        for float_counts in float_counts_files:
+            EnsureFloatCountsIndex(float_counts)
+        command = [os.path.join(_src_dir, 'score-sentences')]
+        if per_word:
+            command.append('--per-word')
+        self.process = subprocess.Popen(command + float_counts_files,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        universal_newlines=True)
+
+    # Returns the sentence 'sentence' (a string of space-separated words) in
+    # integer form.
+    def Integerize(self, sentence):
+        lookup = self.word_to_int.get
+        return ' '.join([lookup(word, '3') for word in sentence.split()])
+
+    def _WriteSentences(self, int_sentences):
+        try:
+            for int_sentence in int_sentences:
+                print(int_sentence, file=self.process.stdin)
+            self.process.stdin.flush()
+        except IOError:
+            # score-sentences died; _ReadResult() will report the error.
+            pass
+
+    def _ReadResult(self):
+        line = self.process.stdout.readline()
+        try:
+            fields = line.split()
+            num_words = int(fields[0])
+            log_prob = float(fields[1])
+            if self.per_word:
+                word_log_probs = [float(x) for x in fields[2:]]
+                assert len(word_log_probs) == num_words
+            else:
+                word_log_probs = None
+                assert len(fields) == 2
+        except:
+            sys.exit("sentence_scorer.py: unexpected output '{0}' from "
+                     "score-sentences (did it fail?)".format(line.strip()))
+        return (num_words, log_prob, word_log_probs)
+
+    # Computes the log-probs of the sentences in the list 'sentences' (each a
+    # string of space-separated words, without <s> or </s>).  Returns a list
+    # with a tuple (num_words, log_prob, word_log_probs) for each sentence,
+    # where num_words includes the end of sentence, log_prob is the natural
+    # log of the probability of the sentence, and word_log_probs is the list of
+    # the num_words log-probs of its words (and of the end of sentence) if
+    # per_word was true, and None otherwise.
+    def ScoreSentences(self, sentences):
+        int_sentences = [self.Integerize(s) for s in sentences]
+        # we write from a separate thread so that neither program can block
+        # the other by filling up a pipe.
+        writer = threading.Thread(target=self._WriteSentences,
+                                  args=[int_sentences])
+        writer.start()
+        results = [self._ReadResult() for s in int_sentences]
+        writer.join()
+        return results
+
+    # Stops the score-sentences process.
+    def Close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
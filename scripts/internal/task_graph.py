@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# we're using python 3.x style print but want it to work in python 2.x,
+from __future__ import print_function
+import os
+import sys
+import threading
+
+from pocolm_common import ExitProgram
+
+# This module provides a simple scheduler for running a set of tasks (python
+# functions, which typically run a command using RunCommand() or
+# GetCommandStdout()) that depend on each other.  Each task is started, in its
+# own thread, as soon as all the tasks it depends on have finished, subject to
+# a limit on the number of tasks running at once and, optionally, to a limit
+# on their total (estimated) memory use.  Tasks become ready in the order in
+# which they were added, and ready tasks are started in that order, so
+# scripts should add tasks roughly in the order in which they would run them
+# serially.
+#
+# Errors are handled as elsewhere in these scripts: a task that fails is
+# expected to call ExitProgram(), which exits the whole program; a task that
+# raises an exception does the same.
+
+
+# Parses a memory size such as '10G', '500M', '4096K' or '1000000' (the latter
+# in bytes) and returns the number of bytes.  The empty string means no limit,
+# and is returned as None.
+def ParseMemorySize(s):
+    if s == '':
+        return None
+    multipliers = {
+        'b': 1,
+        'k': 1024,
+        'm': 1024**2,
+        'g': 1024**3,
+        't': 1024**4
+    }
+    try:
+        if s[-1].isdigit():
+            ans = int(s)
+        else:
+            ans = int(s[:-1]) * multipliers[s[-1].lower()]
+        assert ans > 0
+    except:
+        ExitProgram("invalid memory size '{0}': expected something like "
+                    "'10G', '500M' or '1000000'".format(s))
+    return ans
+
+
+# Returns the total size in bytes of the files in the list 'filenames' (files
+# that do not exist count as zero); this is useful as a memory estimate for
+# tasks that read their inputs into memory.
+def GetTotalFileSize(filenames):
+    return sum([os.path.getsize(f) for f in filenames if os.path.exists(f)])
+
+
+class TaskGraph(object):
+    # 'num_jobs' is the maximum number of tasks that may run at once (0 means
+    # no limit); 'max_memory' is the maximum total estimated memory of the
+    # tasks running at once, in bytes, or None for no limit.  A task whose
+    # estimated memory exceeds 'max_memory' by itself is still run, but only
+    # when no other task is running.
+    def __init__(self, num_jobs=0, max_memory=None, verbose=False):
+        self.num_jobs = num_jobs
+        self.max_memory = max_memory
+        self.verbose = verbose
+        # a list of names of tasks, in the order in which they were added.
+        self.names = []
+        # a dict from task name to a tuple (function, args, dependencies,
+        # memory).
+        self.tasks = {}
+        self.finished = set()
+        self.cond = threading.Condition()
+
+    # Adds a task named 'name' (which must be unique) that calls
+    # function(*args) after all the tasks named in 'dependencies' have
+    # finished.  'memory' is an estimate of the memory the task will use, in
+    # bytes: either a number, or a function that is called (with no
+    # arguments) once the dependencies have finished, e.g. to look at the sizes
+    # of files they wrote.  Returns 'name'.
+    def Add(self, name, function, args=[], dependencies=[], memory=0):
+        if name in self.tasks:
+            ExitProgram("task {0} was added twice".format(name))
+        for d in dependencies:
+            if d not in self.tasks:
+                ExitProgram("task {0} depends on unknown task {1}".format(
+                    name, d))
+        self.names.append(name)
+        self.tasks[name] = (function, args, dependencies, memory)
+        return name
+
+    def _RunTask(self, name):
+        (function, args, dependencies, memory) = self.tasks[name]
+        try:
+            function(*args)
+        except Exception as e:
+            # Run() would otherwise wait forever for this task to finish.
+            ExitProgram("task {0} failed: {1}".format(name, repr(e)))
+        with self.cond:
+            self.finished.add(name)
+            self.cond.notify()
+
+    # Runs all the tasks, and returns when they have all finished.
+    def Run(self):
+        pending = list(self.names)
+        # a dict from the name of each running task to its memory estimate.
+        running = {}
+        with self.cond:
+            while len(pending) > 0 or len(running) > 0:
+                for name in list(running.keys()):
+                    if name in self.finished:
+                        del running[name]
+                for name in list(pending):
+                    if self.num_jobs > 0 and len(running) >= self.num_jobs:
+                        break
+                    (function, args, dependencies, memory) = self.tasks[name]
+                    if not all([d in self.finished for d in dependencies]):
+                        continue
+                    if callable(memory):
+                        memory = memory()
+                    if (self.max_memory is not None and len(running) > 0
+                            and sum(running.values()) + memory >
+                            self.max_memory):
+                        # wait for something to finish; we don't start later
+                        # tasks ahead of this one, so that large tasks are not
+                        # starved.
+                        break
+                    if self.verbose:
+                        print("{0}: starting task {1}".format(
+                            os.path.basename(sys.argv[0]), name),
+                              file=sys.stderr)
+                    pending.remove(name)
+                    running[name] = memory
+                    t = threading.Thread(target=self._RunTask, args=[name])
+                    t.daemon = True
+                    t.start()
+                if len(running) > 0 and all(
+                    [name not in self.finished for name in running]):
+                    self.cond.wait()
+                elif len(running) == 0 and len(pending) > 0:
+                    # can't happen, since dependencies must already exist
+                    # when a task is added, so there can be no cycles.
+                    ExitProgram("no task can be run, but tasks {0} have not "
+                                "been run".format(pending))
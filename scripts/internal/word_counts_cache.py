@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# we're using python 3.x style print but want it to work in python 2.x,
+from __future__ import print_function
+import os
+import struct
+import sys
+from array import array
+
+# This module reads and writes the binary word-counts table that
+# get_word_counts.py writes to <count-dir>/counts.bin alongside the text-form
+# *.counts files, so that get_unigram_weights.py and word_counts_to_vocab.py
+# don't have to re-parse the text files.
+#
+# The format is as follows (all integers are native-endian):
+#   the magic string b'pocolm-word-counts-v1\n'
+#   int64 num_words, int64 num_bytes, then num_bytes of utf-8 text which is
+#      the num_words distinct words of all the sources, each followed by '\n'.
+#   int64 num_sources, then for each source:
+#      int64 name_bytes, then the utf-8 name of the source (e.g. 'dev'),
+#      int64 num_entries, then num_entries uint32 word-indexes (into the list of
+#         words above), then int64 count_size (4 or 8), then num_entries counts
+#         as uint32 (if count_size is 4) or int64 (if count_size is 8).
+# The entries of each source are in the same order as the lines of its
+# .counts file, so that readers process the words in the same order whichever
+# form they read.
+
+_magic = b'pocolm-word-counts-v1\n'
+_cache_name = 'counts.bin'
+
+
+def _WriteInt(f, i):
+    f.write(struct.pack('=q', i))
+
+
+def _ReadInt(f):
+    return struct.unpack('=q', f.read(8))[0]
+
+
+# Writes the cache to <count_dir>/counts.bin.  'source_to_counts' is a dict
+# from source name (e.g. 'dev' or 'switchboard') to a dict from word to count,
+# whose iteration order is the order of the source's .counts file.  This
+# should be called after the .counts files are written, since the cache is only
+# used if it is newer than all of them.
+def WriteWordCountsCache(count_dir, source_to_counts):
+    word_to_index = {}
+    for word_to_count in source_to_counts.values():
+        for word in word_to_count:
+            if word not in word_to_index:
+                word_to_index[word] = len(word_to_index)
+    words_bytes = ''.join([w + '\n' for w in word_to_index]).encode('utf-8')
+
+    path = os.path.join(count_dir, _cache_name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_magic)
+        _WriteInt(f, len(word_to_index))
+        _WriteInt(f, len(words_bytes))
+        f.write(words_bytes)
+        _WriteInt(f, len(source_to_counts))
+        for name, word_to_count in source_to_counts.items():
+            name_bytes = name.encode('utf-8')
+            _WriteInt(f, len(name_bytes))
+            f.write(name_bytes)
+            _WriteInt(f, len(word_to_count))
+            array('I', [word_to_index[w] for w in word_to_count]).tofile(f)
+            counts = array('q', word_to_count.values())
+            if len(counts) == 0 or max(counts) < 2**32:
+                counts = array('I', counts)
+            _WriteInt(f, counts.itemsize)
+            counts.tofile(f)
+    os.rename(tmp_path, path)
+
+
+# Returns the list of source names in 'count_dir' (the names of the *.counts
+# files without their suffix), in the order of os.listdir().
+def GetCountsSourceNames(count_dir):
+    return [
+        f[:-7] for f in os.listdir(count_dir)
+        if f.endswith('.counts')
+    ]
+
+
+# Reads <count_dir>/counts.bin if it exists and is up to date with respect to
+# the .counts files in 'count_dir'.  Returns a tuple (words, source_to_entries)
+# where 'words' is a list of words and 'source_to_entries' is a dict from source
+# name to a pair (indexes, counts) of arrays, with words[indexes[i]] having
+# count counts[i].  Returns None if the cache should not be used, in which case
+# the caller should read the .counts files.
+def ReadWordCountsCache(count_dir):
+    path = os.path.join(count_dir, _cache_name)
+    if not os.path.exists(path):
+        return None
+    names = GetCountsSourceNames(count_dir)
+    cache_time = os.path.getmtime(path)
+    for name in names:
+        if os.path.getmtime(os.path.join(count_dir,
+                                         name + '.counts')) > cache_time:
+            print('{0}: warning: not using {1} since it is older than the '
+                  '.counts files'.format(os.path.basename(sys.argv[0]), path),
+                  file=sys.stderr)
+            return None
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(_magic)) != _magic:
+                raise ValueError('bad header')
+            num_words = _ReadInt(f)
+            num_bytes = _ReadInt(f)
+            words = f.read(num_bytes).decode('utf-8').split('\n')
+            if len(words) != num_words + 1 or words[-1] != '':
+                raise ValueError('bad word list')
+            words.pop()
+            source_to_entries = {}
+            for s in range(_ReadInt(f)):
+                name = f.read(_ReadInt(f)).decode('utf-8')
+                num_entries = _ReadInt(f)
+                indexes = array('I')
+                indexes.fromfile(f, num_entries)
+                count_size = _ReadInt(f)
+                if count_size not in [4, 8]:
+                    raise ValueError('bad count size')
+                counts = array('I' if count_size == 4 else 'q')
+                counts.fromfile(f, num_entries)
+                source_to_entries[name] = (indexes, counts)
+            if f.read(1) != b'':
+                raise ValueError('junk at end of file')
+    except (ValueError, EOFError, struct.error, UnicodeDecodeError) as e:
+        sys.exit('{0}: error reading word-counts cache {1}: {2}'.format(
+            os.path.basename(sys.argv[0]), path, str(e)))
+    if sorted(source_to_entries.keys()) != sorted(names):
+        print('{0}: warning: not using {1} since its sources do not match the '
+              '.counts files'.format(os.path.basename(sys.argv[0]), path),
+              file=sys.stderr)
+        return None
+    return (words, source_to_entries)
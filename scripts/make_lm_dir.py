@@ -16,6 +16,12 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
     sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
 
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+from pocolm_common import GetFloatCountsFiles, EnsureFloatCountsIndex
+
 parser = argparse.ArgumentParser(
     description="This script, given counts and metaparameters, will "
     "estimate an LM  in the 'pocolm-internal' format.  This consists of "
@@ -50,6 +56,19 @@ parser.add_argument(
     "to the most recent history-word (the unigram state is repeated), "
     "and the file num_splits containing the --num-splits argument, which "
     "must be >1.")
+parser.add_argument("--compact-float-counts",
+                    type=str,
+                    default="false",
+                    choices=["true", "false"],
+                    help="If true, write the float-counts of the output "
+                    "LM-dir in the compact format written by "
+                    "float-counts-compress (see src/lm-state.h), in which "
+                    "counts are 16-bit indexes into a codebook and words are "
+                    "delta-encoded.  It is read transparently by all programs "
+                    "that read float-counts.  It is lossless if there are no "
+                    "more than 65536 distinct counts; otherwise counts are "
+                    "quantized on a log scale (the relative change is "
+                    "typically well under 0.1%).")
 parser.add_argument("--cleanup",
                     type=str,
                     default="true",
@@ -189,6 +208,17 @@ try:
 except:
     sys.exit("make_lm_dir.py: error copying {0} to {1}".format(src, dst))
 
+
+def MoveFloatCounts(src_file, dest_file):
+    if args.compact_float_counts == 'true':
+        command = "float-counts-compress {0} {1}".format(src_file, dest_file)
+        if os.system(command) != 0:
+            sys.exit("make_lm_dir.py: error running command " + command)
+        os.remove(src_file)
+    else:
+        shutil.move(src_file, dest_file)
+
+
 if args.keep_splits == 'true':
     f = open(args.lm_dir + '/num_splits', 'w', encoding="utf-8")
     print(str(args.num_splits), file=f)
@@ -198,16 +228,22 @@ if args.keep_splits == 'true':
                                                        args.num_splits, i)
         dest_file = "{0}/float.all.{1}".format(args.lm_dir, i)
         try:
-            shutil.move(src_file, dest_file)
-        except:
+            MoveFloatCounts(src_file, dest_file)
+        except OSError:
             sys.exit("make_lm_dir.py: error moving {0} to {1}".format(
                 src_file, dest_file))
 else:
     try:
-        shutil.move(work_dir + "/float.all", args.lm_dir + "/float.all")
-    except:
+        MoveFloatCounts(work_dir + "/float.all", args.lm_dir + "/float.all")
+    except OSError:
         sys.exit("make_lm_dir.py: error moving {0}/float.all to {1}/float.all".
                  format(work_dir, args.lm_dir))
 
+# write the index files now, so that the programs that need them
+# (format_arpa_lm.py, get_data_prob.py and so on) don't have to write to the
+# LM-dir.
+for float_counts in GetFloatCountsFiles(args.lm_dir):
+    EnsureFloatCountsIndex(float_counts)
+
 if os.system("validate_lm_dir.py " + args.lm_dir) != 0:
     sys.exit("make_lm_dir.py: error validating lm-dir " + args.lm_dir)
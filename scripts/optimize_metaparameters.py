@@ -5,6 +5,7 @@ from __future__ import print_function
 import numpy as np
 import os
 import argparse
+import subprocess
 import sys
 import math
 from math import log
@@ -49,6 +50,16 @@ parser.add_argument(
     help="Controls the number of parallel processes used to "
     "get objective functions and derivatives.  If >1, then "
     "we split the counts and compute these things in parallel.")
+parser.add_argument(
+    "--use-server",
+    type=str,
+    default="true",
+    choices=["true", "false"],
+    help="If true and --num-splits=1, the objective functions and derivatives "
+    "are computed by a single compute-objf-and-derivs process that reads the "
+    "counts once and keeps all the intermediate counts in memory, instead of "
+    "by running get_objf_and_derivs.py for each evaluation.  This is much "
+    "faster, but needs enough memory to hold the counts.")
 parser.add_argument(
     "--read-inv-hessian",
     type=str,
@@ -84,9 +95,12 @@ print(' '.join(sys.argv), file=sys.stderr)
 
 args = parser.parse_args()
 
-# Add the script dir to the path
+# Add the script dir and the src dir to the path
 os.environ['PATH'] = (os.environ['PATH'] + os.pathsep +
-                      os.path.abspath(os.path.dirname(sys.argv[0])))
+                      os.path.abspath(os.path.dirname(sys.argv[0])) +
+                      os.pathsep +
+                      os.path.abspath(os.path.dirname(sys.argv[0])) +
+                      "/../src")
 
 if args.warm_start_dir is not None:
     if args.initial_metaparameters is not None or args.read_inv_hessian is not None:
@@ -360,6 +374,67 @@ def TestConstraints():
         file=sys.stderr)
 
 
+# the compute-objf-and-derivs process, if we are using one (see --use-server);
+# it is started by the first call to GetObjfAndDerivsFromServer().
+server = None
+
+
+# This function does the same as running get_objf_and_derivs.py with
+# --derivs-out=deriv_file, but it gets the objective function and derivatives
+# from a compute-objf-and-derivs process that stays running between calls.
+def GetObjfAndDerivsFromServer(metaparameter_file, objf_file, deriv_file,
+                               log_file):
+    global server
+    server_log_file = "{0}/work/compute_objf_and_derivs.log".format(
+        args.optimize_dir)
+    if server is None:
+        try:
+            server_log = open(server_log_file, "w", encoding="utf-8")
+            server = subprocess.Popen(
+                ["compute-objf-and-derivs", args.count_dir],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=server_log,
+                universal_newlines=True)
+            server_log.close()
+        except Exception as e:
+            sys.exit("optimize_metaparameters.py: error starting "
+                     "compute-objf-and-derivs: " + str(e))
+
+    f = open(metaparameter_file, "r", encoding="utf-8")
+    values = [line.split()[1] for line in f]
+    f.close()
+    request = "objf-and-derivs " + " ".join(values)
+    response = ""
+    try:
+        server.stdin.write(request + "\n")
+        server.stdin.flush()
+        response = server.stdout.readline()
+        a = response.split()
+        assert len(a) == 2 + len(values)
+        num_dev_set_words = int(a[0])
+        objf = float(a[1]) / num_dev_set_words
+        derivs = [float(x) / num_dev_set_words for x in a[2:]]
+    except Exception:
+        sys.exit("optimize_metaparameters.py: failed to get objf and derivs "
+                 "from compute-objf-and-derivs (see {0}); response was: "
+                 "{1}".format(server_log_file, response))
+
+    f = open(objf_file, "w", encoding="utf-8")
+    print(str(objf), file=f)
+    f.close()
+    f = open(deriv_file, "w", encoding="utf-8")
+    for name, deriv in zip(metaparameter_names, derivs):
+        print(name, deriv, file=f)
+    f.close()
+    f = open(log_file, "w", encoding="utf-8")
+    print("# {0} (log in {1})".format(request, server_log_file), file=f)
+    print("optimize_metaparameters.py: objf is {0} over {1} words".format(
+        objf, num_dev_set_words),
+          file=f)
+    f.close()
+
+
 # this will return a 2-tuple (objf, deriv).  note, the objective function and
 # derivative are both negated because conventionally optimization problems are
 # framed as minimization problems.
@@ -387,6 +462,9 @@ def GetObjfAndDeriv(x):
             "info from {0} and {1} (presumably you are rerunning after a partially "
             "finished run)".format(deriv_file, objf_file),
             file=sys.stderr)
+    elif args.use_server == "true" and args.num_splits == 1:
+        GetObjfAndDerivsFromServer(metaparameter_file, objf_file, deriv_file,
+                                   log_file)
     else:
         # we need to call get_objf_and_derivs.py
         command = (
@@ -462,6 +540,13 @@ if args.read_inv_hessian is not None:
                           progress_tolerance=args.progress_tolerance,
                           verbose=True)
 
+if server is not None:
+    server.stdin.close()
+    if server.wait() != 0:
+        sys.exit("optimize_metaparameters.py: compute-objf-and-derivs "
+                 "failed, see {0}/work/compute_objf_and_derivs.log".format(
+                     args.optimize_dir))
+
 y = UnconstrainedToConstrained(x)
 print("optimize_metaparameters: final metaparameters are ", y, file=sys.stderr)
 if y[-4] < 0.1:
@@ -47,12 +47,34 @@ parser.add_argument(
     default="true",
     help="Setting --parallel false will disable the (default) "
     "parallel processing of multiple data sources by this script.")
+parser.add_argument(
+    "--int-format",
+    type=str,
+    choices=["text", "packed"],
+    default="text",
+    help="Format of the integerized data: 'text' writes gzipped text "
+    "(<int-dir>/1.txt.gz, ...); 'packed' writes 32-bit word-ids in the "
+    "format read directly by get-text-counts --packed-input (<int-dir>/1.int "
+    "and its index <int-dir>/1.int.index, ...).  Packed data takes more disk "
+    "space but is much faster to read, which helps if you compute counts "
+    "from the same int-dir several times.")
+parser.add_argument(
+    "--num-jobs-per-source",
+    type=int,
+    default=1,
+    help="Number of processes that text_to_int.py uses to integerize "
+    "each data source (see text_to_int.py --num-jobs).  Setting this larger "
+    "than 1 helps if there are a few large data sources.")
 parser.add_argument("text_dir", help="Directory of original data")
 parser.add_argument("vocab", help="Vocabulary")
 parser.add_argument("int_dir", help="Directory of formed data")
 
 args = parser.parse_args()
 
+if args.num_jobs_per_source < 1:
+    ExitProgram("prepare_int_data.py: invalid option --num-jobs-per-source={0}"
+                .format(args.num_jobs_per_source))
+
 
 def GetNumTrainSets(int_dir):
     with open(int_dir, encoding="utf-8") as f:
@@ -102,19 +124,40 @@ def CopyFile(src, dest):
 
 
 def GetData(int, name):
+    if args.int_format == "packed":
+        output_command = "pack-int-text {int_dir}/{int}.int".format(
+            int_dir=args.int_dir, int=int)
+        stale_files = ["{0}/{1}.txt.gz".format(args.int_dir, int)]
+    else:
+        output_command = "gzip -c > {int_dir}/{int}.txt.gz".format(
+            int_dir=args.int_dir, int=int)
+        stale_files = [
+            "{0}/{1}.int".format(args.int_dir, int),
+            "{0}/{1}.int.index".format(args.int_dir, int)
+        ]
+    # remove any data in the other format from a previous run, since the
+    # packed data takes precedence if both exist.
+    for f in stale_files:
+        if os.path.exists(f):
+            os.remove(f)
     if os.path.exists(args.text_dir + "/" + name + ".txt.gz"):
         command = "set -o pipefail; gunzip -c {text_dir}/{name}.txt.gz | "\
-                "text_to_int.py {vocab} | gzip -c > {int_dir}/{int}.txt.gz "\
+                "text_to_int.py --num-jobs={num_jobs} {vocab} | {output_command} "\
                 "2>{int_dir}/log/{int}.log".format(text_dir=args.text_dir, name=name,
-                                                   vocab=args.vocab, int_dir=args.int_dir, int=int)
+                                                   num_jobs=args.num_jobs_per_source,
+                                                   vocab=args.vocab, output_command=output_command,
+                                                   int_dir=args.int_dir, int=int)
         log_file = "{int_dir}/log/{int}.log".format(int_dir=args.int_dir,
                                                     int=int)
         output = GetCommandStdout(command, log_file)
     else:
-        command = "set -o pipefail; cat {text_dir}/{name}.txt | text_to_int.py {vocab} "\
-                "| gzip -c > {int_dir}/{int}.txt.gz 2>{int_dir}/log/{int}.log".format(
+        # we give text_to_int.py the filename rather than piping the text in,
+        # so that its jobs can each read their own part of the file.
+        command = "set -o pipefail; text_to_int.py --num-jobs={num_jobs} {vocab} "\
+                "{text_dir}/{name}.txt | {output_command} 2>{int_dir}/log/{int}.log".format(
                         text_dir=args.text_dir, name=name, vocab=args.vocab,
-                        int_dir=args.int_dir, int=int)
+                        num_jobs=args.num_jobs_per_source,
+                        output_command=output_command, int_dir=args.int_dir, int=int)
         log_file = "{int_dir}/log/{int}.log".format(int_dir=args.int_dir,
                                                     int=int)
         output = GetCommandStdout(command, log_file)
@@ -4,6 +4,7 @@
 from __future__ import print_function
 import os
 import argparse
+import re
 import sys
 import subprocess
 import shutil
@@ -22,13 +23,16 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
 # make sure scripts/internal is on the pythonpath.
 sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
             ] + sys.path
-from prune_size_model import PruneSizeModel
+from prune_size_model import PruneSizeModel, CostHistogram
 
 # for ExitProgram and RunCommand
 from pocolm_common import ExitProgram
 from pocolm_common import RunCommand
 from pocolm_common import GetCommandStdout
 from pocolm_common import LogMessage
+from pocolm_common import GetFloatCountsFiles
+from pocolm_common import EnsureFloatCountsIndex
+from task_graph import TaskGraph
 
 parser = argparse.ArgumentParser(
     description="This script takes an lm-dir, as produced by make_lm_dir.py, "
@@ -81,6 +85,16 @@ parser.add_argument(
     default=0.25,
     help="Initial threshold for the pruning steps starting from. "
     "This is only relevant if --target-num-ngrams is specified.")
+parser.add_argument(
+    "--use-cost-histogram",
+    type=str,
+    choices=['true', 'false'],
+    default='true',
+    help="If true, each prune step also writes a histogram of the costs of "
+    "the n-grams (the threshold above which each would be pruned), from "
+    "which we can predict the num-ngrams we'd get with other thresholds; "
+    "this makes the search for the threshold converge in fewer iterations. "
+    "This is only relevant if --target-num-ngrams is specified.")
 parser.add_argument(
     "--max-iter",
     type=int,
@@ -98,7 +112,31 @@ parser.add_argument("--cleanup",
                     choices=['true', 'false'],
                     default='true',
                     help='Set this to false to disable clean up of the '
-                    'work directory.')
+                    'work directory.  If true, the step directories that are no '
+                    'longer needed are also removed as we go, so that only the '
+                    'last two (and those we may backtrack to, with '
+                    '--target-num-ngrams) are kept.')
+parser.add_argument(
+    "--resume",
+    type=str,
+    choices=['true', 'false'],
+    default='true',
+    help="If true, and the work directory contains the checkpoint of an "
+    "earlier run of this script with the same input and options that did not "
+    "finish, continue from the last step that it completed.")
+parser.add_argument("--compact-float-counts",
+                    type=str,
+                    choices=['true', 'false'],
+                    default='false',
+                    help='If true, write the float-counts of the output '
+                    'LM-dir in the compact format written by '
+                    'float-counts-compress (see src/lm-state.h), in which '
+                    'counts are 16-bit indexes into a codebook and words are '
+                    'delta-encoded.  It is read transparently by all programs '
+                    'that read float-counts.  It is lossless if there are no '
+                    'more than 65536 distinct counts; otherwise counts are '
+                    'quantized on a log scale (the relative change is '
+                    'typically well under 0.1%).')
 parser.add_argument("--remove-zeros",
                     type=str,
                     choices=['true', 'false'],
@@ -114,6 +152,23 @@ parser.add_argument("--max-memory",
                     type=str,
                     default='',
                     help="Memory limitation for sort.")
+parser.add_argument(
+    "--parallel-splits",
+    type=str,
+    choices=['true', 'false'],
+    default='true',
+    help="Only relevant if the input LM-dir is split (see make_lm_dir.py "
+    "--keep-splits).  If true, the pruning and E-M steps are run on each split "
+    "separately, in parallel, and the output LM-dir is split in the same way. "
+    "The pruning differs very slightly from pruning the merged model, because "
+    "while pruning a split we don't see the changes made to the unigram state "
+    "by the other splits.  If false, the splits are merged before pruning.")
+parser.add_argument(
+    "--num-jobs",
+    type=int,
+    default=0,
+    help="Maximum number of splits to process at once, with "
+    "--parallel-splits=true (0 means all of them).")
 parser.add_argument("lm_dir_in",
                     help="Source directory, for the input language model.")
 parser.add_argument(
@@ -169,6 +224,14 @@ if os.path.exists(args.lm_dir_in + "/num_splits"):
     num_splits = int(f.readline())
     f.close()
 
+# if we're processing the splits of the input separately (see the
+# --parallel-splits option), num_parts is the number of splits; else it's None.
+num_parts = None
+if num_splits is not None and args.parallel_splits == 'true':
+    num_parts = num_splits
+if args.num_jobs < 0:
+    ExitProgram("invalid option --num-jobs={0}".format(args.num_jobs))
+
 work_dir = args.lm_dir_out + "/work"
 
 if args.target_num_ngrams > 0:
@@ -247,14 +310,32 @@ def GetNumGrams(lm_dir_in):
     return (num_unigrams, tot_num_xgrams)
 
 
+# Returns the space-separated list of the files called 'name' in the work
+# directory 'work', e.g. 'work/float.all', or if we're processing the splits
+# separately, 'work/float.all.1 work/float.all.2 ...'.
+def PartFiles(work, name):
+    if num_parts is None:
+        return "{0}/{1}".format(work, name)
+    return ' '.join(
+        ["{0}/{1}.{2}".format(work, name, n) for n in range(1, num_parts + 1)])
+
+
+# Returns the start of a pipeline that writes work/float.all to its stdout (if
+# we're processing the splits separately, they are merged).
+def MergedFloatCountsPipe(work):
+    if num_parts is None:
+        return "cat {0}/float.all".format(work)
+    return "merge-float-counts " + PartFiles(work, "float.all")
+
+
 # This script creates work/protected.all (listing protected
 # counts which may not be removed); it requires work/float.all
-# to exist.
+# to exist.  (protected.all is not split, even if float.all is).
 def CreateProtectedCounts(work):
     command = (
-        "bash -c 'float-counts-to-histories <{0}/float.all | LC_ALL=C sort {1}|"
-        " histories-to-null-counts >{0}/protected.all'".format(
-            work, sort_mem_opt))
+        "bash -c '{0} | float-counts-to-histories | LC_ALL=C sort {1}|"
+        " histories-to-null-counts >{2}/protected.all'".format(
+            MergedFloatCountsPipe(work), sort_mem_opt, work))
     log_file = work + "/log/create_protected_counts.log"
     RunCommand(command, log_file, args.verbose == 'true')
 
@@ -269,6 +350,20 @@ def SoftLink(src, dest):
                                                       dest))
 
 
+# Makes 'dest' a hard link to the file 'src' (following soft links), so that it
+# stays valid if the step directory of 'src' is removed (see
+# RemoveOldStepDirs()); if that fails, e.g. because 'src' is on a different
+# filesystem, we make a soft link instead.
+def HardLink(src, dest):
+    src = os.path.realpath(src)
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        SoftLink(src, dest)
+
+
 def CreateInitialWorkDir():
     # Creates float.all, stats.all, and protected.all in work_dir/step
     work0dir = work_dir + "/step0"
@@ -278,6 +373,10 @@ def CreateInitialWorkDir():
     SoftLink(args.lm_dir_in + "/num_ngrams", work0dir + "/num_ngrams")
     if num_splits is None:
         SoftLink(args.lm_dir_in + "/float.all", work0dir + "/float.all")
+    elif num_parts is not None:
+        for n in range(1, num_parts + 1):
+            SoftLink(args.lm_dir_in + "/float.all." + str(n),
+                     work0dir + "/float.all." + str(n))
     else:
         splits_star = ' '.join([
             args.lm_dir_in + "/float.all." + str(n)
@@ -298,12 +397,19 @@ def CreateInitialWorkDir():
     # create stats.{1,2,3..}
     # e.g. command = 'float-counts-to-float-stats 20000 foo/work/step0/stats.1 '
     #                'foo/work/step0/stats.2 <foo/work/step0/float.all'
-    command = ("float-counts-to-float-stats {0} ".format(num_words) +
-               stats_star + " <{0}/float.all".format(work0dir))
+    # (the stats of the unigram state depend on all the other LM-states, so
+    # if the model is split, this is done on the merged model).
+    command = (MergedFloatCountsPipe(work0dir) +
+               " | float-counts-to-float-stats {0} ".format(num_words) +
+               stats_star)
     log_file = work0dir + "/log/float_counts_to_float_stats.log"
     RunCommand(command, log_file, args.verbose == 'true')
-    command = "merge-float-counts {0} > {1}/stats.all".format(
-        stats_star, work0dir)
+    if num_parts is None:
+        command = "merge-float-counts {0} > {1}/stats.all".format(
+            stats_star, work0dir)
+    else:
+        command = "merge-float-counts {0} | split-float-counts {1}".format(
+            stats_star, PartFiles(work0dir, "stats.all"))
     log_file = work0dir + "/log/merge_float_counts.log"
     RunCommand(command, log_file, args.verbose == 'true')
     for f in stats_star.split():
@@ -314,35 +420,52 @@ def CreateInitialWorkDir():
 def GetInitialLogprob():
     work0dir = work_dir + "/step0"
     float_star = ' '.join(['/dev/null' for n in range(1, ngram_order + 1)])
-    command = ('float-counts-estimate {num_words} {work0dir}/float.all '
-               '{work0dir}/stats.all {float_star} '.format(
-                   num_words=num_words,
-                   work0dir=work0dir,
-                   float_star=float_star))
-    try:
-        print(command, file=sys.stderr)
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE,
-                             shell=True,
-                             universal_newlines=True)
-        # the stdout of this program will be something like:
-        # 1.63388e+06 -7.39182e+06 10.5411 41.237 49.6758
-        # representing: total-count, total-like, and for each order, the like-change
-        # for that order.
-        line = p.stdout.readline()
-        print(line, file=sys.stderr)
-        a = line.split()
-        tot_count = float(a[0])
-        tot_like = float(a[1])
-        like_change = 0.0
-        logprob_per_word = tot_like / tot_count
-        for i in range(2, len(a)):  # for each n-gram order
-            like_change += float(a[i])
-        like_change_per_word = like_change / tot_count
-        assert like_change_per_word < 0.0001  # should be exactly zero.
-    except Exception as e:
-        ExitProgram("error running command '{0}', error is '{1}'".format(
-            command, repr(e)))
+    if num_parts is None:
+        commands = [
+            'float-counts-estimate {num_words} {work0dir}/float.all '
+            '{work0dir}/stats.all {float_star} '.format(
+                num_words=num_words, work0dir=work0dir, float_star=float_star)
+        ]
+    else:
+        # the totals printed for the parts add up to the totals for the
+        # whole model.
+        commands = [
+            'float-counts-estimate --part={n}/{num_parts} {num_words} '
+            '{work0dir}/float.all.{n} {work0dir}/stats.all.{n} '
+            '{float_star} '.format(n=n,
+                                   num_parts=num_parts,
+                                   num_words=num_words,
+                                   work0dir=work0dir,
+                                   float_star=float_star)
+            for n in range(1, num_parts + 1)
+        ]
+    tot_count = 0.0
+    tot_like = 0.0
+    like_change = 0.0
+    for command in commands:
+        try:
+            print(command, file=sys.stderr)
+            p = subprocess.Popen(command,
+                                 stdout=subprocess.PIPE,
+                                 shell=True,
+                                 universal_newlines=True)
+            # the stdout of this program will be something like:
+            # 1.63388e+06 -7.39182e+06 10.5411 41.237 49.6758
+            # representing: total-count, total-like, and for each order, the like-change
+            # for that order.
+            line = p.stdout.readline()
+            print(line, file=sys.stderr)
+            a = line.split()
+            tot_count += float(a[0])
+            tot_like += float(a[1])
+            for i in range(2, len(a)):  # for each n-gram order
+                like_change += float(a[i])
+        except Exception as e:
+            ExitProgram("error running command '{0}', error is '{1}'".format(
+                command, repr(e)))
+    logprob_per_word = tot_like / tot_count
+    like_change_per_word = like_change / tot_count
+    assert like_change_per_word < 0.0001  # should be exactly zero.
     global initial_logprob_per_word
     initial_logprob_per_word = logprob_per_word
 
@@ -358,29 +481,185 @@ def WriteNumNgrams(out_dir, num_ngrams):
         ExitProgram("error writing num-ngrams to: " + out_file)
 
 
+# Returns the option that makes float-counts-prune write the histogram of the
+# costs of the n-grams to 'filename', or '' if we don't need it.
+def CostHistogramOption(filename):
+    if args.target_num_ngrams > 0 and args.use_cost_histogram == 'true':
+        return '--cost-histogram-out={0} '.format(filename)
+    return ''
+
+
+# Sets current_cost_histogram to the sum of the cost histograms in the
+# space-separated list 'filenames' (as written by float-counts-prune
+# --cost-histogram-out), which are then removed, as a CostHistogram for a
+# prune step whose input had 'num_xgrams' x-grams; or to None if we didn't
+# ask for the cost histogram.
+def ReadCostHistograms(filenames, num_xgrams):
+    global current_cost_histogram
+    current_cost_histogram = None
+    if CostHistogramOption(filenames) == '':
+        return
+    counts = {}
+    for filename in filenames.split():
+        try:
+            f = open(filename, encoding="utf-8")
+            for line in f:
+                [lower, upper, count] = line.split()
+                key = (float(lower), float(upper))
+                counts[key] = counts.get(key, 0) + int(count)
+            f.close()
+            os.remove(filename)
+        except Exception as e:
+            ExitProgram("error reading cost histogram from {0}: {1}".format(
+                filename, repr(e)))
+    bins = [(lower, upper, counts[(lower, upper)])
+            for (lower, upper) in sorted(counts.keys())]
+    current_cost_histogram = CostHistogram(num_xgrams, bins)
+
+
+# Runs 'command' for each part n = 1 .. num_parts (the command is obtained by
+# calling command_fn(n), and its log goes to log_prefix.n.log), in parallel,
+# and returns the list of their outputs.
+def RunPartCommands(command_fn, log_prefix):
+    outputs = [None] * num_parts
+
+    def RunPart(n):
+        outputs[n - 1] = GetCommandStdout(command_fn(n),
+                                          "{0}.{1}.log".format(log_prefix, n),
+                                          args.verbose == 'true')
+
+    graph = TaskGraph(num_jobs=args.num_jobs,
+                      verbose=(args.verbose == 'true'))
+    for n in range(1, num_parts + 1):
+        graph.Add("part{0}".format(n), RunPart, [n])
+    graph.Run()
+    return outputs
+
+
+# This is the version of RunPruneStep() used when we process the splits of the
+# model separately: each part is pruned by a separate float-counts-prune
+# process, and then the changes they made to the unigram state are combined.
+def RunSplitPruneStep(work_in, work_out, threshold):
+    def PruneCommand(n):
+        options = '--part={0}/{1} --ngram-order={2} '.format(
+            n, num_parts, ngram_order)
+        options += '--histories-out={0}/histories.{1} '.format(work_out, n)
+        options += CostHistogramOption("{0}/cost_histogram.{1}".format(
+            work_out, n))
+        if args.remove_zeros == 'true':
+            options += ('--float-stats-in={0}/stats.all.{2} '
+                        '--float-stats-out={1}/stats.all.{2} '.format(
+                            work_in, work_out, n))
+        return ("float-counts-prune {options}{threshold} {num_words} "
+                "{work_in}/float.all.{n} {work_in}/protected.all "
+                "{work_out}/float.all.{n}".format(options=options,
+                                                  threshold=threshold,
+                                                  num_words=num_words,
+                                                  work_in=work_in,
+                                                  work_out=work_out,
+                                                  n=n))
+
+    outputs = RunPartCommands(PruneCommand, work_out + "/log/float_counts_prune")
+    # the outputs of the parts are summed; e.g. only part 1 reports the
+    # word-count and the number of unigrams.
+    word_count = 0.0
+    like_change = 0.0
+    tot_xgrams = 0
+    pruned = 0
+    num_ngrams = [0] * ngram_order
+    try:
+        for output in outputs:
+            lines = output.split('\n')
+            a = lines[0].split()
+            word_count += float(a[0])
+            like_change += float(a[1])
+            a = lines[1].split()
+            tot_xgrams += int(a[0])
+            pruned += int(a[3])
+            for i, num in enumerate(lines[2].split()):
+                num_ngrams[i] += int(num)
+    except Exception as e:
+        ExitProgram("error parsing the output of float-counts-prune: "
+                    "'{0}', error is '{1}'".format(outputs, repr(e)))
+    like_change_per_word = like_change / word_count
+
+    names = ['float.all']
+    if args.remove_zeros == 'true':
+        names.append('stats.all')
+    else:
+        for n in range(1, num_parts + 1):
+            HardLink("{0}/stats.all.{1}".format(work_in, n),
+                     "{0}/stats.all.{1}".format(work_out, n))
+    for name in names:
+        command = "float-counts-sum-unigrams {0}/{1}.1 {2}".format(
+            work_in, name, PartFiles(work_out, name))
+        log_file = "{0}/log/sum_unigrams.{1}.log".format(work_out, name)
+        RunCommand(command, log_file, args.verbose == 'true')
+
+    # protected.all is shared by all the parts (each of them only reads the
+    # part of it that it needs).
+    histories = PartFiles(work_out, "histories")
+    command = ("bash -c 'LC_ALL=C sort {0}{1} | histories-to-null-counts "
+               ">{2}/protected.all'".format(sort_mem_opt, histories, work_out))
+    log_file = work_out + "/log/create_protected_counts.log"
+    RunCommand(command, log_file, args.verbose == 'true')
+    for f in histories.split():
+        os.remove(f)
+
+    global current_num_xgrams
+    current_num_xgrams = tot_xgrams - pruned
+    ReadCostHistograms(PartFiles(work_out, "cost_histogram"), tot_xgrams)
+    WriteNumNgrams(work_out, num_ngrams)
+    return like_change_per_word
+
+
 def RunPruneStep(work_in, work_out, threshold):
-    # set float_star = 'work_out/float.1 work_out/float.2 ...'
-    float_star = " ".join([
-        '{0}/float.{1}'.format(work_out, n) for n in range(1, ngram_order + 1)
-    ])
-    # create work_out/float.{1,2,..}
+    if num_parts is not None:
+        return RunSplitPruneStep(work_in, work_out, threshold)
+    # float-counts-prune writes work_out/float.all directly (and unless
+    # --remove-zeros=false, it also removes the zero counts and writes the
+    # stats, restructured to match, to work_out/stats.all), so the model is
+    # read and written only once.  It writes the histories of the pruned
+    # LM-states to a pipe, from which work_out/protected.all is created as in
+    # CreateProtectedCounts().
+    (histories_read, histories_write) = os.pipe()
+    options = '--ngram-order={0} --histories-out=/dev/fd/{1} '.format(
+        ngram_order, histories_write)
+    options += CostHistogramOption(work_out + '/cost_histogram')
+    if args.remove_zeros == 'true':
+        options += ('--float-stats-in={0}/stats.all '
+                    '--float-stats-out={1}/stats.all '.format(
+                        work_in, work_out))
     log_file = work_out + '/log/float_counts_prune.log'
     command = (
-        "float-counts-prune {threshold} {num_words} {work_in}/float.all "
-        "{work_in}/protected.all {float_star} 2>>{log_file}".format(
-            threshold=threshold,
-            num_words=num_words,
-            work_in=work_in,
-            float_star=float_star,
-            log_file=log_file))
+        "float-counts-prune {options}{threshold} {num_words} "
+        "{work_in}/float.all {work_in}/protected.all {work_out}/float.all "
+        "2>>{log_file}".format(options=options,
+                               threshold=threshold,
+                               num_words=num_words,
+                               work_in=work_in,
+                               work_out=work_out,
+                               log_file=log_file))
     with open(log_file, 'w', encoding="utf-8") as f:
         print("# " + command, file=f)
+    protected_log_file = work_out + "/log/create_protected_counts.log"
+    protected_command = (
+        "LC_ALL=C sort {0}| histories-to-null-counts >{1}/protected.all "
+        "2>>{2}".format(sort_mem_opt, work_out, protected_log_file))
+    with open(protected_log_file, 'w', encoding="utf-8") as f:
+        print("# " + protected_command, file=f)
     try:
         print(command, file=sys.stderr)
+        p_protected = subprocess.Popen(protected_command,
+                                       stdin=histories_read,
+                                       shell=True)
         p = subprocess.Popen(command,
                              stdout=subprocess.PIPE,
                              shell=True,
-                             universal_newlines=True)
+                             universal_newlines=True,
+                             pass_fds=(histories_write, ))
+        os.close(histories_read)
+        os.close(histories_write)
         [word_count, like_change] = p.stdout.readline().split()
         like_change_per_word = float(like_change) / float(word_count)
         [tot_xgrams, shadowed, protected, pruned] = p.stdout.readline().split()
@@ -389,68 +668,83 @@ def RunPruneStep(work_in, work_out, threshold):
         assert p.stdout.readline() == ''
         ret = p.wait()
         assert ret == 0
+        ret = p_protected.wait()
+        assert ret == 0
         global current_num_xgrams
 
         current_num_xgrams = int(tot_xgrams) - int(pruned)
     except Exception as e:
         ExitProgram("error running command '{0}', error is '{1}'".format(
             command, repr(e)))
+    ReadCostHistograms(work_out + '/cost_histogram', int(tot_xgrams))
 
     WriteNumNgrams(work_out, num_ngrams)
 
     if args.remove_zeros == 'false':
-        # create work_out/float.all.
-        command = 'merge-float-counts {0} >{1}/float.all'.format(
-            float_star, work_out)
-        log_file = work_out + '/log/merge_float_counts.log'
-        RunCommand(command, log_file, args.verbose == 'true')
-        for f in float_star.split():
-            os.remove(f)
-        # soft-link work_out/stats.all to work_in/stats.all
-        SoftLink(work_in + "/stats.all", work_out + "/stats.all")
-    else:
-        # in this case we pipe the output of merge-float-counts into
-        # float-counts-stats-remove-zeros.
-        # set stats_star = 'work_out/stats.1 work_out/stats.2 ..'
-        stats_star = " ".join([
-            '{0}/stats.{1}'.format(work_out, n)
-            for n in range(1, ngram_order + 1)
-        ])
+        # link work_out/stats.all to work_in/stats.all
+        HardLink(work_in + "/stats.all", work_out + "/stats.all")
+    return like_change_per_word
 
-        command = (
-            'merge-float-counts {float_star} | float-counts-stats-remove-zeros '
-            '{num_words} /dev/stdin {work_in}/stats.all {work_out}/float.all '
-            '{stats_star}'.format(num_words=num_words,
-                                  float_star=float_star,
-                                  work_in=work_in,
-                                  work_out=work_out,
-                                  stats_star=stats_star))
-        log_file = work_out + '/log/remove_zeros.log'
-        RunCommand(command, log_file, args.verbose == 'true')
-        # create work_out/stats.all
-        command = 'merge-float-counts {0} >{1}/stats.all'.format(
-            stats_star, work_out)
-        log_file = work_out + '/log/merge_float_counts.log'
-        RunCommand(command, log_file, args.verbose == 'true')
-        for f in float_star.split() + stats_star.split():
-            os.remove(f)
 
-    # create work_out/protected.all
-    CreateProtectedCounts(work_out)
+# This is the version of RunEmStep() used when we process the splits of the
+# model separately: each part is estimated by a separate float-counts-estimate
+# process, which writes the E-M stats of the unigram state, and then
+# float-counts-sum-unigrams re-estimates the unigram state from their sum.
+def RunSplitEmStep(work_in, work_out):
+    def EstimateCommand(n):
+        return ('float-counts-estimate --ngram-order={ngram_order} '
+                '--part={n}/{num_parts} {num_words} {work_in}/float.all.{n} '
+                '{work_in}/stats.all.{n} {work_out}/float.all.{n}'.format(
+                    ngram_order=ngram_order,
+                    n=n,
+                    num_parts=num_parts,
+                    num_words=num_words,
+                    work_in=work_in,
+                    work_out=work_out))
+
+    outputs = RunPartCommands(EstimateCommand,
+                              work_out + "/log/float_counts_estimate")
+    command = "float-counts-sum-unigrams --em {0}/float.all.1 {1}".format(
+        work_in, PartFiles(work_out, "float.all"))
+    log_file = work_out + "/log/sum_unigrams.log"
+    outputs.append(GetCommandStdout(command, log_file, args.verbose == 'true'))
+    # the last output is the like-change for the unigram state; the others
+    # are as described in RunEmStep().
+    tot_count = 0.0
+    tot_like = 0.0
+    like_change = 0.0
+    try:
+        for output in outputs[:-1]:
+            a = output.split()
+            tot_count += float(a[0])
+            tot_like += float(a[1])
+            for i in range(2, len(a)):  # for each n-gram order
+                like_change += float(a[i])
+        like_change += float(outputs[-1])
+    except Exception as e:
+        ExitProgram("error parsing the output of float-counts-estimate: "
+                    "'{0}', error is '{1}'".format(outputs, repr(e)))
+    global final_logprob_per_word
+    final_logprob_per_word = tot_like / tot_count
+    like_change_per_word = like_change / tot_count
+
+    for n in range(1, num_parts + 1):
+        HardLink("{0}/stats.all.{1}".format(work_in, n),
+                 "{0}/stats.all.{1}".format(work_out, n))
+    HardLink(work_in + "/protected.all", work_out + "/protected.all")
+    HardLink(work_in + "/num_ngrams", work_out + "/num_ngrams")
     return like_change_per_word
 
 
 def RunEmStep(work_in, work_out):
-    # set float_star = 'work_out/float.1 work_out/float.2 ...'
-    float_star = " ".join([
-        '{0}/float.{1}'.format(work_out, n) for n in range(1, ngram_order + 1)
-    ])
-
-    command = (
-        'float-counts-estimate {num_words} {work_in}/float.all {work_in}/stats.all '
-        '{float_star}'.format(num_words=num_words,
-                              work_in=work_in,
-                              float_star=float_star))
+    if num_parts is not None:
+        return RunSplitEmStep(work_in, work_out)
+    command = ('float-counts-estimate --ngram-order={ngram_order} '
+               '{num_words} {work_in}/float.all {work_in}/stats.all '
+               '{work_out}/float.all'.format(ngram_order=ngram_order,
+                                             num_words=num_words,
+                                             work_in=work_in,
+                                             work_out=work_out))
     log_file = work_out + "/log/float_counts_estimate.log"
     try:
         output = GetCommandStdout(command, log_file, args.verbose == 'true')
@@ -471,32 +765,205 @@ def RunEmStep(work_in, work_out):
         ExitProgram("error running command '{0}', error is '{1}'".format(
             command, repr(e)))
 
-    command = 'merge-float-counts {0} >{1}/float.all'.format(
-        float_star, work_out)
-    log_file = work_out + '/log/merge_float_counts.log'
-    RunCommand(command, log_file, args.verbose == 'true')
-    for f in float_star.split():
-        os.remove(f)
-    # soft-link work_out/stats.all to work_in/stats.all
-    SoftLink(work_in + "/stats.all", work_out + "/stats.all")
-    # soft-link work_out/protected.all to work_in/protected.all
-    SoftLink(work_in + "/protected.all", work_out + "/protected.all")
-    SoftLink(work_in + "/num_ngrams", work_out + "/num_ngrams")
+    # link work_out/stats.all to work_in/stats.all
+    HardLink(work_in + "/stats.all", work_out + "/stats.all")
+    # link work_out/protected.all to work_in/protected.all
+    HardLink(work_in + "/protected.all", work_out + "/protected.all")
+    HardLink(work_in + "/num_ngrams", work_out + "/num_ngrams")
     return like_change_per_word
 
 
+# The checkpoint, work_dir/checkpoint, records the steps completed so far, so
+# that if this script is killed, rerunning it continues from the last
+# completed step.  It is a text file: the lines of GetCheckpointKey(), which
+# identify the input and options, and then a line for each step completed so
+# far (in order, and including steps whose output was later abandoned), as
+# written by StepRecordToLine(), which records the step's key
+# (step_number, in_step, threshold, step_text) and its results
+# (logprob_change, current_num_xgrams, current_cost_histogram,
+# final_logprob_per_word).  Since everything else this script does only
+# depends on the results of the steps, we resume by doing the same calls to
+# RunStep() as before, which just return the recorded results (see
+# ReplayStep()) until we get to the steps that were not completed.
+def GetCheckpointKey():
+    key = ["lm-dir-in " + os.path.abspath(args.lm_dir_in)]
+    # the size and modification time of the input model, so we don't resume
+    # if it has been rewritten (e.g. by rerunning make_lm_dir.py).
+    for filename in (GetFloatCountsFiles(args.lm_dir_in) +
+                     [args.lm_dir_in + "/metaparameters"]):
+        try:
+            s = os.stat(filename)
+        except OSError:
+            ExitProgram("failed to stat " + filename)
+        key.append("input {0} {1} {2}".format(os.path.basename(filename),
+                                              s.st_size, s.st_mtime_ns))
+    for (name, value) in [
+        ('num-words', num_words), ('ngram-order', ngram_order),
+        ('num-unigrams', num_unigrams),
+        ('initial-num-xgrams', initial_num_xgrams), ('num-parts', num_parts),
+        ('steps', args.steps), ('final-threshold', args.final_threshold),
+        ('target-num-ngrams', args.target_num_ngrams),
+        ('target-lower-threshold', args.target_lower_threshold),
+        ('target-upper-threshold', args.target_upper_threshold),
+        ('initial-threshold', args.initial_threshold),
+        ('use-cost-histogram', args.use_cost_histogram),
+        ('max-iter', args.max_iter), ('remove-zeros', args.remove_zeros)
+    ]:
+        key.append("option {0} {1}".format(name, value))
+    return key
+
+
+# Returns the line of the checkpoint for a completed step (see
+# GetCheckpointKey()): "step", the step key, the results and then the cost
+# histogram as its num-xgrams followed by (lower, upper, count) for each bin,
+# with "none" for the values that are None.  Floats are written with repr(),
+# so they are read back exactly.
+def StepRecordToLine(record):
+    ((step_number, in_step, threshold, step_text),
+     (logprob_change, num_xgrams, cost_histogram,
+      logprob_per_word)) = record
+    fields = [
+        'step', step_number, in_step, repr(float(threshold)), step_text,
+        repr(logprob_change), 'none' if num_xgrams is None else num_xgrams,
+        'none' if logprob_per_word is None else repr(logprob_per_word)
+    ]
+    if cost_histogram is None:
+        fields.append('none')
+    else:
+        fields.append(cost_histogram.num_xgrams)
+        for (lower, upper, count) in cost_histogram.bins:
+            fields += [repr(lower), repr(upper), count]
+    return ' '.join([str(x) for x in fields])
+
+
+# The inverse of StepRecordToLine(); raises an exception if 'line' is not
+# valid.
+def LineToStepRecord(line):
+    a = line.split()
+    assert a[0] == 'step' and len(a) >= 9
+    step_key = (int(a[1]), int(a[2]), float(a[3]), a[4])
+    if a[8] == 'none':
+        assert len(a) == 9
+        cost_histogram = None
+    else:
+        b = a[9:]
+        assert len(b) % 3 == 0
+        bins = [(float(b[i]), float(b[i + 1]), int(b[i + 2]))
+                for i in range(0, len(b), 3)]
+        cost_histogram = CostHistogram(int(a[8]), bins)
+    step_results = (float(a[5]), None if a[6] == 'none' else int(a[6]),
+                    cost_histogram, None if a[7] == 'none' else float(a[7]))
+    return (step_key, step_results)
+
+
+def WriteCheckpoint():
+    checkpoint = work_dir + "/checkpoint"
+    try:
+        f = open(checkpoint + ".tmp", "w", encoding="utf-8")
+        for line in GetCheckpointKey():
+            print(line, file=f)
+        for record in checkpoint_records:
+            print(StepRecordToLine(record), file=f)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(checkpoint + ".tmp", checkpoint)
+    except Exception as e:
+        ExitProgram("error writing checkpoint {0}: {1}".format(
+            checkpoint, repr(e)))
+
+
+# Returns the records from work_dir/checkpoint (see GetCheckpointKey()), or
+# None if there is no checkpoint that we can resume from.
+def ReadCheckpoint():
+    checkpoint = work_dir + "/checkpoint"
+    if args.resume == 'false' or not os.path.exists(checkpoint):
+        return None
+    key = []
+    records = []
+    try:
+        with open(checkpoint, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("step "):
+                    records.append(LineToStepRecord(line))
+                else:
+                    assert len(records) == 0
+                    key.append(line.rstrip("\n"))
+    except Exception as e:
+        LogMessage("ignoring checkpoint {0} that could not be read: {1}".format(
+            checkpoint, repr(e)))
+        return None
+    if key != GetCheckpointKey():
+        LogMessage("ignoring checkpoint {0} from a run with different input "
+                   "or options".format(checkpoint))
+        return None
+    LogMessage("resuming from checkpoint {0}, after {1} completed "
+               "step(s)".format(checkpoint, len(records)))
+    return records
+
+
+# This is called by RunStep() for the steps that were completed before we
+# resumed; it sets the global variables the step would have set, and returns
+# its logprob change.
+def ReplayStep(step_key):
+    global current_num_xgrams, current_cost_histogram, final_logprob_per_word
+    (recorded_step_key, step_results) = replay_records.pop(0)
+    if recorded_step_key != step_key:
+        ExitProgram("step {0} does not match the checkpoint in {1} ({2} vs. "
+                    "{3}); remove the checkpoint and rerun.".format(
+                        step_key[0], work_dir, step_key, recorded_step_key))
+    checkpoint_records.append((step_key, step_results))
+    (logprob_change, current_num_xgrams, current_cost_histogram,
+     final_logprob_per_word) = step_results
+    return logprob_change
+
+
+# If --cleanup=true, removes the step directories other than step0, the input
+# and output of the step just run, and those in backtrack_steps.
+def RemoveOldStepDirs(in_step, out_step):
+    if args.cleanup == 'false':
+        return
+    keep = set([0, in_step, out_step]) | backtrack_steps
+    for name in os.listdir(work_dir):
+        m = re.match(r'step(\d+)$', name)
+        if m is not None and int(m.group(1)) not in keep:
+            shutil.rmtree(work_dir + "/" + name)
+
+
 # runs one of the numbered steps.  step_number >= 0 is the number of the work
 # directory we'll get the input from (the output will be that plus one).
 # returns the expected log-prob change (on data generated from the model
 # itself.. this will be negative for pruning steps and positive for E-M steps.
+# Unless the step was completed before we resumed, it's recorded in the
+# checkpoint.
 def RunStep(step_number, threshold, **kwargs):
     if 'in_step' in kwargs:
-        work_in = work_dir + "/step" + str(kwargs['in_step'])
+        in_step = kwargs['in_step']
     else:
-        work_in = work_dir + "/step" + str(step_number)
+        in_step = step_number
+    step_key = (step_number, in_step, threshold, steps[step_number])
+    if len(replay_records) > 0:
+        return ReplayStep(step_key)
+    logprob_change = DoStep(step_number, in_step, threshold)
+    checkpoint_records.append(
+        (step_key, (logprob_change, current_num_xgrams, current_cost_histogram,
+                    final_logprob_per_word)))
+    WriteCheckpoint()
+    RemoveOldStepDirs(in_step, step_number + 1)
+    return logprob_change
+
+
+# this does the work of RunStep(); the step reads its input from
+# work_dir/step<in_step>.
+def DoStep(step_number, in_step, threshold):
+    work_in = work_dir + "/step" + str(in_step)
     work_out = work_dir + "/step" + str(step_number + 1)
-    if not os.path.isdir(work_out + "/log"):
-        os.makedirs(work_out + "/log")
+    # work_out may be left over from an abandoned iteration or a step that
+    # was killed; its files may be hard links to files we still need, so we
+    # start from scratch rather than overwrite them.
+    if os.path.exists(work_out):
+        shutil.rmtree(work_out)
+    os.makedirs(work_out + "/log")
     step_text = steps[step_number]
     if step_text[0:6] == 'prune*':
         try:
@@ -515,12 +982,26 @@ def RunStep(step_number, threshold, **kwargs):
 
 
 def FinalizeOutput(final_work_out):
-    try:
-        shutil.move(final_work_out + "/float.all",
-                    args.lm_dir_out + "/float.all")
-    except:
-        ExitProgram("error moving {0}/float.all to {1}/float.all".format(
-            final_work_out, args.lm_dir_out))
+    if num_parts is None:
+        names = ['float.all']
+    else:
+        names = ['float.all.' + str(n) for n in range(1, num_parts + 1)]
+    for name in names:
+        if args.compact_float_counts == 'true':
+            command = "float-counts-compress {0}/{2} {1}/{2}".format(
+                final_work_out, args.lm_dir_out, name)
+            log_file = final_work_out + "/log/float_counts_compress.log"
+            RunCommand(command, log_file, args.verbose == 'true')
+        else:
+            try:
+                shutil.move(final_work_out + "/" + name,
+                            args.lm_dir_out + "/" + name)
+            except:
+                ExitProgram("error moving {0}/{2} to {1}/{2}".format(
+                    final_work_out, args.lm_dir_out, name))
+        # write the index now, so the programs that need it don't have to
+        # write to the LM-dir.
+        EnsureFloatCountsIndex(args.lm_dir_out + "/" + name)
     try:
         shutil.copy(final_work_out + "/num_ngrams",
                     args.lm_dir_out + "/num_ngrams")
@@ -536,14 +1017,30 @@ def FinalizeOutput(final_work_out):
         except:
             ExitProgram("error copying {0}/{1} to {2}/{1}".format(
                 args.lm_dir_in, f, args.lm_dir_out))
-    if os.path.exists(args.lm_dir_out + "/num_splits"):
+    if num_parts is not None:
+        f = open(args.lm_dir_out + "/num_splits", "w", encoding="utf-8")
+        print(num_parts, file=f)
+        f.close()
+    elif os.path.exists(args.lm_dir_out + "/num_splits"):
         os.remove(args.lm_dir_out + "/num_splits")
 
 
+# sets backtrack_steps to the set of steps whose output a prune step may read if
+# we backtrack (see FindThreshold()), so that RemoveOldStepDirs() keeps them.
+def SetBacktrackSteps(model, iter2step):
+    global backtrack_steps
+    backtrack_steps = set()
+    for h in model.history:
+        starting_iter = h[-1]
+        if starting_iter < len(iter2step) and iter2step[starting_iter] >= 0:
+            backtrack_steps.add(iter2step[starting_iter])
+
+
 # find threshold in order to match the target-num-ngrams with final LM
 # using PruneSizeModel
-# this will return a tuple of (threshold, num_iterations), if we overshot with
-# the initial_threshold, it will return (0.0, 0)
+# this will return a tuple (threshold, num_iterations); if we overshot with the
+# initial_threshold (which can only happen with --use-cost-histogram=false), it
+# will return (0.0, None).
 def FindThreshold(initial_threshold):
     global initial_num_xgrams, current_num_xgrams, num_unigrams, steps
     global logprob_changes, effective_logprob_changes
@@ -563,6 +1060,7 @@ def FindThreshold(initial_threshold):
     ]  # This maps a iter-index to the step-index of the last step of that iteration
     while True:
         steps += ['prune*1.0']
+        SetBacktrackSteps(model, iter2step)
         logprob_change = RunStep(step,
                                  cur_threshold,
                                  in_step=iter2step[backtrack_iter])
@@ -571,19 +1069,26 @@ def FindThreshold(initial_threshold):
         thresholds.append(cur_threshold)
         step += 1
 
-        (action, arguments) = model.GetNextAction(current_num_xgrams)
+        (action, arguments) = model.GetNextAction(current_num_xgrams,
+                                                  current_cost_histogram)
         if action == 'overshoot':
-            return (0.0, 0)
+            return (0.0, None)
 
         if action == 'backtrack':
             (cur_threshold, backtrack_iter) = arguments
-            assert (iter2step[backtrack_iter] > 0)
+            # backtrack_iter may be 0 (i.e. prune the input model again) if
+            # we have the cost histograms.
+            assert (iter2step[backtrack_iter] >= 0)
             del effective_logprob_changes[iter2step[backtrack_iter]:]
             iter2step.append(-1)
+            if model.iter > args.max_iter:
+                ExitProgram("Too many iterations, please set a higher "
+                            "--initial-threshold and rerun.")
             continue
 
         # EM steps
         steps += 'EM EM'.split()
+        SetBacktrackSteps(model, iter2step)
         while step < len(steps):
             logprob_change = RunStep(step, 0.0)
             logprob_changes.append(logprob_change)
@@ -615,14 +1120,22 @@ num_words = GetNumWords(args.lm_dir_in)
 ngram_order = GetNgramOrder(args.lm_dir_in)
 (num_unigrams, initial_num_xgrams) = GetNumGrams(args.lm_dir_in)
 current_num_xgrams = None
+current_cost_histogram = None
 initial_logprob_per_word = None
 final_logprob_per_word = None
 waiting_thread = None
 logprob_changes = []
 effective_logprob_changes = []
 thresholds = []
+backtrack_steps = set()
+checkpoint_records = []
 
-CreateInitialWorkDir()
+replay_records = ReadCheckpoint()
+if replay_records is None:
+    replay_records = []
+    CreateInitialWorkDir()
+    # the checkpoint with no steps means that step0 is complete.
+    WriteCheckpoint()
 
 if args.check_exact_divergence == 'true':
     if args.target_num_ngrams <= 0 and steps[-1] != 'EM':
@@ -653,7 +1166,7 @@ if args.target_num_ngrams > 0:
     threshold = 0.0
     initial_threshold = args.initial_threshold
     while threshold == 0.0:
-        (threshold, iter) = FindThreshold(initial_threshold)
+        (threshold, num_iters) = FindThreshold(initial_threshold)
         if threshold > 0.0:
             break
         logprob_changes = []
@@ -665,7 +1178,7 @@ if args.target_num_ngrams > 0:
             initial_threshold))
 
     LogMessage("Find the threshold {0} in {1} iteration(s)".format(
-        threshold, iter))
+        threshold, num_iters))
     LogMessage("thresholds per iter were " + str(thresholds))
 else:
     for step in range(len(steps)):
@@ -673,6 +1186,8 @@ else:
         logprob_changes.append(logprob_change)
         effective_logprob_changes.append(logprob_change)
 
+# once we start to move the output, we can't resume.
+os.remove(work_dir + "/checkpoint")
 FinalizeOutput(work_dir + "/step" + str(len(steps)))
 
 if waiting_thread is not None:
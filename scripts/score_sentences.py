@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# we're using python 3.x style print but want it to work in python 2.x,
+from __future__ import print_function
+import os
+import argparse
+import sys
+
+# If the encoding of the default sys.stdout is not utf-8,
+# force it to be utf-8. See PR #95.
+if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
+    import codecs
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
+    sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
+    sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
+
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+from sentence_scorer import SentenceScorer
+
+parser = argparse.ArgumentParser(
+    description="This script computes the log-probability of each sentence "
+    "of some text given a language model in a pocolm 'lm-dir' (as validated "
+    "by validate_lm_dir.py).  For each line of the input it writes a line "
+    "containing the number of words (including the end of sentence) and the "
+    "natural-log probability of the sentence, and with --per-word=true, the "
+    "log-prob of each word.  The output is flushed after each line when "
+    "reading from the standard input, so this script can be used as a "
+    "server.  The probabilities are the same as those used by "
+    "get_data_prob.py.  (From python, you can use class SentenceScorer in "
+    "scripts/internal/sentence_scorer.py directly).",
+    epilog="e.g. echo 'hello there' | score_sentences.py data/lm",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+parser.add_argument("--per-word",
+                    type=str,
+                    default="false",
+                    choices=["true", "false"],
+                    help="If true, also write the log-prob of each word.")
+parser.add_argument(
+    "--batch-size",
+    type=int,
+    default=1000,
+    help="Number of sentences to score at once when reading from a file "
+    "(when reading from the standard input, each line is scored as soon as "
+    "it is read).")
+parser.add_argument("lm_dir", help="Directory of the language model.")
+parser.add_argument(
+    "text_in",
+    nargs='?',
+    help="Filename of input text (one sentence per line, no BOS or EOS "
+    "symbols); if not given, the text is read from the standard input.")
+
+args = parser.parse_args()
+
+if os.system("validate_lm_dir.py {0} >/dev/null".format(args.lm_dir)) != 0:
+    sys.exit("score_sentences.py: failed to validate input LM-dir")
+
+if args.batch_size < 1:
+    sys.exit("score_sentences.py: invalid option --batch-size={0}".format(
+        args.batch_size))
+
+scorer = SentenceScorer(args.lm_dir, per_word=(args.per_word == "true"))
+
+
+def ScoreAndPrint(sentences):
+    for (num_words, log_prob,
+         word_log_probs) in scorer.ScoreSentences(sentences):
+        fields = [str(num_words), str(log_prob)]
+        if word_log_probs is not None:
+            fields += [str(x) for x in word_log_probs]
+        print(' '.join(fields))
+    sys.stdout.flush()
+
+
+if args.text_in is None:
+    # we don't use 'for line in sys.stdin', which may read ahead.
+    for line in iter(sys.stdin.readline, ''):
+        ScoreAndPrint([line])
+else:
+    with open(args.text_in, "r", encoding="utf-8") as f:
+        sentences = []
+        for line in f:
+            sentences.append(line)
+            if len(sentences) == args.batch_size:
+                ScoreAndPrint(sentences)
+                sentences = []
+        if len(sentences) > 0:
+            ScoreAndPrint(sentences)
+
+scorer.Close()
@@ -16,6 +16,12 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
     sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
 
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+from pocolm_common import GetFloatCountsFiles, EnsureFloatCountsIndex
+
 parser = argparse.ArgumentParser(
     description="This script takes an lm-dir, as produced by make_lm_dir.py, "
     "that should not have the counts split up into pieces, and it "
@@ -80,6 +86,11 @@ f = open(args.lm_dir_out + "/num_splits", "w", encoding="utf-8")
 print(args.num_splits, file=f)
 f.close()
 
+# write the index files now, so that the programs that need them don't have to
+# write to the LM-dir.
+for float_counts in GetFloatCountsFiles(args.lm_dir_out):
+    EnsureFloatCountsIndex(float_counts)
+
 if os.system("validate_lm_dir.py " + args.lm_dir_out) != 0:
     sys.exit("split_lm_dir.py: failed to validate output LM-dir")
 
@@ -4,7 +4,11 @@
 from __future__ import print_function
 import os
 import argparse
+import io
+import itertools
+import multiprocessing
 import sys
+from collections import deque
 
 # If the encoding of the default sys.stdout is not utf-8,
 # force it to be utf-8. See PR #95.
@@ -21,65 +25,194 @@ parser = argparse.ArgumentParser(
     "word not in the word-list or equal to words numbered 0, 1 or 2 "
     "(normally <eps>, <s> and </s>) are treated as out-of-vocabulary "
     "words (OOV) and written as symbol 3 (normally '<unk>').",
-    epilog="e.g. text_to_int.py words.txt < text > int_text",
+    epilog="e.g. text_to_int.py words.txt < text > int_text, or "
+    "text_to_int.py --num-jobs=8 words.txt text > int_text",
     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
+parser.add_argument(
+    "--num-jobs",
+    type=int,
+    default=1,
+    help="Number of worker processes to use for the conversion.  If "
+    "<text-in> is given, each worker reads its own byte-range of the file; "
+    "otherwise the standard input is read in blocks of lines which are "
+    "given to the workers.  The output is in the same order as the input.")
+parser.add_argument(
+    "--lines-per-block",
+    type=int,
+    default=20000,
+    help="When reading from the standard input with --num-jobs > 1, the "
+    "number of lines per block of work.")
 parser.add_argument(
     "vocab_file",
     help="Filename of vocabulary file, e.g. as produced by get_vocab.py")
+parser.add_argument(
+    "text_in",
+    nargs='?',
+    help="Filename of (non-gzipped) input text; if not given, the text is "
+    "read from the standard input.")
 
 args = parser.parse_args()
 
 if not os.path.exists(args.vocab_file):
-    sys.exit("validate_vocab.py: Expected file {0} to exist".format(
-        args.text_dir))
+    sys.exit("text_to_int.py: Expected file {0} to exist".format(
+        args.vocab_file))
 
-word_to_index = {}
+if args.num_jobs < 1:
+    sys.exit("text_to_int.py: invalid option --num-jobs={0}".format(
+        args.num_jobs))
+
+if args.text_in is not None and not os.path.exists(args.text_in):
+    sys.exit("text_to_int.py: Expected file {0} to exist".format(
+        args.text_in))
+
+# The workers read the vocabulary from the parent via fork(); if fork is not
+# available (e.g. on Windows) we just use one process.
+if (args.num_jobs > 1
+        and 'fork' not in multiprocessing.get_all_start_methods()):
+    print("text_to_int.py: warning: fork() is not supported on this "
+          "platform, so ignoring --num-jobs={0}".format(args.num_jobs),
+          file=sys.stderr)
+    args.num_jobs = 1
+
+# word_to_int_string maps each word to the string form of its integer id, with
+# words numbered 0, 1 or 2 (the 'forbidden' words) mapped to '3'.
+word_to_int_string = {}
+# forbidden_words is a list of the words numbered 0, 1 or 2, in the order of
+# the vocab file.
+forbidden_words = []
+unk_word = None
 
 f = open(args.vocab_file, "r", encoding="utf-8")
 
 for line in f:
     try:
         [word, index] = line.split()
-        word_to_index[word] = int(index)
+        index = int(index)
     except:
-        sys.exit("validate_vocab.py: bad line {0} in vocab file {1}".format(
+        sys.exit("text_to_int.py: bad line {0} in vocab file {1}".format(
             line[:-1], args.vocab_file))
+    if index <= 2:
+        # this means that when we encounter symbols <eps>, <s> or </s> in the
+        # text, we treat them the same as any unknown-word.
+        forbidden_words.append(word)
+        word_to_int_string[word] = '3'
+    else:
+        word_to_int_string[word] = str(index)
+    if index == 3:
+        unk_word = word
+f.close()
+forbidden_word_set = set(forbidden_words)
+
+
+# This function converts a list of lines of text to integer form.  It returns
+# a tuple (output_text, num_words_total, num_words_oov, num_words_forbidden).
+def IntegerizeLines(lines):
+    num_words_total = 0
+    num_words_oov = 0
+    num_words_forbidden = 0
+    output = []
+    lookup = word_to_int_string.get
+    for line in lines:
+        words = line.split()
+        num_words_total += len(words)
+        line_ints = [lookup(word) for word in words]
+        if None in line_ints:
+            num_words_oov += line_ints.count(None)
+            line_ints = ['3' if x is None else x for x in line_ints]
+        output.append(' '.join(line_ints))
+    if forbidden_word_set:
+        for line in lines:
+            for word in line.split():
+                if word in forbidden_word_set:
+                    num_words_forbidden += 1
+    output.append('')
+    return ('\n'.join(output), num_words_total, num_words_oov,
+            num_words_forbidden)
+
+
+# This function converts the lines of the file 'filename' that start within
+# the byte range [begin, end) to integer form; it returns the same tuple as
+# IntegerizeLines().
+def IntegerizeByteRange(filename, begin, end):
+    f = open(filename, "rb")
+    if begin > 0:
+        # skip to the start of the first line that starts at or after 'begin'.
+        f.seek(begin - 1)
+        f.readline()
+    pos = f.tell()
+    data = f.read(max(end - pos, 0))
+    if len(data) > 0 and data[-1:] != b'\n':
+        # finish the line that contains byte end - 1.
+        data += f.readline()
+    f.close()
+    # StringIO with newline=None splits lines the same way as reading the file
+    # in text mode would.
+    lines = io.StringIO(data.decode("utf-8"), newline=None).readlines()
+    return IntegerizeLines(lines)
+
+
+# This generator runs func(*task) for each task in 'tasks' using 'pool', and
+# yields the results in order; it keeps at most 'max_pending' tasks in flight,
+# to bound the memory used.
+def RunInOrder(pool, func, tasks, max_pending):
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, task))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+
+def GetTasks():
+    if args.text_in is not None:
+        # Split the file into byte ranges; we use more ranges than jobs so
+        # that the output can be written while the workers are busy, and the
+        # memory used stays bounded.
+        file_size = os.path.getsize(args.text_in)
+        block_size = max(1 << 20, min(1 << 24, file_size // (4 * args.num_jobs)))
+        for begin in range(0, file_size, block_size):
+            yield (IntegerizeByteRange,
+                   (args.text_in, begin, min(begin + block_size, file_size)))
+    else:
+        while True:
+            lines = list(itertools.islice(sys.stdin, args.lines_per_block))
+            if len(lines) == 0:
+                break
+            yield (IntegerizeLines, (lines, ))
+
+
+def ProcessTask(func, task_args):
+    return func(*task_args)
+
 
 num_words_total = 0
 num_words_oov = 0
 num_words_forbidden = 0
 
-for line in sys.stdin:
-    line_ints = []
-    for word in line.split():
-        num_words_total += 1
-        if word in word_to_index:
-            index = word_to_index[word]
-            if index <= 2:
-                num_words_forbidden += 1
-                # the next line means that when we encounter symbols <eps>, <s>
-                # or </s> in the text, we treat them the same as any
-                # unknown-word.
-                line_ints.append(str(3))
-            else:
-                line_ints.append(str(index))
-        else:
-            num_words_oov += 1
-            line_ints.append(str(3))
-    print(' '.join(line_ints))
+if args.num_jobs == 1:
+    results = (func(*task_args) for (func, task_args) in GetTasks())
+else:
+    pool = multiprocessing.get_context('fork').Pool(args.num_jobs)
+    results = RunInOrder(pool, ProcessTask, GetTasks(), 2 * args.num_jobs)
+
+for (output, total, oov, forbidden) in results:
+    sys.stdout.write(output)
+    num_words_total += total
+    num_words_oov += oov
+    num_words_forbidden += forbidden
+sys.stdout.flush()
+
+if args.num_jobs > 1:
+    pool.close()
+    pool.join()
 
 print("text_to_int.py: converted {0} words, {1}% of which were OOV".format(
     num_words_total, (100.0 * num_words_oov) / num_words_total),
       file=sys.stderr)
 
-forbidden_words = []
 if (num_words_forbidden != 0):
-    for (word, index) in word_to_index.items():
-        if index <= 2:
-            forbidden_words.append(word)
-        if index == 3:
-            unk_word = word
     print(
         "text_to_int.py: warning: encountered forbidden symbols ({0}) {1} times; "
         "converted them to {2}".format(",".join(forbidden_words),
@@ -122,6 +122,15 @@ parser.add_argument("--max-memory",
                     type=str,
                     default='',
                     help="Memory limitation for sort called by get_counts.py.")
+parser.add_argument(
+    "--incremental",
+    type=str,
+    choices=['true', 'false'],
+    default='false',
+    help="Passed to get_counts.py: if true, reuse the counts of data-sources "
+    "whose data has not changed since an earlier run.  Note: with "
+    "--min-counts, this keeps the per-source counts in the counts directory "
+    "(regardless of --cleanup), which takes extra disk space.")
 parser.add_argument("text_dir", help="Directory containing the training text.")
 parser.add_argument("order", help="Order of N-gram model to be trained.")
 parser.add_argument("work_dir",
@@ -265,20 +274,20 @@ def CheckFreshness(tgt_file, ref_files):
 word_counts_dir = os.path.join(work_dir, 'word_counts')
 if os.system("validate_text_dir.py " + args.text_dir) != 0:
     sys.exit(1)
-last_done_files = []
-for f in os.listdir(args.text_dir):
-    if f.endswith(".txt") or f.endswith(".txt.gz"):
-        last_done_files.append(os.path.join(args.text_dir, f))
 done_file = os.path.join(word_counts_dir, '.done')
-if not CheckFreshness(done_file, last_done_files):
-    LogMessage("Skip getting word counts")
-else:
-    log_file = os.path.join(log_dir, 'get_word_counts.log')
-    LogMessage("Getting word counts... log in " + log_file)
-    command = "get_word_counts.py {0} {1}".format(args.text_dir,
-                                                  word_counts_dir)
-    RunCommand(command, log_file, args.verbose == 'true')
+# get_word_counts.py only recounts the data sources that have changed (it
+# keeps fingerprints of the text files), so we always run it; it only rewrites
+# counts.bin if some counts changed, and in that case we touch the done file so
+# that the later stages are redone.
+log_file = os.path.join(log_dir, 'get_word_counts.log')
+LogMessage("Getting word counts... log in " + log_file)
+command = "get_word_counts.py --num-jobs={0} {1} {2}".format(
+    args.num_splits, args.text_dir, word_counts_dir)
+RunCommand(command, log_file, args.verbose == 'true')
+if CheckFreshness(done_file, [os.path.join(word_counts_dir, 'counts.bin')]):
     TouchFile(done_file)
+else:
+    LogMessage("Word counts are unchanged")
 
 # get unigram weights
 unigram_weights = os.path.join(args.text_dir, 'unigram_weights')
@@ -388,9 +397,9 @@ if not CheckFreshness(done_file, last_done_files):
 else:
     log_file = os.path.join(log_dir, 'get_counts.log')
     LogMessage("Getting ngram counts... log in " + log_file)
-    command = "get_counts.py --min-counts='{0}' --max-memory={1} --limit-unk-history={5} {2} {3} {4}".format(
+    command = "get_counts.py --incremental={7} --num-splits={6} --min-counts='{0}' --max-memory={1} --limit-unk-history={5} {2} {3} {4}".format(
         args.min_counts, args.max_memory, int_dir, args.order, counts_dir,
-        args.limit_unk_history)
+        args.limit_unk_history, args.num_splits, args.incremental)
     RunCommand(command, log_file, args.verbose == 'true')
     TouchFile(done_file)
 
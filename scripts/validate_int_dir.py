@@ -4,6 +4,8 @@
 from __future__ import print_function
 import os
 import argparse
+import array
+import struct
 import sys
 import subprocess
 
@@ -32,10 +34,11 @@ if not os.path.exists(args.int_dir):
     sys.exit("validate_int_dir.py: Expected directory {0} to exist".format(
         args.int_dir))
 
-if not os.path.exists("{0}/dev.txt.gz".format(args.int_dir)):
+if (not os.path.exists("{0}/dev.txt.gz".format(args.int_dir))
+        and not os.path.exists("{0}/dev.int".format(args.int_dir))):
     sys.exit(
-        "validate_int_dir.py: Expected file {0}/dev.txt.gz to exist".format(
-            args.int_dir))
+        "validate_int_dir.py: Expected file {0}/dev.txt.gz (or {0}/dev.int) "
+        "to exist".format(args.int_dir))
 
 if not os.path.exists("{0}/num_train_sets".format(args.int_dir)):
     sys.exit("validate_int_dir.py: Expected file {0}/num_train_sets to exist".
@@ -143,7 +146,50 @@ names = ['dev']
 for n in range(1, num_train_sets + 1):
     names.append(str(n))
 
+
+# This function checks the data in the packed int-text format (see
+# prepare_int_data.py --int-format=packed), i.e. {int_dir}/{name}.int and its
+# index {int_dir}/{name}.int.index.
+def ValidatePackedData(name):
+    filename = "{0}/{1}.int".format(args.int_dir, name)
+    index_filename = filename + ".index"
+    size = os.path.getsize(filename)
+    if size % 4 != 0:
+        sys.exit("validate_int_dir.py: size of file {0} is not a multiple "
+                 "of 4".format(filename))
+    try:
+        index_size = os.path.getsize(index_filename)
+        f = open(index_filename, "rb")
+        f.seek(index_size - 8)
+        [total_words] = struct.unpack("=q", f.read(8))
+        f.close()
+    except Exception as e:
+        sys.exit("validate_int_dir.py: error reading index file {0}: {1}".format(
+            index_filename, str(e)))
+    if total_words * 4 != size:
+        sys.exit("validate_int_dir.py: index file {0} does not match the size "
+                 "of {1}".format(index_filename, filename))
+    f = open(filename, "rb")
+    data = array.array('I', f.read(4 * 1000))
+    f.close()
+    num_ints = 0
+    for i in data:
+        if i == 0:  # sentence terminator
+            continue
+        num_ints += 1
+        if i < 3 or i > num_words:
+            sys.exit(
+                "validate_int_dir.py: value {0} out of range in file {1}".
+                format(i, filename))
+    if num_ints == 0:
+        sys.exit("validate_int_dir.py: did not see any data in file {0}".format(
+            filename))
+
+
 for name in names:
+    if os.path.exists("{0}/{1}.int".format(args.int_dir, name)):
+        ValidatePackedData(name)
+        continue
     p = subprocess.Popen("gunzip -c {0}/{1}.txt.gz 2>/dev/null".format(
         args.int_dir, name),
                          stdout=subprocess.PIPE,
@@ -16,6 +16,13 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding.lower() != "utf-8":
     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
     sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
 
+# make sure scripts/internal is on the pythonpath.
+sys.path = [os.path.abspath(os.path.dirname(sys.argv[0])) + "/internal"
+            ] + sys.path
+
+# for ReadWordCountsCache
+from word_counts_cache import ReadWordCountsCache
+
 parser = argparse.ArgumentParser(
     description="Creates a vocabulary file from a 'counts' directory "
     "as created by get_counts.py and a set of weights as created by "
@@ -115,6 +122,10 @@ saw_counts_without_weight = False
 
 num_counts_files = 0
 
+# if the binary cache written by get_word_counts.py is up to date, we read the
+# counts from it instead of from the .counts files.
+cache = ReadWordCountsCache(args.count_dir)
+
 for name in os.listdir(args.count_dir):
     if name.endswith('.counts'):
         num_counts_files += 1
@@ -132,6 +143,12 @@ for name in os.listdir(args.count_dir):
         else:
             weight = 1.0
             saw_counts_without_weight = True
+        if cache is not None:
+            (words, source_to_entries) = cache
+            (indexes, counts) = source_to_entries[name[:-7]]
+            for i, count in zip(indexes, counts):
+                word_to_weighted_count[words[i]] += count * weight
+            continue
         counts_path = args.count_dir + os.sep + name
         f = open(counts_path, 'r', encoding="utf-8")
         for line in f:
@@ -0,0 +1,130 @@
+// binary-lm-to-arpa.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iomanip>
+#include <iostream>
+#include <string>
+#include <vector>
+#include <stdlib.h>
+#include "pocolm-types.h"
+#include "binary-lm.h"
+
+
+/**
+   This program converts a binary LM (see binary-lm.h) into an ARPA-format
+   LM, which it writes to its standard output.  The n-grams of each order are
+   written in the same order as by float-counts-to-arpa-section.  It is mainly
+   useful for checking binary LMs, and for showing how to traverse them.
+*/
+
+namespace pocolm {
+
+class BinaryLmToArpa {
+ public:
+  explicit BinaryLmToArpa(const BinaryLm &lm): lm_(lm) { }
+
+  void Write(std::ostream &os) {
+    os << std::setprecision(6);
+    os << "\\data\\\n";
+    for (int32 order = 1; order <= lm_.NgramOrder(); order++) {
+      // the ARPA file counts <s> as a unigram, although it has no probability.
+      os << "ngram " << order << '='
+         << (lm_.NumNgrams(order) + (order == 1 ? 1 : 0)) << '\n';
+    }
+    for (int32 order = 1; order <= lm_.NgramOrder(); order++) {
+      os << "\n\\" << order << "-grams:\n";
+      if (order == 1) {
+        os << "-99\t" << lm_.Word(kBosSymbol);
+        WriteBackoff(std::vector<int32>(1, kBosSymbol), os);
+        os << '\n';
+      }
+      std::vector<int32> history;
+      WriteNgrams(order, 1, 0, &history, os);
+    }
+    os << "\n\\end\\\n";
+  }
+
+ private:
+  // Writes the n-grams of order 'order' that are predicted by the i'th
+  // LM-state of order 'state_order' (whose reversed history is 'history') and
+  // by its descendants.
+  void WriteNgrams(int32 order, int32 state_order, int64 i,
+                   std::vector<int32> *history, std::ostream &os) {
+    if (state_order < order) {
+      int64 begin = lm_.State(state_order, i).children_begin,
+          end = lm_.State(state_order, i + 1).children_begin;
+      for (int64 c = begin; c < end; c++) {
+        history->push_back(lm_.State(state_order + 1, c).word);
+        WriteNgrams(order, state_order + 1, c, history, os);
+        history->pop_back();
+      }
+      return;
+    }
+    // 'words' is the history in its natural order, followed by a space.
+    std::string words;
+    for (int32 j = static_cast<int32>(history->size()) - 1; j >= 0; j--) {
+      words += lm_.Word((*history)[j]);
+      words += ' ';
+    }
+    std::vector<int32> backoff_history(1);
+    backoff_history.insert(backoff_history.end(), history->begin(),
+                           history->end());
+    int64 begin = lm_.State(order, i).ngrams_begin,
+        end = lm_.State(order, i + 1).ngrams_begin;
+    for (int64 j = begin; j < end; j++) {
+      int32 word = lm_.NgramWord(order, j);
+      os << lm_.NgramLogProb(order, j) << '\t' << words << lm_.Word(word);
+      backoff_history[0] = word;
+      WriteBackoff(backoff_history, os);
+      os << '\n';
+    }
+  }
+
+  // Writes a tab and the backoff weight of the LM-state with reversed history
+  // 'history' to 'os', if it exists.
+  void WriteBackoff(const std::vector<int32> &history, std::ostream &os) {
+    int64 i = lm_.FindState(history);
+    if (i != -1)
+      os << '\t' << lm_.StateBackoff(history.size() + 1, i);
+  }
+
+  const BinaryLm &lm_;
+};
+
+}  // namespace pocolm
+
+
+int main (int argc, const char **argv) {
+  if (argc != 2) {
+    std::cerr << "Usage: binary-lm-to-arpa <binary-lm> > <arpa-file>\n"
+              << "e.g.: binary-lm-to-arpa lm.bin | gzip -c > lm.arpa.gz\n"
+              << "This program converts a binary LM, as written by\n"
+              << "float-counts-to-binary-lm, into ARPA format.\n";
+    exit(1);
+  }
+  pocolm::BinaryLm lm(argv[1]);
+  pocolm::BinaryLmToArpa converter(lm);
+  converter.Write(std::cout);
+  if (std::cout.fail()) {
+    std::cerr << "binary-lm-to-arpa: failure to write output (disk full?)\n";
+    exit(1);
+  }
+  return 0;
+}
@@ -0,0 +1,222 @@
+// binary-lm.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iostream>
+#include <limits>
+#include <errno.h>
+#include <fcntl.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include "binary-lm.h"
+
+namespace pocolm {
+
+BinaryLm::BinaryLm(const std::string &filename):
+    filename_(filename), mapped_data_(NULL), mapped_size_(0), data_(NULL) {
+  int fd = open(filename.c_str(), O_RDONLY);
+  struct stat file_stat;
+  if (fd == -1 || fstat(fd, &file_stat) != 0) {
+    std::cerr << "BinaryLm: failed to open binary LM '" << filename
+              << "': " << strerror(errno) << "\n";
+    exit(1);
+  }
+  mapped_size_ = file_stat.st_size;
+  if (mapped_size_ < sizeof(BinaryLmHeader)) {
+    std::cerr << "BinaryLm: file '" << filename << "' is too small to be "
+              << "a binary LM.\n";
+    exit(1);
+  }
+  mapped_data_ = mmap(NULL, mapped_size_, PROT_READ, MAP_SHARED, fd, 0);
+  if (mapped_data_ == MAP_FAILED) {
+    std::cerr << "BinaryLm: failed to mmap file '" << filename
+              << "': " << strerror(errno) << "\n";
+    exit(1);
+  }
+  close(fd);
+  data_ = static_cast<const char*>(mapped_data_);
+
+  header_ = reinterpret_cast<const BinaryLmHeader*>(data_);
+  if (memcmp(header_->magic, kBinaryLmMagic, sizeof(header_->magic)) != 0 ||
+      header_->version != kBinaryLmVersion) {
+    std::cerr << "BinaryLm: file '" << filename << "' is not a binary LM "
+              << "(or has the wrong version).\n";
+    exit(1);
+  }
+  int32 ngram_order = header_->ngram_order,
+      bits = header_->quantization_bits;
+  if (ngram_order < 1 || header_->num_words < 3 || bits < 1 || bits > 16) {
+    std::cerr << "BinaryLm: file '" << filename << "' has a bad header.\n";
+    exit(1);
+  }
+  CheckRange(sizeof(BinaryLmHeader), sizeof(BinaryLmOrderInfo) * ngram_order);
+  order_info_ = reinterpret_cast<const BinaryLmOrderInfo*>(
+      data_ + sizeof(BinaryLmHeader));
+
+  CheckRange(header_->vocab_offset, header_->vocab_bytes);
+  const char *vocab = data_ + header_->vocab_offset,
+      *vocab_end = vocab + header_->vocab_bytes;
+  while (vocab < vocab_end) {
+    words_.push_back(vocab);
+    vocab += strlen(vocab) + 1;
+  }
+  if (vocab != vocab_end ||
+      words_.size() != static_cast<size_t>(header_->num_words) + 1) {
+    std::cerr << "BinaryLm: file '" << filename << "' has a bad vocabulary.\n";
+    exit(1);
+  }
+
+  int64 max_codebook_size = 1 << bits;
+  for (int32 o = 0; o < ngram_order; o++) {
+    const BinaryLmOrderInfo &info = order_info_[o];
+    if (info.prob_codebook_size < 1 ||
+        info.prob_codebook_size > max_codebook_size ||
+        info.backoff_codebook_size < 1 ||
+        info.backoff_codebook_size > max_codebook_size) {
+      std::cerr << "BinaryLm: file '" << filename << "' has bad codebooks.\n";
+      exit(1);
+    }
+    CheckRange(info.prob_codebook_offset,
+               sizeof(float) * info.prob_codebook_size);
+    CheckRange(info.backoff_codebook_offset,
+               sizeof(float) * info.backoff_codebook_size);
+    CheckRange(info.states_offset,
+               sizeof(BinaryLmState) * (info.num_states + 1));
+    CheckRange(info.words_offset, sizeof(int32) * info.num_ngrams);
+    CheckRange(info.probs_offset, sizeof(uint16) * info.num_ngrams);
+    prob_codebooks_.push_back(
+        reinterpret_cast<const float*>(data_ + info.prob_codebook_offset));
+    backoff_codebooks_.push_back(
+        reinterpret_cast<const float*>(data_ + info.backoff_codebook_offset));
+    states_.push_back(
+        reinterpret_cast<const BinaryLmState*>(data_ + info.states_offset));
+    ngram_words_.push_back(
+        reinterpret_cast<const int32*>(data_ + info.words_offset));
+    ngram_probs_.push_back(
+        reinterpret_cast<const uint16*>(data_ + info.probs_offset));
+    // check the end markers, so that lookups can't go outside the arrays.
+    const BinaryLmState &end = states_[o][info.num_states];
+    if (end.ngrams_begin != info.num_ngrams ||
+        end.children_begin != (o + 1 < ngram_order ?
+                               order_info_[o + 1].num_states : 0)) {
+      std::cerr << "BinaryLm: file '" << filename << "' has bad LM-states "
+                << "of order " << (o + 1) << ".\n";
+      exit(1);
+    }
+  }
+  if (order_info_[0].num_states != 1) {
+    std::cerr << "BinaryLm: file '" << filename << "' has "
+              << order_info_[0].num_states << " unigram LM-states.\n";
+    exit(1);
+  }
+}
+
+BinaryLm::~BinaryLm() {
+  if (munmap(mapped_data_, mapped_size_) != 0) {
+    std::cerr << "BinaryLm: failed to unmap file '" << filename_
+              << "': " << strerror(errno) << "\n";
+  }
+}
+
+void BinaryLm::CheckRange(int64 offset, int64 size) const {
+  if (offset < 0 || size < 0 || offset % 8 != 0 ||
+      offset + size > static_cast<int64>(mapped_size_)) {
+    std::cerr << "BinaryLm: file '" << filename_ << "' is truncated or "
+              << "corrupted.\n";
+    exit(1);
+  }
+}
+
+int64 BinaryLm::FindChild(int32 order, int64 i, int32 word) const {
+  if (order >= NgramOrder())
+    return -1;
+  const BinaryLmState *children = states_[order];
+  int64 low = states_[order - 1][i].children_begin,
+      high = states_[order - 1][i + 1].children_begin;
+  while (low < high) {
+    int64 mid = (low + high) / 2;
+    if (children[mid].word < word)
+      low = mid + 1;
+    else
+      high = mid;
+  }
+  if (low < states_[order - 1][i + 1].children_begin &&
+      children[low].word == word)
+    return low;
+  return -1;
+}
+
+int64 BinaryLm::FindNgram(int32 order, int64 i, int32 word) const {
+  const int32 *words = ngram_words_[order - 1];
+  int64 low = states_[order - 1][i].ngrams_begin,
+      end = states_[order - 1][i + 1].ngrams_begin,
+      high = end;
+  while (low < high) {
+    int64 mid = (low + high) / 2;
+    if (words[mid] < word)
+      low = mid + 1;
+    else
+      high = mid;
+  }
+  if (low < end && words[low] == word)
+    return low;
+  return -1;
+}
+
+int64 BinaryLm::FindState(const std::vector<int32> &history) const {
+  int32 order = history.size() + 1;
+  if (order > NgramOrder())
+    return -1;
+  int64 i = 0;
+  for (int32 o = 1; o < order && i != -1; o++)
+    i = FindChild(o, i, history[o - 1]);
+  return i;
+}
+
+float BinaryLm::LogProb(const std::vector<int32> &history, int32 word) const {
+  // We go from the unigram LM-state towards the LM-state with the longest
+  // history; 'log_prob' is the log-prob of the word in the highest-order
+  // LM-state we have seen that predicts it, and 'backoff' is the sum of the
+  // backoff weights of the LM-states after that one.
+  float log_prob = -std::numeric_limits<float>::infinity(),
+      backoff = 0.0;
+  int32 ngram_order = NgramOrder(),
+      history_size = history.size();
+  int64 i = 0;
+  for (int32 order = 1; ; order++) {
+    int64 j = FindNgram(order, i, word);
+    if (j != -1) {
+      log_prob = NgramLogProb(order, j);
+      backoff = 0.0;
+    } else {
+      backoff += StateBackoff(order, i);
+    }
+    if (order == ngram_order || order > history_size)
+      break;
+    i = FindChild(order, i, history[order - 1]);
+    if (i == -1)
+      break;
+  }
+  return log_prob + backoff;
+}
+
+}  // namespace pocolm
@@ -0,0 +1,195 @@
+// binary-lm.h
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef POCOLM_BINARY_LM_H_
+#define POCOLM_BINARY_LM_H_
+
+#include <string>
+#include <vector>
+#include "pocolm-types.h"
+
+namespace pocolm {
+
+/**
+   This header describes the binary LM format, which is written by
+   float-counts-to-binary-lm (see also format_binary_lm.py), and the class
+   BinaryLm which reads it.  It is meant for decoders: the file is
+   memory-mapped, so loading it takes no time and its pages are shared between
+   processes that use the same LM, and it can be used without any parsing.  It
+   contains the same information as the ARPA file (the log10 probabilities and
+   backoff weights), except that they are quantized.
+
+   The LM is stored as a trie of LM-states (history-states), indexed by
+   reversed history, with one sorted array of LM-states for each order: the
+   LM-states of order o (history-length o-1) are stored in the same order as in
+   float.all (sorted on reversed history), which makes the children of each
+   LM-state of order o (the LM-states of order o+1 whose history extends its
+   history by one less recent word) contiguous.  Each LM-state has a
+   contiguous range of the n-gram arrays of its order, containing the words
+   it predicts (sorted), with their quantized log-probs.
+
+   The file consists of:
+     - a BinaryLmHeader
+     - a BinaryLmOrderInfo for each order 1 ... ngram_order
+   and then, at the offsets given in those structs (which are multiples of 8):
+     - the vocabulary: the words in order of their integer ids, from 0 to
+       num_words, each terminated by a '\0'
+     - for each order, the prob and backoff codebooks (each an array of
+       floats, sorted, of size at most 1 << quantization_bits; the quantized
+       value of a log-prob or backoff weight is an index into the codebook)
+     - for each order, num_states + 1 BinaryLmStates (the last one is there to
+       mark the end of the ranges of the last LM-state)
+     - for each order, num_ngrams int32 words, and num_ngrams uint16 quantized
+       log-probs.
+   The numbers are in the byte order of the machine that wrote the file.
+*/
+
+struct BinaryLmHeader {
+  // "pocolm-binary-lm"
+  char magic[16];
+  int32 version;
+  int32 ngram_order;
+  // the highest-numbered word; the vocabulary has num_words + 1 entries,
+  // including epsilon (0).
+  int32 num_words;
+  int32 quantization_bits;
+  int64 vocab_offset;
+  int64 vocab_bytes;
+};
+
+struct BinaryLmOrderInfo {
+  int64 num_states;
+  int64 num_ngrams;
+  // the codebooks have at most (1 << quantization_bits) entries.
+  int64 prob_codebook_size;
+  int64 backoff_codebook_size;
+  int64 prob_codebook_offset;
+  int64 backoff_codebook_offset;
+  int64 states_offset;
+  int64 words_offset;
+  int64 probs_offset;
+};
+
+struct BinaryLmState {
+  // the least recent word of the history of this LM-state (i.e. the word by
+  // which it extends the history of its parent); 0 for the unigram LM-state.
+  int32 word;
+  // the quantized log10 backoff weight of this LM-state (i.e. the backoff
+  // weight of the n-gram that is its history, in ARPA terms).
+  uint16 backoff;
+  uint16 unused;
+  // the index of the first n-gram of this LM-state in the n-gram arrays of its
+  // order; its n-grams end where those of the next LM-state begin.
+  int64 ngrams_begin;
+  // the index of the first child of this LM-state in the LM-states of the next
+  // order; its children end where those of the next LM-state begin.
+  int64 children_begin;
+};
+
+static const char kBinaryLmMagic[] = "pocolm-binary-lm";
+static const int32 kBinaryLmVersion = 1;
+
+
+class BinaryLm {
+ public:
+  // Maps the binary LM in 'filename'.  Dies on error.
+  explicit BinaryLm(const std::string &filename);
+
+  ~BinaryLm();
+
+  int32 NgramOrder() const { return header_->ngram_order; }
+
+  // Returns the highest-numbered word.
+  int32 NumWords() const { return header_->num_words; }
+
+  // Returns the printed form of word 'word' (0 <= word <= NumWords()).
+  const char *Word(int32 word) const { return words_[word]; }
+
+  // Returns the log10 probability of 'word' given the (reversed, as
+  // elsewhere) history 'history', which may be longer than NgramOrder() - 1;
+  // the extra words are ignored.  This is the same as the ARPA file would
+  // give, except for quantization.  Returns -infinity if 'word' is not
+  // predicted by the unigram LM-state (e.g. if it is <s>).
+  float LogProb(const std::vector<int32> &history, int32 word) const;
+
+  int64 NumStates(int32 order) const {
+    return order_info_[order - 1].num_states;
+  }
+  int64 NumNgrams(int32 order) const {
+    return order_info_[order - 1].num_ngrams;
+  }
+
+  // Returns the i'th LM-state of order 'order'; i may be NumStates(order), for
+  // the end marker.
+  const BinaryLmState &State(int32 order, int64 i) const {
+    return states_[order - 1][i];
+  }
+
+  // Returns the log10 backoff weight of the i'th LM-state of order 'order'.
+  float StateBackoff(int32 order, int64 i) const {
+    return backoff_codebooks_[order - 1][states_[order - 1][i].backoff];
+  }
+
+  // Returns the word of the j'th n-gram of order 'order'.
+  int32 NgramWord(int32 order, int64 j) const {
+    return ngram_words_[order - 1][j];
+  }
+
+  // Returns the log10 probability of the j'th n-gram of order 'order'.
+  float NgramLogProb(int32 order, int64 j) const {
+    return prob_codebooks_[order - 1][ngram_probs_[order - 1][j]];
+  }
+
+  // Returns the index of the child of the i'th LM-state of order 'order' that
+  // extends its history with 'word' (an LM-state of order 'order' + 1), or -1
+  // if there is no such LM-state.
+  int64 FindChild(int32 order, int64 i, int32 word) const;
+
+  // Returns the index j of the n-gram of the i'th LM-state of order 'order'
+  // that predicts 'word', or -1 if it has no such n-gram.
+  int64 FindNgram(int32 order, int64 i, int32 word) const;
+
+  // Returns the index of the LM-state with (reversed) history 'history', of
+  // order history.size() + 1, or -1 if there is no such LM-state.
+  int64 FindState(const std::vector<int32> &history) const;
+
+ private:
+  // Checks that [offset, offset + size) is inside the file; dies otherwise.
+  void CheckRange(int64 offset, int64 size) const;
+
+  std::string filename_;
+  void *mapped_data_;
+  size_t mapped_size_;
+  const char *data_;
+
+  const BinaryLmHeader *header_;
+  const BinaryLmOrderInfo *order_info_;
+  // words_[i] is the printed form of word i.
+  std::vector<const char*> words_;
+  // the following are indexed by order - 1.
+  std::vector<const float*> prob_codebooks_;
+  std::vector<const float*> backoff_codebooks_;
+  std::vector<const BinaryLmState*> states_;
+  std::vector<const int32*> ngram_words_;
+  std::vector<const uint16*> ngram_probs_;
+};
+
+}  // namespace pocolm
+
+#endif  // POCOLM_BINARY_LM_H_
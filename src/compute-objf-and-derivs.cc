@@ -0,0 +1,1124 @@
+// compute-objf-and-derivs.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <algorithm>
+#include <cassert>
+#include <iomanip>
+#include <iostream>
+#include <sstream>
+#include <fstream>
+#include <string>
+#include <vector>
+#include <map>
+#include <numeric>
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+#include "lm-state-derivs.h"
+
+
+/**
+   This program does, in a single process, the same computation as the sequence
+   of programs that get_objf_and_derivs.py runs (merge-counts, discount-counts,
+   discount-counts-1gram, merge-float-counts and compute-probs, and if
+   derivatives are needed, the backward versions of these programs), keeping
+   all the intermediate counts in memory.  It reads the int-counts from the
+   count directory once, when it starts; it then reads requests from its
+   standard input, one per line, and writes one line of output for each
+   request, so it can be kept running to evaluate many sets of metaparameters
+   (this is how optimize_metaparameters.py uses it).
+
+   The arithmetic is done in the same way and in the same order as in the
+   individual programs, so the objective function is the same as that of
+   get_objf_and_derivs.py.  The derivatives agree with it to within text
+   rounding: get_objf_and_derivs.py passes the intermediate derivatives between
+   programs as text, which loses some precision (up to about 5e-6, relative),
+   while here they stay in memory.
+*/
+
+namespace pocolm {
+
+/**
+   This class works out the order in which merge-counts processes the
+   LM-states of its inputs, for inputs that are held in memory: it visits the
+   distinct histories in (lexicographical) order, and for each one it gives the
+   list of inputs that have an LM-state with that history, in the same order
+   in which merge-counts and merge-counts-backward would process them (this
+   matters because the addition of counts is not exactly commutative).  The
+   inputs numbered 0 ... int_inputs.size() - 1 are int-counts, and if
+   'general_input' is non-NULL it is numbered int_inputs.size().
+ */
+class CountMergeIterator {
+ public:
+  CountMergeIterator(
+      const std::vector<const std::vector<IntLmState>*> &int_inputs,
+      const std::vector<GeneralLmStateDerivs> *general_input):
+      int_inputs_(int_inputs), general_input_(general_input) {
+    int32 num_inputs = int_inputs_.size() + (general_input_ != NULL ? 1 : 0);
+    positions_.resize(num_inputs, 0);
+    for (int32 i = 0; i < num_inputs; i++)
+      ReadInput(i);
+    Next();
+  }
+
+  bool Done() const { return inputs_.empty(); }
+
+  // The history of the current merged state.
+  const std::vector<int32> &History() const { return history_; }
+
+  // The inputs that have an LM-state with the current history.
+  const std::vector<int32> &Inputs() const { return inputs_; }
+
+  // The position, in the vector of LM-states of input i, of its LM-state with
+  // the current history (only valid for i in Inputs()).
+  size_t Position(int32 i) const { return positions_[i]; }
+
+  bool IsGeneral(int32 i) const {
+    return static_cast<size_t>(i) == int_inputs_.size();
+  }
+
+  void Next() {
+    for (std::vector<int32>::const_iterator iter = inputs_.begin();
+         iter != inputs_.end(); ++iter) {
+      positions_[*iter]++;
+      ReadInput(*iter);
+    }
+    inputs_.clear();
+    if (!hist_to_inputs_.empty()) {
+      history_ = hist_to_inputs_.begin()->first;
+      inputs_ = hist_to_inputs_.begin()->second;
+      hist_to_inputs_.erase(hist_to_inputs_.begin());
+    }
+  }
+
+ private:
+  // This is the counterpart of ReadStream() in merge-counts: it registers the
+  // LM-state at the current position of input i (if there is one) in
+  // hist_to_inputs_.
+  void ReadInput(int32 i) {
+    const std::vector<int32> *this_hist;
+    if (IsGeneral(i)) {
+      if (positions_[i] >= general_input_->size())
+        return;
+      this_hist = &((*general_input_)[positions_[i]].history);
+    } else {
+      if (positions_[i] >= int_inputs_[i]->size())
+        return;
+      this_hist = &((*int_inputs_[i])[positions_[i]].history);
+    }
+    hist_to_inputs_[*this_hist].push_back(i);
+  }
+
+  const std::vector<const std::vector<IntLmState>*> &int_inputs_;
+  const std::vector<GeneralLmStateDerivs> *general_input_;
+
+  // positions_[i] is the position of the next LM-state of input i that has
+  // not yet been processed.
+  std::vector<size_t> positions_;
+
+  std::vector<int32> history_;
+  std::vector<int32> inputs_;
+
+  std::map<std::vector<int32>, std::vector<int32> > hist_to_inputs_;
+};
+
+
+class ObjfAndDerivsComputer {
+ public:
+  // See the usage message for the meaning of the arguments; fold_dev_into is
+  // 0 if the dev data is not to be folded into any training set, and
+  // float_counts_out is empty if the float-counts are not to be written.
+  ObjfAndDerivsComputer(const std::string &count_dir,
+                        int32 fold_dev_into,
+                        const std::string &float_counts_out):
+      count_dir_(count_dir), fold_dev_into_(fold_dev_into),
+      float_counts_out_(float_counts_out) {
+    ReadCounts();
+  }
+
+  // Reads requests from the standard input and writes the responses to the
+  // standard output until it reaches end of file.  See the usage message for
+  // the format.
+  void ProcessRequests() {
+    std::string line;
+    while (std::getline(std::cin, line)) {
+      std::istringstream is(line);
+      std::string command;
+      if (!(is >> command))
+        continue;  // ignore empty lines.
+      bool need_derivs;
+      if (command == "objf") {
+        need_derivs = false;
+      } else if (command == "objf-and-derivs") {
+        need_derivs = true;
+        if (fold_dev_into_ != 0) {
+          std::cerr << "compute-objf-and-derivs: derivatives cannot be "
+                    << "computed with the --fold-dev-into option.\n";
+          exit(1);
+        }
+      } else {
+        std::cerr << "compute-objf-and-derivs: bad request '" << line << "'\n";
+        exit(1);
+      }
+      ReadMetaparameters(line, &is);
+      Forward(need_derivs);
+      if (!float_counts_out_.empty())
+        WriteFloatCounts();
+      std::cout << std::setprecision(10)
+                << total_count_ << " " << total_log_prob_;
+      if (need_derivs) {
+        Backward();
+        for (int32 n = 1; n <= num_train_sets_; n++)
+          std::cout << " " << scale_derivs_[n];
+        for (int32 o = 2; o <= ngram_order_; o++)
+          std::cout << " " << d1_deriv_[o] << " " << d2_deriv_[o]
+                    << " " << d3_deriv_[o] << " " << d4_deriv_[o];
+      }
+      std::cout << std::endl;
+      if (std::cout.fail()) {
+        std::cerr << "compute-objf-and-derivs: error writing output\n";
+        exit(1);
+      }
+    }
+  }
+
+ private:
+  int32 ReadIntFromFile(const std::string &name) {
+    std::string filename = count_dir_ + "/" + name;
+    std::ifstream is(filename.c_str());
+    int32 ans;
+    if (!(is >> ans)) {
+      std::cerr << "compute-objf-and-derivs: failed to read an integer from "
+                << filename << "\n";
+      exit(1);
+    }
+    return ans;
+  }
+
+  void ReadIntCounts(const std::string &filename,
+                     std::vector<IntLmState> *lm_states) {
+    std::ifstream is(filename.c_str(),
+                     std::ios_base::binary|std::ios_base::in);
+    if (is.fail()) {
+      std::cerr << "compute-objf-and-derivs: failed to open '"
+                << filename << "' for reading\n";
+      exit(1);
+    }
+    while (is.peek(), !is.eof()) {
+      lm_states->resize(lm_states->size() + 1);
+      lm_states->back().Read(is);
+      num_ngrams_read_ += lm_states->back().counts.size();
+    }
+  }
+
+  void ReadCounts() {
+    ngram_order_ = ReadIntFromFile("ngram_order");
+    num_train_sets_ = ReadIntFromFile("num_train_sets");
+    num_words_ = ReadIntFromFile("num_words");
+    if (ngram_order_ < 2 || num_train_sets_ < 1 || num_words_ <= 3) {
+      std::cerr << "compute-objf-and-derivs: bad ngram_order, num_train_sets "
+                << "or num_words in " << count_dir_ << "\n";
+      exit(1);
+    }
+    num_ngrams_read_ = 0;
+    int64 num_lm_states_read = 0;
+    // int_counts_[n][o] holds the counts of training set n and order o.
+    int_counts_.resize(num_train_sets_ + 1);
+    for (int32 n = 1; n <= num_train_sets_; n++) {
+      int_counts_[n].resize(ngram_order_ + 1);
+      for (int32 o = 2; o <= ngram_order_; o++) {
+        std::ostringstream filename;
+        filename << count_dir_ << "/int." << n << "." << o;
+        ReadIntCounts(filename.str(), &(int_counts_[n][o]));
+        num_lm_states_read += int_counts_[n][o].size();
+      }
+    }
+    ReadIntCounts(count_dir_ + "/int.dev", &dev_counts_);
+    num_lm_states_read += dev_counts_.size();
+    if (fold_dev_into_ != 0) {
+      if (fold_dev_into_ < 1 || fold_dev_into_ > num_train_sets_) {
+        std::cerr << "compute-objf-and-derivs: --fold-dev-into="
+                  << fold_dev_into_ << " is out of range.\n";
+        exit(1);
+      }
+      // dev_counts_by_order_[o] holds the dev-data counts of order o, read
+      // from <count-dir>/int.dev.o.
+      dev_counts_by_order_.resize(ngram_order_ + 1);
+      for (int32 o = 2; o <= ngram_order_; o++) {
+        std::ostringstream filename;
+        filename << count_dir_ << "/int.dev." << o;
+        ReadIntCounts(filename.str(), &(dev_counts_by_order_[o]));
+        num_lm_states_read += dev_counts_by_order_[o].size();
+      }
+    }
+    std::cerr << "compute-objf-and-derivs: read " << num_lm_states_read
+              << " LM states, with " << num_ngrams_read_
+              << " individual n-grams, from " << count_dir_ << "\n";
+
+    scales_.resize(num_train_sets_ + 1);
+    d1_.resize(ngram_order_ + 1);
+    d2_.resize(ngram_order_ + 1);
+    d3_.resize(ngram_order_ + 1);
+    d4_.resize(ngram_order_ + 1);
+    merged_counts_.resize(ngram_order_ + 1);
+    float_counts_.resize(ngram_order_ + 1);
+    discount_counts_.resize(ngram_order_ + 1);
+  }
+
+  float ReadFloat(const std::string &line, std::istringstream *is) {
+    std::string str;
+    char *end;
+    float ans = 0.0;
+    if (*is >> str)
+      ans = strtod(str.c_str(), &end);
+    if (str.empty() || *end != '\0') {
+      std::cerr << "compute-objf-and-derivs: bad request '" << line << "'\n";
+      exit(1);
+    }
+    return ans;
+  }
+
+  // Reads the metaparameters of a request, in the same order as in the
+  // metaparameters file: the scale for each training set, then D1 through D4
+  // for each order from 2 to ngram_order.
+  void ReadMetaparameters(const std::string &line, std::istringstream *is) {
+    for (int32 n = 1; n <= num_train_sets_; n++) {
+      scales_[n] = ReadFloat(line, is);
+      if (!(scales_[n] > 0.0)) {
+        std::cerr << "compute-objf-and-derivs: bad scale " << scales_[n]
+                  << "\n";
+        exit(1);
+      }
+    }
+    for (int32 o = 2; o <= ngram_order_; o++) {
+      d1_[o] = ReadFloat(line, is);
+      d2_[o] = ReadFloat(line, is);
+      d3_[o] = ReadFloat(line, is);
+      d4_[o] = ReadFloat(line, is);
+      if (!(1.0 >= d1_[o] && d1_[o] >= d2_[o] && d2_[o] >= d3_[o] &&
+            d3_[o] >= d4_[o] && d4_[o] >= 0)) {
+        std::cerr << "compute-objf-and-derivs: bad discounting values "
+                  << d1_[o] << " " << d2_[o] << " " << d3_[o] << " "
+                  << d4_[o] << " for order " << o << "\n";
+        exit(1);
+      }
+    }
+    std::string str;
+    if (*is >> str) {
+      std::cerr << "compute-objf-and-derivs: too many values in request '"
+                << line << "'\n";
+      exit(1);
+    }
+  }
+
+  void Forward(bool need_derivs) {
+    for (int32 o = ngram_order_; o > 1; o--) {
+      MergeCounts(o);
+      DiscountCounts(o, need_derivs);
+      if (!need_derivs) {
+        // we won't need these for the backward pass, so free the memory.
+        std::vector<GeneralLmStateDerivs>().swap(merged_counts_[o]);
+        std::vector<GeneralLmStateDerivs>().swap(discount_counts_[o]);
+      }
+    }
+    DiscountCountsOrder1();
+    ComputeObjf(need_derivs);
+  }
+
+  void Backward() {
+    scale_derivs_.clear();
+    scale_derivs_.resize(num_train_sets_ + 1, 0.0);
+    d1_deriv_.clear();
+    d1_deriv_.resize(ngram_order_ + 1, 0.0);
+    d2_deriv_.clear();
+    d2_deriv_.resize(ngram_order_ + 1, 0.0);
+    d3_deriv_.clear();
+    d3_deriv_.resize(ngram_order_ + 1, 0.0);
+    d4_deriv_.clear();
+    d4_deriv_.resize(ngram_order_ + 1, 0.0);
+    DiscountCountsOrder1Backward();
+    for (int32 o = 2; o <= ngram_order_; o++) {
+      DiscountCountsBackward(o);
+      MergeCountsBackward(o);
+    }
+  }
+
+  // Sets up the inputs to the count merging for order o > 1, and the scales
+  // of the int-count inputs.  The int-count inputs are those of the training
+  // sets, in order, followed by those of the dev data if it is folded into a
+  // training set.
+  void GetMergeInputs(
+      int32 o,
+      std::vector<const std::vector<IntLmState>*> *int_inputs,
+      std::vector<float> *int_input_scales,
+      const std::vector<GeneralLmStateDerivs> **general_input) const {
+    int_inputs->clear();
+    int_input_scales->clear();
+    for (int32 n = 1; n <= num_train_sets_; n++) {
+      int_inputs->push_back(&(int_counts_[n][o]));
+      int_input_scales->push_back(scales_[n]);
+    }
+    if (fold_dev_into_ != 0) {
+      int_inputs->push_back(&(dev_counts_by_order_[o]));
+      int_input_scales->push_back(scales_[fold_dev_into_]);
+    }
+    *general_input = (o < ngram_order_ ? &(discount_counts_[o]) : NULL);
+  }
+
+  // This does the same as merge-counts, merging the int-counts of order o > 1
+  // with the training-set scales, and for orders less than the highest order,
+  // the discounted-away counts of the one-higher order, into
+  // merged_counts_[o].
+  void MergeCounts(int32 o) {
+    std::vector<const std::vector<IntLmState>*> int_inputs;
+    std::vector<float> int_input_scales;
+    const std::vector<GeneralLmStateDerivs> *general_input;
+    GetMergeInputs(o, &int_inputs, &int_input_scales, &general_input);
+    std::vector<GeneralLmStateDerivs> &merged = merged_counts_[o];
+    merged.clear();
+    for (CountMergeIterator iter(int_inputs, general_input); !iter.Done();
+         iter.Next()) {
+      const std::vector<int32> &inputs = iter.Inputs();
+      merged.resize(merged.size() + 1);
+      GeneralLmState &output_lm_state = merged.back();
+      if (inputs.size() == 1 && iter.IsGeneral(inputs[0])) {
+        static_cast<GeneralLmState&>(output_lm_state) =
+            (*general_input)[iter.Position(inputs[0])];
+      } else {
+        builder_.Clear();
+        for (std::vector<int32>::const_iterator in_iter = inputs.begin();
+             in_iter != inputs.end(); ++in_iter) {
+          int32 i = *in_iter;
+          if (iter.IsGeneral(i))
+            builder_.AddCounts((*general_input)[iter.Position(i)]);
+          else
+            builder_.AddCounts((*int_inputs[i])[iter.Position(i)],
+                               int_input_scales[i]);
+        }
+        builder_.Output(iter.History(), &output_lm_state);
+      }
+    }
+    if (merged.empty()) {
+      std::cerr << "compute-objf-and-derivs: no counts of order " << o
+                << "\n";
+      exit(1);
+    }
+  }
+
+  // This does the same as discount-counts: it discounts the merged counts of
+  // order o > 1, writing the discounted counts to float_counts_[o] and the
+  // discounted-away part, aggregated by backed-off history, to
+  // discount_counts_[o - 1].
+  void DiscountCounts(int32 o, bool need_derivs) {
+    const std::vector<GeneralLmStateDerivs> &merged = merged_counts_[o];
+    std::vector<FloatLmStateDerivs> &discounted = float_counts_[o];
+    std::vector<GeneralLmStateDerivs> &backoff = discount_counts_[o - 1];
+    float d1 = d1_[o], d2 = d2_[o], d3 = d3_[o], d4 = d4_[o];
+    size_t backoff_history_size = o - 2;
+    discounted.clear();
+    discounted.resize(merged.size());
+    backoff.clear();
+    builder_.Clear();
+    for (size_t i = 0; i < merged.size(); i++) {
+      const GeneralLmState &lm_state = merged[i];
+      assert(lm_state.history.size() == static_cast<size_t>(o - 1));
+      if (i > 0 && !std::equal(lm_state.history.begin(),
+                               lm_state.history.begin() + backoff_history_size,
+                               merged[i - 1].history.begin())) {
+        // the history of the backoff state has changed.
+        OutputDiscountStats(merged[i - 1].history, &backoff);
+      }
+      FloatLmStateDerivs &discounted_state = discounted[i];
+      discounted_state.history = lm_state.history;
+      discounted_state.counts.resize(lm_state.counts.size());
+      if (need_derivs)
+        discounted_state.count_derivs.resize(lm_state.counts.size(), 0.0);
+
+      std::vector<std::pair<int32, Count> >::const_iterator in_iter =
+          lm_state.counts.begin(), in_end = lm_state.counts.end();
+      std::vector<std::pair<int32, float> >::iterator out_iter =
+          discounted_state.counts.begin();
+      double lm_state_total = lm_state.discount,
+          discount_total = lm_state.discount;
+      for (; in_iter != in_end; ++in_iter,++out_iter) {
+        int32 word = in_iter->first;
+        const Count &count = in_iter->second;
+        out_iter->first = word;
+        // these are volatile for the same reason as in discount-counts.cc:
+        // the backprop relies on exact floating-point comparisons.
+        volatile float top4plus = count.total - count.top1 - count.top2 -
+            count.top3,
+            this_d1 = d1 * count.top1, this_d2 = d2 * count.top2,
+            this_d3 = d3 * count.top3, this_d4 = d4 * top4plus,
+            d = this_d1 + this_d2 + this_d3 + this_d4;
+        if (POCOLM_SEPARATE_COUNTS) {
+          Count discount;
+          discount.top1 = this_d1;
+          discount.top2 = this_d2;
+          discount.top3 = this_d3;
+          discount.total = d;
+          builder_.AddCount(word, discount);
+        } else {
+          builder_.AddCount(word, d);
+        }
+        lm_state_total += count.total;
+        discount_total += d;
+        out_iter->second = count.total - d;
+      }
+      discounted_state.total = lm_state_total;
+      discounted_state.discount = discount_total;
+    }
+    // flush the last state's discount stats.
+    OutputDiscountStats(merged.back().history, &backoff);
+  }
+
+  // Outputs the discount stats accumulated in builder_ as an LM-state whose
+  // history is 'history' with the least recent word removed.
+  void OutputDiscountStats(const std::vector<int32> &history,
+                           std::vector<GeneralLmStateDerivs> *backoff) {
+    std::vector<int32> backoff_history(history.begin(), history.end() - 1);
+    backoff->resize(backoff->size() + 1);
+    builder_.Output(backoff_history, &(backoff->back()));
+    builder_.Clear();
+  }
+
+  // This does the same as discount-counts-1gram: it discounts the unigram
+  // counts in discount_counts_[1] and writes the result to float_counts_[1].
+  void DiscountCountsOrder1() {
+    if (discount_counts_[1].size() != 1) {
+      std::cerr << "compute-objf-and-derivs: expected exactly one unigram "
+                << "LM state, got " << discount_counts_[1].size() << "\n";
+      exit(1);
+    }
+    const GeneralLmState &input_lm_state = discount_counts_[1][0];
+    float_counts_[1].resize(1);
+    FloatLmStateDerivs *output_lm_state = &(float_counts_[1][0]);
+    int32 vocab_size = num_words_;
+
+    std::vector<float> unigram_counts(vocab_size + 1, 0.0);
+    assert(input_lm_state.discount == 0);
+    double total_count = 0.0, total_discount = input_lm_state.discount;
+
+    std::vector<std::pair<int32, Count> >::const_iterator
+        iter = input_lm_state.counts.begin(),
+        end = input_lm_state.counts.end();
+    for (; iter != end; ++iter) {
+      int32 word = iter->first;
+      assert(word != kBosSymbol && "<s> should never be predicted.");
+      if (!(word > 0 && word <= vocab_size)) {
+        std::cerr << "compute-objf-and-derivs: invalid word index "
+                  << word << " (vs. vocabulary size " << vocab_size << ")\n";
+        exit(1);
+      }
+      const Count &count = iter->second;
+      float discount = POCOLM_UNIGRAM_D1 * count.top1 +
+          POCOLM_UNIGRAM_D2 * count.top2 +
+          POCOLM_UNIGRAM_D3 * count.top3;
+      assert(discount < count.total);
+      float this_count = count.total,
+          discounted_count = this_count - discount;
+      total_count += this_count;
+      total_discount += discount;
+      unigram_counts[word] = discounted_count;
+    }
+
+    float extra_count = total_discount * (1.0 - POCOLM_UNK_PROPORTION) /
+        (vocab_size - 2),
+        extra_unk_count = POCOLM_UNK_PROPORTION * total_discount;
+    unigram_counts[kUnkSymbol] += extra_unk_count;
+    for (int32 i = 1; i <= vocab_size; i++)
+      if (i != kBosSymbol && i != kUnkSymbol)
+        unigram_counts[i] += extra_count;
+
+    output_lm_state->history.clear();
+    output_lm_state->total = total_count;
+    output_lm_state->discount = 0.0;
+    assert(kBosSymbol == 1 && kEosSymbol == 2);
+    output_lm_state->counts.resize(vocab_size - 1);
+    for (int32 i = kEosSymbol; i <= vocab_size; i++) {
+      output_lm_state->counts[i - kEosSymbol].first = i;
+      float count = unigram_counts[i];
+      assert(count > 0.0);
+      output_lm_state->counts[i - kEosSymbol].second = count;
+    }
+    output_lm_state->total_deriv = 0.0;
+    output_lm_state->discount_deriv = 0.0;
+    output_lm_state->count_derivs.clear();
+    output_lm_state->count_derivs.resize(vocab_size - 1, 0.0);
+  }
+
+  // This does the same as merge-float-counts: it writes the discounted
+  // float-counts of all orders to float_counts_out_, sorted on history.
+  void WriteFloatCounts() {
+    std::ofstream os(float_counts_out_.c_str(),
+                     std::ios_base::binary|std::ios_base::out);
+    if (os.fail()) {
+      std::cerr << "compute-objf-and-derivs: failed to open '"
+                << float_counts_out_ << "' for writing\n";
+      exit(1);
+    }
+    std::vector<size_t> positions(ngram_order_ + 1, 0);
+    std::vector<int64> num_ngrams(ngram_order_ + 1, 0);
+    int64 num_lm_states = 0;
+    while (true) {
+      int32 next_order = -1;
+      for (int32 o = 1; o <= ngram_order_; o++) {
+        if (positions[o] < float_counts_[o].size() &&
+            (next_order == -1 ||
+             float_counts_[o][positions[o]].history <
+             float_counts_[next_order][positions[next_order]].history))
+          next_order = o;
+      }
+      if (next_order == -1)
+        break;
+      const FloatLmState &lm_state =
+          float_counts_[next_order][positions[next_order]++];
+      lm_state.Write(os);
+      num_ngrams[next_order] += lm_state.counts.size();
+      num_lm_states++;
+    }
+    os.close();
+    if (os.fail()) {
+      std::cerr << "compute-objf-and-derivs: failed to close '"
+                << float_counts_out_ << "' (disk full?)\n";
+      exit(1);
+    }
+    // the second sentence is in the same format as the output of
+    // merge-float-counts, which get_objf_and_derivs.py parses.
+    std::cerr << "compute-objf-and-derivs: wrote " << num_lm_states
+              << " LM states to " << float_counts_out_ << ". Write ";
+    for (int32 o = 1; o <= ngram_order_; o++) {
+      std::cerr << num_ngrams[o];
+      if (o < ngram_order_)
+        std::cerr << " + ";
+    }
+    std::cerr << " = " << std::accumulate(num_ngrams.begin(),
+                                          num_ngrams.end(), int64(0))
+              << " individual n-grams.\n";
+  }
+
+  // Returns the discounted LM-state whose history equals the first
+  // 'hist_size' elements of 'history', or NULL if there is none.
+  FloatLmStateDerivs *FindDiscountedState(const std::vector<int32> &history,
+                                          int32 hist_size) {
+    std::vector<FloatLmStateDerivs> &lm_states = float_counts_[hist_size + 1];
+    std::vector<FloatLmStateDerivs>::iterator iter =
+        std::lower_bound(lm_states.begin(), lm_states.end(), history,
+                         HistoryPrefixLess(hist_size));
+    if (iter != lm_states.end() &&
+        std::equal(iter->history.begin(), iter->history.end(),
+                   history.begin()))
+      return &(*iter);
+    else
+      return NULL;
+  }
+
+  // compares the history of an LM-state with the first 'hist_size' elements
+  // of a history vector.
+  struct HistoryPrefixLess {
+    explicit HistoryPrefixLess(int32 hist_size): hist_size(hist_size) { }
+    bool operator () (const FloatLmState &lm_state,
+                      const std::vector<int32> &history) const {
+      return std::lexicographical_compare(
+          lm_state.history.begin(), lm_state.history.end(),
+          history.begin(), history.begin() + hist_size);
+    }
+    int32 hist_size;
+  };
+
+  // This does the same as compute-probs (except that it does not need the
+  // discounted counts of the different orders to be merged first).
+  void ComputeObjf(bool need_derivs) {
+    total_log_prob_ = 0.0;
+    total_count_ = 0;
+    std::vector<FloatLmStateDerivs*> lm_states(ngram_order_);
+    lm_states[0] = &(float_counts_[1][0]);
+    for (std::vector<IntLmState>::const_iterator dev_iter =
+             dev_counts_.begin(); dev_iter != dev_counts_.end(); ++dev_iter) {
+      const IntLmState &dev_state = *dev_iter;
+      int32 hist_size = dev_state.history.size();
+      assert(hist_size < ngram_order_);
+      // find the longest history that we have training-data counts for.
+      while (hist_size > 0 &&
+             (lm_states[hist_size] =
+              FindDiscountedState(dev_state.history, hist_size)) == NULL)
+        hist_size--;
+      for (int32 h = 1; h < hist_size; h++) {
+        lm_states[h] = FindDiscountedState(dev_state.history, h);
+        assert(lm_states[h] != NULL);
+      }
+      assert(dev_state.counts.size() != 0);
+      for (std::vector<std::pair<int32, int32> >::const_iterator iter =
+               dev_state.counts.begin(); iter != dev_state.counts.end();
+           ++iter) {
+        int32 word = iter->first,
+            count_of_word = iter->second;
+        assert(word > 0 && word != kBosSymbol &&
+               count_of_word > 0);
+        ProcessWord(lm_states, hist_size, word, count_of_word, need_derivs);
+      }
+    }
+    std::cerr << "compute-objf-and-derivs: average log-prob per word was "
+              << (total_log_prob_ / total_count_)
+              << " (perplexity = "
+              << exp(-total_log_prob_ / total_count_) << ") over "
+              << total_count_ << " words.\n";
+    if (need_derivs) {
+      // this is what FloatLmStateDerivs::WriteDerivs() would do before
+      // compute-probs writes the derivatives.
+      for (int32 o = 1; o <= ngram_order_; o++)
+        for (std::vector<FloatLmStateDerivs>::iterator iter =
+                 float_counts_[o].begin(); iter != float_counts_[o].end();
+             ++iter)
+          iter->BackpropFromTotalDeriv();
+    }
+  }
+
+  // This is as ProbComputer::ProcessWord() in compute-probs.cc; see the
+  // comments there.  lm_states[h] is the discounted LM-state with history
+  // length h that is relevant to the word, for 0 <= h <= hist_size.
+  void ProcessWord(const std::vector<FloatLmStateDerivs*> &lm_states,
+                   int32 hist_size, int32 word, int32 count_of_word,
+                   bool need_derivs) {
+    std::vector<int32> &count_position = count_position_;
+    count_position.clear();
+    count_position.resize(hist_size, -1);
+
+    float cur_backoff_prob = 1.0;
+    float tot_prob = 0.0;
+    for (int32 h = hist_size; h >= 0; h--) {
+      const FloatLmState &lm_state = *(lm_states[h]);
+      assert(lm_state.total != 0.0);
+      if (h == 0) {
+        assert(word >= kEosSymbol &&
+               static_cast<int32>(lm_state.counts.size()) > word - kEosSymbol &&
+               lm_state.counts[word - kEosSymbol].first == word);
+        double unigram_count = lm_state.counts[word - kEosSymbol].second,
+            unigram_total = lm_state.total;
+        tot_prob += cur_backoff_prob * unigram_count / unigram_total;
+      } else {
+        std::pair<int32, float> search_pair(word,
+                                            0.0);
+        std::vector<std::pair<int32, float> >::const_iterator
+            iter = std::lower_bound(lm_state.counts.begin(),
+                                    lm_state.counts.end(),
+                                    search_pair);
+        if (iter != lm_state.counts.end() &&
+            iter->first == word) {
+          float this_count = iter->second;
+          tot_prob += cur_backoff_prob * this_count / lm_state.total;
+          count_position[h - 1] = iter - lm_state.counts.begin();
+        }
+        cur_backoff_prob *= lm_state.discount / lm_state.total;
+      }
+    }
+    assert(tot_prob > 0.0);
+    float log_prob = log(tot_prob);
+    total_log_prob_ += log_prob * count_of_word;
+    total_count_ += count_of_word;
+
+    if (!need_derivs)
+      return;
+
+    float tot_prob_deriv = count_of_word / tot_prob,
+        cur_backoff_prob_deriv = 0.0;
+    for (int32 h = 0; h <= hist_size; h++) {
+      FloatLmStateDerivs &lm_state = *(lm_states[h]);
+      if (h == 0) {
+        double unigram_count = lm_state.counts[word - kEosSymbol].second,
+            unigram_total = lm_state.total;
+        cur_backoff_prob_deriv += tot_prob_deriv * unigram_count / unigram_total;
+        float unigram_count_deriv =
+            tot_prob_deriv * cur_backoff_prob / unigram_total,
+            unigram_total_deriv =
+            -(tot_prob_deriv * cur_backoff_prob * unigram_count) /
+            (unigram_total * unigram_total);
+        lm_state.total_deriv += unigram_total_deriv;
+        lm_state.count_derivs[word - kEosSymbol] += unigram_count_deriv;
+      } else {
+        int32 pos = count_position[h - 1];
+        float total = lm_state.total, discount = lm_state.discount;
+        lm_state.total_deriv -= (cur_backoff_prob_deriv * cur_backoff_prob) / total;
+        cur_backoff_prob *= total / discount;
+        lm_state.discount_deriv += cur_backoff_prob_deriv * cur_backoff_prob / total;
+        cur_backoff_prob_deriv *= discount / total;
+
+        if (pos != -1) {
+          float this_count = lm_state.counts[pos].second;
+          double &this_count_deriv = lm_state.count_derivs[pos];
+          lm_state.total_deriv -=
+              (tot_prob_deriv * cur_backoff_prob * this_count) /
+              (total * total);
+          this_count_deriv += tot_prob_deriv * cur_backoff_prob / total;
+          cur_backoff_prob_deriv += tot_prob_deriv * this_count / total;
+        }
+      }
+    }
+    assert(fabs(cur_backoff_prob - 1.0) < 0.001);
+  }
+
+  // This does the same as discount-counts-1gram-backward, setting the
+  // derivatives in discount_counts_[1][0].
+  void DiscountCountsOrder1Backward() {
+    const FloatLmStateDerivs &output_lm_state = float_counts_[1][0];
+    GeneralLmStateDerivs *input_lm_state = &(discount_counts_[1][0]);
+    int32 vocab_size = output_lm_state.counts.size() + 1;
+
+    double extra_count_deriv = 0.0, extra_unk_count_deriv = 0.0;
+    for (int32 i = kEosSymbol; i <= vocab_size; i++) {
+      float output_deriv = output_lm_state.count_derivs[i - kEosSymbol];
+      if (i != kUnkSymbol) {
+        extra_count_deriv += output_deriv;
+      } else {
+        extra_unk_count_deriv = output_deriv;
+      }
+    }
+    double total_discount_deriv =
+        extra_count_deriv * (1.0 - POCOLM_UNK_PROPORTION) / (vocab_size - 2) +
+        POCOLM_UNK_PROPORTION * extra_unk_count_deriv;
+    input_lm_state->discount_deriv = total_discount_deriv;
+
+    int32 num_counts = input_lm_state->counts.size();
+    input_lm_state->count_derivs.resize(num_counts);
+    for (int32 i = 0; i < num_counts; i++) {
+      int32 word = input_lm_state->counts[i].first;
+      Count &count_deriv = input_lm_state->count_derivs[i];
+      float output_deriv = output_lm_state.count_derivs[word - kEosSymbol];
+      float diff_deriv = total_discount_deriv - output_deriv;
+      count_deriv.top1 = POCOLM_UNIGRAM_D1 * diff_deriv;
+      count_deriv.top2 = POCOLM_UNIGRAM_D2 * diff_deriv;
+      count_deriv.top3 = POCOLM_UNIGRAM_D3 * diff_deriv;
+      count_deriv.total = output_deriv;
+    }
+  }
+
+  // ensures that the top1, top2, top3 derivs of 'state' have all been
+  // propagated; see CheckDerivsUsed() in discount-counts-backward.cc.
+  void CheckDerivsUsed(const GeneralLmStateDerivs &state) const {
+    std::vector<Count>::const_iterator
+        iter = state.count_derivs.begin(),
+        end = state.count_derivs.end();
+    std::vector<std::pair<int32,Count> >::const_iterator pair_iter =
+        state.counts.begin();
+    for (; iter != end; ++iter, ++pair_iter) {
+      assert((iter->top1 == 0.0 || pair_iter->second.top1 == 0.0) &&
+             (iter->top2 == 0.0 || pair_iter->second.top2 == 0.0) &&
+             (iter->top3 == 0.0 || pair_iter->second.top3 == 0.0) &&
+             "some derivatives were not accounted for.");
+    }
+  }
+
+  // sets up word_map_ so that for each word in 'counts', word_map_[word] is
+  // its position in 'counts' (other entries are undefined).
+  template <class T>
+  void PopulateWordMap(const std::vector<std::pair<int32, T> > &counts) {
+    for (size_t i = 0; i < counts.size(); i++) {
+      int32 word = counts[i].first;
+      assert(word > 0);
+      if (word_map_.size() <= static_cast<size_t>(word))
+        word_map_.resize(static_cast<size_t>(word) + 1);
+      word_map_[word] = i;
+    }
+  }
+
+  // This does the same as discount-counts-backward for order o > 1: given the
+  // derivatives w.r.t. float_counts_[o] and discount_counts_[o - 1], it
+  // computes the derivatives w.r.t. merged_counts_[o] and adds to the
+  // derivatives w.r.t. the discounting constants.
+  void DiscountCountsBackward(int32 o) {
+    std::vector<GeneralLmStateDerivs> &merged = merged_counts_[o];
+    const std::vector<FloatLmStateDerivs> &discounted = float_counts_[o];
+    std::vector<GeneralLmStateDerivs> &backoff = discount_counts_[o - 1];
+    float d1 = d1_[o], d2 = d2_[o], d3 = d3_[o], d4 = d4_[o];
+    assert(merged.size() == discounted.size());
+    GeneralLmStateDerivs *backoff_lm_state = NULL;
+    size_t next_backoff_pos = 0;
+    for (size_t i = 0; i < merged.size(); i++) {
+      GeneralLmStateDerivs &lm_state = merged[i];
+      const FloatLmStateDerivs &discounted_lm_state = discounted[i];
+      if (backoff_lm_state == NULL ||
+          !std::equal(backoff_lm_state->history.begin(),
+                      backoff_lm_state->history.end(),
+                      lm_state.history.begin())) {
+        if (backoff_lm_state != NULL)
+          CheckDerivsUsed(*backoff_lm_state);
+        assert(next_backoff_pos < backoff.size());
+        backoff_lm_state = &(backoff[next_backoff_pos++]);
+        PopulateWordMap(backoff_lm_state->counts);
+      }
+      assert(discounted_lm_state.counts.size() == lm_state.counts.size());
+      lm_state.count_derivs.clear();
+      lm_state.count_derivs.resize(lm_state.counts.size(), 0.0);
+
+      std::vector<std::pair<int32,Count> >::const_iterator count_iter =
+          lm_state.counts.begin(), count_end = lm_state.counts.end();
+      std::vector<double>::const_iterator discounted_deriv_iter =
+          discounted_lm_state.count_derivs.begin();
+      std::vector<Count>::iterator deriv_iter = lm_state.count_derivs.begin();
+      double d1_deriv_part = 0.0,
+          d2_deriv_part = 0.0,
+          d3_deriv_part = 0.0,
+          d4_deriv_part = 0.0;
+      float total_backoff_count_deriv = discounted_lm_state.discount_deriv;
+      lm_state.discount_deriv = discounted_lm_state.discount_deriv;
+      for (; count_iter != count_end;
+           ++count_iter, ++discounted_deriv_iter, ++deriv_iter) {
+        int32 word = count_iter->first;
+        const Count &count = count_iter->second;
+        float discounted_deriv = *discounted_deriv_iter;
+        Count &deriv = *deriv_iter;
+        assert(static_cast<size_t>(word) < word_map_.size() &&
+               static_cast<size_t>(word_map_[word]) <
+               backoff_lm_state->counts.size() &&
+               backoff_lm_state->counts[word_map_[word]].first == word);
+        int32 backoff_pos = word_map_[word];
+        const Count &backoff_count = backoff_lm_state->counts[backoff_pos].second;
+        Count &backoff_deriv = backoff_lm_state->count_derivs[backoff_pos];
+        volatile float top4plus = count.total - count.top1 - count.top2 -
+            count.top3,
+            this_d1 = d1 * count.top1, this_d2 = d2 * count.top2,
+            this_d3 = d3 * count.top3, this_d4 = d4 * top4plus,
+            d = this_d1 + this_d2 + this_d3 + this_d4;
+        float d_deriv = total_backoff_count_deriv - discounted_deriv;
+        deriv.total = discounted_deriv;
+
+        if (POCOLM_SEPARATE_COUNTS) {
+          Count discount;
+          discount.total = d;
+          discount.top1 = this_d1;
+          discount.top2 = this_d2;
+          discount.top3 = this_d3;
+          Count discount_deriv(0.0f);
+          backoff_count.AddBackward(discount, &backoff_deriv, &discount_deriv);
+          float d1_deriv = discount_deriv.top1 + discount_deriv.total + d_deriv,
+              d2_deriv = discount_deriv.top2 + discount_deriv.total + d_deriv,
+              d3_deriv = discount_deriv.top3 + discount_deriv.total + d_deriv,
+              d4_deriv = discount_deriv.total + d_deriv;
+          d1_deriv_part += count.top1 * d1_deriv;
+          d2_deriv_part += count.top2 * d2_deriv;
+          d3_deriv_part += count.top3 * d3_deriv;
+          d4_deriv_part += top4plus * d4_deriv;
+          float top4plus_deriv = d4_deriv * d4;
+          deriv.top1 = d1_deriv * d1 - top4plus_deriv;
+          deriv.top2 = d2_deriv * d2 - top4plus_deriv;
+          deriv.top3 = d3_deriv * d3 - top4plus_deriv;
+          deriv.total += top4plus_deriv;
+        } else {
+          backoff_count.AddBackward(d, &backoff_deriv, &d_deriv);
+          d1_deriv_part += count.top1 * d_deriv;
+          d2_deriv_part += count.top2 * d_deriv;
+          d3_deriv_part += count.top3 * d_deriv;
+          d4_deriv_part += top4plus * d_deriv;
+          float top4plus_deriv = d_deriv * d4;
+          deriv.top1 = d_deriv * d1 - top4plus_deriv;
+          deriv.top2 = d_deriv * d2 - top4plus_deriv;
+          deriv.top3 = d_deriv * d3 - top4plus_deriv;
+          deriv.total += top4plus_deriv;
+        }
+      }
+      d1_deriv_[o] += d1_deriv_part;
+      d2_deriv_[o] += d2_deriv_part;
+      d3_deriv_[o] += d3_deriv_part;
+      d4_deriv_[o] += d4_deriv_part;
+    }
+    if (backoff_lm_state != NULL)
+      CheckDerivsUsed(*backoff_lm_state);
+    assert(next_backoff_pos == backoff.size());
+  }
+
+  // This does the same as merge-counts-backward for order o > 1: given the
+  // derivatives w.r.t. merged_counts_[o], it adds to the derivatives w.r.t.
+  // the training-set scales, and for orders less than the highest order,
+  // computes the derivatives w.r.t. discount_counts_[o].
+  void MergeCountsBackward(int32 o) {
+    std::vector<const std::vector<IntLmState>*> int_inputs;
+    std::vector<float> int_input_scales;
+    const std::vector<GeneralLmStateDerivs> *general_input;
+    GetMergeInputs(o, &int_inputs, &int_input_scales, &general_input);
+    std::vector<GeneralLmStateDerivs> &merged = merged_counts_[o];
+    std::vector<GeneralLmStateDerivs> &general_states = discount_counts_[o];
+    size_t merged_pos = 0;
+    for (CountMergeIterator iter(int_inputs, general_input); !iter.Done();
+         iter.Next(), merged_pos++) {
+      const std::vector<int32> &inputs = iter.Inputs();
+      GeneralLmStateDerivs &merged_state = merged[merged_pos];
+      assert(merged_state.history == iter.History());
+      if (inputs.size() == 1 && iter.IsGeneral(inputs[0])) {
+        GeneralLmStateDerivs &input = general_states[iter.Position(inputs[0])];
+        input.count_derivs = merged_state.count_derivs;
+        input.discount_deriv = merged_state.discount_deriv;
+        continue;
+      }
+      PopulateWordMap(merged_state.counts);
+      for (std::vector<int32>::const_iterator in_iter = inputs.begin();
+           in_iter != inputs.end(); ++in_iter) {
+        int32 i = *in_iter;
+        if (iter.IsGeneral(i)) {
+          GeneralLmStateDerivs &source_state = general_states[iter.Position(i)];
+          source_state.count_derivs.clear();
+          source_state.count_derivs.resize(source_state.counts.size(), 0.0);
+          std::vector<std::pair<int32, Count> >::const_iterator
+              count_iter = source_state.counts.begin(),
+              count_end = source_state.counts.end();
+          std::vector<Count>::iterator deriv_iter =
+              source_state.count_derivs.begin();
+          for (; count_iter != count_end; ++count_iter, ++deriv_iter) {
+            int32 word = count_iter->first;
+            int32 pos = word_map_[word];
+            assert(merged_state.counts[pos].first == word);
+            const Count &merged_count = merged_state.counts[pos].second;
+            Count &merged_deriv = merged_state.count_derivs[pos];
+            merged_count.AddBackward(count_iter->second, &merged_deriv,
+                                     &(*deriv_iter));
+          }
+          source_state.discount_deriv = merged_state.discount_deriv;
+        } else {
+          float scale = int_input_scales[i];
+          const IntLmState &source_state = (*int_inputs[i])[iter.Position(i)];
+          double scale_deriv = source_state.discount *
+              merged_state.discount_deriv;
+          std::vector<std::pair<int32, int32> >::const_iterator
+              count_iter = source_state.counts.begin(),
+              count_end = source_state.counts.end();
+          for (; count_iter != count_end; ++count_iter) {
+            int32 word = count_iter->first;
+            int32 num_words = count_iter->second;
+            int32 pos = word_map_[word];
+            assert(merged_state.counts[pos].first == word);
+            const Count &merged_count = merged_state.counts[pos].second;
+            Count &merged_deriv = merged_state.count_derivs[pos];
+            merged_count.AddBackward(scale, num_words, &merged_deriv,
+                                     &scale_deriv);
+          }
+          scale_derivs_[i + 1] += scale_deriv;
+        }
+      }
+    }
+    assert(merged_pos == merged.size());
+  }
+
+  std::string count_dir_;
+  int32 fold_dev_into_;
+  std::string float_counts_out_;
+  int32 ngram_order_;
+  int32 num_train_sets_;
+  int32 num_words_;
+  int64 num_ngrams_read_;
+
+  // int_counts_[n][o], for 1 <= n <= num_train_sets_ and 2 <= o <=
+  // ngram_order_, contains the int-counts of training set n and order o, read
+  // from <count-dir>/int.n.o.
+  std::vector<std::vector<std::vector<IntLmState> > > int_counts_;
+  // the dev-data counts, read from <count-dir>/int.dev.
+  std::vector<IntLmState> dev_counts_;
+  // only used with --fold-dev-into; see ReadCounts().
+  std::vector<std::vector<IntLmState> > dev_counts_by_order_;
+
+  // The metaparameters of the current request; these are indexed by training
+  // set (scales_) or by order (the others), and element zero is unused.
+  std::vector<float> scales_;
+  std::vector<float> d1_;
+  std::vector<float> d2_;
+  std::vector<float> d3_;
+  std::vector<float> d4_;
+
+  // The following are indexed by n-gram order, and correspond to the files
+  // merged.o, float.o and discount.o that get_objf_and_derivs.py writes to its
+  // work directory; they also hold the corresponding derivatives.
+  std::vector<std::vector<GeneralLmStateDerivs> > merged_counts_;
+  std::vector<std::vector<FloatLmStateDerivs> > float_counts_;
+  std::vector<std::vector<GeneralLmStateDerivs> > discount_counts_;
+
+  double total_log_prob_;
+  int64 total_count_;
+
+  // The derivatives w.r.t. the metaparameters (indexed like scales_, d1_ and
+  // so on).
+  std::vector<double> scale_derivs_;
+  std::vector<double> d1_deriv_;
+  std::vector<double> d2_deriv_;
+  std::vector<double> d3_deriv_;
+  std::vector<double> d4_deriv_;
+
+  // The following are temporaries that we keep here to avoid reallocation.
+  GeneralLmStateBuilder builder_;
+  std::vector<int32> word_map_;
+  std::vector<int32> count_position_;
+};
+
+}  // namespace pocolm
+
+int main (int argc, const char **argv) {
+  int32 fold_dev_into = 0;
+  std::string float_counts_out;
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option.compare(0, 16, "--fold-dev-into=") == 0) {
+      char *end;
+      fold_dev_into = strtol(argv[1] + 16, &end, 10);
+      if (*end != '\0' || fold_dev_into <= 0) {
+        std::cerr << "compute-objf-and-derivs: bad option " << option << "\n";
+        exit(1);
+      }
+    } else if (option.compare(0, 19, "--float-counts-out=") == 0) {
+      float_counts_out = option.substr(19);
+    } else {
+      std::cerr << "compute-objf-and-derivs: unrecognized option " << option
+                << "\n";
+      exit(1);
+    }
+    argc--;
+    argv++;
+  }
+
+  if (argc != 2) {
+    std::cerr << "compute-objf-and-derivs: expected usage:\n"
+              << "compute-objf-and-derivs [options] <count-dir>  <requests >responses\n"
+              << "This program reads the int-counts from <count-dir> (int.dev and\n"
+              << "int.<n>.<o> for each training set n and order o > 1), and then\n"
+              << "for each line of its input, of the form\n"
+              << "  (objf|objf-and-derivs) <metaparameter1> <metaparameter2> ...\n"
+              << "where the metaparameters are in the same order as in a\n"
+              << "metaparameters file (the scale of each training set, then\n"
+              << "D1 through D4 for each order > 1), it does the same computation\n"
+              << "as get_objf_and_derivs.py and writes to the standard output a\n"
+              << "line containing the total count of dev words followed by the\n"
+              << "total log-prob, and for 'objf-and-derivs' requests, the\n"
+              << "derivatives of the total log-prob w.r.t. the metaparameters (in\n"
+              << "the same order).\n"
+              << "Options:\n"
+              << "  --fold-dev-into=<n>  Include the dev-data counts (from\n"
+              << "            <count-dir>/int.dev.<o>) in the training data, with the\n"
+              << "            same scale as training set n.  Not compatible with\n"
+              << "            'objf-and-derivs' requests.\n"
+              << "  --float-counts-out=<file>  After the forward computation of each\n"
+              << "            request, write the discounted float-counts of all orders\n"
+              << "            to <file> (like the float.all that get_objf_and_derivs.py\n"
+              << "            writes), and print their number of n-grams to stderr.\n"
+              << "e.g.: echo objf 0.5 0.8 0.6 0.4 0.2 | compute-objf-and-derivs counts\n";
+    exit(1);
+  }
+
+  pocolm::ObjfAndDerivsComputer computer(argv[1], fold_dev_into,
+                                         float_counts_out);
+  computer.ProcessRequests();
+  return 0;
+}
@@ -162,6 +162,7 @@ class UnigramCountDiscounter {
 }
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
 
   if (argc != 2) {
     std::cerr << "discount-counts-1gram: expected usage:\n"
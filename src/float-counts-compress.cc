@@ -0,0 +1,228 @@
+// float-counts-compress.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+
+#include <algorithm>
+#include <cassert>
+#include <fstream>
+#include <iostream>
+#include <string>
+#include <unordered_set>
+#include <vector>
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+
+
+/**
+   This program converts float-counts into the compact format described in
+   lm-state.h, in which each count is stored as an index into a codebook and
+   the words as varint-encoded differences; all programs that read
+   float-counts read that format transparently.
+*/
+
+namespace pocolm {
+
+class FloatCountsCompressor {
+ public:
+  FloatCountsCompressor(int32 bits, const std::string &input_filename):
+      max_codebook_size_(1 << bits), input_filename_(input_filename),
+      lossless_(true) {
+    MakeCodebook();
+  }
+
+  void Write(const std::string &output_filename) {
+    std::ifstream input;
+    OpenInput(&input);
+    std::ofstream output(output_filename.c_str(),
+                         std::ios_base::out|std::ios_base::binary);
+    if (!output) {
+      std::cerr << "float-counts-compress: failed to open '"
+                << output_filename << "' for writing\n";
+      exit(1);
+    }
+    int64 num_lm_states = 0, num_counts = 0;
+    double max_change = 0.0;
+    FloatLmState lm_state;
+    while (input.peek(), !input.eof()) {
+      lm_state.Read(input);
+      if (num_lm_states == 0)
+        WriteFloatCountsCodebook(output, codebook_);
+      if (!lossless_) {
+        // replace the counts by their quantized values, and recompute the
+        // total so that the LM-state stays consistent.
+        for (size_t i = 0; i < lm_state.counts.size(); i++) {
+          float &count = lm_state.counts[i].second,
+              quantized = codebook_[NearestCodebookEntry(codebook_, count)];
+          if (count > 0.0)
+            max_change = std::max<double>(max_change,
+                                          fabs(quantized - count) / count);
+          count = quantized;
+        }
+        lm_state.ComputeTotal();
+      }
+      lm_state.WriteCompact(output, codebook_);
+      num_lm_states++;
+      num_counts += lm_state.counts.size();
+    }
+    output.close();
+    if (output.fail()) {
+      std::cerr << "float-counts-compress: error writing to '"
+                << output_filename << "' (disk full?)\n";
+      exit(1);
+    }
+    int64 input_bytes = FileSize(input_filename_),
+        output_bytes = FileSize(output_filename);
+    std::cerr << "float-counts-compress: wrote " << num_lm_states
+              << " LM states with " << num_counts << " counts, using a "
+              << (lossless_ ? "lossless" : "lossy") << " codebook of size "
+              << codebook_.size() << "; " << input_bytes << " -> "
+              << output_bytes << " bytes";
+    if (!lossless_)
+      std::cerr << "; max relative change of a count was " << max_change;
+    std::cerr << "\n";
+  }
+
+ private:
+  void OpenInput(std::ifstream *input) {
+    input->open(input_filename_.c_str(),
+                std::ios_base::in|std::ios_base::binary);
+    if (!(*input)) {
+      std::cerr << "float-counts-compress: failed to open '"
+                << input_filename_ << "' for reading\n";
+      exit(1);
+    }
+  }
+
+  static int64 FileSize(const std::string &filename) {
+    std::ifstream input(filename.c_str(),
+                        std::ios_base::in|std::ios_base::binary);
+    input.seekg(0, std::ios_base::end);
+    return input.tellg();
+  }
+
+  // Makes the codebook: the distinct values of the counts if there are no
+  // more than max_codebook_size_ of them (so the compression is lossless);
+  // otherwise values spaced uniformly on a log scale between the smallest
+  // and largest nonzero counts (plus zero, if there are zero counts).
+  void MakeCodebook() {
+    std::ifstream input;
+    OpenInput(&input);
+    std::unordered_set<float> values;
+    float min_count = 0.0, max_count = 0.0;
+    bool have_zero = false;
+    FloatLmState lm_state;
+    while (input.peek(), !input.eof()) {
+      lm_state.Read(input);
+      for (size_t i = 0; i < lm_state.counts.size(); i++) {
+        float count = lm_state.counts[i].second;
+        if (lossless_) {
+          values.insert(count);
+          if (values.size() > static_cast<size_t>(max_codebook_size_)) {
+            lossless_ = false;
+            values.clear();
+          }
+        }
+        if (count < 0.0) {
+          std::cerr << "float-counts-compress: negative count " << count
+                    << " in " << input_filename_ << "\n";
+          exit(1);
+        } else if (count == 0.0) {
+          have_zero = true;
+        } else {
+          if (min_count == 0.0 || count < min_count)
+            min_count = count;
+          max_count = std::max(max_count, count);
+        }
+      }
+    }
+    if (lossless_) {
+      codebook_.assign(values.begin(), values.end());
+      std::sort(codebook_.begin(), codebook_.end());
+      if (codebook_.empty())  // the input is empty; no codebook is written.
+        codebook_.push_back(0.0);
+      return;
+    }
+    if (have_zero)
+      codebook_.push_back(0.0);
+    int32 num_values = max_codebook_size_ - codebook_.size();
+    double log_min = log(min_count),
+        log_step = (num_values > 1 ?
+                    (log(max_count) - log_min) / (num_values - 1) : 0.0);
+    for (int32 i = 0; i < num_values; i++)
+      codebook_.push_back(exp(log_min + i * log_step));
+    codebook_.back() = max_count;
+    std::sort(codebook_.begin(), codebook_.end());
+  }
+
+  int32 max_codebook_size_;
+  std::string input_filename_;
+  bool lossless_;
+  // the sorted codebook of count values.
+  std::vector<float> codebook_;
+};
+
+}  // namespace pocolm
+
+
+int main (int argc, const char **argv) {
+  int32 bits = 16;
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option.compare(0, 7, "--bits=") == 0) {
+      bits = atoi(option.c_str() + 7);
+      if (bits < 1 || bits > 16) {
+        std::cerr << "float-counts-compress: invalid option " << option
+                  << "\n";
+        exit(1);
+      }
+    } else {
+      std::cerr << "float-counts-compress: unrecognized option " << option
+                << "\n";
+      exit(1);
+    }
+    argc--;
+    argv++;
+  }
+  if (argc != 3) {
+    std::cerr << "Usage: float-counts-compress [options] <float-counts-in> "
+              << "<float-counts-out>\n"
+              << "e.g.: float-counts-compress float.all float.all.compact\n"
+              << "This program writes the float-counts in <float-counts-in> in\n"
+              << "the compact format described in lm-state.h, in which each count\n"
+              << "is an index into a codebook of count values, and words are stored\n"
+              << "as varint-encoded differences.  Programs that read float-counts\n"
+              << "read the compact format transparently.  The compression is\n"
+              << "lossless if there are at most 2^bits distinct counts; otherwise\n"
+              << "the counts are quantized, on a log scale, and the totals of the\n"
+              << "LM-states are recomputed.  <float-counts-in> is read twice, so it\n"
+              << "can't be a pipe.  To convert back to the normal format, use e.g.\n"
+              << "'merge-float-counts float.all.compact > float.all'.\n"
+              << "Options:\n"
+              << "  --bits=<b>   The number of bits (1 to 16) of the count\n"
+              << "               indexes; up to 8 bits they take one byte, and\n"
+              << "               otherwise two [16].\n";
+    exit(1);
+  }
+  pocolm::FloatCountsCompressor compressor(bits, argv[1]);
+  compressor.Write(argv[2]);
+  return 0;
+}
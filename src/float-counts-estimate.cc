@@ -26,7 +26,9 @@
 #include <numeric>
 #include <sstream>
 #include <vector>
+#include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include "pocolm-types.h"
 #include "lm-state.h"
 
@@ -45,10 +47,15 @@ class FloatCountsEstimator {
  public:
   // usage is:
   // float-counts-estimate <num-words> <float-counts-input> <float-stats-input> <order1-counts-output> ... <orderN-counts-output>
-  // both inputs and outputs are of float-counts type.
-  FloatCountsEstimator(int argc, const char **argv):
-      order_(argc - 4), outputs_(NULL),
-      lm_states_(order_), work_(order_),
+  // or, if ngram_order > 0 (from the --ngram-order option):
+  // float-counts-estimate <num-words> <float-counts-input> <float-stats-input> <float-counts-output>
+  // both inputs and outputs are of float-counts type.  part and num_parts are
+  // from the --part option (else 1 and 1).
+  FloatCountsEstimator(int32 ngram_order, int32 part, int32 num_parts,
+                       int argc, const char **argv):
+      order_(ngram_order > 0 ? ngram_order : argc - 4),
+      part_(part), num_parts_(num_parts), outputs_(NULL),
+      writer_(NULL), lm_states_(order_), work_(order_),
       total_count_(0.0), total_logprob_(0.0), auxf_impr_(order_, 0.0) {
     assert(order_ >= 1);
     char *end;
@@ -60,19 +67,21 @@ class FloatCountsEstimator {
     }
     word_to_position_map_.resize((num_words_ + 1) * (order_ - 1));
     OpenInputs(argc, argv);
-    OpenOutputs(argc, argv);
+    if (ngram_order > 0)
+      OpenOutput(argv[4]);
+    else
+      OpenOutputs(argc, argv);
     ProcessInput();
   }
   ~FloatCountsEstimator() {
-    for (int32 o = 0; o < order_; o++) {
-      outputs_[o].close();
-      if (outputs_[o].fail()) {
-        std::cerr << "float-counts-estimate: failed to close an output "
-                  << "file.  Disk full?\n";
-        exit(1);
-      }
+    delete writer_;
+    if (outputs_ != NULL) {
+      for (int32 o = 0; o < order_; o++)
+        CloseOutput(&(outputs_[o]));
+      delete [] outputs_;
+    } else {
+      CloseOutput(&output_);
     }
-    delete [] outputs_;
     // produce some output on stdout:
     std::cout << total_count_ << ' ' << total_logprob_ << ' ';
     for (int32 o = 0; o < order_; o++)
@@ -124,6 +133,25 @@ class FloatCountsEstimator {
     }
   }
 
+  void OpenOutput(const char *filename) {
+    output_.open(filename, std::ios_base::out|std::ios_base::binary);
+    if (output_.fail()) {
+      std::cerr << "float-counts-estimate: error opening output file '"
+                << filename << "' for writing.\n";
+      exit(1);
+    }
+    writer_ = new FloatLmStateSortedWriter(output_, order_);
+  }
+
+  static void CloseOutput(std::ofstream *output) {
+    output->close();
+    if (output->fail()) {
+      std::cerr << "float-counts-estimate: failed to close an output "
+                << "file.  Disk full?\n";
+      exit(1);
+    }
+  }
+
   void OpenOutputs(int argc, const char **argv) {
     outputs_ = new std::ofstream[order_];
     for (int32 i = 0; i < order_; i++) {
@@ -145,6 +173,8 @@ class FloatCountsEstimator {
              "of the input counts is more than expected given the number of "
              "command-line arguments.");
       FlushOutput(history_length);
+      if (history_length == 0 && writer_ != NULL)
+        writer_->ReserveUnigramState(lm_state);
       lm_state.Swap(&(lm_states_[history_length]));
       if (static_cast<int32>(history_length) < order_ - 1)
         PopulateMap(history_length);
@@ -153,7 +183,10 @@ class FloatCountsEstimator {
       // Re-use the same object to read the float-stats.
       FloatLmState &lm_stats(lm_state);
       lm_stats.Read(float_stats_input_);
-      DoExpectation(lm_stats);
+      // the unigram state is shared by all parts of a split model, so its
+      // stats are only counted for the first part.
+      if (history_length > 0 || part_ == 1)
+        DoExpectation(lm_stats);
     }
     FlushOutput(0);
     float_stats_input_.peek();
@@ -303,7 +336,10 @@ class FloatCountsEstimator {
     for (int32 h = order_ - 1; h >= history_length; h--) {
       if (!lm_states_[h].counts.empty()) {
         DoMaximizationForLmState(h);
-        lm_states_[h].Write(outputs_[h]);
+        if (writer_ != NULL)
+          writer_->Write(lm_states_[h]);
+        else
+          lm_states_[h].Write(outputs_[h]);
         // after we make the following call, we treat this history-state
         // as being empty.
         lm_states_[h].counts.clear();
@@ -321,6 +357,24 @@ class FloatCountsEstimator {
     const FloatLmStateWork &work = work_[history_length];
     assert(work.counts.size() == lm_state.counts.size());
 
+    if (history_length == 0 && num_parts_ > 1) {
+      // The unigram state of a split model only has this part's share of the
+      // stats, so we just output the stats; float-counts-sum-unigrams adds
+      // them up over the parts (which is all the 'maximization' there is to
+      // do), and works out the auxiliary function improvement.
+      lm_state.discount = work.discount;
+      lm_state.total = work.discount +
+          std::accumulate(work.counts.begin(), work.counts.end(), 0.0);
+      std::vector<std::pair<int32, float> >::iterator
+          counts_iter = lm_state.counts.begin(),
+          counts_end = lm_state.counts.end();
+      std::vector<double>::const_iterator work_counts_iter =
+          work.counts.begin();
+      for (; counts_iter != counts_end; ++counts_iter,++work_counts_iter)
+        counts_iter->second = *work_counts_iter;
+      return;
+    }
+
     float old_total = lm_state.total,
         work_total = work.discount +
         std::accumulate(work.counts.begin(), work.counts.end(), 0.0);
@@ -378,7 +432,17 @@ class FloatCountsEstimator {
 
   int32 num_words_;
   int32 order_;
+  // the index of the part of a split model that the input is, and the number
+  // of parts (see the --part option); else both are 1.
+  int32 part_;
+  int32 num_parts_;
+  // outputs, one for each order of N-gram (NULL if the --ngram-order option
+  // was given).
   std::ofstream *outputs_;
+  // the output, and the writer that writes the LM-states to it sorted on
+  // history, if the --ngram-order option was given (else writer_ is NULL).
+  std::ofstream output_;
+  FloatLmStateSortedWriter *writer_;
 
   std::ifstream float_counts_input_;
   std::ifstream float_stats_input_;
@@ -426,8 +490,34 @@ class FloatCountsEstimator {
 
 
 int main (int argc, const char **argv) {
-  if (argc < 3) {
+  int32 ngram_order = 0;
+  int part = 1, num_parts = 1;
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option.compare(0, 7, "--part=") == 0) {
+      if (sscanf(argv[1] + 7, "%d/%d", &part, &num_parts) != 2 ||
+          part < 1 || part > num_parts) {
+        std::cerr << "float-counts-estimate: bad option " << option << "\n";
+        exit(1);
+      }
+    } else if (option.compare(0, 14, "--ngram-order=") == 0) {
+      ngram_order = atoi(option.c_str() + 14);
+      if (ngram_order < 1) {
+        std::cerr << "float-counts-estimate: invalid option " << option
+                  << "\n";
+        exit(1);
+      }
+    } else {
+      std::cerr << "float-counts-estimate: unrecognized option " << option
+                << "\n";
+      exit(1);
+    }
+    argc--;
+    argv++;
+  }
+  if (ngram_order > 0 ? argc != 5 : argc < 5) {
     std::cerr << "Usage: float-counts-estimate <num-words> <float-counts-input> <float-stats-input> <order1-output> ... <orderN-output>\n"
+              << " or: float-counts-estimate --ngram-order=<N> <num-words> <float-counts-input> <float-stats-input> <float-counts-output>\n"
               << "E.g. float-counts-estimate 20000 float.all float_stats.all float.1 float.2 float.3\n"
               << "This can be viewed as a single iteration of E-M (for use after pruning).\n"
               << "To the standard output, this program prints:\n"
@@ -440,12 +530,23 @@ int main (int argc, const char **argv) {
               << "float-counts-to-float-stats on the un-pruned model (and then merging the\n"
               << "orders.\n"
               << "The different orders of output will typically be merged together with\n"
-              << "merge-float-counts.\n";
+              << "merge-float-counts; with the --ngram-order=<N> option, all N orders\n"
+              << "are instead written, sorted, to the single file <float-counts-output>,\n"
+              << "which must be seekable (it can't be a pipe).\n"
+              << "With the --part=<i>/<n> option, the inputs are part i of n of a split\n"
+              << "model (see split-float-counts), whose unigram state is repeated in each\n"
+              << "part, and the parts can be processed in parallel.  The printed totals\n"
+              << "can then be added up over the parts (the unigram state is only counted\n"
+              << "for part 1).  The unigram state that is written out has just this part's\n"
+              << "share of the stats, and the auxiliary function improvement for it is\n"
+              << "printed as zero; use float-counts-sum-unigrams --em to combine the\n"
+              << "unigram states of the parts' outputs and to get that improvement.\n";
     exit(1);
   }
 
   // everything gets called from the constructor.
-  pocolm::FloatCountsEstimator generator(argc, argv);
+  pocolm::FloatCountsEstimator generator(ngram_order, part, num_parts,
+                                         argc, argv);
 
   return 0;
 }
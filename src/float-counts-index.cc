@@ -0,0 +1,138 @@
+// float-counts-index.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iostream>
+#include <fstream>
+#include <string>
+#include <vector>
+#include <sstream>
+#include <stdio.h>
+#include <stdlib.h>
+#include <unistd.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+
+
+/*
+   This program writes the index file that class MappedFloatCounts needs for
+   random access to a float-counts file sorted on history (see lm-state.h for
+   the format).
+*/
+
+
+int main (int argc, char **argv) {
+  if (argc != 2) {
+    std::cerr << "float-counts-index: expected usage:\n"
+              << "float-counts-index <float-counts>\n"
+              << "This program writes an index of the LM-states in\n"
+              << "<float-counts>, which must be sorted on history (e.g. float.all\n"
+              << "as written by merge-float-counts), to <float-counts>.index.\n"
+              << "It allows programs to look up the LM-state for a history without\n"
+              << "reading the whole file.  The index is written to a temporary file\n"
+              << "and then renamed, so other programs never see it half-written.\n";
+    exit(1);
+  }
+  std::string float_counts_filename(argv[1]),
+      index_filename = float_counts_filename + ".index";
+
+  std::ifstream input(float_counts_filename.c_str(),
+                      std::ios_base::in|std::ios_base::binary);
+  if (!input) {
+    std::cerr << "float-counts-index: failed to open '"
+              << float_counts_filename << "' for reading\n";
+    exit(1);
+  }
+
+  // offsets[o-1] contains the offsets of the LM-states of order o.
+  std::vector<std::vector<int64> > offsets;
+  pocolm::FloatLmState lm_state;
+  std::vector<int32> prev_history;
+  int64 num_lm_states = 0, offset = 0;
+  while (input.peek(), !input.eof()) {
+    // compact float-counts (see lm-state.h) start with a codebook, which is
+    // not an LM-state.
+    if (pocolm::ReadFloatCountsCodebook(input)) {
+      if (num_lm_states > 0) {
+        std::cerr << "float-counts-index: " << float_counts_filename
+                  << " has more than one codebook (is it a concatenation of\n"
+                  << "compact float-counts files?); this is not supported.\n";
+        exit(1);
+      }
+      offset = input.tellg();
+      continue;
+    }
+    lm_state.Read(input);
+    if (num_lm_states > 0 && !(prev_history < lm_state.history)) {
+      std::cerr << "float-counts-index: LM-states in " << float_counts_filename
+                << " are not sorted on history.\n";
+      exit(1);
+    }
+    size_t order = lm_state.history.size() + 1;
+    if (offsets.size() < order)
+      offsets.resize(order);
+    offsets[order - 1].push_back(offset);
+    offset = input.tellg();
+    prev_history.swap(lm_state.history);
+    num_lm_states++;
+  }
+
+  // the name of the temporary file includes the process id, in case another
+  // process is writing the same index.
+  std::ostringstream tmp_filename_stream;
+  tmp_filename_stream << index_filename << ".tmp." << getpid();
+  std::string tmp_filename = tmp_filename_stream.str();
+  std::ofstream output(tmp_filename.c_str(),
+                       std::ios_base::out|std::ios_base::binary);
+  if (!output) {
+    std::cerr << "float-counts-index: failed to open '" << tmp_filename
+              << "' for writing\n";
+    exit(1);
+  }
+  int64 num_orders = offsets.size();
+  output.write(reinterpret_cast<const char*>(&num_orders), sizeof(int64));
+  for (int32 o = 0; o < num_orders; o++) {
+    int64 num_states = offsets[o].size();
+    output.write(reinterpret_cast<const char*>(&num_states), sizeof(int64));
+  }
+  for (int32 o = 0; o < num_orders; o++) {
+    if (!offsets[o].empty())
+      output.write(reinterpret_cast<const char*>(&(offsets[o][0])),
+                   sizeof(int64) * offsets[o].size());
+  }
+  output.write(reinterpret_cast<const char*>(&offset), sizeof(int64));
+  output.close();
+  if (output.fail()) {
+    std::cerr << "float-counts-index: error writing to '" << tmp_filename
+              << "' (disk full?)\n";
+    unlink(tmp_filename.c_str());
+    exit(1);
+  }
+  if (rename(tmp_filename.c_str(), index_filename.c_str()) != 0) {
+    std::cerr << "float-counts-index: failed to rename '" << tmp_filename
+              << "' to '" << index_filename << "'\n";
+    unlink(tmp_filename.c_str());
+    exit(1);
+  }
+
+  std::cerr << "float-counts-index: indexed " << num_lm_states
+            << " LM states of " << num_orders << " orders in "
+            << float_counts_filename << "\n";
+  return 0;
+}
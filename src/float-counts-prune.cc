@@ -22,11 +22,15 @@
 #include <iomanip>
 #include <iostream>
 #include <fstream>
+#include <limits>
+#include <map>
 #include <math.h>
 #include <numeric>
 #include <sstream>
 #include <vector>
+#include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include "pocolm-types.h"
 #include "lm-state.h"
 
@@ -41,6 +45,19 @@
   counts.  Later on, after re-estimating the parameters, we'll structurally
   remove the un-needed counts and states from the model.
 
+  Alternatively (with the --float-stats-in and --float-stats-out options),
+  this program removes the zero counts itself, while making the same
+  structural change to the float-stats as float-counts-stats-remove-zeros; and
+  with the --histories-out option it also writes out the histories of the
+  pruned model, as float-counts-to-histories would.  Together with the
+  --ngram-order option, which makes it write all orders to a single file,
+  this lets a pruning step be done in one pass over the model.
+
+  With the --cost-histogram-out option, it also writes a histogram of the
+  'cost' of each n-gram, meaning the threshold above which a single pass of
+  pruning would have pruned it; this tells us (approximately) how many n-grams
+  we would get with any other threshold, which is useful when searching for
+  the threshold that gives a particular number of n-grams.
 */
 
 
@@ -55,7 +72,7 @@ class NullCountsReader {
                    int32 order,
                    int32 num_words):
       input_(input), order_(order), num_words_(num_words),
-      lm_states_(order), word_to_position_map_(order * (num_words + 1)) { }
+      lm_states_(order), search_pos_(order, 0) { }
 
 
   // This function uses the 'null-counts' to determine whether the n-gram of
@@ -89,11 +106,35 @@ class NullCountsReader {
     if (lm_states_[history_size].history != history)
       return false;
 
-    int32 pos = word_to_position_map_[word * order_ + history_size];
-    return (pos < static_cast<int32>(lm_states_[history_size].predicted.size()) &&
-            lm_states_[history_size].predicted[pos] == word);
+    return FindWord(history_size, word);
   }
  private:
+  // Returns true if 'word' is in lm_states_[history_length].predicted, which
+  // is sorted.  The calls for a history-state normally come in increasing
+  // order of word, so we do a galloping search forward from where the
+  // previous search ended (search_pos_[history_length]); the time taken is
+  // logarithmic in the distance moved, rather than in the number of words.
+  bool FindWord(int32 history_length, int32 word) {
+    const std::vector<int32> &predicted = lm_states_[history_length].predicted;
+    size_t size = predicted.size(),
+        &pos = search_pos_[history_length];
+    if (pos > 0 && predicted[pos - 1] >= word)
+      pos = 0;  // the words are out of order; search from the start.
+    // find 'lo' and 'hi' such that predicted[lo - 1] < word (if lo > pos),
+    // and predicted[hi] >= word (if hi < size).
+    size_t lo = pos, hi = pos, step = 1;
+    while (hi < size && predicted[hi] < word) {
+      lo = hi + 1;
+      hi += step;
+      step *= 2;
+    }
+    if (hi > size)
+      hi = size;
+    pos = std::lower_bound(predicted.begin() + lo, predicted.begin() + hi,
+                           word) - predicted.begin();
+    return (pos < size && predicted[pos] == word);
+  }
+
   // Keeps reading until the next thing to be read is strictly greater
   // than 'history' in lexicographical order on histories.
   void ReadUntil(const std::vector<int32> &history) {
@@ -108,7 +149,8 @@ class NullCountsReader {
                  "float-counts-prune: order of protected-counts input is "
                  "unexpectedly high.");
           pending_lm_state_.Swap(&lm_states_[history_size]);
-          PopulateMap(history_size);
+          assert(lm_states_[history_size].predicted.back() <= num_words_);
+          search_pos_[history_size] = 0;
           pending_lm_state_.predicted.clear();
         } else {
           // It's >= 'history' in the ordering, so we're done.
@@ -134,24 +176,9 @@ class NullCountsReader {
   // lm_states_ array (else it contains trash).
   NullLmState pending_lm_state_;
 
-  // indexed: word * order_ + history-length.
-  std::vector<int32> word_to_position_map_;
-
-  void PopulateMap(int32 hist_length) {
-    int32 pos = 0, num_words = num_words_, order = order_;
-    assert(word_to_position_map_.size() ==
-           static_cast<size_t>((num_words + 1) * order));
-    int32 *map_data = &(word_to_position_map_[0]);
-    std::vector<int32>::const_iterator
-        iter = lm_states_[hist_length].predicted.begin(),
-        end = lm_states_[hist_length].predicted.end();
-    for (pos = 0; iter != end; ++iter, pos++) {
-      int32 word = *iter,
-          index = word * order + hist_length;
-      assert(word > 0 && word <= num_words);
-      map_data[index] = pos;
-    }
-  }
+  // indexed by history-length, the position in lm_states_[history-length]
+  // .predicted where the previous search (see FindWord()) ended.
+  std::vector<size_t> search_pos_;
 };
 
 
@@ -159,36 +186,82 @@ class FloatCountsPruner {
  public:
   // usage is:
   // float-counts-prune <threshold> <num-words> <float-counts-input> <protected-counts-input> <order1-counts-output> ... <orderN-counts-output>
-
-  FloatCountsPruner(int argc, const char **argv):
-      order_(argc - 5), outputs_(NULL),
+  // or, if ngram_order > 0 (from the --ngram-order option):
+  // float-counts-prune <threshold> <num-words> <float-counts-input> <protected-counts-input> <float-counts-output>
+  // float_stats_input and float_stats_output (which require ngram_order > 0)
+  // histories_output and cost_histogram_output are empty if the
+  // corresponding options were not given.  part is from the --part option
+  // (else 1).
+  FloatCountsPruner(int32 ngram_order, int32 part,
+                    const std::string &float_stats_input,
+                    const std::string &float_stats_output,
+                    const std::string &histories_output,
+                    const std::string &cost_histogram_output,
+                    int argc, const char **argv):
+      order_(ngram_order > 0 ? ngram_order : argc - 5),
+      part_(part), outputs_(NULL),
+      writer_(NULL), remove_zeros_(!float_stats_input.empty()),
+      stats_writer_(NULL),
       null_counts_reader_(NULL),
-      lm_states_(order_), count_shadowed_(order_),
+      lm_states_(order_), lm_stats_(remove_zeros_ ? order_ : 0),
+      count_shadowed_(order_), cost_histogram_(!cost_histogram_output.empty()),
+      shadowing_cost_(cost_histogram_ ? order_ : 0),
       total_count_(0.0), total_logprob_change_(0.0),
       num_ngrams_(0), num_ngrams_shadowed_(0), num_ngrams_protected_(0),
       num_ngrams_pruned_(0) {
     assert(order_ >= 1);
+    assert(float_stats_input.empty() == float_stats_output.empty() &&
+           (ngram_order > 0 || !remove_zeros_));
     SetThresholdAndNumWords(argv);
     word_to_position_map_.resize((num_words_ + 1) * (order_ - 1));
     OpenInputs(argc, argv);
-    OpenOutputs(argc, argv);
+    if (ngram_order > 0)
+      OpenOutput(argv[5]);
+    else
+      OpenOutputs(argc, argv);
+    if (remove_zeros_)
+      OpenStats(float_stats_input, float_stats_output);
+    if (!histories_output.empty()) {
+      histories_output_.open(histories_output.c_str());
+      if (histories_output_.fail()) {
+        std::cerr << "float-counts-prune: error opening output file '"
+                  << histories_output << "' for writing.\n";
+        exit(1);
+      }
+    }
+    if (cost_histogram_) {
+      cost_histogram_output_.open(cost_histogram_output.c_str());
+      if (cost_histogram_output_.fail()) {
+        std::cerr << "float-counts-prune: error opening output file '"
+                  << cost_histogram_output << "' for writing.\n";
+        exit(1);
+      }
+    }
     null_counts_reader_ = new NullCountsReader(protected_counts_input_,
                                                order_ - 1,
                                                num_words_);
     ProcessInput();
+    if (cost_histogram_)
+      WriteCostHistogram();
   }
 
   ~FloatCountsPruner() {
     delete null_counts_reader_;
-    for (int32 o = 0; o < order_; o++) {
-      outputs_[o].close();
-      if (outputs_[o].fail()) {
-        std::cerr << "float-counts-prune: failed to close an output "
-                  << "file.  Disk full?\n";
-        exit(1);
-      }
+    delete writer_;
+    delete stats_writer_;
+    if (outputs_ != NULL) {
+      for (int32 o = 0; o < order_; o++)
+        CloseOutput(&(outputs_[o]));
+      delete [] outputs_;
+    } else {
+      CloseOutput(&output_);
     }
-    delete [] outputs_;
+    if (remove_zeros_)
+      CloseOutput(&stats_output_);
+    if (histories_output_.is_open())
+      CloseOutput(&histories_output_);
+    if (cost_histogram_)
+      CloseOutput(&cost_histogram_output_);
     // produce some output on stdout:
     std::cout << total_count_ << ' ' << total_logprob_change_ << ' ' << '\n';
 
@@ -254,6 +327,44 @@ class FloatCountsPruner {
     }
   }
 
+  void OpenOutput(const char *filename) {
+    output_.open(filename, std::ios_base::out|std::ios_base::binary);
+    if (output_.fail()) {
+      std::cerr << "float-counts-prune: error opening output file '"
+                << filename << "' for writing.\n";
+      exit(1);
+    }
+    writer_ = new FloatLmStateSortedWriter(output_, order_);
+  }
+
+  void OpenStats(const std::string &float_stats_input,
+                 const std::string &float_stats_output) {
+    stats_input_.open(float_stats_input.c_str(),
+                      std::ios_base::in|std::ios_base::binary);
+    if (stats_input_.fail()) {
+      std::cerr << "float-counts-prune: error opening input file '"
+                << float_stats_input << "'\n";
+      exit(1);
+    }
+    stats_output_.open(float_stats_output.c_str(),
+                       std::ios_base::out|std::ios_base::binary);
+    if (stats_output_.fail()) {
+      std::cerr << "float-counts-prune: error opening output file '"
+                << float_stats_output << "' for writing.\n";
+      exit(1);
+    }
+    stats_writer_ = new FloatLmStateSortedWriter(stats_output_, order_);
+  }
+
+  static void CloseOutput(std::ofstream *output) {
+    output->close();
+    if (output->fail()) {
+      std::cerr << "float-counts-prune: failed to close an output "
+                << "file.  Disk full?\n";
+      exit(1);
+    }
+  }
+
   void OpenOutputs(int argc, const char **argv) {
     outputs_ = new std::ofstream[order_];
     for (int32 i = 0; i < order_; i++) {
@@ -270,19 +381,55 @@ class FloatCountsPruner {
     while (float_counts_input_.peek(), !float_counts_input_.eof()) {
       FloatLmState lm_state;
       lm_state.Read(float_counts_input_);
-      total_count_ += lm_state.total - lm_state.discount;
       int32 history_length = lm_state.history.size();
+      // the unigram state is shared by all parts of a split model, so only
+      // count it for the first part.
+      if (history_length > 0 || part_ == 1)
+        total_count_ += lm_state.total - lm_state.discount;
       assert(history_length < order_ && "float-counts-prune: the order "
              "of the input counts is more than expected given the number of "
              "command-line arguments.");
       // the actual pruning is called from FlushOutput().
       FlushOutput(history_length);
+      if (history_length == 0 && writer_ != NULL)
+        writer_->ReserveUnigramState(lm_state);
       lm_state.Swap(&(lm_states_[history_length]));
       if (static_cast<int32>(history_length) < order_ - 1)
         PopulateMap(history_length);
       InitializeCountShadowed(history_length);
+      if (remove_zeros_)
+        ReadStats(history_length);
     }
     FlushOutput(0);
+    if (remove_zeros_) {
+      stats_input_.peek();
+      if (!stats_input_.eof()) {
+        std::cerr << "float-counts-prune: <float-stats-in> has more input "
+                  << "than <float-counts-input>.  Mismatch?\n";
+        exit(1);
+      }
+    }
+  }
+
+  // Reads the float-stats corresponding to the LM-state that has just been
+  // read into lm_states_[history_length].
+  void ReadStats(int32 history_length) {
+    stats_input_.peek();
+    if (stats_input_.eof()) {
+      std::cerr << "float-counts-prune: <float-stats-in> has less input "
+                << "than <float-counts-input>.  Mismatch?\n";
+      exit(1);
+    }
+    FloatLmState &lm_stats = lm_stats_[history_length];
+    lm_stats.Read(stats_input_);
+    if (lm_stats.history != lm_states_[history_length].history ||
+        lm_stats.counts.size() != lm_states_[history_length].counts.size()) {
+      std::cerr << "float-counts-prune: mismatch in float-counts and "
+                << "float-stats inputs.\n";
+      exit(1);
+    }
+    if (history_length == 0)
+      stats_writer_->ReserveUnigramState(lm_stats);
   }
 
   void PopulateMap(int32 hist_length) {
@@ -306,6 +453,63 @@ class FloatCountsPruner {
     count_shadowed_[hist_length].clear();
     count_shadowed_[hist_length].resize(lm_states_[hist_length].counts.size(),
                                         false);
+    if (cost_histogram_) {
+      shadowing_cost_[hist_length].clear();
+      shadowing_cost_[hist_length].resize(
+          lm_states_[hist_length].counts.size(), 0.0);
+    }
+  }
+
+  // This function is called, if cost_histogram_ is true, for each nonzero
+  // n-gram (other than unigrams), with 'cost' being the threshold above which
+  // we'd prune it if it were not shadowed (i.e. minus the logprob change of
+  // pruning it), or infinity if it is protected.  The n-gram can't be pruned
+  // until all the n-grams that shadow it have been pruned, so its 'effective
+  // cost' is the maximum of 'cost' and the effective costs of those n-grams;
+  // this is added to the histogram, and passed on to the n-gram it shadows.
+  // This means that the number of n-grams whose effective cost is less than
+  // the threshold is exactly the number this program prunes; for other
+  // thresholds, it is an approximation, because the costs depend on which
+  // other n-grams were pruned.
+  void AddToCostHistogram(int32 history_length, size_t pos, float cost) {
+    float effective_cost = std::max(cost,
+                                    shadowing_cost_[history_length][pos]);
+    int32 word = lm_states_[history_length].counts[pos].first,
+        backoff_pos = word_to_position_map_[word * (order_ - 1) +
+                                            history_length - 1];
+    float &backoff_cost = shadowing_cost_[history_length - 1][backoff_pos];
+    backoff_cost = std::max(backoff_cost, effective_cost);
+    if (effective_cost == std::numeric_limits<float>::infinity())
+      return;  // the n-gram can't be pruned at any threshold.
+    int32 bin;
+    if (effective_cost <= 0.0)
+      bin = std::numeric_limits<int32>::min();
+    else
+      bin = static_cast<int32>(floor(log2(effective_cost) * kBinsPerOctave));
+    cost_histogram_counts_[bin]++;
+  }
+
+  // Writes the histogram of effective costs (see AddToCostHistogram()) to
+  // cost_histogram_output_.  Each line is
+  // <cost-lower-bound> <cost-upper-bound> <num-ngrams>
+  // with the bins in increasing order of cost; the first bin, if present, is
+  // "0 0 <num-ngrams>", which contains the n-grams that would be pruned with
+  // any threshold.
+  void WriteCostHistogram() {
+    std::ostream &os = cost_histogram_output_;
+    os << std::setprecision(8);
+    std::map<int32, int64>::const_iterator
+        iter = cost_histogram_counts_.begin(),
+        end = cost_histogram_counts_.end();
+    for (; iter != end; ++iter) {
+      int32 bin = iter->first;
+      if (bin == std::numeric_limits<int32>::min())
+        os << "0 0 ";
+      else
+        os << pow(2.0, bin / static_cast<double>(kBinsPerOctave)) << ' '
+           << pow(2.0, (bin + 1) / static_cast<double>(kBinsPerOctave)) << ' ';
+      os << iter->second << '\n';
+    }
   }
 
   inline void check_divergence_params(double *c_a_h1, double *c_all_h1, double *c_bo_h1,
@@ -465,6 +669,17 @@ class FloatCountsPruner {
   }
 
 
+  // This version of PruningLogprobChange() works out its arguments for the
+  // n-gram of 'word' (whose count is 'count') in the LM-state in
+  // lm_states_[history_length].
+  float PruningLogprobChange(int32 history_length, int32 word, float count) {
+    const FloatLmState &backoff_state = lm_states_[history_length - 1];
+    float backoff_count = backoff_state.total *
+        ProbForWord(word, history_length - 1);
+    return PruningLogprobChange(count, lm_states_[history_length].discount,
+                                backoff_count, backoff_state.total);
+  }
+
   // This function does the pruning for, and then writes out and
   // destroys, the LM-states of all history lengths >= this history-length.
   // This is called prior to reading something in of this history length (to
@@ -476,7 +691,9 @@ class FloatCountsPruner {
         DoPruningForLmState(h);
         UpdateCountShadowed(h);
         lm_states_[h].FixTotalCount();
-        lm_states_[h].Write(outputs_[h]);
+        if (remove_zeros_)
+          RemoveZeros(h);
+        WriteLmState(h);
         // after we make the following call, we treat this history-state
         // as being empty.
         lm_states_[h].counts.clear();
@@ -484,6 +701,95 @@ class FloatCountsPruner {
     }
   }
 
+  // This function removes the zero counts from the (already pruned) LM-state
+  // in lm_states_[history_length], and the corresponding elements of the
+  // float-stats in lm_stats_[history_length], adding them to the float-stats
+  // of the backoff state, as float-counts-stats-remove-zeros does.  The
+  // unigram state is left alone.
+  void RemoveZeros(int32 history_length) {
+    if (history_length == 0)
+      return;
+    FloatLmState &lm_state = lm_states_[history_length],
+        &lm_stats = lm_stats_[history_length],
+        &backoff_lm_stats = lm_stats_[history_length - 1];
+    const int32 *word_to_position_map_data = &(word_to_position_map_[0]);
+    int32 orderm1 = order_ - 1;
+    double extra_discount = 0.0;
+    std::vector<std::pair<int32, float> >::const_iterator
+        counts_in_iter = lm_state.counts.begin(),
+        counts_in_end = lm_state.counts.end(),
+        stats_in_iter = lm_stats.counts.begin();
+    std::vector<std::pair<int32, float> >::iterator
+        counts_out_iter = lm_state.counts.begin(),
+        stats_out_iter = lm_stats.counts.begin();
+    for (; counts_in_iter != counts_in_end;
+         ++counts_in_iter, ++stats_in_iter) {
+      if (counts_in_iter->second != 0.0) {
+        *counts_out_iter = *counts_in_iter;
+        ++counts_out_iter;
+        *stats_out_iter = *stats_in_iter;
+        ++stats_out_iter;
+      } else {
+        // the count was pruned.  Add the stats to those of the lower-order
+        // LM-state.
+        int32 word = stats_in_iter->first;
+        float stats_count = stats_in_iter->second;
+        int32 backoff_pos = word_to_position_map_data[word * orderm1 +
+                                                      history_length - 1];
+        assert(static_cast<size_t>(backoff_pos) < backoff_lm_stats.counts.size()
+               && backoff_lm_stats.counts[backoff_pos].first == word);
+        backoff_lm_stats.counts[backoff_pos].second += stats_count;
+        extra_discount += stats_count;
+      }
+    }
+    lm_state.counts.resize(counts_out_iter - lm_state.counts.begin());
+    lm_stats.counts.resize(stats_out_iter - lm_stats.counts.begin());
+    // the 'discount' term in the stats is defined to include all counts
+    // that weren't explicitly accounted for by n-grams of this order...
+    lm_stats.discount += extra_discount;
+    backoff_lm_stats.total += extra_discount;
+  }
+
+  // This function writes out the LM-state in lm_states_[history_length] (and
+  // if applicable, the corresponding float-stats and history), after it has
+  // been pruned.
+  void WriteLmState(int32 history_length) {
+    const FloatLmState &lm_state = lm_states_[history_length];
+    if (writer_ != NULL)
+      writer_->Write(lm_state);
+    else
+      lm_state.Write(outputs_[history_length]);
+    if (remove_zeros_) {
+      FloatLmState &lm_stats = lm_stats_[history_length];
+      if (!lm_stats.counts.empty())
+        lm_stats.FixTotalCount();
+      stats_writer_->Write(lm_stats);
+      lm_stats.counts.clear();
+    }
+    if (histories_output_.is_open() && history_length > 0)
+      WriteHistory(lm_state);
+  }
+
+  // If the LM-state has any nonzero count, this function writes its history
+  // to histories_output_ in the same format as float-counts-to-histories,
+  // i.e. if the history-state is "a b c" (represented as [ c b a ]), it
+  // writes the line " b a\tc", with each number padded to 7 characters.
+  void WriteHistory(const FloatLmState &lm_state) {
+    std::vector<std::pair<int32, float> >::const_iterator
+        counts_iter = lm_state.counts.begin(),
+        counts_end = lm_state.counts.end();
+    for (; counts_iter != counts_end; ++counts_iter)
+      if (counts_iter->second != 0.0)
+        break;
+    if (counts_iter == counts_end)
+      return;
+    const std::vector<int32> &history = lm_state.history;
+    std::ostream &os = histories_output_;
+    for (size_t i = 1; i < history.size(); i++)
+      os << ' ' << std::setfill(' ') << std::setw(7) << history[i];
+    os << '\t' << std::setfill(' ') << std::setw(7) << history[0] << '\n';
+  }
+
   // This function does the pruning of this LM state, and it assumes that the
   // pruning has already been done for all higher-order LM states.
   // Note: counts are discounted by setting them to zero and moving
@@ -495,7 +801,8 @@ class FloatCountsPruner {
     }
 
     if (history_length == 0) {
-      num_ngrams_per_order_[0] = lm_states_[history_length].counts.size();
+      if (part_ == 1)
+        num_ngrams_per_order_[0] = lm_states_[history_length].counts.size();
       return;  // we don't prune the unigram state.
     }
 
@@ -511,30 +818,41 @@ class FloatCountsPruner {
         counts_end = lm_state.counts.end();
     std::vector<bool>::const_iterator
         shadowed_iter = count_shadowed_[history_length].begin();
+    const float infinity = std::numeric_limits<float>::infinity();
     for (; counts_iter != counts_end; ++counts_iter,++shadowed_iter) {
       int32 word = counts_iter->first;
       float count = counts_iter->second;
       if (count == 0.0)
         continue;  // already pruned.
       num_ngrams_++;
+      size_t pos = counts_iter - lm_state.counts.begin();
       if (*shadowed_iter) {
         num_ngrams_shadowed_++;
         num_ngrams_per_order_[history_length]++;
+        if (cost_histogram_) {
+          bool is_protected =
+              null_counts_reader_->NgramIsProtected(lm_state.history, word);
+          AddToCostHistogram(history_length, pos, is_protected ? infinity :
+                             -PruningLogprobChange(history_length, word,
+                                                   count));
+        }
         continue;  // We can't prune because there is a count for this word in a
                    // history state that backs off to this one.
       }
       if (null_counts_reader_->NgramIsProtected(lm_state.history, word)) {
         num_ngrams_per_order_[history_length]++;
         num_ngrams_protected_++;
+        if (cost_histogram_)
+          AddToCostHistogram(history_length, pos, infinity);
         continue;  // We can't prune because there is a history-state with the
                    // same word-sequence as this n-gram (and there needs to be a
                    // path to get there); this is also a requirement to be able
                    // to format as ARPA.
       }
-      float backoff_count = backoff_state.total * ProbForWord(word, history_length - 1);
       // logprob_change will be negative
-      float logprob_change = PruningLogprobChange(count, lm_state.discount,
-                                                  backoff_count, backoff_state.total);
+      float logprob_change = PruningLogprobChange(history_length, word, count);
+      if (cost_histogram_)
+        AddToCostHistogram(history_length, pos, -logprob_change);
       if (logprob_change > -threshold) {
         // get position of 'word' in the lower-order state.
         int32 pos = word_to_position_map_[word * (order_ - 1) +
@@ -609,8 +927,27 @@ class FloatCountsPruner {
   float threshold_;
   int32 num_words_;
   int32 order_;
-  // outputs, one for each order of N-gram.
+  // the index of the part of a split model that the input is (see the
+  // --part option), or 1.
+  int32 part_;
+  // outputs, one for each order of N-gram (NULL if the --ngram-order option
+  // was given).
   std::ofstream *outputs_;
+  // the output, and the writer that writes the LM-states to it sorted on
+  // history, if the --ngram-order option was given (else writer_ is NULL).
+  std::ofstream output_;
+  FloatLmStateSortedWriter *writer_;
+
+  // true if the --float-stats-in and --float-stats-out options were given, in
+  // which case we remove the zero counts, and restructure the float-stats
+  // to match.
+  bool remove_zeros_;
+  std::ifstream stats_input_;
+  std::ofstream stats_output_;
+  FloatLmStateSortedWriter *stats_writer_;
+
+  // the output for the histories (if the --histories-out option was given).
+  std::ofstream histories_output_;
 
   std::ifstream float_counts_input_;
   std::ifstream protected_counts_input_;
@@ -622,6 +959,10 @@ class FloatCountsPruner {
   // store the stats from work_ that we're about to output.
   std::vector<FloatLmState> lm_states_;
 
+  // The float-stats (see float-counts-to-float-stats) corresponding to the
+  // LM-states in lm_states_, if remove_zeros_ is true; else empty.
+  std::vector<FloatLmState> lm_stats_;
+
   // This vector, of size order_ - 1 tells us for each of the currently loaded
   // LM states (in lm_states_), and for each count, whether there is a
   // higher-order count for the same word that (after pruning) is nonzero.  If
@@ -636,6 +977,23 @@ class FloatCountsPruner {
   // that count) also would disallow pruning.
   std::vector<std::vector<bool> > count_shadowed_;
 
+  // true if the --cost-histogram-out option was given.
+  bool cost_histogram_;
+  std::ofstream cost_histogram_output_;
+
+  // If cost_histogram_ is true, this is indexed like count_shadowed_, and
+  // contains, for each count, the maximum of the effective costs (see
+  // AddToCostHistogram()) of the n-grams that shadow it, or zero if there are
+  // none.
+  std::vector<std::vector<float> > shadowing_cost_;
+
+  // The number of bins per factor of two in the cost histogram.
+  static const int32 kBinsPerOctave = 32;
+
+  // The histogram of effective costs, indexed by bin (the bin for cost c is
+  // floor(log2(c) * kBinsPerOctave), or the lowest int32 value for c <= 0).
+  std::map<int32, int64> cost_histogram_counts_;
+
 
   // This maps from word-index to the position in the 'counts' vectors of the LM
   // states.  It exists to help us do rapid lookup of counts in lower-order
@@ -684,8 +1042,50 @@ class FloatCountsPruner {
 
 
 int main (int argc, const char **argv) {
-  if (argc < 6) {
-    std::cerr << "Usage: float-counts-prune <threshold> <num-words> <float-counts-input> <protected-counts-input> <order1-output> ... <orderN-output>\n"
+  int32 ngram_order = 0;
+  int part = 1, num_parts = 1;
+  std::string float_stats_input, float_stats_output, histories_output,
+      cost_histogram_output;
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option.compare(0, 7, "--part=") == 0) {
+      if (sscanf(argv[1] + 7, "%d/%d", &part, &num_parts) != 2 ||
+          part < 1 || part > num_parts) {
+        std::cerr << "float-counts-prune: bad option " << option << "\n";
+        exit(1);
+      }
+    } else if (option.compare(0, 14, "--ngram-order=") == 0) {
+      ngram_order = atoi(option.c_str() + 14);
+      if (ngram_order < 1) {
+        std::cerr << "float-counts-prune: invalid option " << option << "\n";
+        exit(1);
+      }
+    } else if (option.compare(0, 17, "--float-stats-in=") == 0) {
+      float_stats_input = option.substr(17);
+    } else if (option.compare(0, 18, "--float-stats-out=") == 0) {
+      float_stats_output = option.substr(18);
+    } else if (option.compare(0, 16, "--histories-out=") == 0) {
+      histories_output = option.substr(16);
+    } else if (option.compare(0, 21, "--cost-histogram-out=") == 0) {
+      cost_histogram_output = option.substr(21);
+    } else {
+      std::cerr << "float-counts-prune: unrecognized option " << option
+                << "\n";
+      exit(1);
+    }
+    argc--;
+    argv++;
+  }
+  if (float_stats_input.empty() != float_stats_output.empty() ||
+      (!float_stats_input.empty() && ngram_order == 0)) {
+    std::cerr << "float-counts-prune: the --float-stats-in and "
+              << "--float-stats-out options must be given together, and "
+              << "require --ngram-order.\n";
+    exit(1);
+  }
+  if (ngram_order > 0 ? argc != 6 : argc < 6) {
+    std::cerr << "Usage: float-counts-prune [options] <threshold> <num-words> <float-counts-input> <protected-counts-input> <order1-output> ... <orderN-output>\n"
+              << " or: float-counts-prune --ngram-order=<N> [options] <threshold> <num-words> <float-counts-input> <protected-counts-input> <float-counts-output>\n"
               << "E.g. float-counts-prune 1.6 20000 float.all protected.all float.1 float.2 float.3\n"
               << "This program does entropy pruning of a language model.  Any count that is\n"
               << "not listed in <protected-counts-input> (which will probably be the output\n"
@@ -693,12 +1093,51 @@ int main (int argc, const char **argv) {
               << "from backing off the count to its lower-order history state would be less than\n"
               << "the threshold.\n"
               << "The output is written separately per order, for later\n"
-              << "merging.\n";
+              << "merging, unless the --ngram-order option is given.\n"
+              << "To the standard output, this program prints three lines:\n"
+              << "<total-count> <total-logprob-change>\n"
+              << "<num-xgrams> <num-shadowed> <num-protected> <num-pruned>\n"
+              << "<num-ngrams-order1> ... <num-ngrams-orderN>\n"
+              << "Options:\n"
+              << "  --ngram-order=<N>   Write the pruned counts of all N orders,\n"
+              << "        sorted, to the single file <float-counts-output>, which\n"
+              << "        must be seekable (it can't be a pipe).\n"
+              << "  --float-stats-in=<float-stats-in>\n"
+              << "  --float-stats-out=<float-stats-out>   Remove the zero counts\n"
+              << "        from the output (except from the unigram state), and\n"
+              << "        write <float-stats-in> (as for float-counts-estimate),\n"
+              << "        restructured to match, to <float-stats-out>, as\n"
+              << "        float-counts-stats-remove-zeros would.  Requires\n"
+              << "        --ngram-order.\n"
+              << "  --histories-out=<file>   Write the histories of the pruned\n"
+              << "        LM-states to <file>, as float-counts-to-histories would.\n"
+              << "  --cost-histogram-out=<file>   Write to <file> a histogram of the\n"
+              << "        'effective cost' of each n-gram that is not a unigram, which\n"
+              << "        is the threshold above which this program would have pruned\n"
+              << "        it.  Each line is <cost-lower-bound> <cost-upper-bound> <count>,\n"
+              << "        in increasing order of cost (protected n-grams are not\n"
+              << "        included).  The n-grams with cost below the threshold are\n"
+              << "        exactly the ones that were pruned; for other thresholds the\n"
+              << "        histogram is only an approximation, because the costs depend\n"
+              << "        on which other n-grams were pruned.\n"
+              << "  --part=<i>/<n>   The input is part i of n of a split model\n"
+              << "        (see split-float-counts), whose unigram state is repeated\n"
+              << "        in each part; the parts can be pruned in parallel.  The\n"
+              << "        unigram state is only counted in the stats for part 1, and\n"
+              << "        each part only sees its own changes to it, so afterwards\n"
+              << "        the unigram states of the outputs (and float-stats) should\n"
+              << "        be combined with float-counts-sum-unigrams.\n"
+              << "E.g. float-counts-prune --ngram-order=3 --float-stats-in=stats.all \\\n"
+              << "   --float-stats-out=new/stats.all --histories-out=new/histories \\\n"
+              << "   1.6 20000 float.all protected.all new/float.all\n";
     exit(1);
   }
 
   // everything gets called from the constructor.
-  pocolm::FloatCountsPruner pruner(argc, argv);
+  pocolm::FloatCountsPruner pruner(ngram_order, part,
+                                   float_stats_input,
+                                   float_stats_output, histories_output,
+                                   cost_histogram_output, argc, argv);
 
   return 0;
 }
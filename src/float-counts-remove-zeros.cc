@@ -52,6 +52,7 @@ void RemoveZeroCounts(FloatLmState *lm_state) {
 
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc != 1) {
     std::cerr << "Usage: float-counts-remove-zeros  < <float-counts> > <float-counts>\n"
               << "This program copies float-counts while removing zero counts and\n"
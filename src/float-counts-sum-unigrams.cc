@@ -0,0 +1,220 @@
+// float-counts-sum-unigrams.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iostream>
+#include <fstream>
+#include <math.h>
+#include <vector>
+#include <stdlib.h>
+#include <string.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+
+
+/*
+   This program is used when the parts of a split model (see
+   split-float-counts), whose unigram state is repeated in each part, have
+   been processed separately, by float-counts-prune or float-counts-estimate
+   with the --part option.  It combines the unigram states of the parts, and
+   writes the combined unigram state back to each part, in place; see the
+   usage message for more information.
+*/
+
+
+namespace pocolm {
+
+class UnigramSummer {
+ public:
+  UnigramSummer(bool em, int num_parts, const char **filenames):
+      em_(em) {
+    ReadUnigramState(filenames[0], &old_state_);
+    // Without --em, we start from the old unigram state and add the changes
+    // from each part; with --em, we add up the parts' stats.
+    std::vector<double> counts(old_state_.counts.size(), 0.0);
+    double discount = 0.0, total = 0.0;
+    if (!em_) {
+      for (size_t i = 0; i < counts.size(); i++)
+        counts[i] = old_state_.counts[i].second;
+      discount = old_state_.discount;
+      total = old_state_.total;
+    }
+    std::vector<int64> sizes(num_parts);
+    for (int32 i = 0; i < num_parts; i++) {
+      FloatLmState part_state;
+      sizes[i] = ReadUnigramState(filenames[i + 1], &part_state);
+      CheckSameWords(part_state, filenames[i + 1]);
+      AddState(part_state, &counts, &discount, &total);
+    }
+    FloatLmState new_state;
+    new_state.total = total;
+    new_state.discount = discount;
+    new_state.counts = old_state_.counts;
+    for (size_t i = 0; i < counts.size(); i++)
+      new_state.counts[i].second = counts[i];
+    if (em_)
+      PrintAuxfImpr(new_state);
+    else
+      new_state.FixTotalCount();
+    for (int32 i = 0; i < num_parts; i++)
+      WriteUnigramState(new_state, sizes[i], filenames[i + 1]);
+    std::cerr << "float-counts-sum-unigrams: combined the unigram states of "
+              << num_parts << " parts.\n";
+  }
+
+ private:
+  // Reads the unigram state, which must be the first LM-state, from file
+  // 'filename' and returns its size in bytes.
+  static int64 ReadUnigramState(const char *filename, FloatLmState *lm_state) {
+    std::ifstream input(filename, std::ios_base::in|std::ios_base::binary);
+    if (!input) {
+      std::cerr << "float-counts-sum-unigrams: failed to open '"
+                << filename << "' for reading\n";
+      exit(1);
+    }
+    input.peek();
+    if (input.eof()) {
+      std::cerr << "float-counts-sum-unigrams: file '" << filename
+                << "' is empty.\n";
+      exit(1);
+    }
+    lm_state->Read(input);
+    if (!lm_state->history.empty()) {
+      std::cerr << "float-counts-sum-unigrams: file '" << filename
+                << "' does not start with the unigram state.\n";
+      exit(1);
+    }
+    return input.tellg();
+  }
+
+  void CheckSameWords(const FloatLmState &lm_state,
+                      const char *filename) const {
+    bool same = (lm_state.counts.size() == old_state_.counts.size());
+    for (size_t i = 0; same && i < lm_state.counts.size(); i++)
+      same = (lm_state.counts[i].first == old_state_.counts[i].first);
+    if (!same) {
+      std::cerr << "float-counts-sum-unigrams: the unigram state in file '"
+                << filename << "' has different words from the one in the "
+                << "first file.\n";
+      exit(1);
+    }
+  }
+
+  // Adds the contribution of the unigram state of a part to the combined
+  // counts, discount and total: with --em, that's the state itself (they
+  // contain the E-M stats of the part), else its difference from the old
+  // state (the changes made to it while processing the part).
+  void AddState(const FloatLmState &lm_state, std::vector<double> *counts,
+                double *discount, double *total) const {
+    double scale = (em_ ? 0.0 : 1.0);
+    for (size_t i = 0; i < counts->size(); i++)
+      (*counts)[i] += lm_state.counts[i].second -
+          scale * old_state_.counts[i].second;
+    *discount += lm_state.discount - scale * old_state_.discount;
+    *total += lm_state.total - scale * old_state_.total;
+  }
+
+  // Prints the auxiliary function improvement from replacing the old unigram
+  // state with the new one, computed as in float-counts-estimate.
+  void PrintAuxfImpr(const FloatLmState &new_state) const {
+    double auxf_impr = 0.0;
+    float old_total = old_state_.total, new_total = new_state.total;
+    if (new_state.discount != 0.0) {
+      float old_backoff_prob = old_state_.discount / old_total,
+          new_backoff_prob = new_state.discount / new_total;
+      auxf_impr += new_state.discount * log(new_backoff_prob /
+                                            old_backoff_prob);
+    }
+    for (size_t i = 0; i < new_state.counts.size(); i++) {
+      float count = new_state.counts[i].second,
+          old_prob = old_state_.counts[i].second / old_total,
+          new_prob = count / new_total;
+      if (new_prob != 0.0)
+        auxf_impr += count * log(new_prob / old_prob);
+    }
+    assert(auxf_impr - auxf_impr == 0.0);  // check for NaN.
+    std::cout << auxf_impr << std::endl;
+  }
+
+  static void WriteUnigramState(const FloatLmState &lm_state, int64 size,
+                                const char *filename) {
+    std::fstream output(filename, std::ios_base::in|std::ios_base::out|
+                        std::ios_base::binary);
+    if (!output) {
+      std::cerr << "float-counts-sum-unigrams: failed to open '"
+                << filename << "' for writing\n";
+      exit(1);
+    }
+    lm_state.Write(output);
+    if (output.tellp() != static_cast<std::streampos>(size)) {
+      std::cerr << "float-counts-sum-unigrams: the unigram state in file '"
+                << filename << "' changed in size (is it in the compact "
+                << "format?)\n";
+      exit(1);
+    }
+    output.close();
+    if (output.fail()) {
+      std::cerr << "float-counts-sum-unigrams: failed to close '"
+                << filename << "' (disk full?)\n";
+      exit(1);
+    }
+  }
+
+  bool em_;
+  // the unigram state from the first file, i.e. before the parts were
+  // processed.
+  FloatLmState old_state_;
+};
+
+}  // namespace pocolm
+
+
+int main (int argc, const char **argv) {
+  bool em = false;
+  if (argc > 1 && !strcmp(argv[1], "--em")) {
+    em = true;
+    argc--;
+    argv++;
+  }
+  if (argc < 3) {
+    std::cerr << "Usage: float-counts-sum-unigrams [--em] <float-counts-in> "
+              << "<float-counts-part1> ... <float-counts-partN>\n"
+              << "e.g.: float-counts-sum-unigrams step0/float.all.1 "
+              << "step1/float.all.1 step1/float.all.2\n"
+              << "This program combines the unigram states of the parts of a split\n"
+              << "model (see split-float-counts), after they have been processed\n"
+              << "separately by float-counts-prune or float-counts-estimate with the\n"
+              << "--part option, and writes the combined unigram state back to each\n"
+              << "part, in place.  <float-counts-in> is one of the parts that were\n"
+              << "processed (only its unigram state, which is the same in all of\n"
+              << "them, is read).  Without --em, each part is assumed to have made\n"
+              << "changes to its copy of that unigram state (e.g. by adding the counts\n"
+              << "of pruned bigrams to it), and the combined unigram state has all of\n"
+              << "the changes.  With --em, the unigram states of the parts are the\n"
+              << "E-M stats from float-counts-estimate, and the combined unigram state\n"
+              << "is their sum; the auxiliary function improvement from replacing\n"
+              << "the unigram state of <float-counts-in> with it is printed to the\n"
+              << "standard output.  This works for float-stats too (without --em).\n";
+    exit(1);
+  }
+
+  // everything happens in the constructor.
+  pocolm::UnigramSummer summer(em, argc - 2, argv + 1);
+  return 0;
+}
@@ -0,0 +1,372 @@
+// float-counts-to-arpa-section.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <algorithm>
+#include <cassert>
+#include <functional>
+#include <iomanip>
+#include <iostream>
+#include <fstream>
+#include <math.h>
+#include <queue>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <stdlib.h>
+#include <string.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+
+
+/**
+   This program writes one section (the n-grams of one order) of an ARPA-format
+   language model, directly from one or more indexed float-counts files
+   (float.all, or float.all.1, float.all.2 ... from a split LM-dir).  Unlike
+   float-counts-to-pre-arpa, its output does not need to be sorted: it visits
+   the LM-states of the requested order in the order in which they appear in
+   the (sorted) float-counts files, doing a k-way merge on history if there is
+   more than one file, and it looks up the backoff weight of each n-gram in the
+   LM-state of the next order up via the index.  The probabilities are computed
+   in the same way as in float-counts-to-pre-arpa, so the lines of the output
+   are the same as those of the corresponding section of the ARPA file written
+   by pre-arpa-to-arpa, although they may be in a different order.
+*/
+
+namespace pocolm {
+
+class ArpaSectionWriter {
+ public:
+  ArpaSectionWriter(const std::string &vocab_filename,
+                    const std::vector<std::string> &filenames):
+      ngram_order_(0), lower_order_file_index_(-1) {
+    ReadVocabulary(vocab_filename);
+    for (size_t i = 0; i < filenames.size(); i++) {
+      float_counts_.push_back(new MappedFloatCounts(filenames[i]));
+      if (float_counts_.back()->NumOrders() > ngram_order_)
+        ngram_order_ = float_counts_.back()->NumOrders();
+    }
+  }
+
+  ~ArpaSectionWriter() {
+    for (size_t i = 0; i < float_counts_.size(); i++)
+      delete float_counts_[i];
+  }
+
+  int32 NgramOrder() const { return ngram_order_; }
+
+  // Writes the section of the ARPA file for n-grams of order 'order' (that
+  // is, the line "\<order>-grams:" preceded by an empty line, and then the
+  // n-grams) to 'os'.  Returns the number of n-grams written.
+  int64 WriteSection(int32 order, std::ostream &os) {
+    assert(order >= 1 && order <= ngram_order_);
+    os << std::setprecision(6);
+    os << "\n\\" << order << "-grams:\n";
+    int64 num_ngrams = 0;
+    if (order == 1) {
+      // <s> has a backoff weight but no probability; like pre-arpa-to-arpa,
+      // we print -99 as its log-prob.  The following relies on the fact that
+      // kBosSymbol == 1, documented in pocolm-types.h.
+      os << "-99\t" << vocab_[kBosSymbol];
+      std::vector<int32> bos_history(1, kBosSymbol);
+      float backoff_log_prob;
+      if (GetBackoffLogProb(bos_history, &backoff_log_prob))
+        os << '\t' << backoff_log_prob;
+      os << '\n';
+      num_ngrams++;
+    }
+
+    // 'queue' contains, for each float-counts file that has LM-states of this
+    // order that we have not yet processed, the history of the next such
+    // LM-state and the index of the file; 'next_state' contains the index
+    // (as used in MappedFloatCounts::Offset()) of that LM-state.
+    typedef std::pair<std::vector<int32>, int32> QueueElement;
+    std::priority_queue<QueueElement, std::vector<QueueElement>,
+                        std::greater<QueueElement> > queue;
+    std::vector<int64> next_state(float_counts_.size(), 0);
+    FloatLmState lm_state;
+    for (size_t i = 0; i < float_counts_.size(); i++) {
+      if (float_counts_[i]->NumOrders() >= order &&
+          float_counts_[i]->NumStates(order) > 0) {
+        float_counts_[i]->ReadState(float_counts_[i]->Offset(order, 0),
+                                    &lm_state);
+        queue.push(QueueElement(lm_state.history, i));
+      }
+    }
+    std::vector<int32> prev_history;
+    bool first_state = true;
+    while (!queue.empty()) {
+      int32 i = queue.top().second;
+      queue.pop();
+      const MappedFloatCounts &float_counts = *(float_counts_[i]);
+      int64 offset = float_counts.Offset(order, next_state[i]);
+      float_counts.ReadState(offset, &lm_state);
+      if (++next_state[i] < float_counts.NumStates(order)) {
+        FloatLmState next_lm_state;
+        float_counts.ReadState(float_counts.Offset(order, next_state[i]),
+                               &next_lm_state);
+        queue.push(QueueElement(next_lm_state.history, i));
+      }
+      // the unigram LM-state is in all the files of a split LM; we only want
+      // it once.
+      if (!first_state && lm_state.history == prev_history)
+        continue;
+      first_state = false;
+      prev_history = lm_state.history;
+      num_ngrams += WriteLmState(i, lm_state, os);
+    }
+    if (os.fail()) {
+      std::cerr << "float-counts-to-arpa-section: failure to write output "
+                << "(disk full?)\n";
+      exit(1);
+    }
+    return num_ngrams;
+  }
+
+ private:
+  // Writes the n-grams predicted by 'lm_state', which came from the
+  // float-counts file with index 'file_index', to 'os' and returns their
+  // number.
+  int64 WriteLmState(int32 file_index, const FloatLmState &lm_state,
+                     std::ostream &os) {
+    int32 hist_length = lm_state.history.size();
+    if (hist_length == 0)
+      assert(lm_state.total > 0 &&
+             "Zero count for 1-gram history state (something went wrong?)");
+    FindLowerOrderStates(file_index, lm_state.history);
+    // 'words' will be something like "the cat ", consisting of the history
+    // in its natural order.
+    std::ostringstream words;
+    for (int32 j = hist_length - 1; j >= 0; j--)
+      words << GetWord(lm_state.history[j]) << ' ';
+    std::string words_str = words.str();
+
+    // 'backoff_history' is the reversed history of the LM-state for which
+    // each n-gram is the history: the predicted word followed by this
+    // LM-state's history.
+    std::vector<int32> backoff_history(hist_length + 1);
+    std::copy(lm_state.history.begin(), lm_state.history.end(),
+              backoff_history.begin() + 1);
+
+    std::vector<std::pair<int32, float> >::const_iterator
+        iter = lm_state.counts.begin(),
+        end = lm_state.counts.end();
+    float total_count = lm_state.total,
+        discount_prob = lm_state.discount / total_count;
+    for (; iter != end; ++iter) {
+      int32 word = iter->first;
+      float prob = iter->second / total_count;
+      if (hist_length > 0)
+        prob += discount_prob * GetProbability(hist_length - 1, word);
+      float log10_prob = log10f(prob);
+      assert(log10_prob - log10_prob == 0.0);  // check for NaN/inf.
+      os << log10_prob << '\t' << words_str << GetWord(word);
+      backoff_history[0] = word;
+      float backoff_log_prob;
+      if (GetBackoffLogProb(backoff_history, &backoff_log_prob))
+        os << '\t' << backoff_log_prob;
+      os << '\n';
+    }
+    return lm_state.counts.size();
+  }
+
+  // Sets lower_order_offsets_[h] for 0 <= h < history.size() to the offset
+  // of the LM-state whose history is the first h words of 'history' (the
+  // reversed history of an LM-state in the float-counts file with index
+  // 'file_index').  These LM-states are in the same file, because the files
+  // of a split LM are split on the most recent word of the history, and the
+  // unigram LM-state is in all of them.  Since we visit LM-states in sorted
+  // order, these usually have not changed since the previous call.
+  void FindLowerOrderStates(int32 file_index,
+                            const std::vector<int32> &history) {
+    if (file_index != lower_order_file_index_) {
+      lower_order_offsets_.clear();
+      lower_order_histories_.clear();
+      lower_order_file_index_ = file_index;
+    }
+    const MappedFloatCounts &float_counts = *(float_counts_[file_index]);
+    size_t hist_length = history.size();
+    if (lower_order_offsets_.size() < hist_length) {
+      lower_order_offsets_.resize(hist_length, -1);
+      lower_order_histories_.resize(hist_length);
+    }
+    for (size_t h = 0; h < hist_length; h++) {
+      std::vector<int32> &this_history = lower_order_histories_[h];
+      if (lower_order_offsets_[h] != -1 &&
+          std::equal(this_history.begin(), this_history.end(),
+                     history.begin()))
+        continue;
+      this_history.assign(history.begin(), history.begin() + h);
+      int64 index = float_counts.FindState(this_history);
+      if (index == -1) {
+        std::cerr << "float-counts-to-arpa-section: an LM-state of order "
+                  << (h + 1) << " is missing (bad float-counts?)\n";
+        exit(1);
+      }
+      lower_order_offsets_[h] = float_counts.Offset(h + 1, index);
+    }
+  }
+
+  // This function gets the probability (not log-prob) of word 'word' given
+  // the lower-order LM-state with history-length 'hist_length' found by
+  // FindLowerOrderStates(), including backoff.  It does the same computation
+  // as GetProbability() in float-counts-to-pre-arpa.
+  float GetProbability(int32 hist_length, int32 word) const {
+    float total, discount, numerator;
+    float_counts_[lower_order_file_index_]->LookupCount(
+        lower_order_offsets_[hist_length], word, &total, &discount, &numerator);
+    if (hist_length == 0 && numerator == 0.0) {
+      std::cerr << "float-counts-to-arpa-section: word " << word
+                << " has zero count in unigram counts.\n";
+      exit(1);
+    }
+    // we allow the count to be zero for orders >0, because it might be
+    // possible that we'd prune away a lower-order count while keeping a
+    // higher-order one.
+    if (hist_length > 0)
+      numerator += discount * GetProbability(hist_length - 1, word);
+    return numerator / total;
+  }
+
+  // If there is an LM-state with history 'history' (reversed, as always),
+  // sets 'backoff_log_prob' to the log10 of its backoff weight and returns
+  // true; otherwise returns false.
+  bool GetBackoffLogProb(const std::vector<int32> &history,
+                         float *backoff_log_prob) const {
+    if (static_cast<int32>(history.size()) >= ngram_order_)
+      return false;
+    for (size_t i = 0; i < float_counts_.size(); i++) {
+      int64 index = float_counts_[i]->FindState(history);
+      if (index != -1) {
+        float total, discount, unused_count;
+        float_counts_[i]->LookupCount(
+            float_counts_[i]->Offset(history.size() + 1, index), 0,
+            &total, &discount, &unused_count);
+        float discount_prob = discount / total;
+        *backoff_log_prob = log10f(discount_prob);
+        return true;
+      }
+    }
+    return false;
+  }
+
+  const std::string &GetWord(int32 word) const {
+    if (word <= 0 || static_cast<size_t>(word) >= vocab_.size()) {
+      std::cerr << "float-counts-to-arpa-section: word " << word
+                << " is out of range: the vocabulary size is "
+                << vocab_.size() << "\n";
+      exit(1);
+    }
+    return vocab_[word];
+  }
+
+  // this reads a file like 'words.txt', that should look a bit like
+  // <eps> 0
+  // <s> 1
+  // </s> 2
+  // <unk> 3
+  // the 4
+  // .. and so on.
+  void ReadVocabulary(const std::string &vocab_filename) {
+    std::ifstream vocab_stream(vocab_filename.c_str());
+    if (vocab_stream.fail()) {
+      std::cerr << "float-counts-to-arpa-section: error opening vocabulary "
+                << "file '" << vocab_filename << "'\n";
+      exit(1);
+    }
+    std::string line;
+    while (std::getline(vocab_stream, line)) {
+      std::istringstream is(line);
+      int32 i = -1;
+      std::string word;
+      is >> word >> i >> std::ws;
+      is.peek();  // so it will register as EOF.
+      if (i == -1 || !is.eof()) {
+        std::cerr << "float-counts-to-arpa-section: could not interpret the "
+                  << "following line (line " << (vocab_.size() + 1)
+                  << ") of the file " << vocab_filename << ": " << line;
+        exit(1);
+      }
+      if (static_cast<size_t>(i) != vocab_.size()) {
+        std::cerr << "float-counts-to-arpa-section: expected the vocab file "
+                  << vocab_filename << " to have lines in order: unexpected "
+                  << (vocab_.size() + 1) << "'th line " << line;
+        exit(1);
+      }
+      vocab_.push_back(word);
+    }
+  }
+
+  std::vector<MappedFloatCounts*> float_counts_;
+  int32 ngram_order_;
+
+  // vocab_[i] is the printed form of symbol i, e.g. vocab_[3] = "<unk>"
+  // normally.
+  std::vector<std::string> vocab_;
+
+  // the index of the float-counts file that contains the LM-states found by
+  // FindLowerOrderStates().
+  int32 lower_order_file_index_;
+  // lower_order_offsets_[h] is the offset in that file of the LM-state with
+  // history-length h that the current LM-state backs off to (or -1 if not
+  // yet known), and lower_order_histories_[h] is its history.
+  std::vector<int64> lower_order_offsets_;
+  std::vector<std::vector<int32> > lower_order_histories_;
+};
+
+}  // namespace pocolm
+
+
+int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
+  if (argc < 4) {
+    std::cerr << "Usage: float-counts-to-arpa-section <order> <vocab-file> "
+              << "<float-counts1> [<float-counts2> ...] > <arpa-section>\n"
+              << "e.g.: float-counts-to-arpa-section 2 words.txt float.all > 2.arpa\n"
+              << "This program writes the section of an ARPA-format LM for the\n"
+              << "n-grams of order <order> (starting with an empty line and the\n"
+              << "line '\\<order>-grams:'), directly from the float-counts files\n"
+              << "(e.g. float.all, or float.all.1 float.all.2 ... from a split\n"
+              << "LM-dir), which must have been indexed with float-counts-index.\n"
+              << "It does not require the output to be sorted.  The sections of the\n"
+              << "different orders can be computed in parallel and concatenated,\n"
+              << "after a header with the numbers of n-grams; see format_arpa_lm.py.\n"
+              << "The number of n-grams written is printed to the standard error.\n";
+    exit(1);
+  }
+
+  char *end;
+  int32 order = strtol(argv[1], &end, 10);
+  if (end == argv[1] || *end != '\0' || order < 1) {
+    std::cerr << "float-counts-to-arpa-section: command line: expected "
+              << "n-gram order, got '" << argv[1] << "'\n";
+    exit(1);
+  }
+  std::vector<std::string> filenames(argv + 3, argv + argc);
+  pocolm::ArpaSectionWriter writer(argv[2], filenames);
+  if (order > writer.NgramOrder()) {
+    std::cerr << "float-counts-to-arpa-section: order " << order
+              << " exceeds the n-gram order " << writer.NgramOrder()
+              << " of the float-counts\n";
+    exit(1);
+  }
+  int64 num_ngrams = writer.WriteSection(order, std::cout);
+  std::cerr << "float-counts-to-arpa-section: wrote " << num_ngrams << ' '
+            << order << "-grams\n";
+  return 0;
+}
@@ -0,0 +1,539 @@
+// float-counts-to-binary-lm.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <algorithm>
+#include <cassert>
+#include <functional>
+#include <iostream>
+#include <fstream>
+#include <math.h>
+#include <queue>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <stdlib.h>
+#include <string.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+#include "binary-lm.h"
+
+
+/**
+   This program writes a language model in the binary LM format described in
+   binary-lm.h, directly from one or more indexed float-counts files
+   (float.all, or float.all.1, float.all.2 ... from a split LM-dir).  It
+   computes the same log10 probabilities and backoff weights as
+   float-counts-to-pre-arpa (and float-counts-to-arpa-section), and quantizes
+   them with a codebook for each order.  It processes one order at a time,
+   visiting the LM-states of that order in sorted order (doing a k-way merge
+   if there is more than one file); the memory it needs is dominated by the
+   log-probs of the n-grams of one order (8 bytes per n-gram) and the LM-states
+   of two orders.
+*/
+
+namespace pocolm {
+
+// This class visits the LM-states of a particular order from several
+// float-counts files, in sorted order (the unigram LM-state, which is in all
+// the files of a split LM, is only visited once).
+class FloatCountsMerger {
+ public:
+  FloatCountsMerger(const std::vector<MappedFloatCounts*> &float_counts,
+                    int32 order):
+      float_counts_(float_counts), order_(order),
+      next_state_(float_counts.size(), 0), have_prev_history_(false) {
+    FloatLmState lm_state;
+    for (size_t i = 0; i < float_counts_.size(); i++) {
+      if (order >= 1 && float_counts_[i]->NumOrders() >= order &&
+          float_counts_[i]->NumStates(order) > 0) {
+        float_counts_[i]->ReadState(float_counts_[i]->Offset(order, 0),
+                                    &lm_state);
+        queue_.push(QueueElement(lm_state.history, i));
+      }
+    }
+  }
+
+  // Reads the next LM-state into 'lm_state', and sets 'file_index' to the
+  // index of the file it came from.  Returns false if there are no more
+  // LM-states.
+  bool Next(FloatLmState *lm_state, int32 *file_index) {
+    while (!queue_.empty()) {
+      int32 i = queue_.top().second;
+      queue_.pop();
+      const MappedFloatCounts &float_counts = *(float_counts_[i]);
+      float_counts.ReadState(float_counts.Offset(order_, next_state_[i]),
+                             lm_state);
+      if (++next_state_[i] < float_counts.NumStates(order_)) {
+        FloatLmState next_lm_state;
+        float_counts.ReadState(float_counts.Offset(order_, next_state_[i]),
+                               &next_lm_state);
+        queue_.push(QueueElement(next_lm_state.history, i));
+      }
+      if (have_prev_history_ && lm_state->history == prev_history_)
+        continue;
+      have_prev_history_ = true;
+      prev_history_ = lm_state->history;
+      *file_index = i;
+      return true;
+    }
+    return false;
+  }
+
+ private:
+  typedef std::pair<std::vector<int32>, int32> QueueElement;
+  const std::vector<MappedFloatCounts*> &float_counts_;
+  int32 order_;
+  // for each file, the index of the next LM-state of this order in it.
+  std::vector<int64> next_state_;
+  // for each file that has LM-states we have not visited, the history of the
+  // next one and the index of the file.
+  std::priority_queue<QueueElement, std::vector<QueueElement>,
+                      std::greater<QueueElement> > queue_;
+  // the history of the previous LM-state, if there was one.
+  bool have_prev_history_;
+  std::vector<int32> prev_history_;
+};
+
+
+class BinaryLmWriter {
+ public:
+  BinaryLmWriter(int32 quantization_bits, const std::string &vocab_filename,
+                 const std::vector<std::string> &filenames):
+      quantization_bits_(quantization_bits), ngram_order_(0),
+      lower_order_file_index_(-1) {
+    ReadVocabulary(vocab_filename);
+    for (size_t i = 0; i < filenames.size(); i++) {
+      float_counts_.push_back(new MappedFloatCounts(filenames[i]));
+      if (float_counts_.back()->NumOrders() > ngram_order_)
+        ngram_order_ = float_counts_.back()->NumOrders();
+    }
+  }
+
+  ~BinaryLmWriter() {
+    for (size_t i = 0; i < float_counts_.size(); i++)
+      delete float_counts_[i];
+  }
+
+  void Write(const std::string &filename) {
+    output_.open(filename.c_str(), std::ios_base::out|std::ios_base::binary);
+    if (!output_) {
+      std::cerr << "float-counts-to-binary-lm: failed to open '"
+                << filename << "' for writing\n";
+      exit(1);
+    }
+    BinaryLmHeader header;
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, kBinaryLmMagic, sizeof(header.magic));
+    header.version = kBinaryLmVersion;
+    header.ngram_order = ngram_order_;
+    header.num_words = vocab_.size() - 1;
+    header.quantization_bits = quantization_bits_;
+    order_info_.resize(ngram_order_);
+    memset(&(order_info_[0]), 0, sizeof(BinaryLmOrderInfo) * ngram_order_);
+    // we write the header and order info again at the end, when we know the
+    // offsets.
+    WriteHeader(header);
+
+    std::string vocab;
+    for (size_t i = 0; i < vocab_.size(); i++) {
+      vocab.append(vocab_[i]);
+      vocab.push_back('\0');
+    }
+    header.vocab_offset = Align();
+    header.vocab_bytes = vocab.size();
+    output_.write(vocab.data(), vocab.size());
+
+    for (int32 order = 1; order <= ngram_order_; order++) {
+      ProcessOrder(order);
+      if (order > 1)
+        WriteStates(order - 1);
+      prev_states_.swap(cur_states_);
+    }
+    WriteStates(ngram_order_);
+
+    output_.seekp(0);
+    WriteHeader(header);
+    output_.close();
+    if (output_.fail()) {
+      std::cerr << "float-counts-to-binary-lm: error writing to '" << filename
+                << "' (disk full?)\n";
+      exit(1);
+    }
+    std::cerr << "float-counts-to-binary-lm: wrote " << filename << " with [ ";
+    for (int32 o = 0; o < ngram_order_; o++)
+      std::cerr << order_info_[o].num_ngrams << ' ';
+    std::cerr << "] n-grams\n";
+  }
+
+ private:
+  void WriteHeader(const BinaryLmHeader &header) {
+    output_.write(reinterpret_cast<const char*>(&header), sizeof(header));
+    output_.write(reinterpret_cast<const char*>(&(order_info_[0])),
+                  sizeof(BinaryLmOrderInfo) * ngram_order_);
+  }
+
+  // Pads the output with zeros to a multiple of 8 bytes, and returns the
+  // position.
+  int64 Align() {
+    int64 pos = output_.tellp();
+    while (pos % 8 != 0) {
+      output_.put('\0');
+      pos++;
+    }
+    return pos;
+  }
+
+  // Processes the LM-states of order 'order': writes the codebooks and the
+  // n-gram arrays for this order, sets up cur_states_, and sets the
+  // children_begin of the LM-states in prev_states_ (the previous order).
+  void ProcessOrder(int32 order) {
+    BinaryLmOrderInfo &info = order_info_[order - 1];
+    // we write the words as we go, and the log-probs at the end, since we
+    // need all of them to work out the codebook.
+    info.words_offset = Align();
+    std::vector<float> log_probs, backoffs;
+    cur_states_.clear();
+    // num_children[p] is the number of LM-states of this order whose parent
+    // is prev_states_[p].
+    std::vector<int64> num_children(prev_states_.size(), 0);
+    FloatCountsMerger merger(float_counts_, order);
+    FloatCountsMerger parent_merger(float_counts_, order - 1);
+    FloatLmState lm_state, parent_lm_state;
+    int64 parent = -1;
+    int32 file_index, parent_file_index;
+    std::vector<int32> words;
+    while (merger.Next(&lm_state, &file_index)) {
+      int32 hist_length = lm_state.history.size();
+      if (order > 1) {
+        // find the parent: the LM-state of the previous order whose history
+        // is this one's without the least recent word.
+        while (parent == -1 || !std::equal(parent_lm_state.history.begin(),
+                                           parent_lm_state.history.end(),
+                                           lm_state.history.begin())) {
+          if (!parent_merger.Next(&parent_lm_state, &parent_file_index)) {
+            std::cerr << "float-counts-to-binary-lm: an LM-state of order "
+                      << (order - 1) << " is missing (bad float-counts?)\n";
+            exit(1);
+          }
+          parent++;
+        }
+        num_children[parent]++;
+      }
+      BinaryLmState state;
+      memset(&state, 0, sizeof(state));
+      state.word = (hist_length == 0 ? 0 : lm_state.history.back());
+      state.ngrams_begin = info.num_ngrams;
+      cur_states_.push_back(state);
+      // the backoff weight of the unigram LM-state is never used.
+      backoffs.push_back(hist_length == 0 ? 0.0 :
+                         log10f(lm_state.discount / lm_state.total));
+      ComputeLogProbs(file_index, lm_state, &log_probs);
+      words.resize(lm_state.counts.size());
+      for (size_t i = 0; i < lm_state.counts.size(); i++)
+        words[i] = lm_state.counts[i].first;
+      if (!words.empty())
+        output_.write(reinterpret_cast<const char*>(&(words[0])),
+                      sizeof(int32) * words.size());
+      info.num_ngrams += words.size();
+    }
+    info.num_states = cur_states_.size();
+    if (order == 1 && info.num_states != 1) {
+      std::cerr << "float-counts-to-binary-lm: expected one unigram "
+                << "LM-state\n";
+      exit(1);
+    }
+    // the end marker.
+    BinaryLmState end;
+    memset(&end, 0, sizeof(end));
+    end.ngrams_begin = info.num_ngrams;
+    cur_states_.push_back(end);
+
+    // set children_begin for the previous order.
+    int64 children_begin = 0;
+    for (size_t p = 0; p < prev_states_.size(); p++) {
+      prev_states_[p].children_begin = children_begin;
+      if (p < num_children.size())
+        children_begin += num_children[p];
+    }
+
+    std::vector<float> codebook;
+    std::vector<uint16> codes;
+    MakeCodebook(log_probs, &codebook);
+    info.prob_codebook_size = codebook.size();
+    info.prob_codebook_offset = WriteCodebook(codebook);
+    Quantize(codebook, log_probs, &codes);
+    info.probs_offset = Align();
+    if (!codes.empty())
+      output_.write(reinterpret_cast<const char*>(&(codes[0])),
+                    sizeof(uint16) * codes.size());
+
+    MakeCodebook(backoffs, &codebook);
+    info.backoff_codebook_size = codebook.size();
+    info.backoff_codebook_offset = WriteCodebook(codebook);
+    Quantize(codebook, backoffs, &codes);
+    for (size_t i = 0; i < codes.size(); i++)
+      cur_states_[i].backoff = codes[i];
+  }
+
+  // Writes the LM-states of order 'order' (which are in prev_states_).
+  void WriteStates(int32 order) {
+    std::vector<BinaryLmState> &states = prev_states_;
+    if (order == ngram_order_) {
+      // the last order has no children.
+      for (size_t i = 0; i < states.size(); i++)
+        states[i].children_begin = 0;
+    }
+    order_info_[order - 1].states_offset = Align();
+    output_.write(reinterpret_cast<const char*>(&(states[0])),
+                  sizeof(BinaryLmState) * states.size());
+  }
+
+  int64 WriteCodebook(const std::vector<float> &codebook) {
+    int64 offset = Align();
+    output_.write(reinterpret_cast<const char*>(&(codebook[0])),
+                  sizeof(float) * codebook.size());
+    return offset;
+  }
+
+  // Computes the codebook for the values in 'values', which will be sorted and
+  // have at most 1 << quantization_bits_ entries.  If there are no more
+  // distinct values than that, they are all in the codebook (so the
+  // quantization is lossless); otherwise we divide the sorted values into
+  // bins with equal numbers of values, and the codebook contains the mean of
+  // each bin.
+  void MakeCodebook(const std::vector<float> &values,
+                    std::vector<float> *codebook) const {
+    size_t codebook_size = 1 << quantization_bits_;
+    std::vector<float> sorted_values(values);
+    std::sort(sorted_values.begin(), sorted_values.end());
+    size_t num_distinct = 0;
+    for (size_t i = 0; i < sorted_values.size(); i++)
+      if (i == 0 || sorted_values[i] != sorted_values[i - 1])
+        num_distinct++;
+    codebook->clear();
+    if (num_distinct <= codebook_size) {
+      codebook->assign(sorted_values.begin(),
+                       std::unique(sorted_values.begin(),
+                                   sorted_values.end()));
+    } else {
+      size_t n = sorted_values.size();
+      for (size_t b = 0; b < codebook_size; b++) {
+        size_t begin = n * b / codebook_size,
+            end = n * (b + 1) / codebook_size;
+        double sum = 0.0;
+        for (size_t i = begin; i < end; i++)
+          sum += sorted_values[i];
+        codebook->push_back(sum / (end - begin));
+      }
+    }
+    if (codebook->empty())
+      codebook->push_back(0.0);
+  }
+
+  // Sets 'codes' to the index of the nearest codebook entry for each of
+  // 'values'.
+  static void Quantize(const std::vector<float> &codebook,
+                       const std::vector<float> &values,
+                       std::vector<uint16> *codes) {
+    codes->resize(values.size());
+    for (size_t i = 0; i < values.size(); i++) {
+      float value = values[i];
+      size_t pos = std::lower_bound(codebook.begin(), codebook.end(), value) -
+          codebook.begin();
+      if (pos == codebook.size() ||
+          (pos > 0 && codebook[pos] != value &&
+           value - codebook[pos - 1] < codebook[pos] - value))
+        pos--;
+      (*codes)[i] = pos;
+    }
+  }
+
+  // Appends the log10 probabilities of the words predicted by 'lm_state',
+  // which came from the float-counts file with index 'file_index', to
+  // 'log_probs'.  This is the same computation as in
+  // float-counts-to-pre-arpa.
+  void ComputeLogProbs(int32 file_index, const FloatLmState &lm_state,
+                       std::vector<float> *log_probs) {
+    int32 hist_length = lm_state.history.size();
+    if (hist_length == 0)
+      assert(lm_state.total > 0 &&
+             "Zero count for 1-gram history state (something went wrong?)");
+    FindLowerOrderStates(file_index, lm_state.history);
+    float total_count = lm_state.total,
+        discount_prob = lm_state.discount / total_count;
+    std::vector<std::pair<int32, float> >::const_iterator
+        iter = lm_state.counts.begin(),
+        end = lm_state.counts.end();
+    for (; iter != end; ++iter) {
+      int32 word = iter->first;
+      if (word <= 0 || static_cast<size_t>(word) >= vocab_.size()) {
+        std::cerr << "float-counts-to-binary-lm: word " << word
+                  << " is out of range: the vocabulary size is "
+                  << vocab_.size() << "\n";
+        exit(1);
+      }
+      float prob = iter->second / total_count;
+      if (hist_length > 0)
+        prob += discount_prob * GetProbability(hist_length - 1, word);
+      float log10_prob = log10f(prob);
+      assert(log10_prob - log10_prob == 0.0);  // check for NaN/inf.
+      log_probs->push_back(log10_prob);
+    }
+  }
+
+  // See FindLowerOrderStates() in float-counts-to-arpa-section.cc.
+  void FindLowerOrderStates(int32 file_index,
+                            const std::vector<int32> &history) {
+    if (file_index != lower_order_file_index_) {
+      lower_order_offsets_.clear();
+      lower_order_histories_.clear();
+      lower_order_file_index_ = file_index;
+    }
+    const MappedFloatCounts &float_counts = *(float_counts_[file_index]);
+    size_t hist_length = history.size();
+    if (lower_order_offsets_.size() < hist_length) {
+      lower_order_offsets_.resize(hist_length, -1);
+      lower_order_histories_.resize(hist_length);
+    }
+    for (size_t h = 0; h < hist_length; h++) {
+      std::vector<int32> &this_history = lower_order_histories_[h];
+      if (lower_order_offsets_[h] != -1 &&
+          std::equal(this_history.begin(), this_history.end(),
+                     history.begin()))
+        continue;
+      this_history.assign(history.begin(), history.begin() + h);
+      int64 index = float_counts.FindState(this_history);
+      if (index == -1) {
+        std::cerr << "float-counts-to-binary-lm: an LM-state of order "
+                  << (h + 1) << " is missing (bad float-counts?)\n";
+        exit(1);
+      }
+      lower_order_offsets_[h] = float_counts.Offset(h + 1, index);
+    }
+  }
+
+  // See GetProbability() in float-counts-to-arpa-section.cc.
+  float GetProbability(int32 hist_length, int32 word) const {
+    float total, discount, numerator;
+    float_counts_[lower_order_file_index_]->LookupCount(
+        lower_order_offsets_[hist_length], word, &total, &discount, &numerator);
+    if (hist_length == 0 && numerator == 0.0) {
+      std::cerr << "float-counts-to-binary-lm: word " << word
+                << " has zero count in unigram counts.\n";
+      exit(1);
+    }
+    if (hist_length > 0)
+      numerator += discount * GetProbability(hist_length - 1, word);
+    return numerator / total;
+  }
+
+  // this reads a file like 'words.txt'; see ReadVocabulary() in
+  // pre-arpa-to-arpa.cc.
+  void ReadVocabulary(const std::string &vocab_filename) {
+    std::ifstream vocab_stream(vocab_filename.c_str());
+    if (vocab_stream.fail()) {
+      std::cerr << "float-counts-to-binary-lm: error opening vocabulary "
+                << "file '" << vocab_filename << "'\n";
+      exit(1);
+    }
+    std::string line;
+    while (std::getline(vocab_stream, line)) {
+      std::istringstream is(line);
+      int32 i = -1;
+      std::string word;
+      is >> word >> i >> std::ws;
+      is.peek();  // so it will register as EOF.
+      if (i == -1 || !is.eof() ||
+          static_cast<size_t>(i) != vocab_.size()) {
+        std::cerr << "float-counts-to-binary-lm: bad line "
+                  << (vocab_.size() + 1) << " of the vocabulary file "
+                  << vocab_filename << ": " << line << "\n";
+        exit(1);
+      }
+      vocab_.push_back(word);
+    }
+    if (vocab_.size() < 4) {
+      std::cerr << "float-counts-to-binary-lm: vocabulary file "
+                << vocab_filename << " is too small.\n";
+      exit(1);
+    }
+  }
+
+  int32 quantization_bits_;
+  std::vector<MappedFloatCounts*> float_counts_;
+  int32 ngram_order_;
+  std::vector<std::string> vocab_;
+
+  std::ofstream output_;
+  std::vector<BinaryLmOrderInfo> order_info_;
+  // the LM-states of the order we are processing, and of the previous order
+  // (which can't be written until we know where their children begin).
+  std::vector<BinaryLmState> cur_states_;
+  std::vector<BinaryLmState> prev_states_;
+
+  // the index of the float-counts file that contains the LM-states found by
+  // FindLowerOrderStates(), their offsets and their histories.
+  int32 lower_order_file_index_;
+  std::vector<int64> lower_order_offsets_;
+  std::vector<std::vector<int32> > lower_order_histories_;
+};
+
+}  // namespace pocolm
+
+
+int main (int argc, const char **argv) {
+  int32 quantization_bits = 16;
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option.compare(0, 20, "--quantization-bits=") == 0) {
+      quantization_bits = atoi(option.c_str() + 20);
+      if (quantization_bits < 1 || quantization_bits > 16) {
+        std::cerr << "float-counts-to-binary-lm: invalid option " << option
+                  << "\n";
+        exit(1);
+      }
+    } else {
+      std::cerr << "float-counts-to-binary-lm: unrecognized option " << option
+                << "\n";
+      exit(1);
+    }
+    argc--;
+    argv++;
+  }
+  if (argc < 4) {
+    std::cerr << "Usage: float-counts-to-binary-lm [options] <vocab-file> "
+              << "<binary-lm-out> <float-counts1> [<float-counts2> ...]\n"
+              << "e.g.: float-counts-to-binary-lm words.txt lm.bin float.all\n"
+              << "This program writes the LM in the float-counts files (e.g.\n"
+              << "float.all, or float.all.1 float.all.2 ... from a split LM-dir;\n"
+              << "they must have been indexed with float-counts-index) in the\n"
+              << "memory-mappable binary LM format described in binary-lm.h, with\n"
+              << "the same log10 probabilities and backoff weights as the ARPA\n"
+              << "format, but quantized.  See also binary-lm-to-arpa.\n"
+              << "Options:\n"
+              << "  --quantization-bits=<b>  The number of bits (1 to 16) of the\n"
+              << "               quantized log-probs and backoff weights [16].\n";
+    exit(1);
+  }
+
+  std::vector<std::string> filenames(argv + 3, argv + argc);
+  pocolm::BinaryLmWriter writer(quantization_bits, argv[1], filenames);
+  writer.Write(argv[2]);
+  return 0;
+}
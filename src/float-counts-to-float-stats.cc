@@ -425,6 +425,7 @@ class FloatStatsGenerator {
 
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc < 3) {
     std::cerr << "Usage: float-counts-float-stats <num-words> <order1-output> ... <orderN-output> < <input>\n"
               << "E.g. float-counts-to-float-stats 20000 stats.1 stats.2 stats.3 < float.all\n"
@@ -56,6 +56,7 @@ inline void PrintNumber(int32 i) {
 }
 
 int main (int argc, char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc != 1) {
     std::cerr << "float-counts-to-histories: expected usage: print-float-counts <float_counts >histories.txt\n"
               << "You'll typically pipe this into sort and then into get-null-counts.\n";
@@ -0,0 +1,616 @@
+// get-int-counts-direct.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <algorithm>
+#include <cassert>
+#include <iostream>
+#include <fstream>
+#include <queue>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <errno.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+#include "int-text.h"
+
+
+/*
+   This program does the same job as the pipeline
+
+     get-text-counts <ngram-order> | sort | uniq -c | get-int-counts <outputs>
+
+   (with LC_ALL=C), but without converting the n-grams to text.  It reads lines
+   of integerized text from its stdin and writes int-counts (IntLmState) to its
+   outputs; the output is byte-for-byte identical to that of the pipeline above.
+
+   Each n-gram is encoded as a fixed-width key of <ngram-order> integers: the
+   reversed history, then the predicted word, padded with zeros.  Since word-ids
+   are > 0, sorting the keys lexicographically gives the same order as the text
+   sort does.  The keys are aggregated in an in-memory hash table; when that
+   exceeds the memory budget, its contents are sorted and spilled to a
+   temporary file, and at the end the sorted runs are merged.
+*/
+
+
+namespace pocolm {
+
+// Parses a memory specification in the format accepted by the -S option of
+// 'sort', e.g. "500M", "2G", "10%", "1000000b".  A number with no suffix is
+// interpreted as kilobytes, like sort does.  Returns the number of bytes, or
+// 0 if the string could not be parsed.
+size_t ParseMemorySize(const std::string &str) {
+  const char *c_str = str.c_str();
+  char *end;
+  errno = 0;
+  double value = strtod(c_str, &end);
+  if (end == c_str || errno != 0 || value <= 0.0)
+    return 0;
+  std::string suffix(end);
+  double scale;
+  if (suffix == "" || suffix == "K" || suffix == "k") {
+    scale = 1024.0;
+  } else if (suffix == "b" || suffix == "B") {
+    scale = 1.0;
+  } else if (suffix == "M" || suffix == "m") {
+    scale = 1024.0 * 1024.0;
+  } else if (suffix == "G" || suffix == "g") {
+    scale = 1024.0 * 1024.0 * 1024.0;
+  } else if (suffix == "T" || suffix == "t") {
+    scale = 1024.0 * 1024.0 * 1024.0 * 1024.0;
+  } else if (suffix == "%") {
+    double physical_memory = static_cast<double>(sysconf(_SC_PHYS_PAGES)) *
+        static_cast<double>(sysconf(_SC_PAGESIZE));
+    if (physical_memory <= 0.0)
+      return 0;
+    scale = physical_memory / 100.0;
+  } else {
+    return 0;
+  }
+  return static_cast<size_t>(value * scale);
+}
+
+
+// This class writes the sorted (key, count) pairs as int-counts, grouping
+// together the n-grams that share a history into a single IntLmState, in
+// exactly the way get-int-counts does it.
+class IntCountsWriter {
+ public:
+  IntCountsWriter(int32 ngram_order, int32 num_outputs,
+                  const char **output_names):
+      ngram_order_(ngram_order), num_outputs_(num_outputs),
+      output_names_(output_names), num_states_written_(0),
+      num_counts_(0), first_time_(true) {
+    outputs_ = new std::ofstream[num_outputs];
+    for (int32 i = 0; i < num_outputs; i++) {
+      outputs_[i].open(output_names[i],
+                       std::ios_base::binary|std::ios_base::out);
+      if (!outputs_[i]) {
+        std::cerr << "get-int-counts-direct: Failed to open '"
+                  << output_names[i] << "' for output.\n";
+        exit(1);
+      }
+    }
+  }
+
+  // 'key' is an array of ngram_order_ integers (reversed history, predicted
+  // word, zero padding).  Must be called in sorted order of key, without
+  // repeats.
+  void AddCount(const int32 *key, int32 count) {
+    int32 key_length = 0;
+    while (key_length < ngram_order_ && key[key_length] != 0)
+      key_length++;
+    assert(key_length > 0);
+    int32 history_size = key_length - 1;
+    if (history_size >= num_outputs_ && num_outputs_ != 1) {
+      std::cerr << "get-int-counts-direct: history of length " << history_size
+                << " is too long for " << num_outputs_ << " outputs.\n";
+      exit(1);
+    }
+    if (first_time_ ||
+        static_cast<int32>(int_lm_state_.history.size()) != history_size ||
+        !std::equal(key, key + history_size, int_lm_state_.history.begin())) {
+      if (!first_time_)
+        WriteState();
+      history_.assign(key, key + history_size);
+      int_lm_state_.Init(history_);
+      first_time_ = false;
+    }
+    int_lm_state_.AddCount(key[history_size], count);
+    num_counts_++;
+  }
+
+  // Writes the last state and closes the outputs.
+  void Finish() {
+    if (first_time_) {
+      std::cerr << "get-int-counts-direct: processed no data\n";
+      exit(1);
+    }
+    WriteState();
+    std::cerr << "get-int-counts-direct: processed "
+              << num_states_written_ << " LM states, with "
+              << num_counts_ << " individual n-grams.\n";
+    for (int32 i = 0; i < num_outputs_; i++) {
+      outputs_[i].close();
+      if (outputs_[i].fail()) {
+        std::cerr << "get-int-counts-direct: failed to close file "
+                  << output_names_[i] << " (disk full?)\n";
+        exit(1);
+      }
+    }
+  }
+
+  ~IntCountsWriter() { delete [] outputs_; }
+
+ private:
+  void WriteState() {
+    int32 output_index = (num_outputs_ == 1 ? 0 :
+                          int_lm_state_.history.size());
+    int_lm_state_.Write(outputs_[output_index]);
+    num_states_written_++;
+  }
+
+  int32 ngram_order_;
+  int32 num_outputs_;
+  const char **output_names_;
+  std::ofstream *outputs_;
+  int32 num_states_written_;
+  int64 num_counts_;
+  bool first_time_;
+  std::vector<int32> history_;
+  IntLmState int_lm_state_;
+};
+
+
+// This class reads (key, count) records from a sorted run that was spilled to
+// a temporary file.
+class SortedRunReader {
+ public:
+  SortedRunReader(FILE *file, int32 ngram_order):
+      file_(file), record_size_(ngram_order + 1), buffer_pos_(0),
+      buffer_end_(0), eof_(false) {
+    if (fseek(file_, 0, SEEK_SET) != 0) {
+      std::cerr << "get-int-counts-direct: failed to rewind temporary file: "
+                << strerror(errno) << "\n";
+      exit(1);
+    }
+    buffer_.resize(record_size_ * kRecordsPerRead);
+    Next();
+  }
+
+  bool Done() const { return eof_; }
+
+  // the current record: a key of ngram_order integers followed by the count.
+  const int32 *Record() const { return &(buffer_[buffer_pos_]); }
+
+  void Next() {
+    if (eof_)
+      return;
+    buffer_pos_ += record_size_;
+    if (buffer_pos_ >= buffer_end_) {
+      size_t num_read = fread(&(buffer_[0]), sizeof(int32) * record_size_,
+                              kRecordsPerRead, file_);
+      if (num_read == 0) {
+        if (ferror(file_)) {
+          std::cerr << "get-int-counts-direct: error reading temporary file\n";
+          exit(1);
+        }
+        eof_ = true;
+        fclose(file_);
+        return;
+      }
+      buffer_pos_ = 0;
+      buffer_end_ = num_read * record_size_;
+    }
+  }
+
+ private:
+  static const size_t kRecordsPerRead = 16384;
+  FILE *file_;
+  size_t record_size_;
+  std::vector<int32> buffer_;
+  size_t buffer_pos_;
+  size_t buffer_end_;
+  bool eof_;
+};
+
+
+class DirectCounter {
+ public:
+  DirectCounter(int32 ngram_order, size_t max_memory,
+                const std::string &temp_dir):
+      ngram_order_(ngram_order), max_memory_(max_memory),
+      temp_dir_(temp_dir), num_entries_(0) {
+    InitTable(1 << 10);
+  }
+
+  // Adds one to the count of the n-gram whose key is the array of
+  // ngram_order_ integers starting at 'key'.
+  inline void AddNgram(const int32 *key) {
+    size_t mask = slots_.size() - 1,
+        slot = HashKey(key) & mask;
+    while (true) {
+      int32 index = slots_[slot];
+      if (index == -1) {
+        slots_[slot] = num_entries_;
+        keys_.insert(keys_.end(), key, key + ngram_order_);
+        counts_.push_back(1);
+        num_entries_++;
+        if (2 * num_entries_ > slots_.size())
+          Rehash();
+        if (MemoryUsed() > max_memory_)
+          SpillToDisk();
+        return;
+      } else if (std::equal(key, key + ngram_order_,
+                            &(keys_[static_cast<size_t>(index) *
+                                    ngram_order_]))) {
+        counts_[index]++;
+        return;
+      }
+      slot = (slot + 1) & mask;
+    }
+  }
+
+  // Writes all the counts, in sorted order, to 'writer'.
+  void Output(IntCountsWriter *writer) {
+    if (runs_.empty()) {
+      // everything fitted in memory.
+      std::vector<int32> order;
+      SortEntries(&order);
+      for (size_t i = 0; i < order.size(); i++) {
+        int32 index = order[i];
+        writer->AddCount(&(keys_[static_cast<size_t>(index) * ngram_order_]),
+                         counts_[index]);
+      }
+    } else {
+      if (num_entries_ > 0)
+        SpillToDisk();
+      MergeRuns(writer);
+    }
+  }
+
+ private:
+  struct KeyLess {
+    KeyLess(const std::vector<int32> &keys, int32 ngram_order):
+        keys(keys), ngram_order(ngram_order) { }
+    bool operator () (int32 a, int32 b) const {
+      const int32 *key_a = &(keys[static_cast<size_t>(a) * ngram_order]),
+          *key_b = &(keys[static_cast<size_t>(b) * ngram_order]);
+      return std::lexicographical_compare(key_a, key_a + ngram_order,
+                                          key_b, key_b + ngram_order);
+    }
+    const std::vector<int32> &keys;
+    int32 ngram_order;
+  };
+
+  // Used in the priority queue when merging runs; note that
+  // std::priority_queue puts the largest element first, so this is reversed.
+  struct RunGreater {
+    RunGreater(int32 ngram_order): ngram_order(ngram_order) { }
+    bool operator () (const SortedRunReader *a,
+                      const SortedRunReader *b) const {
+      return std::lexicographical_compare(b->Record(),
+                                          b->Record() + ngram_order,
+                                          a->Record(),
+                                          a->Record() + ngram_order);
+    }
+    int32 ngram_order;
+  };
+
+  inline size_t HashKey(const int32 *key) const {
+    uint64 ans = 0;
+    for (int32 i = 0; i < ngram_order_; i++)
+      ans = (ans + static_cast<uint32>(key[i])) * 0x9E3779B97F4A7C15ULL;
+    return static_cast<size_t>(ans ^ (ans >> 29));
+  }
+
+  size_t MemoryUsed() const {
+    return keys_.capacity() * sizeof(int32) +
+        counts_.capacity() * sizeof(int32) +
+        slots_.size() * sizeof(int32);
+  }
+
+  void InitTable(size_t num_slots) {
+    slots_.clear();
+    slots_.resize(num_slots, -1);
+  }
+
+  void Rehash() {
+    InitTable(slots_.size() * 2);
+    size_t mask = slots_.size() - 1;
+    for (size_t i = 0; i < num_entries_; i++) {
+      size_t slot = HashKey(&(keys_[i * ngram_order_])) & mask;
+      while (slots_[slot] != -1)
+        slot = (slot + 1) & mask;
+      slots_[slot] = i;
+    }
+  }
+
+  void SortEntries(std::vector<int32> *order) {
+    order->resize(num_entries_);
+    for (size_t i = 0; i < num_entries_; i++)
+      (*order)[i] = i;
+    std::sort(order->begin(), order->end(), KeyLess(keys_, ngram_order_));
+  }
+
+  // Sorts the contents of the hash table, writes them to a temporary file and
+  // clears the hash table.
+  void SpillToDisk() {
+    std::string name_template = temp_dir_ + "/get-int-counts-direct.XXXXXX";
+    std::vector<char> name(name_template.begin(), name_template.end());
+    name.push_back('\0');
+    int fd = mkstemp(&(name[0]));
+    FILE *file = (fd == -1 ? NULL : fdopen(fd, "w+b"));
+    if (file == NULL) {
+      std::cerr << "get-int-counts-direct: failed to create temporary file "
+                << "in directory " << temp_dir_ << ": " << strerror(errno)
+                << "\n";
+      exit(1);
+    }
+    // the file stays accessible through 'file' until we close it.
+    unlink(&(name[0]));
+
+    std::vector<int32> order;
+    SortEntries(&order);
+    std::vector<int32> record(ngram_order_ + 1);
+    for (size_t i = 0; i < order.size(); i++) {
+      int32 index = order[i];
+      std::copy(&(keys_[static_cast<size_t>(index) * ngram_order_]),
+                &(keys_[static_cast<size_t>(index) * ngram_order_]) +
+                ngram_order_, record.begin());
+      record[ngram_order_] = counts_[index];
+      if (fwrite(&(record[0]), sizeof(int32), ngram_order_ + 1, file) !=
+          static_cast<size_t>(ngram_order_ + 1)) {
+        std::cerr << "get-int-counts-direct: error writing to temporary file "
+                  << "(disk full?)\n";
+        exit(1);
+      }
+    }
+    if (fflush(file) != 0) {
+      std::cerr << "get-int-counts-direct: error writing to temporary file "
+                << "(disk full?)\n";
+      exit(1);
+    }
+    runs_.push_back(file);
+    std::cerr << "get-int-counts-direct: wrote sorted run " << runs_.size()
+              << " with " << num_entries_ << " distinct n-grams.\n";
+
+    // free the memory as well as clearing the table.
+    num_entries_ = 0;
+    std::vector<int32>().swap(keys_);
+    std::vector<int32>().swap(counts_);
+    InitTable(1 << 10);
+  }
+
+  void MergeRuns(IntCountsWriter *writer) {
+    std::vector<SortedRunReader*> readers;
+    std::priority_queue<SortedRunReader*, std::vector<SortedRunReader*>,
+                        RunGreater> queue((RunGreater(ngram_order_)));
+    for (size_t i = 0; i < runs_.size(); i++) {
+      readers.push_back(new SortedRunReader(runs_[i], ngram_order_));
+      if (!readers.back()->Done())
+        queue.push(readers.back());
+    }
+    runs_.clear();
+    std::vector<int32> key(ngram_order_);
+    while (!queue.empty()) {
+      SortedRunReader *reader = queue.top();
+      queue.pop();
+      std::copy(reader->Record(), reader->Record() + ngram_order_,
+                key.begin());
+      int64 count = reader->Record()[ngram_order_];
+      reader->Next();
+      if (!reader->Done())
+        queue.push(reader);
+      // add up the counts of this n-gram from all the runs it appears in.
+      while (!queue.empty() &&
+             std::equal(key.begin(), key.end(), queue.top()->Record())) {
+        reader = queue.top();
+        queue.pop();
+        count += reader->Record()[ngram_order_];
+        reader->Next();
+        if (!reader->Done())
+          queue.push(reader);
+      }
+      assert(count < 2147483648LL && "get-int-counts-direct: count overflow");
+      writer->AddCount(&(key[0]), static_cast<int32>(count));
+    }
+    for (size_t i = 0; i < readers.size(); i++)
+      delete readers[i];
+  }
+
+  int32 ngram_order_;
+  size_t max_memory_;
+  std::string temp_dir_;
+
+  // the keys of the entries in the hash table, each one of dimension
+  // ngram_order_, stored consecutively.
+  std::vector<int32> keys_;
+  // the counts of the entries in the hash table.
+  std::vector<int32> counts_;
+  size_t num_entries_;
+  // the hash table, indexed by (hash of key) modulo its size, containing
+  // indexes into counts_ (or -1 for empty slots); we use linear probing.
+  std::vector<int32> slots_;
+
+  // sorted runs that we have spilled to disk.
+  std::vector<FILE*> runs_;
+};
+
+}  // namespace pocolm
+
+
+static void Usage() {
+  std::cerr << "Expected usage: get-int-counts-direct [options] <ngram-order> "
+            << "<order1-output> <order2-output> ... < <int-text>\n"
+            << " or: get-int-counts-direct [options] <ngram-order> <all-output> "
+            << "< <int-text>\n"
+            << "This program reads lines of integerized text and writes int-counts\n"
+            << "(binary counts divided by order, or all orders together).  It does\n"
+            << "the same thing as\n"
+            << "  get-text-counts <ngram-order> | sort | uniq -c | get-int-counts <outputs>\n"
+            << "but is faster.\n"
+            << "Options:\n"
+            << "  --limit-unk-history   Truncate the history to the left of <unk>\n"
+            << "                        (see get-text-counts).\n"
+            << "  --max-memory=<size>   Memory to use for counting before spilling\n"
+            << "                        sorted runs to disk; format is as for the -S\n"
+            << "                        option of 'sort', e.g. 10G (default: 1G).\n"
+            << "  --temp-dir=<dir>      Directory for the sorted runs (default:\n"
+            << "                        $TMPDIR, or /tmp).\n"
+            << "  --packed-input=<file> Read the integerized text from <file>, in the\n"
+            << "                        packed format written by pack-int-text, instead\n"
+            << "                        of from the standard input.\n"
+            << "  --part=<j>/<n>        With --packed-input, only read part j of n\n"
+            << "                        (1 <= j <= n) of the file.\n"
+            << "e.g.:\n"
+            << " gunzip -c int/1.txt.gz | get-int-counts-direct 3 /dev/null counts/int.1.2 counts/int.1.3\n";
+  exit(1);
+}
+
+
+int main (int argc, const char **argv) {
+  bool limit_unk_history = false;
+  std::string max_memory_str = "1G";
+  const char *tmpdir_env = getenv("TMPDIR");
+  std::string temp_dir = (tmpdir_env != NULL && *tmpdir_env != '\0' ?
+                          tmpdir_env : "/tmp");
+  std::string packed_input;
+  int part = 1, num_parts = 1;
+
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option == "--limit-unk-history") {
+      limit_unk_history = true;
+    } else if (option.compare(0, 13, "--max-memory=") == 0) {
+      max_memory_str = option.substr(13);
+    } else if (option.compare(0, 11, "--temp-dir=") == 0) {
+      temp_dir = option.substr(11);
+    } else if (option.compare(0, 15, "--packed-input=") == 0) {
+      packed_input = option.substr(15);
+    } else if (option.compare(0, 7, "--part=") == 0) {
+      if (sscanf(argv[1] + 7, "%d/%d", &part, &num_parts) != 2 ||
+          part < 1 || part > num_parts) {
+        std::cerr << "get-int-counts-direct: bad option " << option << "\n";
+        exit(1);
+      }
+    } else {
+      std::cerr << "get-int-counts-direct: unrecognized option " << option
+                << "\n";
+      Usage();
+    }
+    argc--;
+    argv++;
+  }
+  if (argc < 3)
+    Usage();
+  if (num_parts != 1 && packed_input.empty()) {
+    std::cerr << "get-int-counts-direct: the --part option requires "
+              << "--packed-input\n";
+    exit(1);
+  }
+
+  char *end;
+  int32 ngram_order = strtol(argv[1], &end, 10);
+  if (ngram_order <= 0 || *end != '\0') {
+    std::cerr << "get-int-counts-direct: ngram-order must be > 0, got '"
+              << argv[1] << "'\n";
+    Usage();
+  }
+  size_t max_memory = pocolm::ParseMemorySize(max_memory_str);
+  if (max_memory == 0) {
+    std::cerr << "get-int-counts-direct: invalid --max-memory option '"
+              << max_memory_str << "'\n";
+    exit(1);
+  }
+
+  pocolm::IntCountsWriter writer(ngram_order, argc - 2, argv + 2);
+  pocolm::DirectCounter counter(ngram_order, max_memory, temp_dir);
+
+  std::ios_base::sync_with_stdio(false);
+  pocolm::IntTextReader *reader = (packed_input.empty() ?
+      new pocolm::IntTextReader(std::cin) :
+      new pocolm::IntTextReader(packed_input, part - 1, num_parts));
+  int64 num_lines_processed = 0, num_words_processed = 0;
+  std::vector<int32> words;
+  std::vector<int32> line_ints;
+  std::vector<int32> key(ngram_order);
+
+  while (reader->ReadSentence(&words)) {
+    num_lines_processed++;
+    line_ints.clear();
+    line_ints.push_back(kBosSymbol);
+    for (size_t j = 0; j < words.size(); j++) {
+      int32 i = words[j];
+      assert(i > 2);
+      assert(i < 10000000 &&
+             "Vocabularies over 10 million are not supported, for "
+             "compatibility with get-text-counts.");
+      line_ints.push_back(i);
+    }
+    line_ints.push_back(kEosSymbol);
+    int32 size = line_ints.size();
+    num_words_processed += size;
+    // the key is the reversed history followed by the predicted word, padded
+    // with zeros; this corresponds to the text produced by get-text-counts.
+    for (int32 pos = 1; pos < size; pos++) {
+      int32 k = 0;
+      for (int32 h = pos - 1; h >= 0 && h > pos - ngram_order; h--) {
+        key[k++] = line_ints[h];
+        if (limit_unk_history && line_ints[h] == kUnkSymbol)
+          break;
+      }
+      key[k++] = line_ints[pos];
+      for (; k < ngram_order; k++)
+        key[k] = 0;
+      counter.AddNgram(&(key[0]));
+    }
+  }
+  delete reader;
+  if (num_lines_processed == 0) {
+    if (num_parts > 1) {
+      // a part of a packed file may legitimately be empty; we leave the
+      // outputs empty.
+      std::cerr << "get-int-counts-direct: part " << part << " of "
+                << num_parts << " was empty.\n";
+      return 0;
+    }
+    std::cerr << "get-int-counts-direct: processed no data\n";
+    exit(1);
+  }
+  std::cerr << "get-int-counts-direct: processed " << num_lines_processed
+            << " lines, with (on average) "
+            << (num_words_processed * 1.0 / num_lines_processed)
+            << " words per line.\n";
+
+  counter.Output(&writer);
+  writer.Finish();
+  return 0;
+}
+
+/*
+  testing (the two commands should give the same output):
+
+  ( echo 11 12 13; echo 11 12 13 14 ) | get-text-counts 3 | LC_ALL=C sort | uniq -c | get-int-counts /dev/stdout | print-int-counts
+  ( echo 11 12 13; echo 11 12 13 14 ) | get-int-counts-direct 3 /dev/stdout | print-int-counts
+ */
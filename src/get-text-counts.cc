@@ -22,10 +22,12 @@
 #include <sstream>
 #include <vector>
 #include <iomanip>
+#include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 
 #include "pocolm-types.h"
+#include "int-text.h"
 
 /*
    This standalone C++ program is intended to turn integerized text into
@@ -63,47 +65,78 @@
  */
 
 
+static void Usage() {
+  std::cerr << "Expected usage: get-text-counts [options] <ngram-order>\n"
+            << "This program reads lines of integerized text and outputs raw n-grams in\n"
+            << "text form, one per line, in the format <reversed-history> <predicted-word>\n"
+            << "e.g.\n"
+            << "6     5      7\n"
+            << "See comments in code for more details, and get_counts.py for examples.\n"
+            << "Options:\n"
+            << "  --limit-unk-history   Any history greater than bigram history that\n"
+            << "                        is to the left of <unk> (symbol number 3) will\n"
+            << "                        be truncated (this relates to keeping decoding\n"
+            << "                        graphs compact for Kaldi purposes).\n"
+            << "  --packed-input=<file> Read the integerized text from <file>, in the\n"
+            << "                        packed format written by pack-int-text, instead\n"
+            << "                        of from the standard input.\n"
+            << "  --part=<j>/<n>        With --packed-input, only read part j of n\n"
+            << "                        (1 <= j <= n) of the file.\n";
+  exit(1);
+}
+
 int main (int argc, char **argv) {
   int ngram_order;
-  if (argc != 2 && (argc != 3 || strcmp(argv[1], "--limit-unk-history") != 0)) {
-    std::cerr << "Expected usage: get-text-counts [--limit-unk-history] <ngram-order>\n"
-              << "This program reads lines of integerized text and outputs raw n-grams in\n"
-              << "text form, one per line, in the format <reversed-history> <predicted-word>\n"
-              << "e.g.\n"
-              << "6     5      7\n"
-              << "See comments in code for more details, and get_counts.py for examples.\n"
-              << "If the option --limit-unk-history is given, then any history greater\n"
-              << "than bigram history that is to the left of <unk> (symbol number 3)\n"
-              << "will be truncated (this relates to keeping decoding graphs compact\n"
-              << "for Kaldi purposes).\n";
-    exit(1);
-  }
-
   bool limit_unk_history = false;
-  if (argc == 3) {
-    limit_unk_history = true;
-    argc -= 1;
-    argv += 1;
+  std::string packed_input;
+  int part = 1, num_parts = 1;
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option == "--limit-unk-history") {
+      limit_unk_history = true;
+    } else if (option.compare(0, 15, "--packed-input=") == 0) {
+      packed_input = option.substr(15);
+    } else if (option.compare(0, 7, "--part=") == 0) {
+      if (sscanf(argv[1] + 7, "%d/%d", &part, &num_parts) != 2 ||
+          part < 1 || part > num_parts) {
+        std::cerr << "get-text-counts: bad option " << option << "\n";
+        exit(1);
+      }
+    } else {
+      std::cerr << "get-text-counts: unrecognized option " << option << "\n";
+      Usage();
+    }
+    argc--;
+    argv++;
+  }
+  if (argc != 2)
+    Usage();
+  if (num_parts != 1 && packed_input.empty()) {
+    std::cerr << "get-text-counts: the --part option requires --packed-input\n";
+    exit(1);
   }
 
   ngram_order = atoi(argv[1]);
   if (!(ngram_order > 0)) {
-    std::cerr << "Expected usage: get-text-counts [--limit-unk-history] <ngram-order>\n"
+    std::cerr << "Expected usage: get-text-counts [options] <ngram-order>\n"
               << "ngram-order must be > 0\n";
     exit(1);
   }
 
+  pocolm::IntTextReader *reader = (packed_input.empty() ?
+      new pocolm::IntTextReader(std::cin) :
+      new pocolm::IntTextReader(packed_input, part - 1, num_parts));
+
   long int num_lines_processed = 0, num_words_processed = 0;
-  std::string line;
+  std::vector<int> words;
   std::vector<int> line_ints;
 
-  while (std::getline(std::cin, line)) {
+  while (reader->ReadSentence(&words)) {
     num_lines_processed++;
-    std::istringstream str(line);
     line_ints.clear();
     line_ints.push_back(kBosSymbol);
-    int i;
-    while (str >> i) {
+    for (size_t j = 0; j < words.size(); j++) {
+      int i = words[j];
       assert(i > 2);
       line_ints.push_back(i);
     }
@@ -133,5 +166,7 @@ int main (int argc, char **argv) {
             << " lines, with (on average) "
             << (num_words_processed * 1.0 / num_lines_processed)
             << " words per line.\n";
-  return (num_lines_processed > 0 ? 0 : 1);
+  delete reader;
+  // a part of a packed file may legitimately be empty.
+  return (num_lines_processed > 0 || num_parts > 1 ? 0 : 1);
 }
@@ -41,6 +41,7 @@
 */
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
 
   if (argc != 1) {
     std::cerr << "histories-to-null-counts: expected usage:\n"
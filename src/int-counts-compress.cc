@@ -0,0 +1,87 @@
+// int-counts-compress.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+
+#include <cassert>
+#include <fstream>
+#include <iostream>
+#include <string>
+#include <stdlib.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+
+
+/*
+   This program converts int-counts (IntLmStates, e.g. the int.* files of a
+   count directory) into the block-compressed format described in lm-state.h,
+   which all programs that read int-counts read transparently.
+*/
+
+// Returns the size of file 'filename' in bytes.
+static int64 FileSize(const char *filename) {
+  std::ifstream input(filename, std::ios_base::in|std::ios_base::binary);
+  input.seekg(0, std::ios_base::end);
+  return input.tellg();
+}
+
+int main (int argc, const char **argv) {
+  if (argc != 3) {
+    std::cerr << "Usage: int-counts-compress <int-counts-in> <int-counts-out>\n"
+              << "e.g.: int-counts-compress counts/int.1.3 counts/int.1.3.tmp\n"
+              << "This program writes the int-counts in <int-counts-in> in the\n"
+              << "block-compressed format described in lm-state.h, which is read\n"
+              << "transparently by all programs that read int-counts.  Blocks can be\n"
+              << "decoded independently of each other.  To convert back to the\n"
+              << "normal format, use e.g. 'merge-int-counts int.1.3 > int.1.3.raw'.\n";
+    exit(1);
+  }
+  std::ifstream input(argv[1], std::ios_base::in|std::ios_base::binary);
+  if (!input) {
+    std::cerr << "int-counts-compress: failed to open '" << argv[1]
+              << "' for reading\n";
+    exit(1);
+  }
+  std::ofstream output(argv[2], std::ios_base::out|std::ios_base::binary);
+  if (!output) {
+    std::cerr << "int-counts-compress: failed to open '" << argv[2]
+              << "' for writing\n";
+    exit(1);
+  }
+  pocolm::EnableIntCountsBlocks(output);
+
+  int64 num_lm_states = 0, num_counts = 0;
+  pocolm::IntLmState lm_state;
+  while (input.peek(), !input.eof()) {
+    lm_state.Read(input);
+    lm_state.Write(output);
+    num_lm_states++;
+    num_counts += lm_state.counts.size();
+  }
+  pocolm::FlushIntCountsBlocks(output);
+  output.close();
+  if (output.fail()) {
+    std::cerr << "int-counts-compress: error writing to '" << argv[2]
+              << "' (disk full?)\n";
+    exit(1);
+  }
+  std::cerr << "int-counts-compress: wrote " << num_lm_states
+            << " LM states with " << num_counts << " individual n-grams; "
+            << FileSize(argv[1]) << " -> " << FileSize(argv[2]) << " bytes\n";
+  return 0;
+}
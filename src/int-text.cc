@@ -0,0 +1,161 @@
+// int-text.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <fstream>
+#include <errno.h>
+#include <fcntl.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include "int-text.h"
+
+namespace pocolm {
+
+
+IntTextReader::IntTextReader(std::istream &is):
+    is_(&is), mapped_data_(NULL), mapped_size_(0), data_(NULL),
+    pos_(0), end_(0) { }
+
+
+IntTextReader::IntTextReader(const std::string &packed_filename,
+                             int32 part, int32 num_parts):
+    is_(NULL), packed_filename_(packed_filename), mapped_data_(NULL),
+    mapped_size_(0), data_(NULL), pos_(0), end_(0) {
+  assert(num_parts > 0 && part >= 0 && part < num_parts);
+  int fd = open(packed_filename.c_str(), O_RDONLY);
+  struct stat file_stat;
+  if (fd == -1 || fstat(fd, &file_stat) != 0) {
+    std::cerr << "IntTextReader: failed to open packed int-text file '"
+              << packed_filename << "': " << strerror(errno) << "\n";
+    exit(1);
+  }
+  mapped_size_ = file_stat.st_size;
+  if (mapped_size_ % sizeof(uint32) != 0) {
+    std::cerr << "IntTextReader: size of file '" << packed_filename
+              << "' is not a multiple of 4 (not a packed int-text file?)\n";
+    exit(1);
+  }
+  if (mapped_size_ > 0) {
+    mapped_data_ = mmap(NULL, mapped_size_, PROT_READ, MAP_SHARED, fd, 0);
+    if (mapped_data_ == MAP_FAILED) {
+      std::cerr << "IntTextReader: failed to mmap file '" << packed_filename
+                << "': " << strerror(errno) << "\n";
+      exit(1);
+    }
+    madvise(mapped_data_, mapped_size_, MADV_SEQUENTIAL);
+    data_ = static_cast<const uint32*>(mapped_data_);
+  }
+  close(fd);
+  ReadIndex(packed_filename + ".index", part, num_parts);
+}
+
+void IntTextReader::ReadIndex(const std::string &index_filename,
+                              int32 part, int32 num_parts) {
+  std::ifstream index_input(index_filename.c_str(),
+                            std::ios_base::in|std::ios_base::binary);
+  if (!index_input) {
+    std::cerr << "IntTextReader: failed to open index file '"
+              << index_filename << "'\n";
+    exit(1);
+  }
+  std::vector<int64> index;
+  int64 i;
+  while (index_input.read(reinterpret_cast<char*>(&i), sizeof(int64)))
+    index.push_back(i);
+  int64 total_words = mapped_size_ / sizeof(uint32);
+  if (index.empty() || index.back() != total_words ||
+      index_input.gcount() != 0) {
+    std::cerr << "IntTextReader: index file '" << index_filename
+              << "' does not match packed file '" << packed_filename_
+              << "' (was it modified?)\n";
+    exit(1);
+  }
+  // each of the index.size() - 1 blocks contains kIntTextIndexInterval
+  // sentences (except possibly the last), and we give each part a contiguous
+  // range of blocks.
+  int64 num_blocks = index.size() - 1,
+      begin_block = (num_blocks * part) / num_parts,
+      end_block = (num_blocks * (part + 1)) / num_parts;
+  pos_ = index[begin_block];
+  end_ = index[end_block];
+  if (pos_ < 0 || pos_ > end_ || end_ > total_words ||
+      (pos_ > 0 && data_[pos_ - 1] != 0)) {
+    std::cerr << "IntTextReader: index file '" << index_filename
+              << "' has bad contents.\n";
+    exit(1);
+  }
+}
+
+IntTextReader::~IntTextReader() {
+  if (mapped_data_ != NULL)
+    munmap(mapped_data_, mapped_size_);
+}
+
+bool IntTextReader::ReadSentence(std::vector<int32> *words) {
+  words->clear();
+  if (is_ != NULL) {
+    if (!std::getline(*is_, line_))
+      return false;
+    const char *cur_pos = line_.c_str();
+    while (true) {
+      while (*cur_pos == ' ' || *cur_pos == '\t' || *cur_pos == '\r')
+        cur_pos++;
+      if (*cur_pos == '\0')
+        return true;
+      char *next_pos;
+      long i = strtol(cur_pos, &next_pos, 10);
+      if (next_pos == cur_pos) {
+        std::cerr << "IntTextReader: bad line of integerized text '"
+                  << line_ << "'\n";
+        exit(1);
+      }
+      words->push_back(i);
+      cur_pos = next_pos;
+    }
+  } else {
+    if (pos_ >= end_)
+      return false;
+    while (true) {
+      if (pos_ >= end_) {
+        std::cerr << "IntTextReader: packed file '" << packed_filename_
+                  << "' ends without a sentence terminator.\n";
+        exit(1);
+      }
+      uint32 word = data_[pos_++];
+      if (word == 0)
+        return true;
+      words->push_back(static_cast<int32>(word));
+    }
+  }
+}
+
+
+void WritePackedSentence(const std::vector<int32> &words, std::ostream &os) {
+  if (!words.empty())
+    os.write(reinterpret_cast<const char*>(&(words[0])),
+             sizeof(int32) * words.size());
+  uint32 zero = 0;
+  os.write(reinterpret_cast<const char*>(&zero), sizeof(uint32));
+}
+
+
+}  // namespace pocolm
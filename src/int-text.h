@@ -0,0 +1,97 @@
+// int-text.h
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef POCOLM_INT_TEXT_H_
+#define POCOLM_INT_TEXT_H_
+
+#include <iostream>
+#include <string>
+#include <vector>
+#include "pocolm-types.h"
+
+namespace pocolm {
+
+/*
+   The 'packed' int-text format is an alternative to the gzipped text form of
+   integerized data (e.g. data/int/1.txt.gz) that prepare_int_data.py can
+   write.  A packed file (e.g. data/int/1.int) is a sequence of native-endian
+   32-bit word-ids in which each sentence is terminated by a zero (zero is
+   <eps>, which never appears in the data).  It is accompanied by an index file
+   (e.g. data/int/1.int.index), which is a sequence of int64: the position
+   (in words, not bytes) of the start of sentence number 0,
+   kIntTextIndexInterval, 2*kIntTextIndexInterval, and so on, followed by the
+   total number of words in the packed file.  The index allows a file to be
+   split into roughly equal parts, on sentence boundaries, without reading it.
+
+   The packed files are read via mmap, so no decompression or decimal
+   parsing is needed.  See pack-int-text.cc for how they are written.
+*/
+
+const int64 kIntTextIndexInterval = 1024;
+
+
+/**
+   This class reads integerized text one sentence at a time, either in text
+   form (lines of space-separated integers) from an istream, or from a packed
+   int-text file.
+ */
+class IntTextReader {
+ public:
+  // Reads text-form lines from 'is'.
+  explicit IntTextReader(std::istream &is);
+
+  // Reads part 'part' (0 <= part < num_parts) of the packed int-text file
+  // 'packed_filename', which requires the index file
+  // <packed_filename>.index.  Dies on error.
+  IntTextReader(const std::string &packed_filename,
+                int32 part, int32 num_parts);
+
+  ~IntTextReader();
+
+  // Reads the next sentence into 'words' (not including the BOS and EOS
+  // symbols).  Returns false if there were no more sentences.  Dies on bad
+  // input.
+  bool ReadSentence(std::vector<int32> *words);
+
+ private:
+  void ReadIndex(const std::string &index_filename,
+                 int32 part, int32 num_parts);
+
+  // the istream we read text from, or NULL if we're reading packed data.
+  std::istream *is_;
+  std::string line_;
+
+  // the following are relevant when reading packed data.
+  std::string packed_filename_;
+  void *mapped_data_;
+  size_t mapped_size_;
+  // the start of the packed data.
+  const uint32 *data_;
+  // current and end position in data_ of the part we're reading.
+  int64 pos_;
+  int64 end_;
+};
+
+// Writes a sentence to a packed int-text stream.  The caller is responsible
+// for writing the index (see pack-int-text.cc).
+void WritePackedSentence(const std::vector<int32> &words, std::ostream &os);
+
+}  // namespace pocolm
+
+#endif  // POCOLM_INT_TEXT_H_
@@ -91,11 +91,9 @@ class FloatLmStateDerivs: public FloatLmState {
     count_derivs.swap(other->count_derivs);
   }
 
- private:
-  // called from Write, this adds total_deriv to discount_deriv
+  // called from WriteDerivs, this adds total_deriv to discount_deriv
   // and each member of count_derivs, then zeroes it.
   void BackpropFromTotalDeriv();
-
 };
 
 
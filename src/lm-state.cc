@@ -18,8 +18,16 @@
 // limitations under the License.
 
 #include <cassert>
+#include <fstream>
+#include <sstream>
+#include <errno.h>
+#include <fcntl.h>
 #include <stdlib.h>
+#include <string.h>
 #include <math.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
 #include <algorithm>
 #include "lm-state.h"
 
@@ -47,97 +55,403 @@ void IntLmState::Print(std::ostream &os) const {
 }
 
 
+// Reads 'size' bytes into 'data' directly from the stream buffer of 'is'.
+// This is what is.read() does, but without its per-call overhead (constructing
+// a sentry, which for std::cin also flushes std::cout), which matters because
+// LM-states are small and we read them a few fields at a time.  Like
+// is.read(), on a short read it sets eofbit and failbit on 'is'; returns false
+// in that case.
+static inline bool ReadBytes(std::istream &is, void *data, size_t size) {
+  std::streamsize num_read = is.rdbuf()->sgetn(static_cast<char*>(data), size);
+  if (num_read != static_cast<std::streamsize>(size)) {
+    is.setstate(std::ios_base::eofbit | std::ios_base::failbit);
+    return false;
+  }
+  return true;
+}
+
+// Writes 'size' bytes from 'data' directly to the stream buffer of 'os' (see
+// ReadBytes()); on failure it sets badbit on 'os', as os.write() would.
+static inline void WriteBytes(std::ostream &os, const void *data,
+                              size_t size) {
+  std::streamsize num_written =
+      os.rdbuf()->sputn(static_cast<const char*>(data), size);
+  if (num_written != static_cast<std::streamsize>(size))
+    os.setstate(std::ios_base::badbit);
+}
+
+void UseFastStandardStreams() {
+  std::ios_base::sync_with_stdio(false);
+  std::cin.tie(NULL);
+}
+
+// Appends 'value' to 'bytes' as a varint (7 bits per byte, least significant
+// first, with the top bit set on all bytes except the last).
+static inline void AppendVarint(uint32 value, std::string *bytes) {
+  while (value >= 0x80) {
+    *bytes += static_cast<char>((value & 0x7f) | 0x80);
+    value >>= 7;
+  }
+  *bytes += static_cast<char>(value);
+}
+
+// Reads a varint from *ptr (which must be before 'end'), advancing *ptr.
+// Returns false if the data is corrupted.
+static inline bool ReadVarint(const uint8 **ptr, const uint8 *end,
+                              uint32 *value) {
+  *value = 0;
+  int32 shift = 0;
+  uint8 byte;
+  do {
+    if (*ptr == end || shift > 28)
+      return false;
+    byte = *((*ptr)++);
+    *value |= static_cast<uint32>(byte & 0x7f) << shift;
+    shift += 7;
+  } while (byte & 0x80);
+  return true;
+}
+
+// zigzag encoding maps signed integers with small absolute values to small
+// unsigned integers.
+static inline uint32 ZigZagEncode(int32 i) {
+  return (static_cast<uint32>(i) << 1) ^ static_cast<uint32>(i >> 31);
+}
+static inline int32 ZigZagDecode(uint32 u) {
+  return static_cast<int32>(u >> 1) ^ -static_cast<int32>(u & 1);
+}
+
+
+// The size, in bytes of encoded LM-states, at which we write out a block of
+// block-compressed IntLmStates.
+static const size_t kIntCountsBlockSize = 1 << 20;
+
+/*
+   This class accumulates the block of block-compressed IntLmStates (see
+   lm-state.h) that is currently being written to a stream.  It is stored in
+   the stream's pword() by EnableIntCountsBlocks().
+*/
+class IntCountsBlockWriter {
+ public:
+  IntCountsBlockWriter(): num_raw_bytes_(0), num_states_(0) { }
+
+  void Write(const IntLmState &lm_state, std::ostream &os) {
+    int32 history_size = lm_state.history.size(),
+        num_counts = lm_state.counts.size(),
+        num_shared = 0;
+    while (num_shared < history_size &&
+           num_shared < static_cast<int32>(prev_history_.size()) &&
+           lm_state.history[num_shared] == prev_history_[num_shared])
+      num_shared++;
+    AppendVarint(lm_state.discount, &bytes_);
+    AppendVarint(history_size, &bytes_);
+    AppendVarint(num_shared, &bytes_);
+    for (int32 i = num_shared; i < history_size; i++)
+      AppendVarint(lm_state.history[i], &bytes_);
+    AppendVarint(num_counts, &bytes_);
+    int32 prev_word = 0;
+    for (int32 i = 0; i < num_counts; i++) {
+      AppendVarint(ZigZagEncode(lm_state.counts[i].first - prev_word),
+                   &bytes_);
+      AppendVarint(lm_state.counts[i].second, &bytes_);
+      prev_word = lm_state.counts[i].first;
+    }
+    num_raw_bytes_ += sizeof(int32) * ((lm_state.discount != 0 ? 3 : 2) +
+                                       history_size + 2 * num_counts);
+    num_states_++;
+    prev_history_ = lm_state.history;
+    if (bytes_.size() >= kIntCountsBlockSize ||
+        num_raw_bytes_ >= 4 * static_cast<int64>(kIntCountsBlockSize))
+      Flush(os);
+  }
+
+  void Flush(std::ostream &os) {
+    if (num_states_ == 0)
+      return;
+    if (num_raw_bytes_ > 2147483647) {
+      std::cerr << "Failure writing IntLmState to stream: LM-state too "
+                << "large for the block-compressed format\n";
+      exit(1);
+    }
+    int32 header[4] = { kIntCountsBlockMarker,
+                        static_cast<int32>(bytes_.size()),
+                        static_cast<int32>(num_raw_bytes_),
+                        num_states_ };
+    WriteBytes(os, header, sizeof(header));
+    WriteBytes(os, bytes_.data(), bytes_.size());
+    if (!os.good()) {
+      std::cerr << "Failure writing IntLmState to stream\n";
+      exit(1);
+    }
+    bytes_.clear();
+    num_raw_bytes_ = 0;
+    num_states_ = 0;
+    prev_history_.clear();
+  }
+
+  bool Empty() const { return num_states_ == 0; }
+
+ private:
+  // the encoded LM-states of the current block.
+  std::string bytes_;
+  // the size the LM-states of the current block would have in the normal
+  // format.
+  int64 num_raw_bytes_;
+  int32 num_states_;
+  // the history of the previous LM-state in the current block.
+  std::vector<int32> prev_history_;
+};
+
+
+/*
+   This stream buffer decodes block-compressed IntLmStates (see lm-state.h)
+   from another stream buffer into the normal format.  IntLmState::Read()
+   installs it in the stream it is reading from when it encounters a block.
+*/
+class IntCountsBlockReader: public std::streambuf {
+ public:
+  // 'source' is the stream buffer to read the blocks from; it must be
+  // positioned just after the marker and the num-bytes of the first block,
+  // which is 'num_bytes'.
+  IntCountsBlockReader(std::streambuf *source, int32 num_bytes):
+      source_(source), first_num_bytes_(num_bytes) { }
+
+ protected:
+  virtual int_type underflow() {
+    while (gptr() == egptr()) {
+      if (!ReadBlock())
+        return traits_type::eof();
+    }
+    return traits_type::to_int_type(*gptr());
+  }
+
+ private:
+  // Reads and decodes the next block into decoded_ and makes it the get
+  // area; returns false at the end of the input.  Dies on error.
+  bool ReadBlock() {
+    int32 header[4];
+    if (first_num_bytes_ >= 0) {
+      header[0] = kIntCountsBlockMarker;
+      header[1] = first_num_bytes_;
+      if (source_->sgetn(reinterpret_cast<char*>(header + 2),
+                         2 * sizeof(int32)) != 2 * sizeof(int32))
+        Fail("truncated block header");
+      first_num_bytes_ = -1;
+    } else {
+      std::streamsize n = source_->sgetn(reinterpret_cast<char*>(header),
+                                         sizeof(header));
+      if (n == 0)
+        return false;
+      if (n != sizeof(header))
+        Fail("truncated block header");
+    }
+    int32 num_bytes = header[1], num_raw_bytes = header[2],
+        num_states = header[3];
+    if (header[0] != kIntCountsBlockMarker)
+      Fail("expected a block (mixed normal and block-compressed data?)");
+    if (num_bytes < 0 || num_raw_bytes < 0 ||
+        num_raw_bytes % sizeof(int32) != 0 || num_states < 0)
+      Fail("bad block header");
+    encoded_.resize(num_bytes + 1);
+    if (source_->sgetn(reinterpret_cast<char*>(&(encoded_[0])), num_bytes) !=
+        num_bytes)
+      Fail("truncated block");
+    decoded_.clear();
+    decoded_.reserve(num_raw_bytes / sizeof(int32));
+    const uint8 *ptr = &(encoded_[0]), *end = ptr + num_bytes;
+    std::vector<int32> history;
+    for (int32 s = 0; s < num_states; s++) {
+      uint32 discount, history_size, num_shared, num_counts, value;
+      if (!ReadVarint(&ptr, end, &discount) ||
+          !ReadVarint(&ptr, end, &history_size) ||
+          !ReadVarint(&ptr, end, &num_shared) ||
+          history_size > 10000 || num_shared > history_size ||
+          num_shared > history.size())
+        Fail("corrupted block");
+      history.resize(history_size);
+      for (uint32 i = num_shared; i < history_size; i++) {
+        if (!ReadVarint(&ptr, end, &value))
+          Fail("corrupted block");
+        history[i] = value;
+      }
+      if (!ReadVarint(&ptr, end, &num_counts) ||
+          decoded_.size() + (discount != 0 ? 3 : 2) + history_size +
+          2 * static_cast<uint64>(num_counts) > num_raw_bytes / sizeof(int32))
+        Fail("corrupted block");
+      if (discount != 0)
+        decoded_.push_back(-static_cast<int32>(discount));
+      decoded_.push_back(history_size);
+      decoded_.push_back(num_counts);
+      decoded_.insert(decoded_.end(), history.begin(), history.end());
+      int32 word = 0;
+      for (uint32 i = 0; i < num_counts; i++) {
+        if (!ReadVarint(&ptr, end, &value))
+          Fail("corrupted block");
+        word += ZigZagDecode(value);
+        decoded_.push_back(word);
+        if (!ReadVarint(&ptr, end, &value))
+          Fail("corrupted block");
+        decoded_.push_back(value);
+      }
+    }
+    if (ptr != end || decoded_.size() * sizeof(int32) !=
+        static_cast<size_t>(num_raw_bytes))
+      Fail("corrupted block");
+    char *begin = reinterpret_cast<char*>(decoded_.empty() ? NULL :
+                                          &(decoded_[0]));
+    setg(begin, begin, begin + num_raw_bytes);
+    return true;
+  }
+
+  void Fail(const char *message) {
+    std::cerr << "Failure reading block-compressed IntLmStates: " << message
+              << "\n";
+    exit(1);
+  }
+
+  std::streambuf *source_;
+  // the num-bytes of the first block, if its header has been partly read
+  // already (see the constructor); -1 otherwise.
+  int32 first_num_bytes_;
+  std::vector<uint8> encoded_;
+  std::vector<int32> decoded_;
+};
+
+
+// Returns the index of the stream's pword() in which we keep the
+// IntCountsBlockWriter (for an ostream) or IntCountsBlockReader (for an
+// istream).
+static int IntCountsBlockIndex() {
+  static const int index = std::ios_base::xalloc();
+  return index;
+}
+
+// Deletes the IntCountsBlockWriter or IntCountsBlockReader of a stream when
+// the stream is destroyed; they are not copied by copyfmt().
+static void IntCountsBlockWriterCallback(std::ios_base::event event,
+                                         std::ios_base &stream, int index) {
+  void *&ptr = stream.pword(index);
+  if (event == std::ios_base::erase_event) {
+    IntCountsBlockWriter *writer = static_cast<IntCountsBlockWriter*>(ptr);
+    if (writer != NULL && !writer->Empty())
+      std::cerr << "Warning: block-compressed IntLmStates were not flushed "
+                << "(code error)\n";
+    delete writer;
+    ptr = NULL;
+  } else if (event == std::ios_base::copyfmt_event) {
+    ptr = NULL;
+  }
+}
+static void IntCountsBlockReaderCallback(std::ios_base::event event,
+                                         std::ios_base &stream, int index) {
+  void *&ptr = stream.pword(index);
+  if (event == std::ios_base::erase_event) {
+    delete static_cast<IntCountsBlockReader*>(ptr);
+    ptr = NULL;
+  } else if (event == std::ios_base::copyfmt_event) {
+    ptr = NULL;
+  }
+}
+
+void EnableIntCountsBlocks(std::ostream &os) {
+  void *&ptr = os.pword(IntCountsBlockIndex());
+  if (ptr == NULL) {
+    ptr = new IntCountsBlockWriter();
+    os.register_callback(IntCountsBlockWriterCallback, IntCountsBlockIndex());
+  }
+}
+
+void FlushIntCountsBlocks(std::ostream &os) {
+  IntCountsBlockWriter *writer = static_cast<IntCountsBlockWriter*>(
+      os.pword(IntCountsBlockIndex()));
+  if (writer != NULL)
+    writer->Flush(os);
+}
+
 void IntLmState::Write(std::ostream &os) const {
   if (rand() % 2 == 0)
     Check();
-  if (discount != 0) {
-    assert(discount > 0);
-    // We write the negative of the discount, if it's
-    // nonzero, and nothing otherwise... this gives back compatibility
-    // in the on-disk format to when there was no 'discount' class member,
-    // and also saves a little I/O.
-    int32 neg_discount = -discount;
-    os.write(reinterpret_cast<const char*>(&neg_discount),
-             sizeof(int32));
+  IntCountsBlockWriter *writer = static_cast<IntCountsBlockWriter*>(
+      os.pword(IntCountsBlockIndex()));
+  if (writer != NULL) {
+    writer->Write(*this, os);
+    return;
   }
   int32 history_size = history.size(),
-      num_counts = counts.size(),
-      buffer_size = (2 + history_size + 2 * num_counts);
+      num_counts = counts.size();
   // Nnote: we allow num-counts to be zero because it's possible
   // when applying min-counts that for some not-higher-order states,
   // we may have a nonzero 'discount' that needs to be written, but
   // no actual counts.
   assert(num_counts >= 0);
-  int32 *buffer = new int32[buffer_size];
-  buffer[0] = history_size;
-  buffer[1] = num_counts;
-  for (int32 i = 0; i < history_size; i++)
-    buffer[2 + i] = history[i];
-  for (int32 i = 0; i < num_counts; i++) {
-    buffer[2 + history_size + 2 * i] = counts[i].first;
-    buffer[2 + history_size + 2 * i + 1] = counts[i].second;
+  int32 header[3] = { -discount, history_size, num_counts };
+  if (discount != 0) {
+    assert(discount > 0);
+    // We write the negative of the discount, if it's
+    // nonzero, and nothing otherwise... this gives back compatibility
+    // in the on-disk format to when there was no 'discount' class member,
+    // and also saves a little I/O.
+    WriteBytes(os, header, sizeof(header));
+  } else {
+    WriteBytes(os, header + 1, 2 * sizeof(int32));
+  }
+  if (history_size > 0)
+    WriteBytes(os, &(history[0]), sizeof(int32) * history_size);
+  if (num_counts > 0) {
+    assert(sizeof(std::pair<int32,int32>) == 8);
+    WriteBytes(os, &(counts[0]), sizeof(int32) * 2 * num_counts);
   }
-  os.write(reinterpret_cast<const char*>(buffer),
-           sizeof(int32) * size_t(buffer_size));
   if (!os.good()) {
     std::cerr << "Failure writing IntLmState to stream\n";
     exit(1);
   }
-  delete[] buffer;
 }
 
 
-inline static void ReadInt(std::istream &is,
-                            int32 *i) {
-  size_t bytes_read = is.read(reinterpret_cast<char*>(i),
-                              sizeof(int32)).gcount();
-  if (bytes_read != sizeof(int32)) {
-    std::cerr << "Failure reading IntLmState, expected 4 bytes, got "
-              << bytes_read;
+inline static void ReadInts(std::istream &is, int32 *i, int32 n = 1) {
+  if (!ReadBytes(is, i, sizeof(int32) * n)) {
+    std::cerr << "Failure reading IntLmState, expected " << (4 * n)
+              << " bytes\n";
     exit(1);
   }
 }
 
 void IntLmState::Read(std::istream &is) {
-  ReadInt(is, &discount);
+  // we read the first two ints together; this is the history-size and
+  // num-counts unless the discount is nonzero (see Write()).
+  int32 header[2];
+  ReadInts(is, header, 2);
+  if (header[0] == kIntCountsBlockMarker) {
+    // block-compressed data: from now on, read through a stream buffer that
+    // decodes the blocks.
+    void *&ptr = is.pword(IntCountsBlockIndex());
+    assert(ptr == NULL);
+    IntCountsBlockReader *reader = new IntCountsBlockReader(is.rdbuf(),
+                                                            header[1]);
+    ptr = reader;
+    is.register_callback(IntCountsBlockReaderCallback, IntCountsBlockIndex());
+    is.rdbuf(reader);
+    ReadInts(is, header, 2);
+  }
   int32 history_size, num_counts;
-  if (discount < 0) {
-    discount *= -1;  // We just read the negative of the discount.
-    ReadInt(is, &history_size);
+  if (header[0] < 0) {
+    discount = -header[0];  // We just read the negative of the discount.
+    history_size = header[1];
+    ReadInts(is, &num_counts);
   } else {
-    history_size = discount;  // We just read the history-size, the discount was
-                              // zero.
-    discount = 0;
+    discount = 0;  // We just read the history-size, the discount was zero.
+    history_size = header[0];
+    num_counts = header[1];
   }
-  ReadInt(is, &num_counts);
 
   assert(history_size >= 0 && num_counts >= 0);
   history.resize(history_size);
-  size_t bytes_read;
-  if (history_size > 0) {
-    size_t expected_bytes = sizeof(int32) * history_size;
-    bytes_read = is.read(reinterpret_cast<char*>(&(history[0])),
-                         expected_bytes).gcount();
-    if (bytes_read != expected_bytes) {
-      std::cerr << "Failure reading IntLmState history, expected "
-                << expected_bytes << " bytes, got "
-                << bytes_read;
-      exit(1);
-    }
-  }
+  if (history_size > 0)
+    ReadInts(is, &(history[0]), history_size);
   counts.resize(num_counts);
-
   if (num_counts > 0) {
     assert(sizeof(std::pair<int32,int32>) == 8);
-    size_t expected_bytes = sizeof(int32) * 2 * num_counts;
-    bytes_read = is.read(reinterpret_cast<char*>(&(counts[0])),
-                         expected_bytes).gcount();
-    if (bytes_read != expected_bytes) {
-      std::cerr << "Failure reading IntLmState counts, expected "
-                << expected_bytes << " bytes, got "
-                << bytes_read;
-      exit(1);
-    }
+    ReadInts(is, &(counts[0].first), 2 * num_counts);
   }
   if (rand() % 10 == 0)
     Check();
@@ -159,14 +473,11 @@ void IntLmState::Check() const {
 void NullLmState::Write(std::ostream &os) const {
   int32 history_size = history.size(), num_predicted = predicted.size();
   assert(num_predicted > 0);
-  os.write(reinterpret_cast<const char*>(&history_size), sizeof(int32));
-  os.write(reinterpret_cast<const char*>(&num_predicted), sizeof(int32));
-  if (history_size > 0) {
-    os.write(reinterpret_cast<const char*>(&(history[0])),
-             sizeof(int32) * history_size);
-  }
-  os.write(reinterpret_cast<const char*>(&(predicted[0])),
-           sizeof(int32) * num_predicted);
+  int32 header[2] = { history_size, num_predicted };
+  WriteBytes(os, header, sizeof(header));
+  if (history_size > 0)
+    WriteBytes(os, &(history[0]), sizeof(int32) * history_size);
+  WriteBytes(os, &(predicted[0]), sizeof(int32) * num_predicted);
   if (!os.good()) {
     std::cerr << "Failure writing NullLmState to stream\n";
     exit(1);
@@ -174,13 +485,12 @@ void NullLmState::Write(std::ostream &os) const {
 }
 
 void NullLmState::Read(std::istream &is) {
-  int32 history_size, num_predicted;
-  is.read(reinterpret_cast<char*>(&history_size), sizeof(int32));
-  is.read(reinterpret_cast<char*>(&num_predicted), sizeof(int32));
-  if (!is.good() || is.eof()) {
-    std::cerr << "Failure reading FloatLmState from stream\n";
+  int32 header[2];
+  if (!ReadBytes(is, header, sizeof(header))) {
+    std::cerr << "Failure reading NullLmState from stream\n";
     exit(1);
   }
+  int32 history_size = header[0], num_predicted = header[1];
   if (history_size < 0 || history_size > 10000 || num_predicted <= 0) {
     std::cerr << "Failure reading NullLmState from stream: "
         "got implausible data (wrong input?)\n";
@@ -188,13 +498,9 @@ void NullLmState::Read(std::istream &is) {
   }
   history.resize(history_size);
   predicted.resize(num_predicted);
-  if (history_size > 0) {
-    is.read(reinterpret_cast<char*>(&(history[0])),
-            sizeof(int32) * history_size);
-  }
-  is.read(reinterpret_cast<char*>(&(predicted[0])),
-          sizeof(int32) * num_predicted);
-  if (!is.good()) {
+  if ((history_size > 0 &&
+       !ReadBytes(is, &(history[0]), sizeof(int32) * history_size)) ||
+      !ReadBytes(is, &(predicted[0]), sizeof(int32) * num_predicted)) {
     std::cerr << "Failure reading NullLmState from stream\n";
     exit(1);
   }
@@ -224,19 +530,184 @@ void NullLmState::Print(std::ostream &os) const {
 }
 
 
+// Writes the header of a FloatLmState, which is the same for the normal and
+// the compact format (see lm-state.h) except that in the compact format,
+// 'history_size' is replaced by -2 - history_size.
+static inline void WriteFloatLmStateHeader(std::ostream &os,
+                                           int32 history_size,
+                                           int32 num_counts,
+                                           float total, float discount) {
+  char header[4 * sizeof(int32)];
+  memcpy(header, &history_size, sizeof(int32));
+  memcpy(header + sizeof(int32), &num_counts, sizeof(int32));
+  memcpy(header + 2 * sizeof(int32), &total, sizeof(float));
+  memcpy(header + 3 * sizeof(int32), &discount, sizeof(float));
+  WriteBytes(os, header, sizeof(header));
+}
+
 void FloatLmState::Write(std::ostream &os) const {
   int32 history_size = history.size(), num_counts = counts.size();
   assert(num_counts > 0);
-  os.write(reinterpret_cast<const char*>(&history_size), sizeof(int32));
-  os.write(reinterpret_cast<const char*>(&num_counts), sizeof(int32));
-  os.write(reinterpret_cast<const char*>(&total), sizeof(float));
-  os.write(reinterpret_cast<const char*>(&discount), sizeof(float));
-  if (history_size > 0) {
-    os.write(reinterpret_cast<const char*>(&(history[0])),
-             sizeof(int32) * history_size);
+  WriteFloatLmStateHeader(os, history_size, num_counts, total, discount);
+  if (history_size > 0)
+    WriteBytes(os, &(history[0]), sizeof(int32) * history_size);
+  WriteBytes(os, &(counts[0]), sizeof(std::pair<int32, float>) * num_counts);
+  if (!os.good()) {
+    std::cerr << "Failure writing FloatLmState to stream\n";
+    exit(1);
   }
-  os.write(reinterpret_cast<const char*>(&(counts[0])),
-           sizeof(std::pair<int32, float>) * num_counts);
+}
+
+// Returns the index of the stream's pword() in which ReadFloatCountsCodebook()
+// keeps the codebook (a std::vector<float>*) of compact float-counts.
+static int CodebookStreamIndex() {
+  static const int index = std::ios_base::xalloc();
+  return index;
+}
+
+// Deletes the stream's codebook when the stream is destroyed, and copies it
+// if the stream's format is copied by copyfmt().
+static void CodebookStreamCallback(std::ios_base::event event,
+                                   std::ios_base &stream, int index) {
+  void *&codebook = stream.pword(index);
+  if (event == std::ios_base::erase_event) {
+    delete static_cast<std::vector<float>*>(codebook);
+    codebook = NULL;
+  } else if (event == std::ios_base::copyfmt_event && codebook != NULL) {
+    codebook = new std::vector<float>(
+        *static_cast<std::vector<float>*>(codebook));
+  }
+}
+
+void WriteFloatCountsCodebook(std::ostream &os,
+                              const std::vector<float> &codebook) {
+  assert(!codebook.empty() && codebook.size() <= 65536 &&
+         std::is_sorted(codebook.begin(), codebook.end()));
+  int32 marker = -1, codebook_size = codebook.size();
+  os.write(reinterpret_cast<const char*>(&marker), sizeof(int32));
+  os.write(reinterpret_cast<const char*>(&codebook_size), sizeof(int32));
+  os.write(reinterpret_cast<const char*>(&(codebook[0])),
+           sizeof(float) * codebook_size);
+  if (!os.good()) {
+    std::cerr << "Failure writing float-counts codebook to stream\n";
+    exit(1);
+  }
+}
+
+bool ReadFloatCountsCodebook(std::istream &is) {
+  // A codebook record starts with the int32 -1, so its first byte is 0xff;
+  // an LM-state record would only start with that byte if its history had
+  // 255 words (mod 256), which we don't allow for.
+  if (is.rdbuf()->sgetc() != 0xff)
+    return false;
+  int32 marker, codebook_size;
+  is.read(reinterpret_cast<char*>(&marker), sizeof(int32));
+  is.read(reinterpret_cast<char*>(&codebook_size), sizeof(int32));
+  if (!is.good() || marker != -1 || codebook_size <= 0 ||
+      codebook_size > 65536) {
+    std::cerr << "Failure reading float-counts codebook from stream: "
+        "got implausible data (wrong input?)\n";
+    exit(1);
+  }
+  void *&ptr = is.pword(CodebookStreamIndex());
+  if (ptr == NULL) {
+    ptr = new std::vector<float>();
+    is.register_callback(CodebookStreamCallback, CodebookStreamIndex());
+  }
+  std::vector<float> *codebook = static_cast<std::vector<float>*>(ptr);
+  codebook->resize(codebook_size);
+  is.read(reinterpret_cast<char*>(&((*codebook)[0])),
+          sizeof(float) * codebook_size);
+  if (!is.good()) {
+    std::cerr << "Failure reading float-counts codebook from stream\n";
+    exit(1);
+  }
+  return true;
+}
+
+int32 NearestCodebookEntry(const std::vector<float> &codebook, float value) {
+  assert(!codebook.empty());
+  int32 i = std::lower_bound(codebook.begin(), codebook.end(), value) -
+      codebook.begin();
+  if (i == static_cast<int32>(codebook.size()) ||
+      (i > 0 && value - codebook[i - 1] < codebook[i] - value))
+    i--;
+  return i;
+}
+
+// Decodes the 'num_bytes' bytes of count-indexes and word differences at
+// 'data', of a compact LM-state (see lm-state.h), into 'counts', which must
+// already have the right size.  Returns false if the data is corrupted.
+static bool DecodeCompactCounts(const char *data, int32 num_bytes,
+                                const std::vector<float> &codebook,
+                                std::vector<std::pair<int32, float> > *counts) {
+  const uint8 *ptr = reinterpret_cast<const uint8*>(data),
+      *end = ptr + num_bytes;
+  int32 num_counts = counts->size(), codebook_size = codebook.size();
+  bool two_bytes = (codebook_size > 256);
+  if (num_counts * (two_bytes ? 2 : 1) > num_bytes)
+    return false;
+  for (int32 i = 0; i < num_counts; i++) {
+    int32 index;
+    if (two_bytes) {
+      uint16 i16;
+      memcpy(&i16, ptr, sizeof(uint16));
+      ptr += sizeof(uint16);
+      index = i16;
+    } else {
+      index = *(ptr++);
+    }
+    if (index >= codebook_size)
+      return false;
+    (*counts)[i].second = codebook[index];
+  }
+  uint32 word = 0;
+  for (int32 i = 0; i < num_counts; i++) {
+    uint32 diff;
+    if (!ReadVarint(&ptr, end, &diff))
+      return false;
+    word += diff;
+    (*counts)[i].first = word;
+  }
+  // the rest is padding.
+  return end - ptr < static_cast<int64>(sizeof(int32));
+}
+
+void FloatLmState::WriteCompact(std::ostream &os,
+                                const std::vector<float> &codebook) const {
+  int32 history_size = history.size(), num_counts = counts.size(),
+      marker = -2 - history_size;
+  assert(num_counts > 0);
+  bool two_bytes = (codebook.size() > 256);
+  std::string bytes;
+  for (int32 i = 0; i < num_counts; i++) {
+    int32 index = NearestCodebookEntry(codebook, counts[i].second);
+    bytes += static_cast<char>(index & 0xff);
+    if (two_bytes)
+      bytes += static_cast<char>(index >> 8);
+  }
+  if (two_bytes) {
+    // the loop above wrote the indexes little-endian; on other machines,
+    // swap each pair of bytes so that they are in the native byte order.
+    uint16 test = 1;
+    if (*reinterpret_cast<const uint8*>(&test) != 1)
+      for (size_t i = 0; i < bytes.size(); i += 2)
+        std::swap(bytes[i], bytes[i + 1]);
+  }
+  uint32 prev_word = 0;
+  for (int32 i = 0; i < num_counts; i++) {
+    assert(counts[i].first > static_cast<int32>(prev_word));
+    AppendVarint(counts[i].first - prev_word, &bytes);
+    prev_word = counts[i].first;
+  }
+  while (bytes.size() % sizeof(int32) != 0)
+    bytes += '\0';
+  int32 num_bytes = bytes.size();
+  WriteFloatLmStateHeader(os, marker, num_counts, total, discount);
+  if (history_size > 0)
+    WriteBytes(os, &(history[0]), sizeof(int32) * history_size);
+  WriteBytes(os, &num_bytes, sizeof(int32));
+  WriteBytes(os, bytes.data(), num_bytes);
   if (!os.good()) {
     std::cerr << "Failure writing FloatLmState to stream\n";
     exit(1);
@@ -244,28 +715,51 @@ void FloatLmState::Write(std::ostream &os) const {
 }
 
 void FloatLmState::Read(std::istream &is) {
-  int32 history_size, num_counts;
-  is.read(reinterpret_cast<char*>(&history_size), sizeof(int32));
-  is.read(reinterpret_cast<char*>(&num_counts), sizeof(int32));
-  if (!is.good() || is.eof()) {
+  while (ReadFloatCountsCodebook(is));
+  char header[4 * sizeof(int32)];
+  if (!ReadBytes(is, header, sizeof(header))) {
     std::cerr << "Failure reading FloatLmState from stream\n";
     exit(1);
   }
+  int32 history_size, num_counts;
+  memcpy(&history_size, header, sizeof(int32));
+  memcpy(&num_counts, header + sizeof(int32), sizeof(int32));
+  memcpy(&total, header + 2 * sizeof(int32), sizeof(float));
+  memcpy(&discount, header + 3 * sizeof(int32), sizeof(float));
+  // a negative history-size means the compact format.
+  bool compact = (history_size < 0);
+  if (compact)
+    history_size = -2 - history_size;
   if (history_size < 0 || history_size > 10000 || num_counts <= 0) {
     std::cerr << "Failure reading FloatLmState from stream: "
         "got implausible data (wrong input?)\n";
     exit(1);
   }
-  is.read(reinterpret_cast<char*>(&total), sizeof(float));
-  is.read(reinterpret_cast<char*>(&discount), sizeof(float));
   history.resize(history_size);
   counts.resize(num_counts);
-  if (history_size > 0) {
-    is.read(reinterpret_cast<char*>(&(history[0])),
-            sizeof(int32) * history_size);
+  if (history_size > 0)
+    ReadBytes(is, &(history[0]), sizeof(int32) * history_size);
+  if (compact) {
+    const std::vector<float> *codebook = static_cast<std::vector<float>*>(
+        is.pword(CodebookStreamIndex()));
+    int32 num_bytes;
+    if (codebook == NULL || !ReadBytes(is, &num_bytes, sizeof(int32)) ||
+        num_bytes < 0 ||
+        num_bytes > 8 * num_counts + 4) {
+      std::cerr << "Failure reading FloatLmState from stream: "
+          "got implausible compact data (wrong input?)\n";
+      exit(1);
+    }
+    std::vector<char> bytes(num_bytes + 1);
+    if (!ReadBytes(is, &(bytes[0]), num_bytes) ||
+        !DecodeCompactCounts(&(bytes[0]), num_bytes, *codebook, &counts)) {
+      std::cerr << "Failure reading FloatLmState from stream: "
+          "compact data is corrupted\n";
+      exit(1);
+    }
+  } else {
+    ReadBytes(is, &(counts[0]), sizeof(std::pair<int32, float>) * num_counts);
   }
-  is.read(reinterpret_cast<char*>(&(counts[0])),
-          sizeof(std::pair<int32, float>) * num_counts);
   if (!is.good()) {
     std::cerr << "Failure reading FloatLmState from stream\n";
     exit(1);
@@ -332,6 +826,292 @@ void FloatLmState::ComputeTotal() {
   total = my_total;
 }
 
+MappedFloatCounts::MappedFloatCounts(const std::string &filename):
+    filename_(filename), mapped_data_(NULL), mapped_size_(0), data_(NULL) {
+  int fd = open(filename.c_str(), O_RDONLY);
+  struct stat file_stat;
+  if (fd == -1 || fstat(fd, &file_stat) != 0) {
+    std::cerr << "MappedFloatCounts: failed to open float-counts file '"
+              << filename << "': " << strerror(errno) << "\n";
+    exit(1);
+  }
+  mapped_size_ = file_stat.st_size;
+  if (mapped_size_ > 0) {
+    mapped_data_ = mmap(NULL, mapped_size_, PROT_READ, MAP_SHARED, fd, 0);
+    if (mapped_data_ == MAP_FAILED) {
+      std::cerr << "MappedFloatCounts: failed to mmap file '" << filename
+                << "': " << strerror(errno) << "\n";
+      exit(1);
+    }
+    data_ = static_cast<const char*>(mapped_data_);
+  }
+  close(fd);
+
+  std::string index_filename = filename + ".index";
+  std::ifstream index_input(index_filename.c_str(),
+                            std::ios_base::in|std::ios_base::binary);
+  if (!index_input) {
+    std::cerr << "MappedFloatCounts: failed to open index file '"
+              << index_filename << "' (use float-counts-index to create it)\n";
+    exit(1);
+  }
+  std::vector<int64> index;
+  int64 i;
+  while (index_input.read(reinterpret_cast<char*>(&i), sizeof(int64)))
+    index.push_back(i);
+  bool ok = (index_input.gcount() == 0 && !index.empty() &&
+             index[0] >= 0 &&
+             index.size() >= static_cast<size_t>(2 + index[0]));
+  int64 num_orders = (ok ? index[0] : 0), total_states = 0;
+  for (int64 o = 0; ok && o < num_orders; o++) {
+    ok = (index[o + 1] >= 0);
+    order_begin_.push_back(total_states);
+    num_states_.push_back(index[o + 1]);
+    total_states += index[o + 1];
+  }
+  if (!ok || index.size() != static_cast<size_t>(
+          2 + num_orders + total_states) ||
+      index.back() != static_cast<int64>(mapped_size_)) {
+    std::cerr << "MappedFloatCounts: index file '" << index_filename
+              << "' does not match float-counts file '" << filename
+              << "' (was it modified?)\n";
+    exit(1);
+  }
+  offsets_.assign(index.begin() + 1 + num_orders, index.end() - 1);
+  for (size_t j = 0; j < offsets_.size(); j++) {
+    if (offsets_[j] < 0 || offsets_[j] >= index.back() ||
+        offsets_[j] % sizeof(int32) != 0) {
+      std::cerr << "MappedFloatCounts: index file '" << index_filename
+                << "' has bad contents.\n";
+      exit(1);
+    }
+  }
+
+  // read the codebook, if the file is in the compact format.
+  if (mapped_size_ >= 2 * sizeof(int32) &&
+      reinterpret_cast<const int32*>(data_)[0] == -1) {
+    int32 codebook_size = reinterpret_cast<const int32*>(data_)[1];
+    if (codebook_size <= 0 || codebook_size > 65536 ||
+        (2 + codebook_size) * sizeof(int32) > mapped_size_) {
+      std::cerr << "MappedFloatCounts: float-counts file '" << filename
+                << "' has a bad codebook.\n";
+      exit(1);
+    }
+    const float *codebook = reinterpret_cast<const float*>(data_) + 2;
+    codebook_.assign(codebook, codebook + codebook_size);
+  }
+  cached_offsets_.resize(num_orders, -1);
+  cached_states_.resize(num_orders);
+}
+
+MappedFloatCounts::~MappedFloatCounts() {
+  if (mapped_data_ != NULL)
+    munmap(mapped_data_, mapped_size_);
+}
+
+void MappedFloatCounts::GetHeader(int64 offset, int32 *history_size,
+                                  int32 *num_counts, bool *compact) const {
+  // the header is history-size, num-counts, total and discount.
+  if (offset < 0 || offset + 4 * sizeof(int32) > mapped_size_) {
+    std::cerr << "MappedFloatCounts: bad offset " << offset
+              << " in float-counts file '" << filename_ << "'\n";
+    exit(1);
+  }
+  const int32 *header = reinterpret_cast<const int32*>(data_ + offset);
+  *history_size = header[0];
+  *num_counts = header[1];
+  // a negative history-size means the compact format, in which the history
+  // is followed by the number of bytes of the counts.
+  *compact = (*history_size < 0);
+  if (*compact)
+    *history_size = -2 - *history_size;
+  int64 counts_bytes = sizeof(std::pair<int32, float>) * *num_counts;
+  if (*compact && *history_size >= 0 && !codebook_.empty() &&
+      offset + 5 * sizeof(int32) + sizeof(int32) * *history_size <=
+      mapped_size_)
+    counts_bytes = sizeof(int32) + header[4 + *history_size];
+  if (*history_size < 0 || *history_size > 10000 || *num_counts <= 0 ||
+      (*compact && codebook_.empty()) || counts_bytes < 0 ||
+      offset + 4 * sizeof(int32) + sizeof(int32) * *history_size +
+      counts_bytes > mapped_size_) {
+    std::cerr << "MappedFloatCounts: got implausible data at offset "
+              << offset << " in float-counts file '" << filename_
+              << "' (wrong input?)\n";
+    exit(1);
+  }
+}
+
+int64 MappedFloatCounts::FindState(const std::vector<int32> &history) const {
+  int32 order = history.size() + 1;
+  if (order > NumOrders())
+    return -1;
+  // binary search for the first LM-state of this order whose history is not
+  // less than 'history'; we compare the histories in place, without copying
+  // them.
+  int64 low = 0, high = NumStates(order);
+  while (low < high) {
+    int64 mid = (low + high) / 2;
+    int32 history_size, num_counts;
+    bool compact;
+    GetHeader(Offset(order, mid), &history_size, &num_counts, &compact);
+    assert(history_size + 1 == order);
+    const int32 *this_history = reinterpret_cast<const int32*>(
+        data_ + Offset(order, mid)) + 4;
+    if (std::lexicographical_compare(this_history,
+                                     this_history + history_size,
+                                     history.begin(), history.end()))
+      low = mid + 1;
+    else
+      high = mid;
+  }
+  if (low < NumStates(order)) {
+    const int32 *this_history = reinterpret_cast<const int32*>(
+        data_ + Offset(order, low)) + 4;
+    if (std::equal(history.begin(), history.end(), this_history))
+      return low;
+  }
+  return -1;
+}
+
+int64 MappedFloatCounts::ReadState(int64 offset,
+                                   FloatLmState *lm_state) const {
+  int32 history_size, num_counts;
+  bool compact;
+  GetHeader(offset, &history_size, &num_counts, &compact);
+  const char *ptr = data_ + offset + 2 * sizeof(int32);
+  memcpy(&(lm_state->total), ptr, sizeof(float));
+  memcpy(&(lm_state->discount), ptr + sizeof(float), sizeof(float));
+  ptr += 2 * sizeof(float);
+  lm_state->history.resize(history_size);
+  if (history_size > 0)
+    memcpy(&(lm_state->history[0]), ptr, sizeof(int32) * history_size);
+  ptr += sizeof(int32) * history_size;
+  lm_state->counts.resize(num_counts);
+  if (compact) {
+    int32 num_bytes;
+    memcpy(&num_bytes, ptr, sizeof(int32));
+    ptr += sizeof(int32);
+    if (!DecodeCompactCounts(ptr, num_bytes, codebook_,
+                             &(lm_state->counts))) {
+      std::cerr << "MappedFloatCounts: corrupted compact data at offset "
+                << offset << " in float-counts file '" << filename_ << "'\n";
+      exit(1);
+    }
+    ptr += num_bytes;
+  } else {
+    memcpy(static_cast<void*>(&(lm_state->counts[0])), ptr,
+           sizeof(std::pair<int32, float>) * num_counts);
+    ptr += sizeof(std::pair<int32, float>) * num_counts;
+  }
+  return ptr - data_;
+}
+
+void MappedFloatCounts::LookupCount(int64 offset, int32 word, float *total,
+                                    float *discount, float *count) const {
+  int32 history_size, num_counts;
+  bool compact;
+  GetHeader(offset, &history_size, &num_counts, &compact);
+  const char *ptr = data_ + offset + 2 * sizeof(int32);
+  memcpy(total, ptr, sizeof(float));
+  memcpy(discount, ptr + sizeof(float), sizeof(float));
+  ptr += 2 * sizeof(float) + sizeof(int32) * history_size;
+  if (compact) {
+    // the words are delta-encoded, so we can't binary-search them in place;
+    // decode the LM-state, keeping it in case the next lookup is in the same
+    // LM-state (which is typical for the lower orders).
+    assert(history_size < NumOrders());
+    FloatLmState &lm_state = cached_states_[history_size];
+    if (cached_offsets_[history_size] != offset) {
+      ReadState(offset, &lm_state);
+      cached_offsets_[history_size] = offset;
+    }
+    const std::vector<std::pair<int32, float> > &counts = lm_state.counts;
+    int32 low = 0, high = num_counts;
+    while (low < high) {
+      int32 mid = (low + high) / 2;
+      if (counts[mid].first < word)
+        low = mid + 1;
+      else
+        high = mid;
+    }
+    if (low < num_counts && counts[low].first == word)
+      *count = counts[low].second;
+    else
+      *count = 0.0;
+    return;
+  }
+  // the counts are pairs (word, count), sorted on word; binary search for
+  // 'word'.
+  const int32 *counts = reinterpret_cast<const int32*>(ptr);
+  int32 low = 0, high = num_counts;
+  while (low < high) {
+    int32 mid = (low + high) / 2;
+    if (counts[2 * mid] < word)
+      low = mid + 1;
+    else
+      high = mid;
+  }
+  if (low < num_counts && counts[2 * low] == word)
+    memcpy(count, counts + 2 * low + 1, sizeof(float));
+  else
+    *count = 0.0;
+}
+
+FloatLmStateSortedWriter::FloatLmStateSortedWriter(std::ostream &os,
+                                                   int32 order):
+    os_(os), buffers_(order + 1), unigram_pos_(0), unigram_size_(-1) {
+  assert(order >= 1);
+}
+
+void FloatLmStateSortedWriter::ReserveUnigramState(
+    const FloatLmState &lm_state) {
+  assert(lm_state.history.empty() && unigram_size_ == -1);
+  unigram_pos_ = os_.tellp();
+  if (unigram_pos_ == std::streampos(-1)) {
+    std::cerr << "FloatLmStateSortedWriter: the output is not seekable "
+              << "(it can't be a pipe).\n";
+    exit(1);
+  }
+  lm_state.Write(os_);
+  unigram_size_ = os_.tellp() - unigram_pos_;
+}
+
+void FloatLmStateSortedWriter::Write(const FloatLmState &lm_state) {
+  int32 history_length = lm_state.history.size();
+  assert(static_cast<size_t>(history_length + 1) < buffers_.size());
+  std::string &children = buffers_[history_length + 1];
+  if (history_length >= 2) {
+    std::ostringstream os(std::ios_base::out|std::ios_base::binary);
+    if (!lm_state.counts.empty())
+      lm_state.Write(os);
+    std::string &buffer = buffers_[history_length];
+    buffer.append(os.str());
+    buffer.append(children);
+  } else if (history_length == 1) {
+    if (!lm_state.counts.empty())
+      lm_state.Write(os_);
+    WriteBytes(os_, children.data(), children.size());
+  } else {
+    assert(children.empty() && unigram_size_ != -1 &&
+           "FloatLmStateSortedWriter: ReserveUnigramState() not called.");
+    std::streampos end_pos = os_.tellp();
+    os_.seekp(unigram_pos_);
+    lm_state.Write(os_);
+    if (os_.tellp() - unigram_pos_ != unigram_size_) {
+      std::cerr << "FloatLmStateSortedWriter: the unigram LM-state changed "
+                << "in size.\n";
+      exit(1);
+    }
+    os_.seekp(end_pos);
+  }
+  children.clear();
+  if (!os_.good()) {
+    std::cerr << "FloatLmStateSortedWriter: failure writing LM-states to "
+              << "stream (disk full?)\n";
+    exit(1);
+  }
+}
+
 void GeneralLmState::Print(std::ostream &os) const {
   os << " [ ";
   int32 hist_size = history.size();
@@ -361,13 +1141,13 @@ void GeneralLmState::Write(std::ostream &os) const {
   // declare a variable so this code won't compile if discount is changed to
   // double, since we use sizeof(float).
   const float *discount_ptr = &discount;
-  os.write(reinterpret_cast<const char*>(discount_ptr), sizeof(float));
-  os.write(reinterpret_cast<const char*>(&history_size), sizeof(int32));
-  os.write(reinterpret_cast<const char*>(&num_counts), sizeof(int32));
-  if (history_size > 0) {
-    os.write(reinterpret_cast<const char*>(&(history[0])),
-             sizeof(int32) * history_size);
-  }
+  char header[sizeof(float) + 2 * sizeof(int32)];
+  memcpy(header, discount_ptr, sizeof(float));
+  memcpy(header + sizeof(float), &history_size, sizeof(int32));
+  memcpy(header + sizeof(float) + sizeof(int32), &num_counts, sizeof(int32));
+  WriteBytes(os, header, sizeof(header));
+  if (history_size > 0)
+    WriteBytes(os, &(history[0]), sizeof(int32) * history_size);
   size_t pair_size = sizeof(std::pair<int32, Count>);
   // We don't check that this size equals sizeof(int32) + 4 * sizeof(float).
   // Thus, in principle there could be some kind of padding, and we'd be
@@ -376,8 +1156,7 @@ void GeneralLmState::Write(std::ostream &os) const {
   // intermediate files used on a single machine-- the final output
   // of this toolkit is going to be a text ARPA file.
 
-  os.write(reinterpret_cast<const char*>(&(counts[0])),
-           pair_size * num_counts);
+  WriteBytes(os, &(counts[0]), pair_size * num_counts);
 
   if (!os.good()) {
     std::cerr << "Failure writing GeneralLmState to stream\n";
@@ -387,34 +1166,21 @@ void GeneralLmState::Write(std::ostream &os) const {
 
 void GeneralLmState::Read(std::istream &is) {
   int32 history_size, num_counts;
-
-  size_t bytes_read = is.read(reinterpret_cast<char*>(&discount),
-                              sizeof(float)).gcount();
-  if (bytes_read != sizeof(float)) {
-    std::cerr << "Failure reading GeneralLmState, expected 4 bytes, got "
-              << bytes_read;
+  char header[sizeof(float) + 2 * sizeof(int32)];
+  if (!ReadBytes(is, header, sizeof(header))) {
+    std::cerr << "Failure reading GeneralLmState, expected "
+              << sizeof(header) << " bytes\n";
     exit(1);
   }
+  memcpy(&discount, header, sizeof(float));
+  memcpy(&history_size, header + sizeof(float), sizeof(int32));
+  memcpy(&num_counts, header + sizeof(float) + sizeof(int32), sizeof(int32));
   assert(discount >= 0.0 && "Reading GeneralLmState, got bad data");
-  bytes_read = is.read(reinterpret_cast<char*>(&history_size),
-                       sizeof(int32)).gcount();
-  if (bytes_read != sizeof(int32)) {
-    std::cerr << "Failure reading GeneralLmState, expected 4 bytes, got "
-              << bytes_read;
-    exit(1);
-  }
   if (history_size > 10000 || history_size < 0) {
     std::cerr << "Reading GeneralLmState, expected history size, got "
               << history_size << " (attempting to read wrong file type?)\n";
     exit(1);
   }
-  bytes_read = is.read(reinterpret_cast<char*>(&num_counts),
-                       sizeof(int32)).gcount();
-  if (bytes_read != sizeof(int32)) {
-    std::cerr << "Failure reading GeneralLmState, expected 4 bytes, got "
-              << bytes_read;
-    exit(1);
-  }
   if (num_counts <= 0) {
     std::cerr << "Reading GeneralLmState, expected num-counts, got "
               << num_counts << " (attempting to read wrong file type?)\n";
@@ -423,12 +1189,9 @@ void GeneralLmState::Read(std::istream &is) {
   history.resize(history_size);
   if (history_size > 0) {
     size_t expected_bytes = sizeof(int32) * history_size;
-    bytes_read = is.read(reinterpret_cast<char*>(&(history[0])),
-                         expected_bytes).gcount();
-    if (bytes_read != expected_bytes) {
+    if (!ReadBytes(is, &(history[0]), expected_bytes)) {
       std::cerr << "Failure reading GeneralLmState history, expected "
-                << expected_bytes << " bytes, got "
-                << bytes_read;
+                << expected_bytes << " bytes\n";
       exit(1);
     }
   }
@@ -436,12 +1199,9 @@ void GeneralLmState::Read(std::istream &is) {
   size_t pair_size = sizeof(std::pair<int32, Count>);
 
   size_t expected_bytes = pair_size * num_counts;
-  bytes_read = is.read(reinterpret_cast<char*>(&(counts[0])),
-                       expected_bytes).gcount();
-  if (bytes_read != expected_bytes) {
+  if (!ReadBytes(is, &(counts[0]), expected_bytes)) {
     std::cerr << "Failure reading GeneralLmState counts, expected "
-              << expected_bytes << " bytes, got "
-              << bytes_read;
+              << expected_bytes << " bytes\n";
     exit(1);
   }
   if (rand() % 10 == 0)
@@ -560,9 +1320,12 @@ void MergeIntLmStates(const std::vector<const IntLmState*> &source_pointers,
   assert(source_pointers.size() > 1);
   std::vector<std::pair<int32, int32> > temp_counts;
   merged_state->history = source_pointers[0]->history;
+  merged_state->discount = 0;
   size_t total_size = 0;
-  for (size_t i = 0; i < source_pointers.size(); i++)
+  for (size_t i = 0; i < source_pointers.size(); i++) {
     total_size += source_pointers[i]->counts.size();
+    merged_state->discount += source_pointers[i]->discount;
+  }
 
   temp_counts.reserve(total_size);
   for (size_t i = 0; i < source_pointers.size(); i++) {
@@ -21,6 +21,7 @@
 #define POCOLM_LM_STATE_H_
 
 #include <iostream>
+#include <string>
 #include <vector>
 #include <utility>
 #include "pocolm-types.h"
@@ -30,6 +31,14 @@ namespace pocolm {
 
 
 
+// Makes it faster to read and write LM-states through std::cin and
+// std::cout: it stops the standard streams from being synchronized with C
+// stdio (so they get their own buffers), and unties std::cin from std::cout
+// (so that reading from std::cin does not flush std::cout).  Programs that
+// read or write LM-states on their standard input or output call this at the
+// start of main(); they must not also use C stdio on stdin or stdout.
+void UseFastStandardStreams();
+
 /**
    This class is used to store the count information we have in a language-model
    state-- for a single data-source, prior to any smoothing, weighting, or interpolation.
@@ -65,13 +74,16 @@ class IntLmState {
     counts.push_back(std::pair<int32,int32>(word, count));
   }
 
-  // writes to the ostream.  Throws on error.
+  // writes to the ostream (in the block-compressed format, if
+  // EnableIntCountsBlocks(os) was called).  Throws on error.
   void Write(std::ostream &os) const;
 
   // prints in text form to the ostream (for debug- the output is not computer readable).
   void Print(std::ostream &os) const;
 
-  // reads from the istream, which is assumed to not be at EOF.
+  // reads from the istream, which is assumed to not be at EOF.  If it
+  // encounters block-compressed data (see below), it makes the stream decode
+  // it, so programs that read IntLmStates read both formats.
   // Throws on error.
   void Read(std::istream &is);
 
@@ -93,6 +105,39 @@ void MergeIntLmStates(const std::vector<const IntLmState*> &source_pointers,
                       IntLmState *merged_state);
 
 
+/**
+   IntLmState files (e.g. the int.* files in count directories) may be
+   written in a block-compressed format (see int-counts-compress and
+   EnableIntCountsBlocks()), which IntLmState::Read() reads transparently.
+   The file is a sequence of blocks, each of which is:
+     int32 kIntCountsBlockMarker, int32 num-bytes, int32 num-raw-bytes,
+     int32 num-states, followed by num-bytes bytes of encoded LM-states
+   where num-raw-bytes is the size of those LM-states in the normal format.
+   Each LM-state is encoded as a sequence of varints: the discount, the
+   history-size, the number of leading history words it shares with the
+   previous LM-state in the block, the rest of the history, the number of
+   counts, and then for each count the difference from the previous word
+   (zigzag-encoded, from zero for the first) and the count.  Blocks contain
+   whole LM-states and are decoded independently of each other, so a file
+   can be divided at block boundaries for parallel processing, and files
+   can be concatenated.  Since the marker would be read as an impossible
+   discount by the normal format, normal and block-compressed data can be
+   told apart from the first number.
+ */
+
+static const int32 kIntCountsBlockMarker = -2147483647 - 1;
+
+// After this is called, IntLmState::Write(os) writes to 'os' in the
+// block-compressed format.  FlushIntCountsBlocks(os) must be called after the
+// last LM-state is written, before 'os' is closed.
+void EnableIntCountsBlocks(std::ostream &os);
+
+// Writes out the partial block of LM-states that have been written to 'os'
+// since EnableIntCountsBlocks(os) or the previous flush; does nothing if
+// EnableIntCountsBlocks(os) was not called.  Dies on error.
+void FlushIntCountsBlocks(std::ostream &os);
+
+
 /**
    This class is used for storing stats that have been discounted, e.g
    3-gram stats from which the discount amount has been removed.  We store
@@ -123,10 +168,19 @@ class FloatLmState {
   // writes to the ostream.  Throws on error.
   void Write(std::ostream &os) const;
 
+  // writes to the ostream in the compact format (see the comment above
+  // WriteFloatCountsCodebook()), with each count replaced by the index of the
+  // nearest entry of 'codebook', which must be the codebook that was most
+  // recently written to 'os' by WriteFloatCountsCodebook().  Dies on error.
+  void WriteCompact(std::ostream &os,
+                    const std::vector<float> &codebook) const;
+
   // prints in text form to the ostream (for debug- the output is not computer readable).
   void Print(std::ostream &os) const;
 
-  // reads from the istream, which is assumed to not be at EOF.
+  // reads from the istream, which is assumed to not be at EOF.  It reads
+  // both the normal and the compact format, so programs that read
+  // float-counts don't need to know which one they were given.
   // Throws on error.
   void Read(std::istream &is);
 
@@ -149,6 +203,178 @@ class FloatLmState {
 };
 
 
+/**
+   Float-counts may be stored in a compact format, which is written by
+   float-counts-compress and is read transparently by FloatLmState::Read()
+   and by class MappedFloatCounts.  A compact file starts with a codebook
+   record:
+     int32 -1, int32 codebook-size, float codebook[codebook-size]
+   where the codebook is sorted and has at most 65536 entries; it is followed
+   by LM-state records, in which the counts are stored as (1-byte if the
+   codebook has at most 256 entries, else 2-byte) indexes into the codebook,
+   and the words as differences from the previous word (from zero for the
+   first one), varint-encoded:
+     int32 -(2 + history-size), int32 num-counts, float total,
+     float discount, int32 history[history-size], int32 num-bytes,
+     followed by num-bytes bytes: the count indexes, the word differences,
+     and zero padding to a multiple of 4 bytes.
+   The header is the same as in the normal format, except for the sign of the
+   first number, so normal and compact records can be told apart.  Since
+   Read() keeps the codebook with the stream, compact files can be
+   concatenated; MappedFloatCounts only supports a codebook at the start of
+   the file, though.
+ */
+
+// Writes a codebook record (see above) to 'os'; dies on error.  'codebook'
+// must be sorted and have between 1 and 65536 entries.
+void WriteFloatCountsCodebook(std::ostream &os,
+                              const std::vector<float> &codebook);
+
+// If the next record in 'is' is a codebook record, reads it, keeping the
+// codebook with the stream for use by FloatLmState::Read(), and returns true;
+// otherwise returns false without reading anything.  Dies on error.
+bool ReadFloatCountsCodebook(std::istream &is);
+
+// Returns the index of the entry of 'codebook' (which must be sorted and
+// nonempty) that is nearest to 'value'.
+int32 NearestCodebookEntry(const std::vector<float> &codebook, float value);
+
+
+/**
+   This class gives random access to a file of float-counts that is sorted on
+   history (such as float.all as written by merge-float-counts), via mmap and
+   an index file <float-counts>.index, as written by float-counts-index.
+
+   The index file is a sequence of native-endian int64: the number of orders
+   N (i.e. one plus the longest history length); then for each order o = 1..N
+   the number of LM-states of that order (whose history has length o - 1);
+   then for each order o = 1..N, the byte offsets in the float-counts file of
+   its LM-states, in the order in which they appear in the file (i.e. sorted
+   on history); then the size of the float-counts file in bytes.  Since a
+   file sorted on history interleaves the orders, this is what makes it
+   possible to binary-search the LM-states of a particular order.
+
+   The float-counts file may be in the compact format (see above); the counts
+   of compact LM-states are decoded when they are accessed.
+ */
+class MappedFloatCounts {
+ public:
+  // Maps the float-counts file 'filename' and reads its index file
+  // <filename>.index.  Dies on error.
+  explicit MappedFloatCounts(const std::string &filename);
+
+  ~MappedFloatCounts();
+
+  int32 NumOrders() const { return num_states_.size(); }
+
+  // Returns the number of LM-states of order 'order' (1 <= order <=
+  // NumOrders()).
+  int64 NumStates(int32 order) const { return num_states_[order - 1]; }
+
+  // Returns the byte offset in the file of the i'th LM-state of order
+  // 'order' (0 <= i < NumStates(order)).
+  int64 Offset(int32 order, int64 i) const {
+    return offsets_[order_begin_[order - 1] + i];
+  }
+
+  // Returns the size of the float-counts file in bytes.
+  int64 FileSize() const { return mapped_size_; }
+
+  // Returns the index i (as used in Offset()) of the LM-state with history
+  // 'history', of order history.size() + 1, or -1 if there is no such
+  // LM-state.
+  int64 FindState(const std::vector<int32> &history) const;
+
+  // Reads the LM-state at byte offset 'offset', which must be the start of an
+  // LM-state (e.g. as returned by Offset()), into 'lm_state', and returns the
+  // offset of the LM-state that follows it in the file (which equals
+  // FileSize() if it was the last one).  Dies if the data is corrupted.
+  int64 ReadState(int64 offset, FloatLmState *lm_state) const;
+
+  // Gets the total and discount of the LM-state at byte offset 'offset', and
+  // its count for word 'word' (zero if it has no count for that word), without
+  // copying the LM-state (unless it is in the compact format, in which case
+  // it's decoded and cached, one LM-state per order).
+  void LookupCount(int64 offset, int32 word, float *total, float *discount,
+                   float *count) const;
+
+ private:
+  // Checks that there is a plausible LM-state header at byte offset 'offset'
+  // and returns its history-size and number of counts, and whether it is in
+  // the compact format; dies otherwise.
+  void GetHeader(int64 offset, int32 *history_size, int32 *num_counts,
+                 bool *compact) const;
+
+  std::string filename_;
+  void *mapped_data_;
+  size_t mapped_size_;
+  // the start of the mapped data.
+  const char *data_;
+  // num_states_[o-1] is the number of LM-states of order o.
+  std::vector<int64> num_states_;
+  // order_begin_[o-1] is the position in offsets_ of the first offset of an
+  // LM-state of order o.
+  std::vector<int64> order_begin_;
+  // the offsets of the LM-states, grouped by order.
+  std::vector<int64> offsets_;
+  // the codebook, if the file is in the compact format.
+  std::vector<float> codebook_;
+  // cached_offsets_[o-1] is the offset of the compact LM-state of order o
+  // that is stored, decoded, in cached_states_[o-1] (or -1); used in
+  // LookupCount().
+  mutable std::vector<int64> cached_offsets_;
+  mutable std::vector<FloatLmState> cached_states_;
+};
+
+
+/**
+   This class is for programs that read float-counts sorted on history (such as
+   float.all) and only finish each LM-state after all the LM-states that back
+   off to it, e.g. float-counts-prune and float-counts-estimate, which modify
+   the lower-order LM-states as they go.  Rather than writing each order to a
+   separate file, to be merged afterwards with merge-float-counts, such
+   programs can give the finished LM-states to this class, which writes them
+   to a single stream, sorted on history.
+
+   To do this, the LM-states of history-length >= 2 are kept in memory until
+   the LM-state of history-length 1 that they back off to is finished, so the
+   memory used is bounded by the size of the largest such group of LM-states,
+   not by the size of the model.  The unigram LM-state is finished last but
+   has to be written first; space is reserved for it by ReserveUnigramState(),
+   and it is written there at the end.  This requires the stream to be
+   seekable (e.g. not a pipe), and the unigram LM-state not to change in size.
+ */
+class FloatLmStateSortedWriter {
+ public:
+  // 'order' is the n-gram order, i.e. one plus the longest history length.
+  FloatLmStateSortedWriter(std::ostream &os, int32 order);
+
+  // This should be called, with the unigram LM-state as read from the input,
+  // before any other LM-state is written.  It writes a placeholder for the
+  // unigram LM-state, and dies if the stream is not seekable.
+  void ReserveUnigramState(const FloatLmState &lm_state);
+
+  // Writes (or keeps in memory, to be written later) an LM-state that has been
+  // finished; each LM-state must be finished after all the LM-states that
+  // back off to it, and in the sorted order otherwise.  If lm_state.counts
+  // is empty, nothing is written for this LM-state (but the LM-states that
+  // back off to it are).  The unigram LM-state must be written last.
+  void Write(const FloatLmState &lm_state);
+
+ private:
+  std::ostream &os_;
+  // buffers_[h], for h >= 2, contains the LM-states of history-length >= h,
+  // in sorted order, that back off to the LM-state of history-length h - 1
+  // that we are currently processing.
+  std::vector<std::string> buffers_;
+  // the position in os_ at which the unigram LM-state is to be written, and
+  // its size; unigram_size_ is -1 if ReserveUnigramState() has not been
+  // called.
+  std::streampos unigram_pos_;
+  int64 unigram_size_;
+};
+
+
 /**
    NullLmState stores LM states that just contain lists of words, with no count
    (hence "null", because the count is null).  This is used in the pruning code
@@ -178,6 +178,7 @@ class CountMerger {
 }  // namespace pocolm
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc <= 1) {
     std::cerr << "merge-counts: expected usage: <counts-file1>[,scale1] <counts-file2>[,scale1] ...\n"
               << " (it writes the merged counts to stdout).  For example:\n"
@@ -0,0 +1,505 @@
+// merge-discount-counts-backward.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iostream>
+#include <sstream>
+#include <fstream>
+#include <vector>
+#include <map>
+#include <stdlib.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+#include "lm-state-derivs.h"
+
+
+/**
+   This is the backprop program corresponding to merge-discount-counts; it does
+   the same as discount-counts-backward followed by merge-counts-backward.
+   Since merge-discount-counts does not write the merged counts, this program
+   recomputes each merged LM-state from the sources (which is cheap compared
+   with reading it from disk), backprops through the discounting to get the
+   derivatives w.r.t. the merged LM-state, and then backprops those through the
+   merging.
+*/
+
+namespace pocolm {
+
+class CountMergerDiscounterBackward {
+ public:
+  CountMergerDiscounterBackward(int argc, const char **argv):
+      d1_deriv_(0.0), d2_deriv_(0.0), d3_deriv_(0.0), d4_deriv_(0.0),
+      num_lm_states_processed_(0) {
+    // see usage message for expected usage.
+    assert(argc >= 11 && argc % 2 == 1);
+    ReadArgs(argv);
+    Init(argc - 9, argv + 9);
+    while (!hist_to_sources_.empty())
+      ProcessState();
+    CheckDerivsUsed(backoff_lm_state_);
+    std::cerr << "merge-discount-counts-backward: processed "
+              << num_lm_states_processed_ << " LM states\n";
+    FinalizeOutput();
+  }
+
+ private:
+  void Init(int32 num_args, const char **args) {
+    int32 num_sources = num_args / 2;
+    scales_.resize(num_sources);
+    count_inputs_ = new std::ifstream[num_sources];
+    deriv_outputs_ = new std::ofstream[num_sources];
+    scale_derivs_.resize(num_sources, 0.0);
+    int_lm_states_.resize(num_sources);
+    general_lm_states_.resize(num_sources);
+
+    for (int32 i = 0; i < num_sources; i++) {
+      const char *count_filename = args[i * 2],
+          *scale_or_deriv_filename = args[i * 2 + 1];
+      OpenStream(count_filename, count_inputs_ + i);
+      char *endptr = NULL;
+      float scale = strtod(scale_or_deriv_filename, &endptr);
+      if (*endptr != '\0') {
+        // not a valid floating-point value: assume it was the filename of a
+        // derivative.
+        scales_[i] = -1;
+        OpenStream(scale_or_deriv_filename, deriv_outputs_ + i);
+      } else {
+        scales_[i] = scale;
+        if (!(scale > 0.0)) {
+          std::cerr << "merge-discount-counts-backward: bad scale "
+                    << scale << "\n";
+          exit(1);
+        }
+      }
+      ReadStream(i);
+    }
+  }
+
+  void FinalizeOutput() {
+    delete [] count_inputs_;
+    std::cout << d1_deriv_ << " " << d2_deriv_ << " " << d3_deriv_
+              << " " << d4_deriv_;
+    for (size_t i = 0; i < scales_.size(); i++) {
+      if (scales_[i] == -1) {
+        deriv_outputs_[i].close();
+        if (deriv_outputs_[i].fail()) {
+          std::cerr << "merge-discount-counts-backward: error closing stream "
+                    << "(disk full?)\n";
+          exit(1);
+        }
+      } else {
+        std::cout << " " << scale_derivs_[i];
+      }
+    }
+    std::cout << "\n";
+    delete [] deriv_outputs_;
+  }
+
+  void OpenStream(const char *filename,
+                  std::ifstream *stream) {
+    stream->open(filename, std::ios_base::binary|std::ios_base::in);
+    if (!stream->is_open()) {
+      std::cerr << "merge-discount-counts-backward: failed to open '"
+                << filename << "' for reading\n";
+      exit(1);
+    }
+  }
+
+  void OpenStream(const char *filename,
+                  std::ofstream *stream) {
+    stream->open(filename, std::ios_base::binary|std::ios_base::out);
+    if (!stream->is_open()) {
+      std::cerr << "merge-discount-counts-backward: failed to open '"
+                << filename << "' for writing\n";
+      exit(1);
+    }
+  }
+
+  // Calling this function will attempt to read a new lm-state from source
+  // stream i, and will update hist_to_sources_ as appropriate; before that,
+  // it writes the derivatives w.r.t. the previous LM-state of source i, if it
+  // is a source of general counts.
+  void ReadStream(int32 i) {
+    assert(static_cast<size_t>(i) < scales_.size());
+    if (scales_[i] == -1 && !general_lm_states_[i].counts.empty()) {
+      general_lm_states_[i].WriteDerivs(deriv_outputs_[i]);
+      general_lm_states_[i].counts.clear();
+    }
+    count_inputs_[i].peek();
+    if (count_inputs_[i].eof())
+      return;
+    const std::vector<int32> *this_hist;
+    if (scales_[i] == -1) {
+      general_lm_states_[i].Read(count_inputs_[i]);
+      this_hist = &(general_lm_states_[i].history);
+    } else {
+      int_lm_states_[i].Read(count_inputs_[i]);
+      this_hist = &(int_lm_states_[i].history);
+    }
+    hist_to_sources_[*this_hist].push_back(i);
+  }
+
+  // This function, which expects hist_to_sources_ to be nonempty, processes
+  // the (lexicographically) first history state in hist_to_sources_: it
+  // recomputes the merged LM-state as merge-discount-counts did, backprops
+  // through the discounting of it and then through the merging.
+  void ProcessState() {
+    assert(!hist_to_sources_.empty());
+    num_lm_states_processed_++;
+    std::vector<int32> hist = hist_to_sources_.begin()->first,
+        sources = hist_to_sources_.begin()->second;
+    hist_to_sources_.erase(hist_to_sources_.begin());
+
+    // if the only source is general counts, the merged LM-state is that
+    // source's LM-state, and the derivatives w.r.t. it are those w.r.t. the
+    // source.
+    bool single_general_source = (sources.size() == 1 &&
+                                  scales_[sources[0]] == -1);
+    GeneralLmStateDerivs *merged_state;
+    if (single_general_source) {
+      merged_state = &(general_lm_states_[sources[0]]);
+    } else {
+      builder_.Clear();
+      for (std::vector<int32>::const_iterator iter = sources.begin();
+           iter != sources.end(); ++iter) {
+        int32 s = *iter;
+        if (scales_[s] == -1)
+          builder_.AddCounts(general_lm_states_[s]);
+        else
+          builder_.AddCounts(int_lm_states_[s], scales_[s]);
+      }
+      builder_.Output(hist, &merged_state_);
+      merged_state_.count_derivs.resize(merged_state_.counts.size());
+      merged_state = &merged_state_;
+    }
+
+    discounted_lm_state_.Read(discounted_count_stream_);
+    discounted_lm_state_.ReadDerivs(discounted_deriv_stream_);
+    assert(discounted_lm_state_.history == hist && "mismatched data?");
+    if (backoff_lm_state_.history.size() + 1 != hist.size() ||
+        !std::equal(backoff_lm_state_.history.begin(),
+                    backoff_lm_state_.history.end(),
+                    hist.begin()) ||
+        backoff_lm_state_.counts.empty()) {
+      CheckDerivsUsed(backoff_lm_state_);
+      backoff_lm_state_.Read(backoff_count_stream_);
+      backoff_lm_state_.ReadDerivs(backoff_deriv_stream_);
+      UpdateBackoffWordMap();
+    }
+    DiscountBackward(discounted_lm_state_, merged_state);
+
+    if (!single_general_source) {
+      PopulateMergedWordMap();
+      for (std::vector<int32>::const_iterator iter = sources.begin();
+           iter != sources.end(); ++iter) {
+        int32 s = *iter;
+        if (scales_[s] == -1)
+          ProcessSourceGeneral(s);
+        else
+          ProcessSourceInt(s);
+      }
+    }
+    for (std::vector<int32>::const_iterator iter = sources.begin();
+         iter != sources.end(); ++iter)
+      ReadStream(*iter);
+  }
+
+  // ensures that the top1, top2, top3 derivs in this GeneralLmStateDerivs class
+  // instance are all zero, implying those derivs have been propagated
+  // correctly (see discount-counts-backward.cc).
+  void CheckDerivsUsed(const GeneralLmStateDerivs &state) const {
+    std::vector<Count>::const_iterator
+        iter = state.count_derivs.begin(),
+        end = state.count_derivs.end();
+    std::vector<std::pair<int32,Count> >::const_iterator pair_iter =
+        state.counts.begin();
+    for (; iter != end; ++iter, ++pair_iter) {
+      assert((iter->top1 == 0.0 || pair_iter->second.top1 == 0.0) &&
+             (iter->top2 == 0.0 || pair_iter->second.top2 == 0.0) &&
+             (iter->top3 == 0.0 || pair_iter->second.top3 == 0.0) &&
+             "some derivatives were not accounted for.");
+    }
+  }
+
+  void UpdateBackoffWordMap() {
+    for (size_t i = 0; i < backoff_lm_state_.counts.size(); i++) {
+      int32 word = backoff_lm_state_.counts[i].first;
+      assert(word > 0);
+      // note, we leave the new indexes undefined, it doesn't matter.
+      if (backoff_word_map_.size() <= static_cast<size_t>(word))
+        backoff_word_map_.resize(static_cast<size_t>(word) + 1);
+      backoff_word_map_[word] = i;
+    }
+  }
+
+  // sets up merged_word_map_ so that we can look up for any word in
+  // merged_state_.counts, the position in that vector.
+  void PopulateMergedWordMap() {
+    for (size_t i = 0; i < merged_state_.counts.size(); i++) {
+      int32 word = merged_state_.counts[i].first;
+      if (merged_word_map_.size() <= static_cast<size_t>(word))
+        merged_word_map_.resize(static_cast<size_t>(word) + 1);
+      merged_word_map_[word] = i;
+    }
+  }
+
+  /*
+    This backprops through the discounting of the merged LM-state 'lm_state'
+    (see ProcessLmState() in discount-counts-backward.cc, which this is the
+    same as): 'discounted_lm_state' is its discounted version, with
+    derivatives, and the output is the derivatives stored in 'lm_state'.  A
+    'hidden' input to this function is 'backoff_lm_state_', which is the
+    lower-order version of this LM state, and which stores the derivatives
+    w.r.t. the backed-off parts.
+   */
+  void DiscountBackward(const FloatLmStateDerivs &discounted_lm_state,
+                        GeneralLmStateDerivs *lm_state) {
+    assert(discounted_lm_state.counts.size() ==
+           lm_state->counts.size());
+
+    std::vector<std::pair<int32,Count> >::const_iterator count_iter =
+        lm_state->counts.begin(), count_end = lm_state->counts.end();
+    std::vector<double>::const_iterator discounted_deriv_iter =
+        discounted_lm_state.count_derivs.begin();
+    std::vector<Count>::iterator deriv_iter = lm_state->count_derivs.begin();
+    double d1_deriv_part = 0.0,
+        d2_deriv_part = 0.0,
+        d3_deriv_part = 0.0,
+        d4_deriv_part = 0.0;
+    float total_backoff_count_deriv = discounted_lm_state.discount_deriv;
+    lm_state->discount_deriv = discounted_lm_state.discount_deriv;
+    for (; count_iter != count_end;
+         ++count_iter, ++discounted_deriv_iter, ++deriv_iter) {
+      int32 word = count_iter->first;
+      const Count &count = count_iter->second;
+      float discounted_deriv = *discounted_deriv_iter;
+      Count &deriv = *deriv_iter;
+      assert(static_cast<size_t>(word) < backoff_word_map_.size() &&
+             static_cast<size_t>(backoff_word_map_[word]) <
+             backoff_lm_state_.counts.size() &&
+             backoff_lm_state_.counts[backoff_word_map_[word]].first == word);
+
+      int32 backoff_pos = backoff_word_map_[word];
+      const Count &backoff_count = backoff_lm_state_.counts[backoff_pos].second;
+      Count &backoff_deriv = backoff_lm_state_.count_derivs[backoff_pos];
+      // these must be exactly the same as in merge-discount-counts.
+      volatile float top4plus = count.total - count.top1 - count.top2 - count.top3,
+          d1 = d1_ * count.top1, d2 = d2_ * count.top2, d3 = d3_ * count.top3,
+          d4 = d4_ * top4plus, d = d1 + d2 + d3 + d4;
+      float d_deriv = total_backoff_count_deriv - discounted_deriv;
+      deriv.total = discounted_deriv;
+
+      if (POCOLM_SEPARATE_COUNTS) {
+        Count discount;
+        discount.total = d;
+        discount.top1 = d1;
+        discount.top2 = d2;
+        discount.top3 = d3;
+        Count discount_deriv(0.0f);
+        backoff_count.AddBackward(discount, &backoff_deriv, &discount_deriv);
+
+        float d1_deriv = discount_deriv.top1 + discount_deriv.total + d_deriv,
+            d2_deriv = discount_deriv.top2 + discount_deriv.total + d_deriv,
+            d3_deriv = discount_deriv.top3 + discount_deriv.total + d_deriv,
+            d4_deriv = discount_deriv.total + d_deriv;
+
+        d1_deriv_part += count.top1 * d1_deriv;
+        d2_deriv_part += count.top2 * d2_deriv;
+        d3_deriv_part += count.top3 * d3_deriv;
+        d4_deriv_part += top4plus * d4_deriv;
+
+        float top4plus_deriv = d4_deriv * d4_;
+        deriv.top1 = d1_deriv * d1_ - top4plus_deriv;
+        deriv.top2 = d2_deriv * d2_ - top4plus_deriv;
+        deriv.top3 = d3_deriv * d3_ - top4plus_deriv;
+        deriv.total += top4plus_deriv;
+      } else {
+        backoff_count.AddBackward(d, &backoff_deriv, &d_deriv);
+
+        d1_deriv_part += count.top1 * d_deriv;
+        d2_deriv_part += count.top2 * d_deriv;
+        d3_deriv_part += count.top3 * d_deriv;
+        d4_deriv_part += top4plus * d_deriv;
+
+        float top4plus_deriv = d_deriv * d4_;
+        deriv.top1 = d_deriv * d1_ - top4plus_deriv;
+        deriv.top2 = d_deriv * d2_ - top4plus_deriv;
+        deriv.top3 = d_deriv * d3_ - top4plus_deriv;
+        deriv.total += top4plus_deriv;
+      }
+    }
+    d1_deriv_ += d1_deriv_part;
+    d2_deriv_ += d2_deriv_part;
+    d3_deriv_ += d3_deriv_part;
+    d4_deriv_ += d4_deriv_part;
+  }
+
+  // This propagates the derivative back from the merged-counts to the i'th
+  // source; this version is called if the i'th source is a GeneralLmState.
+  void ProcessSourceGeneral(int32 i) {
+    GeneralLmStateDerivs &source_state = general_lm_states_[i];
+    std::vector<std::pair<int32, Count> >::const_iterator iter =
+        source_state.counts.begin(), end = source_state.counts.end();
+    std::vector<Count>::iterator deriv_iter = source_state.count_derivs.begin();
+    for (; iter != end; ++iter, ++deriv_iter) {
+      int32 word = iter->first;
+      const Count &count = iter->second;
+      Count &deriv = *deriv_iter;
+      assert(static_cast<size_t>(word) < merged_word_map_.size());
+      int32 pos = merged_word_map_[word];
+      assert(merged_state_.counts[pos].first == word);
+      const Count &merged_count = merged_state_.counts[pos].second;
+      Count &merged_deriv = merged_state_.count_derivs[pos];
+      merged_count.AddBackward(count, &merged_deriv, &deriv);
+    }
+    source_state.discount_deriv = merged_state_.discount_deriv;
+  }
+
+  // This propagates the derivative back from the merged-counts to the scale
+  // of the i'th source; this version is called if the i'th source is an
+  // IntLmState.
+  void ProcessSourceInt(int32 i) {
+    float scale = scales_[i];
+    IntLmState &source_state = int_lm_states_[i];
+    double scale_deriv = source_state.discount * merged_state_.discount_deriv;
+
+    std::vector<std::pair<int32, int32> >::const_iterator iter =
+        source_state.counts.begin(), end = source_state.counts.end();
+    for (; iter != end; ++iter) {
+      int32 word = iter->first;
+      int32 num_words = iter->second;
+      assert(static_cast<size_t>(word) < merged_word_map_.size());
+      int32 pos = merged_word_map_[word];
+      assert(merged_state_.counts[pos].first == word);
+      const Count &merged_count = merged_state_.counts[pos].second;
+      Count &merged_deriv = merged_state_.count_derivs[pos];
+      merged_count.AddBackward(scale, num_words, &merged_deriv, &scale_deriv);
+    }
+    scale_derivs_[i] += scale_deriv;
+  }
+
+  void ReadArgs(const char **argv) {
+    d1_ = ConvertToFloat(argv[1]);
+    d2_ = ConvertToFloat(argv[2]);
+    d3_ = ConvertToFloat(argv[3]);
+    d4_ = ConvertToFloat(argv[4]);
+    assert(1.0 >= d1_ && d1_ >= d2_ && d2_ >= d3_ && d3_ >= d4_ && d4_ >= 0);
+
+    OpenStream(argv[5], &discounted_count_stream_);
+    OpenStream(argv[6], &discounted_deriv_stream_);
+    OpenStream(argv[7], &backoff_count_stream_);
+    OpenStream(argv[8], &backoff_deriv_stream_);
+  }
+
+  float ConvertToFloat(const char *str) const {
+    char *end;
+    float ans = strtod(str, &end);
+    if (!(*end == 0.0)) {
+      std::cerr << "merge-discount-counts-backward: expected float, got '"
+                << str << "'\n";
+    }
+    if (!(ans >= 0.0 and ans <= 1.0)) {
+      std::cerr << "merge-discount-counts-backward: discounting values must "
+                << "be >=0.0 and <= 1.0: " << str << "\n";
+      exit(1);
+    }
+    return ans;
+  }
+
+  float d1_;
+  float d2_;
+  float d3_;
+  float d4_;
+  double d1_deriv_;
+  double d2_deriv_;
+  double d3_deriv_;
+  double d4_deriv_;
+
+  // This vector contains the scale for each source (for int-count inputs), or
+  // -1 if the source has no scale (for sources of general-count type).
+  std::vector<float> scales_;
+
+  // an input stream for each of the sources, to read counts.
+  std::ifstream *count_inputs_;
+  // an output stream for the derivs w.r.t. each of the sources of 'general'
+  // count type (only valid for indexes i with scales_[i] == -1).
+  std::ofstream *deriv_outputs_;
+
+  // derivatives w.r.t. the scales are accumulated here; only valid for indexes
+  // i with scales_[i] != -1.
+  std::vector<double> scale_derivs_;
+
+  // int_lm_states_, indexed by source, is only active for
+  // i such that scales_[i] != -1.
+  std::vector<IntLmState> int_lm_states_;
+  // general_lm_states_, indexed by source, is only active for
+  // i such that scales_[i] == -1.  We create the derivatives
+  // here and write them to disk.
+  std::vector<GeneralLmStateDerivs> general_lm_states_;
+
+  // This is a map from the history vector to the list of source indexes that
+  // currently have an LM-state with that history-vector, that needs to be
+  // processed.
+  std::map<std::vector<int32>, std::vector<int32> > hist_to_sources_;
+
+  GeneralLmStateBuilder builder_;
+  // The recomputed merged LM-state with its derivatives (not used if the
+  // LM-state has a single source of general counts).
+  GeneralLmStateDerivs merged_state_;
+  // maps from word-index to the position in merged_state_.counts; only valid
+  // for words present in merged_state_.
+  std::vector<int32> merged_word_map_;
+
+  // the discounted LM-state with its derivatives, read from disk.
+  FloatLmStateDerivs discounted_lm_state_;
+  std::ifstream discounted_count_stream_;
+  std::ifstream discounted_deriv_stream_;
+
+  // this is the backoff LM-state and its derivatives, both read from disk.
+  GeneralLmStateDerivs backoff_lm_state_;
+  std::ifstream backoff_count_stream_;
+  std::ifstream backoff_deriv_stream_;
+  // maps from word-index to the position in backoff_lm_state_.counts; only
+  // valid for words present in backoff_lm_state_.
+  std::vector<int32> backoff_word_map_;
+
+  int64 num_lm_states_processed_;
+};
+
+}  // namespace pocolm
+
+int main (int argc, const char **argv) {
+  if (argc < 11 || argc % 2 != 1) {
+    std::cerr << "merge-discount-counts-backward: expected usage:\n"
+              << "merge-discount-counts-backward <D1> <D2> <D3> <D4> \\\n"
+              << "  <discounted-float-counts-in> <discounted-float-derivs-in> \\\n"
+              << "  <backoff-counts-in> <backoff-derivs-in> \\\n"
+              << "  <counts-file1> (<scale1>|<deriv-file1>) \\\n"
+              << "  <counts-file2> (<scale2>|<deriv-file2>) ...\n"
+              << "This is the backprop program for merge-discount-counts.  For sources\n"
+              << "<counts-fileX> of general counts, the derivatives are written to the\n"
+              << "specified files.  It prints to its stdout the derivatives w.r.t. D1, D2,\n"
+              << "D3 and D4, followed by those w.r.t. the scales of the int-count sources.\n";
+    exit(1);
+  }
+
+  // everything happens in the constructor.
+  pocolm::CountMergerDiscounterBackward merger_discounter(argc, argv);
+  return 0;
+}
@@ -0,0 +1,349 @@
+// merge-discount-counts.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iostream>
+#include <sstream>
+#include <fstream>
+#include <vector>
+#include <map>
+#include <stdlib.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+
+
+/**
+   This program does the same as merge-counts followed by discount-counts, in a
+   single pass: it merges int-counts and regular counts of a single n-gram order
+   (> 1) as merge-counts would, and discounts each merged LM-state as
+   discount-counts would, as soon as it has been merged.  This saves writing and
+   reading the merged counts, which, with four floats per count, would be the
+   largest of the intermediate files.  The output is exactly the same as that of
+   the two programs.  See merge-discount-counts-backward for the corresponding
+   backprop program.
+*/
+
+namespace pocolm {
+
+class CountMergerDiscounter {
+ public:
+  CountMergerDiscounter(int argc, const char **argv):
+      num_lm_states_processed_(0) {
+    // args are: program name, D1, D2, D3, D4,
+    // discounted-float-counts-filename, discount-counts-filename, and then the
+    // sources.
+    assert(argc > 7);
+    ReadArgs(argv);
+    Init(argc - 7, argv + 7);
+    ProcessInput();
+  }
+
+  ~CountMergerDiscounter() {
+    delete [] inputs_;
+    discounted_output_.close();
+    backoff_output_.close();
+    if (discounted_output_.fail() || backoff_output_.fail()) {
+      std::cerr << "merge-discount-counts: failed to close output "
+                << "(disk full?)\n";
+      exit(1);
+    }
+  }
+ private:
+  void Init(int32 num_sources,
+            const char **source_names) {
+    inputs_ = new std::ifstream[num_sources];
+    scales_.resize(num_sources);
+    int_lm_states_.resize(num_sources);
+    general_lm_states_.resize(num_sources);
+    for (int32 i = 0; i < num_sources; i++) {
+      std::string name (source_names[i]);
+      float scale = -1;
+      ssize_t pos = name.find_last_of(',');
+      if (pos >= 0) {
+        const char *number_str = name.c_str() + pos + 1;
+        char *endptr = NULL;
+        scale = strtod(number_str, &endptr);
+        if (*endptr == '\0' && endptr != number_str) {
+          // It was a valid number.
+          if (!(scale >= 0.0)) {
+            std::cerr << "merge-discount-counts: bad command line argument '"
+                      << source_names[i] << "'\n";
+            exit(1);
+          }
+          name.resize(pos);
+        } else {
+          // After the comma we did not find a valid number; as in
+          // merge-counts, assume that the comma is part of the filename.
+          scale = -1;
+        }
+      }
+      scales_[i] = scale;
+      inputs_[i].open(name.c_str(), std::ios_base::binary|std::ios_base::in);
+      if (inputs_[i].fail()) {
+        std::cerr << "merge-discount-counts: failed to open file '"
+                  << name << "' for reading\n";
+        exit(1);
+      }
+      ReadStream(i);
+    }
+  }
+
+  // Calling this function will attempt to read a new lm-state from source
+  // stream i, and will update hist_to_sources_ as appropriate.
+  void ReadStream(int32 i) {
+    assert(static_cast<size_t>(i) < scales_.size());
+    inputs_[i].peek();
+    if (inputs_[i].eof())
+      return;
+    const std::vector<int32> *this_hist;
+    if (scales_[i] == -1) {
+      general_lm_states_[i].Read(inputs_[i]);
+      this_hist = &(general_lm_states_[i].history);
+    } else {
+      int_lm_states_[i].Read(inputs_[i]);
+      this_hist = &(int_lm_states_[i].history);
+    }
+    hist_to_sources_[*this_hist].push_back(i);
+  }
+
+  void ProcessInput() {
+    bool first_time = true;
+    while (!hist_to_sources_.empty()) {
+      ProcessLmState(first_time, MergeState());
+      first_time = false;
+      // we can only read the next LM-states of the sources of this LM-state
+      // once we have finished with it, as it may be one of them.
+      for (std::vector<int32>::const_iterator iter = sources_.begin();
+           iter != sources_.end(); ++iter)
+        ReadStream(*iter);
+    }
+    if (first_time) {
+      std::cerr << "merge-discount-counts: processed no data\n";
+      exit(1);
+    } else {
+      // flush the last state's discount stats.
+      OutputDiscountStats();
+      std::cerr << "merge-discount-counts: processed "
+                << num_lm_states_processed_ << " LM states\n";
+    }
+  }
+
+  // This function, which expects hist_to_sources_ to be nonempty, takes the
+  // (lexicographically) first history state in hist_to_sources_, combines the
+  // counts across all the inputs as merge-counts would, and returns the
+  // merged LM-state; it sets sources_ to the list of inputs it came from.
+  const GeneralLmState &MergeState() {
+    assert(!hist_to_sources_.empty());
+    std::vector<int32> hist = hist_to_sources_.begin()->first;
+    sources_ = hist_to_sources_.begin()->second;
+    hist_to_sources_.erase(hist_to_sources_.begin());
+
+    if (sources_.size() == 1 && scales_[sources_[0]] == -1)
+      return general_lm_states_[sources_[0]];
+    builder_.Clear();
+    for (std::vector<int32>::const_iterator iter = sources_.begin();
+         iter != sources_.end(); ++iter) {
+      int32 s = *iter;
+      if (scales_[s] == -1)
+        builder_.AddCounts(general_lm_states_[s]);
+      else
+        builder_.AddCounts(int_lm_states_[s], scales_[s]);
+    }
+    builder_.Output(hist, &merged_state_);
+    return merged_state_;
+  }
+
+  // This discounts the merged LM-state 'lm_state', as discount-counts would.
+  // Note: we expect to process input of a single n-gram order.
+  void ProcessLmState(bool first_time, const GeneralLmState &lm_state) {
+    num_lm_states_processed_++;
+    if (backoff_history_.size() + 1 != lm_state.history.size()) {
+      if (first_time) {
+        assert(lm_state.history.size() > 0 && "merge-discount-counts should "
+               "not be applied to 1-gram input");
+        size_t backoff_history_size = lm_state.history.size() - 1;
+        backoff_history_.resize(backoff_history_size);
+        std::copy(lm_state.history.begin(),
+                  lm_state.history.begin() + backoff_history_size,
+                  backoff_history_.begin());
+      } else {
+        std::cerr << "merge-discount-counts: input seems to have differing "
+                  << "n-gram orders\n";
+        exit(1);
+      }
+    }
+    // 'discounted_state_' is what's left of the counts in 'lm_state' after
+    // we've removed the discounted pieces.
+    discounted_state_.history = lm_state.history;
+    discounted_state_.counts.resize(lm_state.counts.size());
+
+    if (!std::equal(backoff_history_.begin(), backoff_history_.end(),
+                    lm_state.history.begin())) {
+      // the history of the backoff state has changed.
+      OutputDiscountStats();
+      size_t backoff_history_size = backoff_history_.size();
+      std::copy(lm_state.history.begin(),
+                lm_state.history.begin() + backoff_history_size,
+                backoff_history_.begin());
+    }
+
+    std::vector<std::pair<int32, Count> >::const_iterator in_iter =
+        lm_state.counts.begin(), in_end = lm_state.counts.end();
+    std::vector<std::pair<int32, float> >::iterator out_iter =
+        discounted_state_.counts.begin();
+    double lm_state_total = lm_state.discount,
+        discount_total = lm_state.discount;
+    for (; in_iter != in_end; ++in_iter,++out_iter) {
+      int32 word = in_iter->first;
+      const Count &count = in_iter->second;
+      out_iter->first = word;
+      // these are volatile for the same reason as in discount-counts: they
+      // must be exactly the same as in merge-discount-counts-backward.
+      volatile float top4plus = count.total - count.top1 - count.top2 - count.top3,
+          d1 = d1_ * count.top1, d2 = d2_ * count.top2, d3 = d3_ * count.top3,
+          d4 = d4_ * top4plus, d = d1 + d2 + d3 + d4;
+      if (POCOLM_SEPARATE_COUNTS) {
+        Count discount;  // the part removed, which will go to the lower-order state.
+        discount.top1 = d1;
+        discount.top2 = d2;
+        discount.top3 = d3;
+        discount.total = d;
+        backoff_builder_.AddCount(word, discount);
+      } else {
+        backoff_builder_.AddCount(word, d);
+      }
+      lm_state_total += count.total;
+      discount_total += d;
+      // store the discounted count.
+      out_iter->second = count.total - d;
+    }
+    discounted_state_.total = lm_state_total;
+    discounted_state_.discount = discount_total;
+    discounted_state_.Write(discounted_output_);
+  }
+
+  void OutputDiscountStats() {
+    // calling this function causes the history and stats in
+    // (backoff_history_, backoff_builder_) to be written to
+    // backoff_output_.
+    GeneralLmState backoff_state;
+    backoff_builder_.Output(backoff_history_, &backoff_state);
+    backoff_state.Write(backoff_output_);
+    backoff_builder_.Clear();
+  }
+
+  void ReadArgs(const char **argv) {
+    d1_ = ConvertToFloat(argv[1]);
+    d2_ = ConvertToFloat(argv[2]);
+    d3_ = ConvertToFloat(argv[3]);
+    d4_ = ConvertToFloat(argv[4]);
+    assert(1.0 >= d1_ && d1_ >= d2_ && d2_ >= d3_ && d3_ >= d4_ && d4_ >= 0);
+
+    discounted_output_.open(argv[5], std::ios_base::binary|std::ios_base::out);
+    if (discounted_output_.fail()) {
+      std::cerr << "merge-discount-counts: failed to open '"
+                << argv[5] << "' for writing.\n";
+      exit(1);
+    }
+    backoff_output_.open(argv[6], std::ios_base::binary|std::ios_base::out);
+    if (backoff_output_.fail()) {
+      std::cerr << "merge-discount-counts: failed to open '"
+                << argv[6] << "' for writing.\n";
+      exit(1);
+    }
+  }
+
+  float ConvertToFloat(const char *str) const {
+    char *end;
+    float ans = strtod(str, &end);
+    if (!(*end == 0.0)) {
+      std::cerr << "merge-discount-counts: expected float, got '" << str
+                << "'\n";
+    }
+    if (!(ans >= 0.0 and ans <= 1.0)) {
+      std::cerr << "merge-discount-counts: discounting values must be "
+                << ">=0.0 and <= 1.0: " << str << "\n";
+      exit(1);
+    }
+    return ans;
+  }
+
+
+  float d1_;
+  float d2_;
+  float d3_;
+  float d4_;
+
+  // This vector contains the scale for each source, or -1 if the
+  // source has no scale.
+  std::vector<float> scales_;
+
+  std::ifstream *inputs_;
+
+  // int_lm_states_, indexed by source, is only active for
+  // i such that scales_[i] != -1.
+  std::vector<IntLmState> int_lm_states_;
+  // general_lm_states_, indexed by source, is only active for
+  // i such that scales_[i] == -1.
+  std::vector<GeneralLmState> general_lm_states_;
+
+  // This is a map from the history vector to the list of source indexes that
+  // currently have an LM-state with that history-vector, that needs to be
+  // processed (see merge-counts.cc).
+  std::map<std::vector<int32>, std::vector<int32> > hist_to_sources_;
+
+  // the sources of the LM-state that is currently being processed.
+  std::vector<int32> sources_;
+
+  // the following are temporary variables used in functions, but we declare
+  // them here to avoid reallocation.
+  GeneralLmStateBuilder builder_;
+  GeneralLmState merged_state_;
+  FloatLmState discounted_state_;
+
+  std::ofstream discounted_output_;
+  std::ofstream backoff_output_;
+
+  // backoff_builder_ and backoff_history_ keep track of the
+  // stats that we discounted from the input, and aggregates them
+  // over the lower-order history state.
+  std::vector<int32> backoff_history_;
+  GeneralLmStateBuilder backoff_builder_;
+
+  int64 num_lm_states_processed_;
+};
+
+}  // namespace pocolm
+
+int main (int argc, const char **argv) {
+  if (argc <= 7) {
+    std::cerr << "merge-discount-counts: expected usage:\n"
+              << "merge-discount-counts <D1> <D2> <D3> <D4> <discounted-float-counts-out> \\\n"
+              << "   <backoff-counts-out> <counts-file1>[,scale1] <counts-file2>[,scale2] ...\n"
+              << "e.g.: merge-discount-counts 0.8 0.5 0.2 0.1 dir/float.3 dir/discount.2 \\\n"
+              << "   counts/int.1.3,0.5 counts/int.2.3,0.8 dir/discount.3\n"
+              << "This program does the same as merge-counts (with the same sources)\n"
+              << "followed by discount-counts, without writing the merged counts.\n";
+    exit(1);
+  }
+
+  // everything happens in the constructor.
+  pocolm::CountMergerDiscounter merger_discounter(argc, argv);
+  return 0;
+}
@@ -169,6 +169,7 @@ class FloatCountMerger {
 }  // namespace pocolm
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc <= 1) {
     std::cerr << "merge-float-counts: expected usage: <float-counts-file1> <float-counts-file2> .. \n"
               << " (it writes the merged float-counts to stdout).  For example:\n"
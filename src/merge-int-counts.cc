@@ -144,6 +144,7 @@ class IntCountMerger {
 }  // namespace pocolm
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc <= 1) {
     std::cerr << "merge-int-counts: expected usage: <int-counts-file1> <int-counts-file2> .. \n"
               << " (it writes the merged int-counts to stdout).  For example:\n"
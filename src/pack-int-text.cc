@@ -0,0 +1,93 @@
+// pack-int-text.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iostream>
+#include <fstream>
+#include <vector>
+#include <stdlib.h>
+#include "pocolm-types.h"
+#include "int-text.h"
+
+
+/*
+   This program reads integerized text (as written by text_to_int.py) from its
+   standard input and writes it in the 'packed' int-text format, together with
+   its index; see int-text.h for a description of the format.  E.g.:
+
+   text_to_int.py words.txt <text | pack-int-text data/int/1.int
+   # writes data/int/1.int and data/int/1.int.index
+*/
+
+
+int main (int argc, const char **argv) {
+  if (argc != 2) {
+    std::cerr << "Usage: pack-int-text <packed-output> < <int-text>\n"
+              << "Converts integerized text to the packed int-text format\n"
+              << "read by get-text-counts --packed-input, writing the index\n"
+              << "to <packed-output>.index\n"
+              << "e.g.: gunzip -c int/1.txt.gz | pack-int-text int/1.int\n";
+    exit(1);
+  }
+  std::string packed_filename(argv[1]),
+      index_filename = packed_filename + ".index";
+  std::ofstream packed_output(packed_filename.c_str(),
+                              std::ios_base::out|std::ios_base::binary),
+      index_output(index_filename.c_str(),
+                   std::ios_base::out|std::ios_base::binary);
+  if (!packed_output || !index_output) {
+    std::cerr << "pack-int-text: failed to open '" << packed_filename
+              << "' or '" << index_filename << "' for writing.\n";
+    exit(1);
+  }
+
+  pocolm::IntTextReader reader(std::cin);
+  std::vector<int32> words;
+  int64 num_sentences = 0, num_words = 0;
+  while (reader.ReadSentence(&words)) {
+    if (num_sentences % pocolm::kIntTextIndexInterval == 0) {
+      // 'num_words + num_sentences' is the current position, counting the
+      // sentence terminators.
+      int64 pos = num_words + num_sentences;
+      index_output.write(reinterpret_cast<const char*>(&pos), sizeof(int64));
+    }
+    for (size_t i = 0; i < words.size(); i++) {
+      if (words[i] <= 0) {
+        std::cerr << "pack-int-text: invalid word-id " << words[i]
+                  << " in input.\n";
+        exit(1);
+      }
+    }
+    pocolm::WritePackedSentence(words, packed_output);
+    num_sentences++;
+    num_words += words.size();
+  }
+  int64 total = num_words + num_sentences;
+  index_output.write(reinterpret_cast<const char*>(&total), sizeof(int64));
+
+  packed_output.close();
+  index_output.close();
+  if (packed_output.fail() || index_output.fail()) {
+    std::cerr << "pack-int-text: error writing output (disk full?)\n";
+    exit(1);
+  }
+  std::cerr << "pack-int-text: wrote " << num_sentences << " sentences with "
+            << num_words << " words to " << packed_filename << "\n";
+  return 0;
+}
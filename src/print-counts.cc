@@ -35,6 +35,7 @@
 
 
 int main (int argc, char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc != 1) {
     std::cerr << "print-int-counts: expected usage: print-int-counts <counts.int >counts.txt\n";
         exit(1);
@@ -23,6 +23,7 @@
 #include <fstream>
 #include <vector>
 #include <stdlib.h>
+#include <string.h>
 #include "pocolm-types.h"
 #include "lm-state.h"
 
@@ -31,16 +32,46 @@
    This program exists to enable human inspection of float-count files, e.g.  as
    output to the first filename argument of discount-counts.  get-int-counts.
    It reads such counts from its stdin, and writes them in human-readable text
-   form to the stdout.
+   form to the stdout.  With the --history option it instead looks up a single
+   LM-state in an indexed float-counts file (see float-counts-index).
 */
 
 
 int main (int argc, char **argv) {
+  pocolm::UseFastStandardStreams();
+  if (argc == 3 && !strncmp(argv[1], "--history=", 10)) {
+    // the history is given in the same (reversed) form in which it is printed.
+    std::vector<int32> history;
+    std::istringstream history_str(argv[1] + 10);
+    int32 word;
+    while (history_str >> word)
+      history.push_back(word);
+    if (!history_str.eof()) {
+      std::cerr << "print-float-counts: bad option " << argv[1] << "\n";
+      exit(1);
+    }
+    pocolm::MappedFloatCounts float_counts(argv[2]);
+    int64 i = float_counts.FindState(history);
+    if (i == -1) {
+      std::cerr << "print-float-counts: no LM state with history '"
+                << (argv[1] + 10) << "' in " << argv[2] << "\n";
+      exit(1);
+    }
+    pocolm::FloatLmState lm_state;
+    float_counts.ReadState(float_counts.Offset(history.size() + 1, i),
+                           &lm_state);
+    lm_state.Print(std::cout);
+    return 0;
+  }
+
   if (argc != 1) {
-    std::cerr << "print-float-counts: expected usage: print-float-counts <float_counts >counts.txt\n";
+    std::cerr << "print-float-counts: expected usage: print-float-counts <float_counts >counts.txt\n"
+              << "or: print-float-counts --history='<reversed-history>' <float-counts>\n"
+              << "e.g. print-float-counts --history='35 1' float.all\n"
+              << "(the second form prints only the LM state with that history;\n"
+              << "it requires <float-counts>.index, see float-counts-index).\n";
         exit(1);
   }
-
   int64 num_lm_states = 0, num_counts = 0;
 
   // we only get EOF after trying to read past the end of the file,
@@ -35,6 +35,7 @@
 
 
 int main (int argc, char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc != 1) {
     std::cerr << "print-null-counts: expected usage: print-null-counts <counts.int >counts.txt\n";
         exit(1);
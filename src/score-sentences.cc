@@ -0,0 +1,271 @@
+// score-sentences.cc
+
+// Copyright     2016  Johns Hopkins University (Author: Daniel Povey)
+
+// See ../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABILITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+
+#include <cassert>
+#include <iomanip>
+#include <iostream>
+#include <string>
+#include <vector>
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+#include "pocolm-types.h"
+#include "lm-state.h"
+#include "int-text.h"
+
+
+/**
+   This program computes the log-probability of each sentence of integerized
+   text, given a language model in the form of one or more indexed float-counts
+   files (e.g. float.all from an LM directory, indexed by float-counts-index).
+   The probabilities are computed in the same way as in compute-probs, but
+   instead of counting the n-grams of the whole input first, it looks up the
+   LM-states it needs for each sentence, so it can give the log-prob of each
+   sentence (and of each word) as soon as it has read it.  It writes one line
+   of output for each line of input and flushes the output after each line, so
+   it can be used as a server, with requests on its standard input.
+*/
+
+namespace pocolm {
+
+class SentenceScorer {
+ public:
+  // 'filenames' are the float-counts files; if there is more than one (e.g.
+  // the float.all.N of a split LM-dir), each history-state is looked up in
+  // each of them in turn.
+  explicit SentenceScorer(const std::vector<std::string> &filenames):
+      ngram_order_(0) {
+    for (size_t i = 0; i < filenames.size(); i++) {
+      float_counts_.push_back(new MappedFloatCounts(filenames[i]));
+      if (float_counts_.back()->NumOrders() > ngram_order_)
+        ngram_order_ = float_counts_.back()->NumOrders();
+    }
+    std::vector<int32> empty_history;
+    const MappedFloatCounts *unused;
+    int64 unused_offset;
+    if (!FindState(empty_history, &unused, &unused_offset)) {
+      std::cerr << "score-sentences: the float-counts have no unigram "
+                << "LM-state.\n";
+      exit(1);
+    }
+  }
+
+  ~SentenceScorer() {
+    for (size_t i = 0; i < float_counts_.size(); i++)
+      delete float_counts_[i];
+  }
+
+  // Computes the log-prob of each word of the sentence 'words' (not including
+  // the BOS and EOS symbols) and of the end of the sentence, and outputs them
+  // to 'word_log_probs', which will have size words.size() + 1.  Returns the
+  // total.
+  double ScoreSentence(const std::vector<int32> &words,
+                       std::vector<float> *word_log_probs) {
+    line_ints_.clear();
+    line_ints_.push_back(kBosSymbol);
+    for (size_t j = 0; j < words.size(); j++) {
+      if (words[j] <= static_cast<int32>(kEosSymbol)) {
+        std::cerr << "score-sentences: bad word-id " << words[j]
+                  << " in input\n";
+        exit(1);
+      }
+      line_ints_.push_back(words[j]);
+    }
+    line_ints_.push_back(kEosSymbol);
+    word_log_probs->clear();
+    double total_log_prob = 0.0;
+    int32 size = line_ints_.size();
+    for (int32 pos = 1; pos < size; pos++) {
+      // this is the reversed history, as in get-text-counts.
+      history_.clear();
+      for (int32 h = pos - 1; h >= 0 && h > pos - ngram_order_; h--)
+        history_.push_back(line_ints_[h]);
+      float log_prob = ComputeLogProb(line_ints_[pos]);
+      word_log_probs->push_back(log_prob);
+      total_log_prob += log_prob;
+    }
+    return total_log_prob;
+  }
+
+ private:
+  // Looks up the LM-state with history 'history' in the float-counts;
+  // returns false if it does not exist.
+  bool FindState(const std::vector<int32> &history,
+                 const MappedFloatCounts **float_counts,
+                 int64 *offset) const {
+    for (size_t i = 0; i < float_counts_.size(); i++) {
+      int64 index = float_counts_[i]->FindState(history);
+      if (index != -1) {
+        *float_counts = float_counts_[i];
+        *offset = float_counts_[i]->Offset(history.size() + 1, index);
+        return true;
+      }
+    }
+    return false;
+  }
+
+  // Returns the log-prob of 'word' given the history in history_; this does
+  // the same computation as ProcessWord() in compute-probs, in the same order,
+  // so the results are the same.
+  float ComputeLogProb(int32 word) {
+    // find the longest history-state that exists; compute-probs assumes that
+    // if it exists, so do all the shorter ones.
+    states_.resize(history_.size() + 1);
+    int32 hist_size = history_.size();
+    while (hist_size > 0) {
+      std::vector<int32> this_history(history_.begin(),
+                                      history_.begin() + hist_size);
+      if (FindState(this_history, &(states_[hist_size].first),
+                    &(states_[hist_size].second)))
+        break;
+      hist_size--;
+    }
+    for (int32 h = hist_size - 1; h >= 0; h--) {
+      std::vector<int32> this_history(history_.begin(),
+                                      history_.begin() + h);
+      if (!FindState(this_history, &(states_[h].first),
+                     &(states_[h].second))) {
+        std::cerr << "score-sentences: an LM-state of order " << (h + 1)
+                  << " is missing (bad float-counts?)\n";
+        exit(1);
+      }
+    }
+
+    float cur_backoff_prob = 1.0;
+    float tot_prob = 0.0;
+    for (int32 h = hist_size; h >= 0; h--) {
+      float total, discount, count;
+      states_[h].first->LookupCount(states_[h].second, word,
+                                    &total, &discount, &count);
+      assert(total != 0.0);
+      if (h == 0) {
+        if (count == 0.0) {
+          std::cerr << "score-sentences: word-id " << word
+                    << " is not in the vocabulary of the LM\n";
+          exit(1);
+        }
+        double unigram_count = count, unigram_total = total;
+        tot_prob += cur_backoff_prob * unigram_count / unigram_total;
+      } else {
+        if (count != 0.0)
+          tot_prob += cur_backoff_prob * count / total;
+        cur_backoff_prob *= discount / total;
+      }
+    }
+    assert(tot_prob > 0.0);
+    return log(tot_prob);
+  }
+
+  std::vector<MappedFloatCounts*> float_counts_;
+  int32 ngram_order_;
+
+  // the current sentence, with BOS and EOS.
+  std::vector<int32> line_ints_;
+  // the current history, reversed.
+  std::vector<int32> history_;
+  // states_[h] is the float-counts file and offset of the LM-state for the
+  // first h words of history_.
+  std::vector<std::pair<const MappedFloatCounts*, int64> > states_;
+};
+
+}  // namespace pocolm
+
+
+int main (int argc, const char **argv) {
+  bool per_word = false, total_only = false;
+  std::string packed_input;
+  while (argc > 1 && !strncmp(argv[1], "--", 2)) {
+    std::string option(argv[1]);
+    if (option == "--per-word") {
+      per_word = true;
+    } else if (option == "--total-only") {
+      total_only = true;
+    } else if (option.compare(0, 15, "--packed-input=") == 0) {
+      packed_input = option.substr(15);
+    } else {
+      std::cerr << "score-sentences: unrecognized option " << option << "\n";
+      exit(1);
+    }
+    argc--;
+    argv++;
+  }
+  if (argc < 2 || (per_word && total_only)) {
+    std::cerr << "score-sentences: expected usage:\n"
+              << "score-sentences [options] <float-counts1> [<float-counts2> ...] "
+              << "<int-text >scores\n"
+              << "This program reads sentences of integerized text (one per line,\n"
+              << "without BOS or EOS symbols) from its stdin, and for each one writes\n"
+              << "to its stdout a line containing the number of words (including the\n"
+              << "end of sentence) and the total log-prob of the sentence, given the\n"
+              << "LM in the float-counts files (e.g. float.all, or float.all.1,\n"
+              << "float.all.2 ... from a split LM-dir).  The float-counts files must\n"
+              << "have been indexed with float-counts-index.  The output is flushed\n"
+              << "after each line, so this program can be used as a server.\n"
+              << "Options:\n"
+              << "  --per-word   Also write the log-prob of each word (and of the end\n"
+              << "               of sentence) on the line, after the total.\n"
+              << "  --total-only Instead of a line per sentence, only write (at the end)\n"
+              << "               the total number of words and the total log-prob,\n"
+              << "               like compute-probs.  Not compatible with --per-word.\n"
+              << "  --packed-input=<file>  Read the integerized text from <file>, in\n"
+              << "               the packed format (see int-text.h), instead of from\n"
+              << "               the stdin.\n"
+              << "e.g.: echo 45 67 | score-sentences lm/float.all\n";
+    exit(1);
+  }
+
+  std::vector<std::string> filenames(argv + 1, argv + argc);
+  pocolm::SentenceScorer scorer(filenames);
+  pocolm::IntTextReader *reader = (packed_input.empty() ?
+      new pocolm::IntTextReader(std::cin) :
+      new pocolm::IntTextReader(packed_input, 0, 1));
+
+  std::vector<int32> words;
+  std::vector<float> word_log_probs;
+  int64 num_sentences = 0, num_words = 0;
+  double total_log_prob = 0.0;
+  while (reader->ReadSentence(&words)) {
+    double log_prob = scorer.ScoreSentence(words, &word_log_probs);
+    num_sentences++;
+    num_words += word_log_probs.size();
+    total_log_prob += log_prob;
+    if (total_only)
+      continue;
+    std::cout << std::setprecision(10) << word_log_probs.size() << " "
+              << log_prob;
+    if (per_word) {
+      for (size_t i = 0; i < word_log_probs.size(); i++)
+        std::cout << " " << word_log_probs[i];
+    }
+    std::cout << std::endl;
+    if (std::cout.fail()) {
+      std::cerr << "score-sentences: error writing output\n";
+      exit(1);
+    }
+  }
+  delete reader;
+  if (total_only)
+    std::cout << std::setprecision(10) << num_words << " " << total_log_prob
+              << "\n";
+  std::cerr << "score-sentences: average log-prob per word was "
+            << (total_log_prob / num_words) << " (perplexity = "
+            << exp(-total_log_prob / num_words) << ") over " << num_words
+            << " words in " << num_sentences << " sentences.\n";
+  return 0;
+}
@@ -38,6 +38,7 @@
 
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc < 3) {
     std::cerr << "split-float-counts: expected usage:\n"
               << "split-float-counts  <output1> <output2> ... <outputN>  < <input-float-counts>\n"
@@ -39,6 +39,7 @@
 
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   int num_outputs = argc - 1;
   if (num_outputs <= 0) {
     std::cerr << "split-int-counts-by-order: expected usage:\n"
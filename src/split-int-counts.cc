@@ -40,6 +40,7 @@
 
 
 int main (int argc, const char **argv) {
+  pocolm::UseFastStandardStreams();
   if (argc < 3 || (!strcmp(argv[1], "-d") && argc < 5)) {
     std::cerr << "split-int-counts: expected usage:\n"
               << "split-int-counts [-d N] <output1> <output2> ... <outputN>  < <input-int-counts>\n"